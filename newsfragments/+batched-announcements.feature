@@ -0,0 +1 @@
+The introducer now sends announcements to its subscribers in batches, and clients write their announcement cache less often.
@@ -0,0 +1 @@
+The HTTP storage protocol has a new ``POST /storage/v1/lease`` endpoint, which renews the leases of many storage indexes in one request. A deep-check with ``add-lease=true`` uses it to renew up to 1024 leases per server in each request.
@@ -0,0 +1 @@
+The HTTP storage protocol has a new ``POST /storage/v1/immutable/shares`` endpoint, which lists the shares of many storage indexes in one request. Checking and downloading many files at once uses it.
@@ -0,0 +1 @@
+Recently read directories are kept in memory, so reading an unchanged directory again does not download and parse it again. See ``dirnode.cache_children`` and ``dirnode.readonly_cache_ttl``.
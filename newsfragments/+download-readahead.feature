@@ -0,0 +1 @@
+Sequential reads of immutable files now request the following segments before they are needed. See ``download.readahead_max_bytes``.
@@ -0,0 +1 @@
+Changing one child of a directory no longer unpacks and re-packs every other child, and MDMF directories are updated in place where possible.
@@ -0,0 +1 @@
+Storage servers now do the disk I/O for HTTP requests in a dedicated thread pool, so a slow disk no longer holds up every other client.
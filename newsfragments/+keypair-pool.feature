@@ -0,0 +1 @@
+Nodes can generate RSA keypairs ahead of time, which makes creating mutable files and directories faster. See ``keypair_pool.size``.
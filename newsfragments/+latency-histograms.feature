@@ -0,0 +1 @@
+The OpenMetrics statistics now include latency histograms for storage server operations, uploads, downloads and mutable publishes.
@@ -0,0 +1 @@
+Directory entries are now only decoded when they are used, which makes listing large directories faster and use less memory.
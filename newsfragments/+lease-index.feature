@@ -0,0 +1 @@
+Storage servers can keep a database of their leases, so that the lease expiration crawler does not have to read every share file. See ``lease_index.enabled``.
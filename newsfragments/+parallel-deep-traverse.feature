@@ -0,0 +1 @@
+Deep-check, deep-size, manifest and other operations on directory trees now run several requests at once, with a bounded amount of memory for the directories still to visit.
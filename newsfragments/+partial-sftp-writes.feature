@@ -0,0 +1 @@
+Writing to part of an existing MDMF file through SFTP now publishes only the segments that changed.
@@ -0,0 +1 @@
+Immutable uploads now read, encrypt and erasure-code the next segment while the previous one is being sent. See ``upload.pipeline_depth`` and ``upload.pipeline_max_bytes``.
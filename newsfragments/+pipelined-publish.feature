@@ -0,0 +1 @@
+Publishing a large MDMF file now encrypts and encodes several segments at once.
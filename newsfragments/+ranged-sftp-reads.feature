@@ -0,0 +1 @@
+SFTP handles opened for reading an immutable or MDMF file now download only the parts of the file that are read.
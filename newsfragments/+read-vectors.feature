@@ -0,0 +1 @@
+The HTTP storage protocol has a new ``POST /storage/v1/immutable/:storage_index/:share_number/readv`` endpoint, which reads several ranges of a share in one request. Downloads use it to fetch a block and its hashes in one round trip.
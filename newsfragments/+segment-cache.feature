@@ -0,0 +1 @@
+Verified segments of downloaded immutable files can be cached on disk, so that reading part of a file again does not fetch it from the storage servers. See ``download.segment_cache_size``.
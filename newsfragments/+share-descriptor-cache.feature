@@ -0,0 +1 @@
+Storage servers now keep recently read immutable share files open, instead of opening them again for every read.
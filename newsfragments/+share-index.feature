@@ -0,0 +1 @@
+Storage servers can keep a database of the shares they hold, instead of listing share directories for every request. See ``share_index.enabled``.
@@ -0,0 +1 @@
+Nodes can remember which storage servers held the shares of recently used files, and ask those servers first. See ``share_locations.max_entries``.
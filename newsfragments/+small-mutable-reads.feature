@@ -0,0 +1 @@
+Reading a small mutable file or directory that was read recently now takes a single round trip to each server.
@@ -0,0 +1 @@
+HTTP storage servers now read immutable share data in larger chunks, reading the next chunk from disk while the previous one is being sent.
@@ -0,0 +1 @@
+HTTP storage servers now write immutable upload data to disk as it arrives, instead of buffering the whole request first.
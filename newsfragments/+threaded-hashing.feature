@@ -0,0 +1 @@
+Block and segment hashes are now computed in the CPU thread pool, instead of in the reactor thread.
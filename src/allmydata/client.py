@@ -7,6 +7,7 @@ import os
 import stat
 import time
 import weakref
+from collections import deque
 from typing import Optional, Iterable
 from base64 import urlsafe_b64encode
 from functools import partial
@@ -32,10 +33,12 @@ import allmydata
 from allmydata import node
 from allmydata.crypto import rsa, ed25519
 from allmydata.crypto.util import remove_prefix
-from allmydata.dirnode import DirectoryNode
+from allmydata.dirnode import DirectoryNode, DirectoryCache
 from allmydata.storage.server import StorageServer, FoolscapStorageServer
 from allmydata import storage_client
 from allmydata.immutable.upload import Uploader
+from allmydata.immutable.encode import PipelineLimits
+from allmydata.immutable.downloader.segcache import SegmentCache
 from allmydata.immutable.offloaded import Helper
 from allmydata.mutable.filenode import MutableFileNode
 from allmydata.introducer.client import IntroducerClient
@@ -63,6 +66,7 @@ from allmydata.interfaces import (
 )
 from allmydata.nodemaker import NodeMaker
 from allmydata.blacklist import Blacklist
+from allmydata.share_locations import ShareLocationCache
 from allmydata.node import _Config
 
 KiB=1024
@@ -87,17 +91,27 @@ def _is_valid_section(section_name):
 _client_config = configutil.ValidConfiguration(
     static_valid_sections={
         "client": (
+            "dirnode.cache_children",
+            "dirnode.readonly_cache_ttl",
+            "download.readahead_max_bytes",
+            "download.segment_cache_size",
             "helper.furl",
             "introducer.furl",
             "key_generator.furl",
+            "keypair_pool.low_water",
+            "keypair_pool.refill_concurrency",
+            "keypair_pool.size",
             "mutable.format",
             "peers.preferred",
             "shares.happy",
             "shares.needed",
             "shares.total",
             "shares._max_immutable_segment_size_for_testing",
+            "share_locations.max_entries",
             "storage.plugins",
             "force_foolscap",
+            "upload.pipeline_depth",
+            "upload.pipeline_max_bytes",
         ),
         "storage": (
             "debug_discard",
@@ -110,8 +124,10 @@ _client_config = configutil.ValidConfiguration(
             "expire.mode",
             "expire.mutable",
             "expire.override_lease_duration",
+            "lease_index.enabled",
             "readonly",
             "reserved_space",
+            "share_index.enabled",
             "storage_dir",
             "plugins",
             "grid_management",
@@ -187,6 +203,110 @@ class KeyGenerator:
         return public, private
 
 
+@implementer(IStatsProducer)
+class KeyPool(service.Service):
+    """
+    I hand out RSA keypairs like a KeyGenerator, but try to have them
+    generated before they are asked for, so that creating a mutable file or
+    directory does not have to wait for it.
+
+    I keep up to ``size`` keypairs ready. Once fewer than ``low_water`` are
+    left, I make more (with ``concurrency`` of them being generated at once)
+    until I am full again, but only while nobody has asked me for a keypair
+    in the last ``IDLE_DELAY`` seconds. When I am empty, keypairs are
+    generated on demand.
+    """
+
+    # generate() calls hold off refilling for this many seconds
+    IDLE_DELAY = 1.0
+
+    def __init__(self, key_generator, size, low_water, concurrency=1,
+                 clock=None):
+        if clock is None:
+            clock = reactor
+        self._key_generator = key_generator
+        self._size = size
+        self._low_water = low_water
+        self._concurrency = max(1, concurrency)
+        self._clock = clock
+        self._keys = deque()
+        self._generating = 0
+        self._refilling = True
+        self._refill_call = None
+        self._hits = 0
+        self._misses = 0
+
+    def startService(self):
+        service.Service.startService(self)
+        self._schedule_refill()
+
+    def stopService(self):
+        if self._refill_call is not None and self._refill_call.active():
+            self._refill_call.cancel()
+        self._refill_call = None
+        return service.Service.stopService(self)
+
+    def generate(self):
+        """
+        I return a Deferred that fires with a (verifyingkey, signingkey)
+        pair, taken from the pool if there is one ready.
+        """
+        if self._keys:
+            self._hits += 1
+            d = defer.succeed(self._keys.popleft())
+        else:
+            self._misses += 1
+            d = self._key_generator.generate()
+        if len(self._keys) < self._low_water:
+            self._refilling = True
+        if self._refilling:
+            self._schedule_refill()
+        return d
+
+    def get_stats(self):
+        return {
+            "keypair_pool.available": len(self._keys),
+            "keypair_pool.generating": self._generating,
+            "keypair_pool.hits": self._hits,
+            "keypair_pool.misses": self._misses,
+        }
+
+    def _schedule_refill(self):
+        if not self.running:
+            return
+        if self._refill_call is not None and self._refill_call.active():
+            self._refill_call.reset(self.IDLE_DELAY)
+        else:
+            self._refill_call = self._clock.callLater(self.IDLE_DELAY,
+                                                      self._refill)
+
+    def _refill(self):
+        self._refill_call = None
+        while (self.running and self._refilling
+               and self._generating < self._concurrency
+               and len(self._keys) + self._generating < self._size):
+            self._generating += 1
+            d = self._key_generator.generate()
+            d.addCallbacks(self._got_keypair, self._generate_failed)
+
+    def _got_keypair(self, keypair):
+        self._generating -= 1
+        if not self.running:
+            return
+        self._keys.append(keypair)
+        if len(self._keys) >= self._size:
+            self._refilling = False
+        elif self._refill_call is None:
+            # still idle
+            self._refill()
+
+    def _generate_failed(self, f):
+        self._generating -= 1
+        # don't retry until the pool is drawn from again
+        self._refilling = False
+        log.err(f, "failed to generate a keypair for the pool")
+
+
 class Terminator(service.Service):
     def __init__(self):
         self._clients = weakref.WeakKeyDictionary()
@@ -648,7 +768,7 @@ class _Client(node.Node, pollmixin.PollMixin):
         self.init_stats_provider()
         self.init_secrets()
         self.init_node_key()
-        self._key_generator = KeyGenerator()
+        self.init_key_generator()
         key_gen_furl = config.get_config("client", "key_generator.furl", None)
         if key_gen_furl:
             log.msg("[client]key_generator.furl= is now ignored, see #2783")
@@ -694,6 +814,29 @@ class _Client(node.Node, pollmixin.PollMixin):
     def get_stats(self):
         return { 'node.uptime': time.time() - self.started_timestamp }
 
+    def init_key_generator(self):
+        """
+        Set up the generator of RSA keys for new mutable files, with a pool
+        of pre-generated keys if ``[client]keypair_pool.size`` asks for one.
+        """
+        self._key_generator = KeyGenerator()
+        size = int(self.config.get_config("client", "keypair_pool.size", 0))
+        if size <= 0:
+            return
+        low_water = int(self.config.get_config(
+            "client", "keypair_pool.low_water", (size + 1) // 2,
+        ))
+        if not 1 <= low_water <= size:
+            raise ValueError("config error: keypair_pool.low_water must be "
+                             "between 1 and keypair_pool.size")
+        concurrency = int(self.config.get_config(
+            "client", "keypair_pool.refill_concurrency", 1,
+        ))
+        pool = KeyPool(self._key_generator, size, low_water, concurrency)
+        pool.setServiceParent(self)
+        self.stats_provider.register_producer(pool)
+        self._key_generator = pool
+
     def init_secrets(self):
         # configs are always unicode
         def _unicode_make_secret():
@@ -817,6 +960,11 @@ class _Client(node.Node, pollmixin.PollMixin):
             sharetypes.append("mutable")
         expiration_sharetypes = tuple(sharetypes)
 
+        share_index = self.config.get_config("storage", "share_index.enabled",
+                                             False, boolean=True)
+        lease_index = self.config.get_config("storage", "lease_index.enabled",
+                                             False, boolean=True)
+
         ss = StorageServer(
             storedir, self.nodeid,
             reserved_space=reserved,
@@ -828,6 +976,8 @@ class _Client(node.Node, pollmixin.PollMixin):
             expiration_override_lease_duration=o_l_d,
             expiration_cutoff_date=cutoff_date,
             expiration_sharetypes=expiration_sharetypes,
+            share_index=share_index,
+            lease_index=lease_index,
         )
         ss.setServiceParent(self)
         return ss
@@ -950,11 +1100,101 @@ class _Client(node.Node, pollmixin.PollMixin):
             helper_furl,
             self.stats_provider,
             self.history,
+            encoder_pipeline=self._get_encoder_pipeline(),
         )
         uploader.setServiceParent(self)
         self.init_blacklist()
         self.init_nodemaker()
 
+    def _get_encoder_pipeline(self):
+        """
+        Read the limits on how far immutable uploads may encode ahead of the
+        network from the ``[client]`` section.
+        """
+        default = PipelineLimits()
+        depth = int(self.config.get_config(
+            "client", "upload.pipeline_depth", default.depth,
+        ))
+        max_bytes = default.max_bytes
+        data = self.config.get_config("client", "upload.pipeline_max_bytes", None)
+        if data is not None:
+            max_bytes = parse_abbreviated_size(data)
+            if max_bytes is None:
+                raise ValueError(
+                    "[client]upload.pipeline_max_bytes= contains unparseable "
+                    "value %s" % (data,)
+                )
+        return PipelineLimits(depth=depth, max_bytes=max_bytes)
+
+    def _get_segment_cache(self):
+        """
+        Create the on-disk cache of downloaded ciphertext segments, if
+        ``[client]download.segment_cache_size`` enables it.
+        """
+        data = self.config.get_config("client", "download.segment_cache_size", None)
+        if data is None:
+            return None
+        max_size = parse_abbreviated_size(data)
+        if max_size is None:
+            raise ValueError(
+                "[client]download.segment_cache_size= contains unparseable "
+                "value %s" % (data,)
+            )
+        if max_size == 0:
+            return None
+        return SegmentCache(
+            self.config.get_private_path("segment-cache"), max_size,
+        )
+
+    def _get_readahead_max_bytes(self):
+        """
+        Read the limit on how far sequential immutable downloads may fetch
+        ahead of their consumer, or ``None`` for the downloader's default.
+        """
+        data = self.config.get_config("client", "download.readahead_max_bytes", None)
+        if data is None:
+            return None
+        max_bytes = parse_abbreviated_size(data)
+        if max_bytes is None:
+            raise ValueError(
+                "[client]download.readahead_max_bytes= contains unparseable "
+                "value %s" % (data,)
+            )
+        return max_bytes
+
+    def _get_directory_cache(self):
+        """
+        Create the in-memory cache of unpacked directories, unless
+        ``[client]dirnode.cache_children`` disables it.
+        """
+        max_children = int(self.config.get_config(
+            "client", "dirnode.cache_children", 10000,
+        ))
+        if max_children <= 0:
+            return None
+        readonly_ttl = float(self.config.get_config(
+            "client", "dirnode.readonly_cache_ttl", 0,
+        ))
+        return DirectoryCache(max_children, readonly_ttl, self.blacklist)
+
+    def _get_share_location_cache(self):
+        """
+        Create the on-disk cache of where the shares of recently used files
+        are, if ``[client]share_locations.max_entries`` enables it.
+        """
+        max_entries = int(self.config.get_config(
+            "client", "share_locations.max_entries", 0,
+        ))
+        if max_entries <= 0:
+            return None
+        cache = ShareLocationCache(
+            self.config.get_private_path("share-locations.sqlite"),
+            max_entries,
+        )
+        # closed when the client stops
+        cache.setServiceParent(self)
+        return cache
+
     def get_auth_token(self):
         """
         This returns a local authentication token, which is just some
@@ -1016,7 +1256,11 @@ class _Client(node.Node, pollmixin.PollMixin):
                                    self.get_encoding_parameters(),
                                    self.mutable_file_default,
                                    self._key_generator,
-                                   self.blacklist)
+                                   self.blacklist,
+                                   self._get_segment_cache(),
+                                   self._get_readahead_max_bytes(),
+                                   self._get_directory_cache(),
+                                   self._get_share_location_cache())
 
     def get_history(self):
         return self.history
@@ -0,0 +1,300 @@
+"""
+The engine behind ``DirectoryNode.deep_traverse``.
+
+A deep traversal is dominated by round-trip latency: each directory has to be
+fetched before its children are known, and each walker callback (a check, a
+repair) may go to the grid as well. So I keep several of these operations in
+flight at once, up to a configurable limit.
+
+Running things in parallel used to blow up memory: a queue of pending
+operations for a tree with hundreds of thousands of directories does not fit
+in a 32-bit process. So the frontier (nodes that have been found but not yet
+handed to the walker) is kept as a stack, giving a roughly depth-first
+order, and only a bounded number of its entries are kept in memory as node
+objects. The rest are spilled to a temporary file as caps, and turned back
+into nodes when the traversal gets to them. The temporary file is encrypted
+with a key that is only kept in memory, so the caps never reach the disk in
+the clear, and it is written and read in the I/O thread pool.
+
+What is not bounded is the set of nodes already found, which is needed to
+visit each node only once even if it is linked from several directories.
+It holds a 16-byte digest of the verifier cap of every file and directory
+visited so far, so it grows with the size of the tree, at roughly 100 bytes
+per node.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Optional, cast
+
+from twisted.internet import defer
+from twisted.internet.interfaces import IReactorFromThreads
+from twisted.python.failure import Failure
+
+from allmydata.interfaces import IDirectoryNode
+from allmydata.monitor import Monitor, OperationCancelledError
+from allmydata.unknown import UnknownNode
+from allmydata.util import fileutil, hashutil, jsonbytes as json
+from allmydata.util.iothreadpool import defer_to_io_thread
+
+# How many walker.add_node()/node.list() operations to run at once.
+DEFAULT_CONCURRENCY = 10
+
+# How many frontier entries to keep in memory as node objects.
+DEFAULT_MAX_IN_MEMORY = 1000
+
+
+class _Frontier:
+    """
+    A stack of ``(node, path)`` entries waiting to be visited. Once more than
+    ``max_in_memory`` entries are held, the oldest half are written to a
+    temporary file as caps. When the entries in memory run out, ``unspill()``
+    reads the newest chunk back (in the same order).
+
+    The file is only touched in the I/O thread pool, one operation at a
+    time and in the order they were requested.
+    """
+
+    def __init__(self, nodemaker, max_in_memory: int):
+        self._nodemaker = nodemaker
+        self._max_in_memory = max(2, max_in_memory)
+        self._entries: list[tuple[Any, list[str]]] = []
+        self._spillfile: Optional[fileutil.EncryptedTemporaryFile] = None
+        # (offset, length) of each spilled chunk, oldest first
+        self._chunks: list[tuple[int, int]] = []
+        # fires when the last requested file operation has finished
+        self._io: defer.Deferred[Any] = defer.succeed(None)
+
+    def __len__(self) -> int:
+        return len(self._entries) + len(self._chunks)
+
+    def must_unspill(self) -> bool:
+        """
+        Return whether ``unspill()`` has to be called before ``pop()``.
+        """
+        return not self._entries and bool(self._chunks)
+
+    def push(self, node, path: list[str]) -> None:
+        self._entries.append((node, path))
+        if len(self._entries) > self._max_in_memory:
+            self._spill()
+
+    def pop(self) -> tuple[Any, list[str]]:
+        return self._entries.pop()
+
+    def close(self) -> None:
+        self._chunks = []
+        self._entries = []
+        self._run_io(self._close_file)
+
+    def _run_io(self, f, *args) -> defer.Deferred[Any]:
+        from twisted.internet import reactor
+        d: defer.Deferred[Any] = defer.Deferred()
+        def run(ignored):
+            result = defer.Deferred.fromCoroutine(
+                defer_to_io_thread(cast(IReactorFromThreads, reactor), f, *args)
+            )
+            # a failed operation fails whoever asked for it, not the next one
+            result.chainDeferred(d)
+            return result
+        self._io.addCallback(run)
+        return d
+
+    def _close_file(self) -> None:
+        if self._spillfile is not None:
+            self._spillfile.close()
+            self._spillfile = None
+
+    def _write(self, offset: int, data: bytes) -> None:
+        if self._spillfile is None:
+            self._spillfile = fileutil.EncryptedTemporaryFile()
+        self._spillfile.seek(offset)
+        self._spillfile.write(data)
+
+    def _read(self, offset: int, length: int) -> bytes:
+        assert self._spillfile is not None
+        self._spillfile.seek(offset)
+        return self._spillfile.read(length)
+
+    def _spill(self) -> None:
+        count = len(self._entries) // 2
+        (spilled, self._entries) = (self._entries[:count],
+                                    self._entries[count:])
+        data = json.dumps_bytes([
+            [node.get_write_uri(), node.get_readonly_uri(), path]
+            for (node, path) in spilled
+        ])
+        if self._chunks:
+            (offset, length) = self._chunks[-1]
+            offset += length
+        else:
+            offset = 0
+        self._chunks.append((offset, len(data)))
+        # if the write fails, reading the chunk back fails too
+        self._run_io(self._write, offset, data).addErrback(lambda f: None)
+
+    def unspill(self) -> defer.Deferred[None]:
+        """
+        Read the newest spilled chunk back into memory.
+        """
+        (offset, length) = self._chunks.pop()
+        d = self._run_io(self._read, offset, length)
+        d.addCallback(self._unspilled)
+        return d
+
+    def _unspilled(self, data: bytes) -> None:
+        # the next spill overwrites this chunk
+        for (writecap, readcap, path) in json.loads(data):
+            node = self._nodemaker.create_from_cap(
+                writecap and writecap.encode("ascii"),
+                readcap and readcap.encode("ascii"),
+            )
+            # entries are spilled and restored in stack order
+            self._entries.append((node, path))
+
+
+class DeepTraversal:
+    """
+    I walk the tree of nodes reachable from ``root``, notifying ``walker``
+    (see ``DirectoryNode.deep_traverse`` for its interface) of everything I
+    encounter, with up to ``concurrency`` operations in flight.
+
+    Each node is given to ``walker.add_node()`` once; for directories this
+    happens before their children are listed. Apart from that, the walker
+    must not depend on the order of the calls, and must accept several of
+    its ``add_node()`` Deferreds being outstanding at once.
+    """
+
+    def __init__(self, root, walker, concurrency: Optional[int] = None,
+                 max_in_memory: Optional[int] = None):
+        if concurrency is None:
+            concurrency = DEFAULT_CONCURRENCY
+        if max_in_memory is None:
+            max_in_memory = DEFAULT_MAX_IN_MEMORY
+        self._root = root
+        self._walker = walker
+        self._concurrency = max(1, concurrency)
+        self._frontier = _Frontier(root._nodemaker, max_in_memory)
+        # digests of the verifier caps of every node we have already seen
+        self._found: set[bytes] = set()
+        self._active = 0
+        # are we waiting for the frontier to read entries back from disk?
+        self._unspilling = False
+        self._failure: Optional[Failure] = None
+        self._pumping = False
+        self._pump_again = False
+        self._done: defer.Deferred[None] = defer.Deferred()
+        self.monitor = Monitor()
+
+    def start(self) -> Monitor:
+        """
+        Start the traversal, returning a ``Monitor`` which can be used to wait
+        for the result of ``walker.finish()``, learn about progress, or
+        cancel the operation.
+        """
+        self._walker.set_monitor(self.monitor)
+        self._seen(self._root)
+        self._frontier.push(self._root, [])
+        d = self._done
+        d.addCallback(lambda ignored: self._walker.finish())
+        d.addBoth(self.monitor.finish)
+        d.addErrback(lambda f: None)
+        self._pump()
+        return self.monitor
+
+    def _seen(self, node) -> bool:
+        """
+        Record ``node`` as found, returning whether it had already been
+        found. LIT files (which have no verifier) are never considered seen.
+        """
+        verifier = node.get_verify_cap()
+        if verifier is None:
+            return False
+        key = hashutil.tagged_hash(b"allmydata_deep_traverse_v1",
+                                   verifier.to_string(), 16)
+        if key in self._found:
+            return True
+        self._found.add(key)
+        return False
+
+    def _pump(self) -> None:
+        # Operations which complete synchronously call back into here; loop
+        # instead of recursing so that long runs of LIT files don't exhaust
+        # the stack.
+        if self._pumping:
+            self._pump_again = True
+            return
+        self._pumping = True
+        try:
+            self._pump_again = True
+            while self._pump_again:
+                self._pump_again = False
+                self._start_operations()
+        finally:
+            self._pumping = False
+
+    def _start_operations(self) -> None:
+        if self._failure is None and self.monitor.is_cancelled():
+            self._failure = Failure(OperationCancelledError())
+        while (self._failure is None and self._active < self._concurrency
+               and self._frontier and not self._unspilling):
+            if self._frontier.must_unspill():
+                self._unspilling = True
+                self._frontier.unspill().addBoth(self._unspilled)
+                break
+            (node, path) = self._frontier.pop()
+            self._active += 1
+            d = self._visit(node, path)
+            d.addBoth(self._operation_done)
+        if (self._active == 0 and not self._unspilling
+                and (self._failure is not None or not self._frontier)):
+            self._frontier.close()
+            if not self._done.called:
+                if self._failure is not None:
+                    self._done.errback(self._failure)
+                else:
+                    self._done.callback(None)
+
+    def _unspilled(self, result) -> None:
+        self._unspilling = False
+        if isinstance(result, Failure) and self._failure is None:
+            self._failure = result
+        self._pump()
+
+    def _operation_done(self, result) -> None:
+        self._active -= 1
+        if isinstance(result, Failure) and self._failure is None:
+            # don't start anything new, and fail once everything in flight
+            # has finished
+            self._failure = result
+        self._pump()
+
+    def _visit(self, node, path: list[str]) -> defer.Deferred[None]:
+        d = defer.maybeDeferred(self._walker.add_node, node, path)
+        if IDirectoryNode.providedBy(node):
+            d.addCallback(lambda ignored: node.list())
+            d.addCallback(self._got_children, node, path)
+        return d
+
+    def _got_children(self, children, parent, path: list[str]):
+        self.monitor.raise_if_cancelled()
+        d = defer.maybeDeferred(self._walker.enter_directory, parent, children)
+        # Push in reverse so that children are popped in sorted order, and
+        # directories first so that file-like children (whose nodes use
+        # more memory) are visited, and can be dropped, first.
+        dirkids = []
+        filekids = []
+        for name, (child, metadata) in sorted(children.items(), reverse=True):
+            childpath = path + [name]
+            if isinstance(child, UnknownNode):
+                self._walker.add_node(child, childpath)
+                continue
+            if self._seen(child):
+                continue
+            if IDirectoryNode.providedBy(child):
+                dirkids.append((child, childpath))
+            else:
+                filekids.append((child, childpath))
+        for (child, childpath) in dirkids + filekids:
+            self._frontier.push(child, childpath)
+        return d
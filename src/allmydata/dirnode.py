@@ -3,23 +3,26 @@
 Ported to Python 3.
 """
 
+import copy
 import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
 
 from zope.interface import implementer
 from twisted.internet import defer
-from foolscap.api import fireEventually
 
 from allmydata.crypto import aes
 from allmydata.deep_stats import DeepStats
+from allmydata.deep_traverse import DeepTraversal
 from allmydata.mutable.common import NotWriteableError
 from allmydata.mutable.filenode import MutableFileNode
-from allmydata.unknown import UnknownNode, strip_prefix_for_ro
+from allmydata.unknown import strip_prefix_for_ro
 from allmydata.interfaces import IFilesystemNode, IDirectoryNode, IFileNode, \
      ExistingChildError, NoSuchChildError, ICheckable, IDeepCheckable, \
-     MustBeDeepImmutableError, CapConstraintError, ChildOfWrongTypeError
+     MustBeDeepImmutableError, CapConstraintError, ChildOfWrongTypeError, \
+     NotEnoughSharesError, ICheckAndRepairResults
 from allmydata.check_results import DeepCheckResults, \
      DeepCheckAndRepairResults
-from allmydata.monitor import Monitor
 from allmydata.util import hashutil, base32, log, jsonbytes as json
 from allmydata.util.encodingutil import quote_output, normalize
 from allmydata.util.assertutil import precondition
@@ -111,9 +114,10 @@ def update_metadata(metadata, new_metadata, now):
     return metadata
 
 
-# TODO: {Deleter,MetadataSetter,Adder}.modify all start by unpacking the
-# contents and end by repacking them. It might be better to apply them to
-# the unpacked contents.
+# {Deleter,MetadataSetter,Adder}.modify only decode the entries they touch.
+# Every other entry is copied into the new contents as it was packed, so
+# that changing one child of a large directory does not decrypt, re-encrypt
+# and re-create every other child.
 
 class Deleter:
     def __init__(self, node, namex, must_exist=True, must_be_directory=False, must_be_file=False):
@@ -124,13 +128,14 @@ class Deleter:
         self.must_be_file = must_be_file
 
     def modify(self, old_contents, servermap, first_time):
-        children = self.node._unpack_contents(old_contents)
-        if self.name not in children:
+        entries = self.node._index_contents(old_contents)
+        child_and_metadata = self.node._unpack_named_entry(entries, self.name)
+        if child_and_metadata is None:
             if first_time and self.must_exist:
                 raise NoSuchChildError(self.name)
             self.old_child = None
             return None
-        self.old_child, metadata = children[self.name]
+        self.old_child, metadata = child_and_metadata
 
         # Unknown children can be removed regardless of must_be_directory or must_be_file.
         if self.must_be_directory and IFileNode.providedBy(self.old_child):
@@ -138,8 +143,8 @@ class Deleter:
         if self.must_be_file and IDirectoryNode.providedBy(self.old_child):
             raise ChildOfWrongTypeError("delete required a file, not a directory")
 
-        del children[self.name]
-        new_contents = self.node._pack_contents(children)
+        del entries[self.name]
+        new_contents = self.node._pack_entries(entries)
         return new_contents
 
 
@@ -151,20 +156,21 @@ class MetadataSetter:
         self.create_readonly_node = create_readonly_node
 
     def modify(self, old_contents, servermap, first_time):
-        children = self.node._unpack_contents(old_contents)
+        entries = self.node._index_contents(old_contents)
         name = self.name
-        if name not in children:
+        child_and_metadata = self.node._unpack_named_entry(entries, name)
+        if child_and_metadata is None:
             raise NoSuchChildError(name)
 
         now = time.time()
-        child = children[name][0]
+        (child, old_metadata) = child_and_metadata
 
-        metadata = update_metadata(children[name][1].copy(), self.metadata, now)
+        metadata = update_metadata(old_metadata, self.metadata, now)
         if self.create_readonly_node and metadata.get('no-write', False):
             child = self.create_readonly_node(child, name)
 
-        children[name] = (child, metadata)
-        new_contents = self.node._pack_contents(children)
+        entries[name] = self.node._pack_child(name, child, metadata)
+        new_contents = self.node._pack_entries(entries)
         return new_contents
 
 
@@ -190,31 +196,32 @@ class Adder:
         self.entries[namex] = (node, metadata)
 
     def modify(self, old_contents, servermap, first_time):
-        children = self.node._unpack_contents(old_contents)
+        packed_entries = self.node._index_contents(old_contents)
         now = time.time()
         for (namex, (child, new_metadata)) in list(self.entries.items()):
             name = normalize(namex)
             precondition(IFilesystemNode.providedBy(child), child)
 
             # Strictly speaking this is redundant because we would raise the
-            # error again in _pack_normalized_children.
+            # error again in _pack_child.
             child.raise_error()
 
             metadata = None
-            if name in children:
+            existing = self.node._unpack_named_entry(packed_entries, name)
+            if existing is not None:
                 if not self.overwrite:
                     raise ExistingChildError("child %s already exists" % quote_output(name, encoding='utf-8'))
 
-                if self.overwrite == ONLY_FILES and IDirectoryNode.providedBy(children[name][0]):
+                if self.overwrite == ONLY_FILES and IDirectoryNode.providedBy(existing[0]):
                     raise ExistingChildError("child %s already exists as a directory" % quote_output(name, encoding='utf-8'))
-                metadata = children[name][1].copy()
+                metadata = existing[1]
 
             metadata = update_metadata(metadata, new_metadata, now)
             if self.create_readonly_node and metadata.get('no-write', False):
                 child = self.create_readonly_node(child, name)
 
-            children[name] = (child, metadata)
-        new_contents = self.node._pack_contents(children)
+            packed_entries[name] = self.node._pack_child(name, child, metadata)
+        new_contents = self.node._pack_entries(packed_entries)
         return new_contents
 
 def _encrypt_rw_uri(writekey, rw_uri):
@@ -248,9 +255,9 @@ def _pack_normalized_children(children, writekey, deep_immutable=False):
          children[unicode_nfc_name] = (IFileSystemNode, metadata_dict)
     and pack it into a single string, for use as the contents of the backing
     file. This is the same format as is returned by _unpack_contents. I also
-    accept an AuxValueDict, in which case I'll use the auxilliary cached data
+    accept an AuxValueDict or LazyChildren, in which case I'll use the auxilliary cached data
     as the pre-packed entry, which is faster than re-packing everything each
-    time.
+    time. The unmodified children of a LazyChildren are not even decoded.
 
     If writekey is provided then I will superencrypt the child's writecap with
     writekey.
@@ -260,6 +267,17 @@ def _pack_normalized_children(children, writekey, deep_immutable=False):
     """
     precondition((writekey is None) or isinstance(writekey, bytes), writekey)
 
+    if isinstance(children, LazyChildren) and not deep_immutable:
+        # Copy unmodified children through without decoding them.
+        entries = []
+        for (name, entry) in children.packed_entries():
+            if entry is None:
+                (child, metadata) = children[name]
+                child.raise_error()
+                entry = _pack_entry(name, child, metadata, writekey)
+            entries.append(netstring(entry))
+        return b"".join(entries)
+
     has_aux = isinstance(children, AuxValueDict)
     entries = []
     for name in sorted(children.keys()):
@@ -274,31 +292,269 @@ def _pack_normalized_children(children, writekey, deep_immutable=False):
         if has_aux:
             entry = children.get_aux(name)
         if not entry:
-            assert IFilesystemNode.providedBy(child), (name,child)
-            assert isinstance(metadata, dict)
-            rw_uri = child.get_write_uri()
-            if rw_uri is None:
-                rw_uri = b""
-            assert isinstance(rw_uri, bytes), rw_uri
-
-            # should be prevented by MustBeDeepImmutableError check above
-            assert not (rw_uri and deep_immutable)
-
-            ro_uri = child.get_readonly_uri()
-            if ro_uri is None:
-                ro_uri = b""
-            assert isinstance(ro_uri, bytes), ro_uri
-            if writekey is not None:
-                writecap = netstring(_encrypt_rw_uri(writekey, rw_uri))
-            else:
-                writecap = ZERO_LEN_NETSTR
-            entry = b"".join([netstring(name.encode("utf-8")),
-                             netstring(strip_prefix_for_ro(ro_uri, deep_immutable)),
-                             writecap,
-                             netstring(json.dumps(metadata).encode("utf-8"))])
+            entry = _pack_entry(name, child, metadata, writekey, deep_immutable)
         entries.append(netstring(entry))
     return b"".join(entries)
 
+def _pack_entry(name, child, metadata, writekey, deep_immutable=False):
+    """Pack a single child into the entry format used by
+    _pack_normalized_children (without the enclosing netstring)."""
+    assert IFilesystemNode.providedBy(child), (name,child)
+    assert isinstance(metadata, dict)
+    rw_uri = child.get_write_uri()
+    if rw_uri is None:
+        rw_uri = b""
+    assert isinstance(rw_uri, bytes), rw_uri
+
+    # should be prevented by the MustBeDeepImmutableError check in
+    # _pack_normalized_children
+    assert not (rw_uri and deep_immutable)
+
+    ro_uri = child.get_readonly_uri()
+    if ro_uri is None:
+        ro_uri = b""
+    assert isinstance(ro_uri, bytes), ro_uri
+    if writekey is not None:
+        writecap = netstring(_encrypt_rw_uri(writekey, rw_uri))
+    else:
+        writecap = ZERO_LEN_NETSTR
+    return b"".join([netstring(name.encode("utf-8")),
+                     netstring(strip_prefix_for_ro(ro_uri, deep_immutable)),
+                     writecap,
+                     netstring(json.dumps(metadata).encode("utf-8"))])
+
+
+class LazyChildren(MutableMapping):
+    """
+    I map child names to (IFilesystemNode, metadata) tuples, like the
+    AuxValueDict that used to be returned by _unpack_contents, but I only
+    decode (decrypt the writecap, parse the metadata, create the node) an
+    entry when it is first asked for. Walking a path through a huge directory
+    only decodes the entries on that path.
+
+    Entries which turn out to be unusable (see DirectoryNode._unpack_entry)
+    are left out, the same as before; telling them apart means decoding
+    them, so len() and iteration decode every entry. Use stream_items() to go
+    through all of the children without keeping them around.
+
+    Like an AuxValueDict, I keep each unmodified child's packed entry as its
+    auxilliary value, so that _pack_normalized_children can reuse it.
+    Copies share the entries decoded so far.
+    """
+
+    def __init__(self, unpack_entry, entries):
+        # unpack_entry(name, entry) returns (child, metadata) or None
+        self._unpack_entry = unpack_entry
+        # name -> packed entry, as returned by _index_contents; shared with
+        # copies and never modified
+        self._entries = entries
+        # name -> (child, metadata) or None; shared with copies, whose
+        # metadata must therefore be copied before it is handed out
+        self._decoded = {}
+        # name -> packed entry, or None once the child has been replaced
+        self._aux = dict(entries)
+        # name -> (child, metadata) that was handed out or set through me
+        self._values = {}
+
+    def _decode(self, name, remember=True):
+        try:
+            return self._decoded[name]
+        except KeyError:
+            pass
+        value = self._unpack_entry(name, self._entries[name])
+        if remember:
+            self._decoded[name] = value
+        return value
+
+    def _usable(self, name):
+        return name in self._values or self._decode(name) is not None
+
+    def __getitem__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        if name not in self._aux:
+            raise KeyError(name)
+        value = self._decode(name)
+        if value is None:
+            raise KeyError(name)
+        (child, metadata) = value
+        value = self._values[name] = (child, copy.deepcopy(metadata))
+        return value
+
+    def __contains__(self, name):
+        return name in self._aux and self._usable(name)
+
+    def __iter__(self):
+        for name in list(self._aux):
+            if self._usable(name):
+                yield name
+
+    def __len__(self):
+        return sum(1 for name in self)
+
+    def __setitem__(self, name, value):
+        self.set_with_aux(name, value, None)
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        del self._aux[name]
+        self._values.pop(name, None)
+
+    def get_aux(self, name, default=None):
+        """Return the packed entry of an unmodified child (see
+        AuxValueDict.get_aux)."""
+        return self._aux.get(name, default)
+
+    def set_with_aux(self, name, value, auxilliary):
+        self._values[name] = value
+        self._aux[name] = auxilliary
+
+    def packed_entries(self):
+        """Yield (name, entry) for each child, in name order, without decoding
+        anything. entry is the packed entry of an unmodified child, or None
+        for a child that was set through me."""
+        for name in sorted(self._aux):
+            yield (name, self._aux[name])
+
+    def count_entries(self):
+        """Return how many entries I have, counting the ones that might turn
+        out to be unusable, without decoding anything."""
+        return len(self._aux)
+
+    def stream_items(self):
+        """Yield (name, (child, metadata)) for each child, like items(),
+        except that children which were not already decoded are not kept."""
+        for name in list(self._aux):
+            if name in self._values:
+                yield (name, self._values[name])
+                continue
+            value = self._decode(name, remember=False)
+            if value is not None:
+                yield (name, value)
+
+    def copy(self):
+        """Return a copy which the caller may modify, metadata included,
+        without affecting me."""
+        copied = LazyChildren(self._unpack_entry, self._entries)
+        copied._decoded = self._decoded
+        copied._aux = dict(self._aux)
+        copied._values = {
+            name: (child, copy.deepcopy(metadata))
+            for (name, (child, metadata)) in self._values.items()
+        }
+        return copied
+
+
+class DirectoryCache:
+    """
+    I remember the unpacked children of recently-read directories, so that
+    reading an unchanged directory again does not have to download it,
+    parse every entry, decrypt every writecap and create every child node.
+
+    Each directory's entry is tagged with the version it was unpacked from:
+    (seqnum, root hash) for mutable directories, None for immutable ones.
+    A reader checks that tag against the current best version (which only
+    needs a servermap update) before using the entry. Entries for read-only
+    mutable directories may also be used without any check for up to
+    ``readonly_ttl`` seconds after they were last validated.
+
+    The cache holds up to ``max_children`` children in total; the least
+    recently used directories are dropped first.
+
+    The cached children were created through the nodemaker, which wraps
+    blacklisted nodes. If a ``blacklist`` is given, I start over whenever it
+    changes.
+    """
+
+    def __init__(self, max_children, readonly_ttl=0, blacklist=None,
+                 clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self._max_children = max_children
+        self._readonly_ttl = readonly_ttl
+        self._blacklist = blacklist
+        self._blacklist_state = None
+        self._clock = clock
+        # (storage_index, writeable) -> (version, children, validated_at),
+        # least recently used first
+        self._entries = OrderedDict()
+        self._total_children = 0
+
+    def _size(self, children):
+        return children.count_entries() + 1
+
+    def _check_blacklist(self):
+        if self._blacklist is None:
+            return
+        self._blacklist.read_blacklist()
+        # a removed blacklist file empties the entries without touching
+        # last_mtime
+        state = (self._blacklist.last_mtime, len(self._blacklist.entries))
+        if state != self._blacklist_state:
+            self._blacklist_state = state
+            self._entries.clear()
+            self._total_children = 0
+
+    def get(self, storage_index, writeable, version):
+        """
+        Return a copy of the children of the given version of a directory,
+        or None if that version is not cached.
+        """
+        self._check_blacklist()
+        key = (storage_index, writeable)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            return None
+        self._entries[key] = (version, entry[1], self._clock.seconds())
+        self._entries.move_to_end(key)
+        return entry[1].copy()
+
+    def get_recent(self, storage_index):
+        """
+        Return a copy of the children of a read-only directory that were
+        validated within the last ``readonly_ttl`` seconds, or None.
+        """
+        self._check_blacklist()
+        key = (storage_index, False)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._clock.seconds() - entry[2] >= self._readonly_ttl:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1].copy()
+
+    def put(self, storage_index, writeable, version, children):
+        """
+        Remember the children unpacked from the given version of a
+        directory. The caller must not modify ``children`` afterwards.
+        """
+        size = self._size(children)
+        if size > self._max_children:
+            return
+        key = (storage_index, writeable)
+        self._discard(key)
+        self._entries[key] = (version, children, self._clock.seconds())
+        self._total_children += size
+        while self._total_children > self._max_children:
+            self._discard(next(iter(self._entries)))
+
+    def invalidate(self, storage_index):
+        """
+        Forget everything about a directory, because it is being modified.
+        """
+        self._discard((storage_index, True))
+        self._discard((storage_index, False))
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_children -= self._size(entry[1])
+
+
 @implementer(IDirectoryNode, ICheckable, IDeepCheckable)
 class DirectoryNode:
     filenode_class = MutableFileNode
@@ -311,6 +567,8 @@ class DirectoryNode:
         self._uri = wrap_dirnode_cap(filenode_cap)
         self._nodemaker = nodemaker
         self._uploader = uploader
+        # size of the version last read through the directory cache
+        self._size = None
 
     def __repr__(self):
         return "<%s %s-%s %s>" % (self.__class__.__name__,
@@ -321,6 +579,8 @@ class DirectoryNode:
     def get_size(self):
         """Return the size of our backing mutable file, in bytes, if we've
         fetched it. Otherwise return None. This returns synchronously."""
+        if self._size is not None:
+            return self._size
         return self._node.get_size()
 
     def get_current_size(self):
@@ -329,6 +589,49 @@ class DirectoryNode:
         return self._node.get_current_size()
 
     def _read(self):
+        cache = self._nodemaker.directory_cache
+        if cache is None:
+            return self._download_and_unpack()
+        storage_index = self._node.get_storage_index()
+        if storage_index is None:
+            # a literal directory is as cheap to unpack as to look up
+            return self._download_and_unpack()
+        writeable = not self.is_readonly()
+        if not self._node.is_mutable():
+            # immutable directories never change
+            children = cache.get(storage_index, writeable, None)
+            if children is not None:
+                return defer.succeed(children)
+            d = download_to_data(self._node)
+            d.addCallback(self._unpack_and_cache, storage_index, writeable,
+                          None)
+            return d
+        if not writeable:
+            children = cache.get_recent(storage_index)
+            if children is not None:
+                return defer.succeed(children)
+        # A servermap update is enough to tell whether the cached children
+        # are still current.
+        d = self._node.get_best_readable_version()
+        def _got_version(mfv):
+            self._size = mfv.get_size()
+            version = (mfv.get_sequence_number(), mfv.get_root_hash())
+            children = cache.get(storage_index, writeable, version)
+            if children is not None:
+                return children
+            d = mfv.download_to_data()
+            d.addCallback(self._unpack_and_cache, storage_index, writeable,
+                          version)
+            def _retry(f):
+                # download_best_version() knows how to try harder
+                f.trap(NotEnoughSharesError)
+                return self._download_and_unpack()
+            d.addErrback(_retry)
+            return d
+        d.addCallback(_got_version)
+        return d
+
+    def _download_and_unpack(self):
         if self._node.is_mutable():
             # use the IMutableFileNode API.
             d = self._node.download_best_version()
@@ -337,6 +640,30 @@ class DirectoryNode:
         d.addCallback(self._unpack_contents)
         return d
 
+    def _unpack_and_cache(self, data, storage_index, writeable, version):
+        children = self._unpack_contents(data)
+        self._nodemaker.directory_cache.put(storage_index, writeable,
+                                            version, children)
+        return children.copy()
+
+    def _modify(self, modifier):
+        """
+        Apply ``modifier`` to the backing mutable file, making sure that no
+        out-of-date copy of the children stays in the directory cache.
+        """
+        cache = self._nodemaker.directory_cache
+        if cache is None:
+            return self._node.modify(modifier)
+        self._size = None
+        storage_index = self._node.get_storage_index()
+        cache.invalidate(storage_index)
+        d = self._node.modify(modifier)
+        def _invalidate(res):
+            cache.invalidate(storage_index)
+            return res
+        d.addBoth(_invalidate)
+        return d
+
     def _decrypt_rwcapdata(self, encwrcap):
         salt = encwrcap[:16]
         crypttext = encwrcap[16:-32]
@@ -366,58 +693,83 @@ class DirectoryNode:
         # cleartext. The 'name' is UTF-8 encoded, and should be normalized to NFC.
         # The rwcapdata is formatted as:
         # pack("16ss32s", iv, AES(H(writekey+iv), plaintext_rw_uri), mac)
+        # Entries are only decoded when they are used; see LazyChildren.
+        return LazyChildren(self._unpack_entry, self._index_contents(data))
+
+    def _index_contents(self, data):
+        """Split the serialized directory into its entries, without decoding
+        them. I return a dict mapping each child's normalized name to its
+        packed entry, in the order the entries appear."""
         assert isinstance(data, bytes), (repr(data), type(data))
-        # an empty directory is serialized as an empty string
-        if data == b"":
-            return AuxValueDict()
-        writeable = not self.is_readonly()
-        mutable = self.is_mutable()
-        children = AuxValueDict()
+        entries = {}
         position = 0
+        # an empty directory is serialized as an empty string
         while position < len(data):
-            entries, position = split_netstring(data, 1, position)
-            entry = entries[0]
-            (namex_utf8, ro_uri, rwcapdata, metadata_s), subpos = split_netstring(entry, 4)
-            if not mutable and len(rwcapdata) > 0:
-                raise ValueError("the rwcapdata field of a dirnode in an immutable directory was not empty")
-
+            (entry,), position = split_netstring(data, 1, position)
+            (namex_utf8,), _ = split_netstring(entry, 1)
             # A name containing characters that are unassigned in one version of Unicode might
             # not be normalized wrt a later version. See the note in section 'Normalization Stability'
             # at <http://unicode.org/policies/stability_policy.html>.
             # Therefore we normalize names going both in and out of directories.
             name = normalize(namex_utf8.decode("utf-8"))
+            entries[name] = entry
+        return entries
+
+    def _unpack_entry(self, name, entry):
+        """Decode one packed entry (as returned by _index_contents) into a
+        (child, metadata) tuple. I return None, after logging why, if the
+        child is not allowed in this directory."""
+        (namex_utf8, ro_uri, rwcapdata, metadata_s), subpos = split_netstring(entry, 4)
+        mutable = self.is_mutable()
+        if not mutable and len(rwcapdata) > 0:
+            raise ValueError("the rwcapdata field of a dirnode in an immutable directory was not empty")
+
+        rw_uri = b""
+        if not self.is_readonly():
+            rw_uri = self._decrypt_rwcapdata(rwcapdata)
+
+        # Since the encryption uses CTR mode, it currently leaks the length of the
+        # plaintext rw_uri -- and therefore whether it is present, i.e. whether the
+        # dirnode is writeable (ticket #925). By stripping trailing spaces in
+        # Tahoe >= 1.6.0, we may make it easier for future versions to plug this leak.
+        # ro_uri is treated in the same way for consistency.
+        # rw_uri and ro_uri will be either None or a non-empty string.
+
+        rw_uri = rw_uri.rstrip(b' ') or None
+        ro_uri = ro_uri.rstrip(b' ') or None
+
+        try:
+            child = self._create_and_validate_node(rw_uri, ro_uri, name)
+            if mutable or child.is_allowed_in_immutable_directory():
+                metadata = json.loads(metadata_s)
+                assert isinstance(metadata, dict)
+                return (child, metadata)
+            log.msg(format="mutable cap for child %(name)s unpacked from an immutable directory",
+                    name=quote_output(name, encoding='utf-8'),
+                    facility="tahoe.webish", level=log.UNUSUAL)
+        except CapConstraintError as e:
+            log.msg(format="unmet constraint on cap for child %(name)s unpacked from a directory:\n"
+                           "%(message)s", message=e.args[0], name=quote_output(name, encoding='utf-8'),
+                           facility="tahoe.webish", level=log.UNUSUAL)
+        return None
+
+    def _unpack_named_entry(self, entries, name):
+        """Decode the entry for 'name' from a dict returned by
+        _index_contents. I return None if there is no usable child by that
+        name."""
+        if name not in entries:
+            return None
+        return self._unpack_entry(name, entries[name])
+
+    def _pack_child(self, name, child, metadata):
+        """Pack one child for use with _pack_entries."""
+        child.raise_error()
+        return _pack_entry(name, child, metadata, self._node.get_writekey())
 
-            rw_uri = b""
-            if writeable:
-                rw_uri = self._decrypt_rwcapdata(rwcapdata)
-
-            # Since the encryption uses CTR mode, it currently leaks the length of the
-            # plaintext rw_uri -- and therefore whether it is present, i.e. whether the
-            # dirnode is writeable (ticket #925). By stripping trailing spaces in
-            # Tahoe >= 1.6.0, we may make it easier for future versions to plug this leak.
-            # ro_uri is treated in the same way for consistency.
-            # rw_uri and ro_uri will be either None or a non-empty string.
-
-            rw_uri = rw_uri.rstrip(b' ') or None
-            ro_uri = ro_uri.rstrip(b' ') or None
-
-            try:
-                child = self._create_and_validate_node(rw_uri, ro_uri, name)
-                if mutable or child.is_allowed_in_immutable_directory():
-                    metadata = json.loads(metadata_s)
-                    assert isinstance(metadata, dict)
-                    children[name] = (child, metadata)
-                    children.set_with_aux(name, (child, metadata), auxilliary=entry)
-                else:
-                    log.msg(format="mutable cap for child %(name)s unpacked from an immutable directory",
-                            name=quote_output(name, encoding='utf-8'),
-                            facility="tahoe.webish", level=log.UNUSUAL)
-            except CapConstraintError as e:
-                log.msg(format="unmet constraint on cap for child %(name)s unpacked from a directory:\n"
-                               "%(message)s", message=e.args[0], name=quote_output(name, encoding='utf-8'),
-                               facility="tahoe.webish", level=log.UNUSUAL)
-
-        return children
+    def _pack_entries(self, entries):
+        """Serialize a dict of packed entries, like the one returned by
+        _index_contents."""
+        return b"".join([netstring(entries[name]) for name in sorted(entries)])
 
     def _pack_contents(self, children):
         # expects children in the same format as _unpack_contents returns
@@ -527,7 +879,7 @@ class DirectoryNode:
         assert isinstance(metadata, dict)
         s = MetadataSetter(self, name, metadata,
                            create_readonly_node=self._create_readonly_node)
-        d = self._node.modify(s.modify)
+        d = self._modify(s.modify)
         d.addCallback(lambda res: self)
         return d
 
@@ -598,7 +950,7 @@ class DirectoryNode:
             # for this type of directory.
             child_node = self._create_and_validate_node(writecap, readcap, namex)
             a.set_node(namex, child_node, metadata)
-        d = self._node.modify(a.modify)
+        d = self._modify(a.modify)
         d.addCallback(lambda ign: self)
         return d
 
@@ -619,7 +971,7 @@ class DirectoryNode:
         a = Adder(self, overwrite=overwrite,
                   create_readonly_node=self._create_readonly_node)
         a.set_node(namex, child, metadata)
-        d = self._node.modify(a.modify)
+        d = self._modify(a.modify)
         d.addCallback(lambda res: child)
         return d
 
@@ -629,7 +981,7 @@ class DirectoryNode:
             return defer.fail(NotWriteableError())
         a = Adder(self, entries, overwrite=overwrite,
                   create_readonly_node=self._create_readonly_node)
-        d = self._node.modify(a.modify)
+        d = self._modify(a.modify)
         d.addCallback(lambda res: self)
         return d
 
@@ -661,7 +1013,7 @@ class DirectoryNode:
             return defer.fail(NotWriteableError())
         deleter = Deleter(self, namex, must_exist=must_exist,
                           must_be_directory=must_be_directory, must_be_file=must_be_file)
-        d = self._node.modify(deleter.modify)
+        d = self._modify(deleter.modify)
         d.addCallback(lambda res: deleter.old_child)
         return d
 
@@ -687,7 +1039,7 @@ class DirectoryNode:
             entries = {name: (child, metadata)}
             a = Adder(self, entries, overwrite=overwrite,
                       create_readonly_node=self._create_readonly_node)
-            d = self._node.modify(a.modify)
+            d = self._modify(a.modify)
             d.addCallback(lambda res: child)
             return d
         d.addCallback(_created)
@@ -730,7 +1082,7 @@ class DirectoryNode:
         return d
 
 
-    def deep_traverse(self, walker):
+    def deep_traverse(self, walker, concurrency=None, max_in_memory=None):
         """Perform a recursive walk, using this dirnode as a root, notifying
         the 'walker' instance of everything I encounter.
 
@@ -742,7 +1094,14 @@ class DirectoryNode:
         counts how large a directory is.
 
         I call walker.add_node(node, path) for each node (both files and
-        directories) I can reach. Most work should be done here.
+        directories) I can reach. Most work should be done here. A directory
+        is given to add_node() before its children are listed.
+
+        Up to 'concurrency' add_node() and list() operations are run at the
+        same time, so the walker must not rely on the order of its calls.
+        At most 'max_in_memory' of the nodes waiting to be visited are held
+        in memory; the rest are spilled to a temporary file. Both default
+        to the values in allmydata.deep_traverse.
 
         I avoid loops by keeping track of verifier-caps and refusing to call
         walker.add_node() or traverse a node that I've seen before. This
@@ -754,78 +1113,8 @@ class DirectoryNode:
         I return a Monitor which can be used to wait for the operation to
         finish, learn about its progress, or cancel the operation.
         """
-
-        # this is just a tree-walker, except that following each edge
-        # requires a Deferred. We used to use a ConcurrencyLimiter to limit
-        # fanout to 10 simultaneous operations, but the memory load of the
-        # queued operations was excessive (in one case, with 330k dirnodes,
-        # it caused the process to run into the 3.0GB-ish per-process 32bit
-        # linux memory limit, and crashed). So we use a single big Deferred
-        # chain, and do a strict depth-first traversal, one node at a time.
-        # This can be slower, because we aren't pipelining directory reads,
-        # but it brought the memory footprint down by roughly 50%.
-
-        monitor = Monitor()
-        walker.set_monitor(monitor)
-
-        found = set([self.get_verify_cap()])
-        d = self._deep_traverse_dirnode(self, [], walker, monitor, found)
-        d.addCallback(lambda ignored: walker.finish())
-        d.addBoth(monitor.finish)
-        d.addErrback(lambda f: None)
-
-        return monitor
-
-    def _deep_traverse_dirnode(self, node, path, walker, monitor, found):
-        # process this directory, then walk its children
-        monitor.raise_if_cancelled()
-        d = defer.maybeDeferred(walker.add_node, node, path)
-        d.addCallback(lambda ignored: node.list())
-        d.addCallback(self._deep_traverse_dirnode_children, node, path,
-                      walker, monitor, found)
-        return d
-
-    def _deep_traverse_dirnode_children(self, children, parent, path,
-                                        walker, monitor, found):
-        monitor.raise_if_cancelled()
-        d = defer.maybeDeferred(walker.enter_directory, parent, children)
-        # we process file-like children first, so we can drop their FileNode
-        # objects as quickly as possible. Tests suggest that a FileNode (held
-        # in the client's nodecache) consumes about 2440 bytes. dirnodes (not
-        # in the nodecache) seem to consume about 2000 bytes.
-        dirkids = []
-        filekids = []
-        for name, (child, metadata) in sorted(children.items()):
-            childpath = path + [name]
-            if isinstance(child, UnknownNode):
-                walker.add_node(child, childpath)
-                continue
-            verifier = child.get_verify_cap()
-            # allow LIT files (for which verifier==None) to be processed
-            if (verifier is not None) and (verifier in found):
-                continue
-            found.add(verifier)
-            if IDirectoryNode.providedBy(child):
-                dirkids.append( (child, childpath) )
-            else:
-                filekids.append( (child, childpath) )
-        for i, (child, childpath) in enumerate(filekids):
-            d.addCallback(lambda ignored, child=child, childpath=childpath:
-                          walker.add_node(child, childpath))
-            # to work around the Deferred tail-recursion problem
-            # (specifically the defer.succeed flavor) requires us to avoid
-            # doing more than 158 LIT files in a row. We insert a turn break
-            # once every 100 files (LIT or CHK) to preserve some stack space
-            # for other code. This is a different expression of the same
-            # Twisted problem as in #237.
-            if i % 100 == 99:
-                d.addCallback(lambda ignored: fireEventually())
-        for (child, childpath) in dirkids:
-            d.addCallback(lambda ignored, child=child, childpath=childpath:
-                          self._deep_traverse_dirnode(child, childpath,
-                                                      walker, monitor,
-                                                      found))
-        return d
+        return DeepTraversal(self, walker, concurrency,
+                             max_in_memory).start()
 
 
     def build_manifest(self):
@@ -873,6 +1162,76 @@ class ManifestWalker(DeepStats):
                 }
 
 
+# The most leases that DeepLeaseAdder sends to one server at once, which is
+# also the most that the HTTP storage protocol takes in one request.
+LEASE_BATCH_SIZE = 1024
+
+class DeepLeaseAdder:
+    """I add leases for the files and directories that a deep-check visits.
+
+    Rather than have every check send its own add-lease messages, the deep
+    checkers check without adding leases and pass me the results. I queue a
+    lease for each server that holds shares of the node, and send each
+    server its leases with IStorageServer.add_leases() once LEASE_BATCH_SIZE
+    of them have been queued, or when I am flushed at the end of the
+    traversal.
+    """
+
+    def __init__(self, root):
+        self._secret_holder = root._nodemaker.secret_holder
+        # IServer -> [(storage_index, renew_secret, cancel_secret)]
+        self._leases = {}
+
+    def add_results(self, results, node):
+        """Queue the leases for a node, given the results of checking it.
+        Return a Deferred that fires with the results, once any batches that
+        this filled have been sent."""
+        si = node.get_storage_index()
+        if results is None or si is None:
+            # literal files and unknown nodes have no shares to lease
+            return defer.succeed(results)
+        cr = results
+        if ICheckAndRepairResults.providedBy(results):
+            cr = results.get_pre_repair_results()
+        servers = set()
+        for shareholders in cr.get_sharemap().values():
+            servers.update(shareholders)
+        crs = hashutil.file_renewal_secret_hash(
+            self._secret_holder.get_renewal_secret(), si)
+        ccs = hashutil.file_cancel_secret_hash(
+            self._secret_holder.get_cancel_secret(), si)
+        ds = []
+        for server in servers:
+            lease_seed = server.get_lease_seed()
+            leases = self._leases.setdefault(server, [])
+            leases.append((si,
+                           hashutil.bucket_renewal_secret_hash(crs, lease_seed),
+                           hashutil.bucket_cancel_secret_hash(ccs, lease_seed)))
+            if len(leases) >= LEASE_BATCH_SIZE:
+                ds.append(self._send(server))
+        d = defer.DeferredList(ds)
+        d.addCallback(lambda ignored: results)
+        return d
+
+    def flush(self):
+        """Send all of the queued leases. Return a Deferred that fires when
+        the servers have answered."""
+        return defer.DeferredList([self._send(server)
+                                   for server in list(self._leases)])
+
+    def _send(self, server):
+        leases = self._leases.pop(server)
+        ds = server.get_storage_server().add_leases(leases)
+        for (d, lease) in zip(ds, leases):
+            d.addErrback(self._add_lease_failed, server, lease[0])
+        return defer.DeferredList(ds)
+
+    def _add_lease_failed(self, f, server, storage_index):
+        log.msg(format="error in add_lease to [%(name)s] for %(si)s",
+                name=server.get_name(), si=base32.b2a(storage_index),
+                failure=f, level=log.UNUSUAL, umid="cA2Qmw")
+
+
 class DeepChecker:
     def __init__(self, root, verify, repair, add_lease):
         root_si = root.get_storage_index()
@@ -885,7 +1244,7 @@ class DeepChecker:
                            si=root_si_base32, verify=verify, repair=repair)
         self._verify = verify
         self._repair = repair
-        self._add_lease = add_lease
+        self._leases = DeepLeaseAdder(root) if add_lease else None
         if repair:
             self._results = DeepCheckAndRepairResults(root_si)
         else:
@@ -898,10 +1257,14 @@ class DeepChecker:
 
     def add_node(self, node, childpath):
         if self._repair:
-            d = node.check_and_repair(self.monitor, self._verify, self._add_lease)
+            d = node.check_and_repair(self.monitor, self._verify, False)
+            if self._leases:
+                d.addCallback(self._leases.add_results, node)
             d.addCallback(self._results.add_check_and_repair, childpath)
         else:
-            d = node.check(self.monitor, self._verify, self._add_lease)
+            d = node.check(self.monitor, self._verify, False)
+            if self._leases:
+                d.addCallback(self._leases.add_results, node)
             d.addCallback(self._results.add_check, childpath)
         d.addCallback(lambda ignored: self._stats.add_node(node, childpath))
         return d
@@ -910,9 +1273,13 @@ class DeepChecker:
         return self._stats.enter_directory(parent, children)
 
     def finish(self):
-        log.msg("deep-check done", parent=self._lp)
-        self._results.update_stats(self._stats.get_results())
-        return self._results
+        d = self._leases.flush() if self._leases else defer.succeed(None)
+        def _done(ignored):
+            log.msg("deep-check done", parent=self._lp)
+            self._results.update_stats(self._stats.get_results())
+            return self._results
+        d.addCallback(_done)
+        return d
 
 
 # use client.create_dirnode() to make one of these
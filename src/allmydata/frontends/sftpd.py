@@ -4,6 +4,7 @@ Ported to Python 3.
 
 import six
 import heapq, traceback, stat, struct
+from collections import OrderedDict
 from stat import S_IFREG, S_IFDIR
 from time import time, strftime, localtime
 
@@ -32,13 +33,15 @@ from allmydata.util import deferredutil
 from allmydata.util.assertutil import _assert, precondition
 from allmydata.util.consumer import download_to_data
 from allmydata.util.encodingutil import get_filesystem_encoding
+from allmydata.util.observer import OneShotObserverList
 from allmydata.interfaces import IFileNode, IDirectoryNode, ExistingChildError, \
-     NoSuchChildError, ChildOfWrongTypeError
+     NoSuchChildError, ChildOfWrongTypeError, MDMF_VERSION
 from allmydata.mutable.common import NotWriteableError
 from allmydata.mutable.publish import MutableFileHandle
 from allmydata.immutable.upload import FileHandle
 from allmydata.dirnode import update_metadata
 from allmydata.util.fileutil import EncryptedTemporaryFile
+from allmydata.util.spans import Spans
 
 noisy = True
 
@@ -563,6 +566,174 @@ class OverwriteableFileConsumer(PrefixingLogMixin):
         self.log("producer unregistered", level=NOISY)
 
 
+def _close_files(res, files):
+    for f in files:
+        f.close()
+    return res
+
+
+class MutableUpdateFile(PrefixingLogMixin):
+    """I stand in for an OverwriteableFileConsumer when an existing MDMF file is opened
+    for writing without FXF_TRUNC. Rather than downloading the whole file, I keep the
+    data that is written in a temporary file, and the regions that have been written in
+    a Spans. Reads of the other regions go to the version of the file that was current
+    when it was opened. On commit, the written regions are published together as one
+    MDMF in-place update that re-encodes only the segments they touch, so the cost of
+    the writes depends on how much was written rather than on the size of the file.
+
+    An update cannot make a file shorter, so if the file is truncated below its original
+    size, the whole file is published instead."""
+
+    def __init__(self, version, tempfile_maker):
+        PrefixingLogMixin.__init__(self, facility="tahoe.sftp")
+        if noisy: self.log(".__init__(%r, %r)" % (version, tempfile_maker), level=NOISY)
+        self.version = version
+        self.tempfile_maker = tempfile_maker
+        self.original_size = version.get_size()
+        self.current_size = self.original_size
+        # The first base_size bytes of the file come from self.version, except where
+        # they have been written. Everything from base_size to current_size has been
+        # written.
+        self.base_size = self.original_size
+        self.written = Spans()
+        self.f = tempfile_maker()
+        self.is_closed = False
+
+    def get_current_size(self):
+        return self.current_size
+
+    def set_current_size(self, size):
+        if noisy: self.log(".set_current_size(%r), current_size = %r" % (size, self.current_size), level=NOISY)
+        if size < self.current_size:
+            self.written.remove(size, self.current_size - size)
+            self.base_size = min(self.base_size, size)
+            self.current_size = size
+        elif size > self.current_size:
+            self._write_zeros(self.current_size, size)
+
+    def overwrite(self, offset, data):
+        if noisy: self.log(".overwrite(%r, <data of length %r>)" % (offset, len(data)), level=NOISY)
+        if self.is_closed:
+            self.log("overwrite called on a closed MutableUpdateFile", level=WEIRD)
+            raise createSFTPError(FX_BAD_MESSAGE, "cannot write to a closed file handle")
+
+        if offset > self.current_size:
+            # Normally writing at an offset beyond the current end-of-file
+            # would leave a hole that appears filled with zeroes.
+            self._write_zeros(self.current_size, offset)
+        self._write(offset, data)
+
+    def _write_zeros(self, start, end):
+        for offset in range(start, end, READ_BLOCK_SIZE):
+            self._write(offset, b"\x00" * min(READ_BLOCK_SIZE, end - offset))
+
+    def _write(self, offset, data):
+        if not data:
+            return
+        self.f.seek(offset)
+        self.f.write(data)
+        self.written.add(offset, len(data))
+        self.current_size = max(self.current_size, offset + len(data))
+
+    def _regions(self, start, end):
+        """Yield (offset, length, written) for the consecutive regions that make up
+        bytes start to end of the file, where written says whether the region has
+        been written or is still that of self.version."""
+        offset = start
+        for (s, length) in Spans(start, end - start) & self.written:
+            if s > offset:
+                yield (offset, s - offset, False)
+            yield (s, length, True)
+            offset = s + length
+        if offset < end:
+            yield (offset, end - offset, False)
+
+    def read(self, offset, length):
+        """Return a Deferred that fires with the data read, or fails."""
+
+        if noisy: self.log(".read(%r, %r), current_size = %r" % (offset, length, self.current_size), level=NOISY)
+        if self.is_closed:
+            self.log("read called on a closed MutableUpdateFile", level=WEIRD)
+            raise createSFTPError(FX_BAD_MESSAGE, "cannot read from a closed file handle")
+
+        if offset >= self.current_size:
+            def _eof(): raise EOFError("read past end of file")
+            return defer.execute(_eof)
+        end = min(offset + length, self.current_size)
+
+        # The written regions are read immediately, so that later writes do not affect
+        # the result.
+        pieces = []
+        for (start, size, written) in self._regions(offset, end):
+            if written:
+                self.f.seek(start)
+                pieces.append(defer.succeed(self.f.read(size)))
+            else:
+                _assert(start + size <= self.base_size, start=start, size=size, base_size=self.base_size)
+                pieces.append(download_to_data(self.version, start, size))
+        d = deferredutil.gatherResults(pieces)
+        d.addCallback(lambda data: b"".join(data))
+        return d
+
+    def _copy(self, start, end):
+        """Return a Deferred that fires with a new temporary file containing bytes
+        start to end of the file."""
+        f = self.tempfile_maker()
+        d = defer.succeed(None)
+        for offset in range(start, end, READ_BLOCK_SIZE):
+            d.addCallback(lambda ign, offset=offset: self.read(offset, min(READ_BLOCK_SIZE, end - offset)))
+            d.addCallback(f.write)
+        d.addCallback(lambda ign: f)
+        return d
+
+    def commit(self, filenode):
+        """Publish the changes to filenode. Return a Deferred that fires when they
+        have been published."""
+
+        if self.base_size < self.original_size:
+            self.log("file was truncated; publishing the whole file", level=OPERATIONAL)
+            d = self._copy(0, self.current_size)
+            def _overwrite(f):
+                d2 = filenode.overwrite(MutableFileHandle(f))
+                d2.addBoth(_close_files, [f])
+                return d2
+            d.addCallback(_overwrite)
+            return d
+
+        if not self.written:
+            return defer.succeed(None)
+
+        # A single update publishes either all of the writes made through this
+        # handle or none of them.
+        spans = list(self.written)
+        self.log("publishing %d written regions" % (len(spans),), level=OPERATIONAL)
+        files = []
+        d = defer.succeed(None)
+        for (start, length) in spans:
+            d.addCallback(lambda ign, start=start, length=length: self._copy(start, start + length))
+            d.addCallback(files.append)
+        def _publish(ign):
+            ranges = [(start, MutableFileHandle(f)) for ((start, length), f) in zip(spans, files)]
+            d2 = filenode.get_best_mutable_version()
+            d2.addCallback(lambda version: version.update_ranges(ranges))
+            return d2
+        d.addCallback(_publish)
+        d.addBoth(_close_files, files)
+        return d
+
+    def when_done(self):
+        return defer.succeed(None)
+
+    def close(self):
+        if not self.is_closed:
+            self.is_closed = True
+            try:
+                self.f.close()
+            except Exception as e:
+                self.log("suppressed %r from close of temporary file %r" % (e, self.f), level=WEIRD)
+        return None
+
+
 SIZE_THRESHOLD = 1000
 
 
@@ -644,11 +815,131 @@ class ShortReadOnlySFTPFile(PrefixingLogMixin):
         return defer.execute(_denied)
 
 
+# RangeReadOnlySFTPFile reads files in blocks of this size (the default
+# segment size), and keeps this many of the most recently used blocks.
+READ_BLOCK_SIZE = 128*1024
+READ_CACHE_BLOCKS = 8
+
+
+@implementer(ISFTPFile)
+class RangeReadOnlySFTPFile(PrefixingLogMixin):
+    """I represent a file handle to a particular file on an SFTP connection.
+    I am used for immutable and MDMF files that are opened in read-only mode
+    and are too big for ShortReadOnlySFTPFile. Rather than downloading the
+    whole file, I read only the aligned blocks that each read request covers,
+    and keep the few most recently used ones for the requests that follow.
+    The version of the file to read is chosen when I am created."""
+
+    def __init__(self, userpath, filenode, metadata):
+        PrefixingLogMixin.__init__(self, facility="tahoe.sftp", prefix=userpath)
+        if noisy: self.log(".__init__(%r, %r, %r)" % (userpath, filenode, metadata), level=NOISY)
+
+        precondition(isinstance(userpath, bytes) and IFileNode.providedBy(filenode),
+                     userpath=userpath, filenode=filenode)
+        self.filenode = filenode
+        self.metadata = metadata
+        self.closed = False
+        self._version = OneShotObserverList()
+        filenode.get_best_readable_version().addBoth(self._version.fire)
+        # block number -> data, least recently used first
+        self._blocks = OrderedDict()
+        # block number -> OneShotObserverList, for blocks being downloaded
+        self._fetching = {}
+
+    def _get_block(self, version, blocknum):
+        data = self._blocks.get(blocknum)
+        if data is not None:
+            self._blocks.move_to_end(blocknum)
+            return defer.succeed(data)
+
+        observers = self._fetching.get(blocknum)
+        if observers is None:
+            observers = self._fetching[blocknum] = OneShotObserverList()
+            start = blocknum * READ_BLOCK_SIZE
+            size = min(READ_BLOCK_SIZE, version.get_size() - start)
+            if noisy: self.log("_get_block: downloading %r bytes at %r" % (size, start), level=NOISY)
+            d = download_to_data(version, start, size)
+            def _downloaded(res):
+                del self._fetching[blocknum]
+                if not isinstance(res, Failure) and not self.closed:
+                    self._blocks[blocknum] = res
+                    while len(self._blocks) > READ_CACHE_BLOCKS:
+                        self._blocks.popitem(last=False)
+                observers.fire(res)
+            d.addBoth(_downloaded)
+        return observers.when_fired()
+
+    def readChunk(self, offset, length):
+        request = ".readChunk(%r, %r)" % (offset, length)
+        self.log(request, level=OPERATIONAL)
+
+        if self.closed:
+            def _closed(): raise createSFTPError(FX_BAD_MESSAGE, "cannot read from a closed file handle")
+            return defer.execute(_closed)
+
+        d = defer.Deferred()
+        def _read(version):
+            if noisy: self.log("_read in readChunk(%r, %r)" % (offset, length), level=NOISY)
+
+            # See ShortReadOnlySFTPFile.readChunk: we respond with an EOF error
+            # iff offset is already at EOF.
+            size = version.get_size()
+            if offset >= size:
+                raise createSFTPError(FX_EOF, "read at or past end of file")
+            end = min(offset + length, size)  # truncated if offset+length > size
+            if end <= offset:
+                return b""
+
+            first = offset // READ_BLOCK_SIZE
+            last = (end - 1) // READ_BLOCK_SIZE
+            d2 = deferredutil.gatherResults([self._get_block(version, blocknum)
+                                             for blocknum in range(first, last + 1)])
+            base = first * READ_BLOCK_SIZE
+            d2.addCallback(lambda blocks: b"".join(blocks)[offset - base:end - base])
+            return d2
+        d1 = self._version.when_fired()
+        d1.addCallback(_read)
+        d1.addBoth(eventually_callback(d))
+        d.addBoth(_convert_error, request)
+        return d
+
+    def writeChunk(self, offset, data):
+        self.log(".writeChunk(%r, <data of length %r>) denied" % (offset, len(data)), level=OPERATIONAL)
+
+        def _denied(): raise createSFTPError(FX_PERMISSION_DENIED, "file handle was not opened for writing")
+        return defer.execute(_denied)
+
+    def close(self):
+        self.log(".close()", level=OPERATIONAL)
+
+        self.closed = True
+        self._blocks.clear()
+        return defer.succeed(None)
+
+    def getAttrs(self):
+        request = ".getAttrs()"
+        self.log(request, level=OPERATIONAL)
+
+        if self.closed:
+            def _closed(): raise createSFTPError(FX_BAD_MESSAGE, "cannot get attributes for a closed file handle")
+            return defer.execute(_closed)
+
+        d = self._version.when_fired()
+        d.addCallback(lambda version: _populate_attrs(self.filenode, self.metadata, size=version.get_size()))
+        d.addBoth(_convert_error, request)
+        return d
+
+    def setAttrs(self, attrs):
+        self.log(".setAttrs(%r) denied" % (attrs,), level=OPERATIONAL)
+        def _denied(): raise createSFTPError(FX_PERMISSION_DENIED, "file handle was not opened for writing")
+        return defer.execute(_denied)
+
+
 @implementer(ISFTPFile)
 class GeneralSFTPFile(PrefixingLogMixin):
     """I represent a file handle to a particular file on an SFTP connection.
-    I wrap an instance of OverwriteableFileConsumer, which is responsible for
-    storing the file contents. In order to allow write requests to be satisfied
+    I wrap an instance of OverwriteableFileConsumer (or of MutableUpdateFile, for
+    an existing MDMF file), which is responsible for storing the file contents. In order to allow write requests to be satisfied
     immediately, there is effectively a FIFO queue between requests made to this
     file handle, and requests to my OverwriteableFileConsumer. This queue is
     implemented by the callback chain of self.async_.
@@ -702,6 +993,15 @@ class GeneralSFTPFile(PrefixingLogMixin):
             # We're either truncating or creating the file, so we don't need the old contents.
             self.consumer = OverwriteableFileConsumer(0, tempfile_maker)
             self.consumer.download_done(b"download not needed")
+        elif ((self.flags & FXF_WRITE) and filenode.is_mutable() and not filenode.is_readonly()
+              and filenode.get_version() == MDMF_VERSION):
+            # Only the regions that are written will be published, so we don't need
+            # to download the old contents.
+            self.async_.addCallback(lambda ignored: filenode.get_best_mutable_version())
+
+            def _got_version(version):
+                self.consumer = MutableUpdateFile(version, tempfile_maker)
+            self.async_.addCallback(_got_version)
         else:
             self.async_.addCallback(lambda ignored: filenode.get_best_readable_version())
 
@@ -877,7 +1177,10 @@ class GeneralSFTPFile(PrefixingLogMixin):
                     _assert(parent and childname, parent=parent, childname=childname, metadata=self.metadata)
                     d2.addCallback(lambda ign: parent.set_metadata_for(childname, self.metadata))
 
-                d2.addCallback(lambda ign: self.filenode.overwrite(MutableFileHandle(self.consumer.get_file())))
+                if isinstance(self.consumer, MutableUpdateFile):
+                    d2.addCallback(lambda ign: self.consumer.commit(self.filenode))
+                else:
+                    d2.addCallback(lambda ign: self.filenode.overwrite(MutableFileHandle(self.consumer.get_file())))
             else:
                 def _add_file(ign):
                     self.log("_add_file childname=%r" % (childname,), level=OPERATIONAL)
@@ -1269,6 +1572,10 @@ class SFTPUserHandler(ConchUser, PrefixingLogMixin):
 
         if not writing and (flags & FXF_READ) and filenode and not filenode.is_mutable() and filenode.get_size() <= SIZE_THRESHOLD:
             d.addCallback(lambda ign: ShortReadOnlySFTPFile(userpath, filenode, metadata))
+        elif not writing and (flags & FXF_READ) and filenode and (not filenode.is_mutable() or
+                                                                  filenode.get_version() == MDMF_VERSION):
+            # SDMF files have a single segment, so they gain nothing from this.
+            d.addCallback(lambda ign: RangeReadOnlySFTPFile(userpath, filenode, metadata))
         else:
             close_notify = None
             if writing:
@@ -32,7 +32,15 @@ class History:
         self.recent_helper_upload_statuses = []
 
 
+    def _observe_timings(self, status, prefix):
+        # Feed the time taken by each phase of the operation into histograms
+        if self.stats_provider:
+            status.set_timing_observer(
+                lambda phase, elapsed: self.stats_provider.add_latency(
+                    "%s.%s" % (prefix, phase), elapsed))
+
     def add_download(self, download_status):
+        self._observe_timings(download_status, "downloader")
         self.all_downloads_statuses[download_status] = None
         self.recent_download_statuses.append(download_status)
         while len(self.recent_download_statuses) > self.MAX_DOWNLOAD_STATUSES:
@@ -43,6 +51,7 @@ class History:
             yield ds
 
     def add_upload(self, upload_status):
+        self._observe_timings(upload_status, "uploader")
         self.all_upload_statuses[upload_status] = None
         self.recent_upload_statuses.append(upload_status)
         while len(self.recent_upload_statuses) > self.MAX_UPLOAD_STATUSES:
@@ -61,6 +70,7 @@ class History:
             self.recent_mapupdate_status.pop(0)
 
     def notify_publish(self, p, size):
+        self._observe_timings(p, "mutable.publish")
         self.all_publish_status[p] = None
         self.recent_publish_status.append(p)
         if self.stats_provider:
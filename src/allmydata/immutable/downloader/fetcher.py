@@ -137,6 +137,12 @@ class SegmentFetcher:
                        | set(self._active_share_map.keys())
                        | set(self._overdue_share_map.keys())
                        ) < k:
+                    if any(sh.is_checking_block()
+                           for sh in self._active_share_map.values()):
+                        # some share already has its block and is just
+                        # checking the hash. Wait a moment for the verdict,
+                        # so we know whether any shares were usable.
+                        return
                     # nope. bail.
                     self._no_shares_error() # this calls self.stop()
                     return
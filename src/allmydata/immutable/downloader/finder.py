@@ -33,7 +33,8 @@ class ShareFinder:
     OVERDUE_TIMEOUT = 10.0
 
     def __init__(self, storage_broker, verifycap, node, download_status,
-                 logparent=None, max_outstanding_requests=10):
+                 logparent=None, max_outstanding_requests=10,
+                 share_location_cache=None):
         self.running = True # stopped by Share.stop, from Terminator
         self.verifycap = verifycap
         self._started = False
@@ -41,6 +42,9 @@ class ShareFinder:
         self.share_consumer = self.node = node
         self.max_outstanding_requests = max_outstanding_requests
         self._hungry = False
+        self._share_location_cache = share_location_cache
+        # ids of the servers believed to hold shares, for the cache
+        self._servers_with_shares = set()
 
         self._commonshares = {} # shnum to CommonShare instance
         self.pending_requests = set()
@@ -68,6 +72,13 @@ class ShareFinder:
         if not self._started:
             si = self.verifycap.storage_index
             servers = self._storage_broker.get_servers_for_psi(si)
+            cache = self._share_location_cache
+            if cache is not None:
+                # ask the servers that had shares last time first
+                locations = cache.get(si)
+                if locations is not None:
+                    self._servers_with_shares = set(locations.servers)
+                servers = cache.order_servers(si, servers)
             self._servers = iter(servers)
             self._started = True
 
@@ -171,6 +182,7 @@ class ShareFinder:
         time_received = now()
         d_ev.finished(shnums, time_received)
         dyhb_rtt = time_received - time_sent
+        self._update_share_locations(server, bool(buckets))
         if not buckets:
             self.log(format="no shares from [%(name)s]", name=server.get_name(),
                      level=log.NOISY, parent=lp, umid="U7d4JA")
@@ -185,6 +197,19 @@ class ShareFinder:
             shares.append(s)
         self._deliver_shares(shares)
 
+    def _update_share_locations(self, server, has_shares):
+        if self._share_location_cache is None:
+            return
+        serverid = server.get_serverid()
+        if has_shares == (serverid in self._servers_with_shares):
+            return
+        if has_shares:
+            self._servers_with_shares.add(serverid)
+        else:
+            self._servers_with_shares.discard(serverid)
+        self._share_location_cache.record(self._storage_index,
+                                          self._servers_with_shares)
+
     def _create_share(self, shnum, bucket, server, dyhb_rtt):
         if shnum in self._commonshares:
             cs = self._commonshares[shnum]
@@ -19,6 +19,7 @@ from allmydata.hashtree import IncompleteHashTree, BadHashError, \
 from .finder import ShareFinder
 from .fetcher import SegmentFetcher
 from .segmentation import Segmentation
+from . import segcache
 from .common import BadCiphertextHashError
 
 class IDownloadStatusHandlingConsumer(Interface):
@@ -42,10 +43,14 @@ class DownloadNode:
     callers use CiphertextFileNode instead."""
 
     default_max_segment_size = DEFAULT_IMMUTABLE_MAX_SEGMENT_SIZE
+    # how many bytes of segments a sequential read() may fetch ahead of its
+    # consumer
+    default_readahead_max_bytes = 1024*1024
 
     # Share._node points to me
     def __init__(self, verifycap, storage_broker, secret_holder,
-                 terminator, history, download_status):
+                 terminator, history, download_status, segment_cache=None,
+                 readahead_max_bytes=None, share_location_cache=None):
         assert isinstance(verifycap, uri.CHKFileVerifierURI)
         self._verifycap = verifycap
         self._storage_broker = storage_broker
@@ -62,6 +67,17 @@ class DownloadNode:
         self._secret_holder = secret_holder
         self._history = history
         self._download_status = download_status
+        # an optional segcache.SegmentCache of verified ciphertext segments
+        self._segment_cache = segment_cache
+        # the key of this file in the segment cache: a hash of the whole
+        # verify cap, so that another file with the same storage index
+        # cannot supply our segments
+        self._cache_id = None
+        if segment_cache is not None:
+            self._cache_id = segcache.file_id(verifycap)
+        if readahead_max_bytes is None:
+            readahead_max_bytes = self.default_readahead_max_bytes
+        self.readahead_max_bytes = readahead_max_bytes
 
         self.share_hash_tree = IncompleteHashTree(self._verifycap.total_shares)
 
@@ -69,8 +85,15 @@ class DownloadNode:
         # segments in a single roundtrip. This populates
         # .guessed_segment_size, .guessed_num_segments, and
         # .ciphertext_hash_tree (with a dummy, to let us guess which hashes
-        # we'll need)
-        self._build_guessed_tables(self.default_max_segment_size)
+        # we'll need). If the segment cache knows the real segment size, the
+        # guess is exact, and cached segments can be served without ever
+        # seeing the UEB.
+        max_segment_size = self.default_max_segment_size
+        if segment_cache is not None:
+            cached_segsize = segment_cache.get_segment_size(self._cache_id)
+            if cached_segsize is not None:
+                max_segment_size = cached_segsize
+        self._build_guessed_tables(max_segment_size)
 
         # filled in when we parse a valid UEB
         self.have_UEB = False
@@ -87,6 +110,11 @@ class DownloadNode:
         self._segment_requests = [] # (segnum, d, cancel_handle, seg_ev, lp)
         self._active_segment = None # a SegmentFetcher, with .segnum
 
+        # read-ahead: segments fetched before anybody asked for them, so
+        # the network stays busy while the consumer is working
+        self._readahead = {} # segnum -> SegmentFetcher
+        self._prefetched = {} # segnum -> (offset, segment, decodetime)
+
         self._segsize_observers = observer.OneShotObserverList()
 
         # we create one top-level logparent for this _Node, and another one
@@ -103,8 +131,11 @@ class DownloadNode:
                      level=log.OPERATIONAL, umid="uJ0zAQ")
         self._lp = lp
 
+        # share_location_cache is an optional
+        # share_locations.ShareLocationCache
         self._sharefinder = ShareFinder(storage_broker, verifycap, self,
-                                        self._download_status, lp)
+                                        self._download_status, lp,
+                                        share_location_cache=share_location_cache)
         self._shares = set()
 
     def _build_guessed_tables(self, max_segment_size):
@@ -126,6 +157,8 @@ class DownloadNode:
         if self._active_segment:
             seg, self._active_segment = self._active_segment, None
             seg.stop()
+        for segnum in list(self._readahead):
+            self.cancel_prefetch(segnum)
         self._sharefinder.stop()
 
     # things called by outside callers, via CiphertextFileNode. get_segment()
@@ -209,14 +242,123 @@ class DownloadNode:
         seg_ev = self._download_status.add_segment_request(segnum, now())
         d = defer.Deferred()
         c = Cancel(self._cancel_request)
+        if (self._segment_cache is not None and
+            self._segment_cache.has_segment(self._cache_id, segnum)):
+            self._get_cached_segment(segnum, d, c, seg_ev, lp)
+            return (d, c)
+        if segnum in self._prefetched:
+            result = self._prefetched.pop(segnum)
+            (offset, segment, decodetime) = result
+            when = now()
+            seg_ev.activate(when)
+            seg_ev.deliver(when, offset, len(segment), decodetime)
+            eventually(self._deliver, d, c, result)
+            return (d, c)
         self._segment_requests.append( (segnum, d, c, seg_ev, lp) )
         self._start_new_segment()
         return (d, c)
 
+    def prefetch(self, segnum, logparent=None):
+        """Start fetching a segment that will probably be asked for soon.
+        A later get_segment() for it uses the fetch already in progress, or
+        its result. The caller is responsible for limiting how many segments
+        are prefetched, and should cancel_prefetch() any it will not ask
+        for after all."""
+        if not self.running:
+            return
+        if (segnum in self._readahead or segnum in self._prefetched or
+            (self._active_segment and self._active_segment.segnum == segnum)
+            or any(req[0] == segnum for req in self._segment_requests)):
+            return
+        if (self._segment_cache is not None and
+            self._segment_cache.has_segment(self._cache_id, segnum)):
+            return
+        log.msg(format="%(node)s.prefetch: segnum=%(segnum)d",
+                node=repr(self), segnum=segnum,
+                level=log.NOISY, parent=logparent, umid="Xk2fCQ")
+        k = self._verifycap.needed_shares
+        fetcher = SegmentFetcher(self, segnum, k, logparent)
+        self._readahead[segnum] = fetcher
+        fetcher.add_shares([s for s in self._shares if s.is_alive()])
+
+    def cancel_prefetch(self, segnum):
+        """Forget about a prefetch() for a segment that is no longer
+        wanted."""
+        self._prefetched.pop(segnum, None)
+        fetcher = self._readahead.pop(segnum, None)
+        if fetcher:
+            fetcher.stop()
+
+    def _get_cached_segment(self, segnum, d, c, seg_ev, lp):
+        # a cache hit needs neither the ShareFinder nor a SegmentFetcher
+        segsize = self._segment_cache.get_segment_size(self._cache_id)
+        offset = segnum * segsize
+        start = now()
+        seg_ev.activate(start)
+        cd = self._segment_cache.get_segment(self._cache_id, segnum)
+        def _got_cached_segment(segment):
+            if not c.active:
+                return # cancelled while we were reading
+            if (segment is not None and
+                not self._cached_segment_is_valid(segnum, segsize, segment)):
+                log.msg(format="cached segment(%(segnum)d) does not match"
+                        " the file, discarding it",
+                        segnum=segnum,
+                        level=log.WEIRD, parent=lp, umid="fX1ZbQ")
+                self._segment_cache.discard_segment(self._cache_id, segnum)
+                segment = None
+            if segment is None:
+                # evicted or damaged since we looked: fetch it after all
+                self._segment_requests.append( (segnum, d, c, seg_ev, lp) )
+                self._start_new_segment()
+                return
+            when = now()
+            log.msg(format="delivering cached segment(%(segnum)d)",
+                    segnum=segnum,
+                    level=log.OPERATIONAL, parent=lp, umid="b0xG5w")
+            if self._history:
+                sp = self._history.stats_provider
+                sp.count("downloader.segment_cache_hits", 1)
+            seg_ev.deliver(when, offset, len(segment), 0)
+            eventually(self._deliver, d, c, (offset, segment, 0))
+        cd.addCallback(_got_cached_segment)
+        cd.addErrback(log.err, "unhandled error reading cached segment",
+                      level=log.WEIRD, parent=lp, umid="Bk5Hcw")
+
+    def _cached_segment_is_valid(self, segnum, segsize, segment):
+        """Check a segment from the cache against what we know about the
+        file: its size, and once we have the UEB, its segment size and
+        ciphertext hash tree."""
+        size = self._verifycap.size
+        offset = segnum * segsize
+        if offset >= size or len(segment) != min(segsize, size - offset):
+            return False
+        if not self.have_UEB:
+            return True
+        if segsize != self.segment_size:
+            return False
+        h = hashutil.crypttext_segment_hash(segment)
+        try:
+            self.ciphertext_hash_tree.set_hashes(leaves={segnum: h})
+        except BadHashError:
+            return False
+        except NotEnoughHashesError:
+            # we haven't fetched the hashes needed to check it. The entry
+            # is keyed by our verify cap, so it was checked against this
+            # same tree when it was stored.
+            pass
+        return True
+
     def get_segsize(self):
         """Return a Deferred that fires when we know the real segment size."""
         if self.segment_size:
             return defer.succeed(self.segment_size)
+        if self._segment_cache is not None:
+            # get_segment(0) below would not see the UEB on a cache hit
+            cached_segsize = self._segment_cache.get_segment_size(
+                self._cache_id)
+            if cached_segsize is not None:
+                return defer.succeed(cached_segsize)
         # TODO: this downloads (and discards) the first segment of the file.
         # We could make this more efficient by writing
         # fetcher.SegmentSizeFetcher, with the job of finding a single valid
@@ -238,8 +380,12 @@ class DownloadNode:
             log.msg(format="%(node)s._start_new_segment: segnum=%(segnum)d",
                     node=repr(self), segnum=segnum,
                     level=log.NOISY, parent=lp, umid="wAlnHQ")
-            self._active_segment = fetcher = SegmentFetcher(self, segnum, k, lp)
             seg_ev.activate(now())
+            if segnum in self._readahead:
+                # already on its way
+                self._active_segment = self._readahead.pop(segnum)
+                return
+            self._active_segment = fetcher = SegmentFetcher(self, segnum, k, lp)
             active_shares = [s for s in self._shares if s.is_alive()]
             fetcher.add_shares(active_shares) # this triggers the loop
 
@@ -249,10 +395,14 @@ class DownloadNode:
         self._shares.update(shares)
         if self._active_segment:
             self._active_segment.add_shares(shares)
+        for fetcher in self._readahead.values():
+            fetcher.add_shares(shares)
     def no_more_shares(self):
         self._no_more_shares = True
         if self._active_segment:
             self._active_segment.no_more_shares()
+        for fetcher in self._readahead.values():
+            fetcher.no_more_shares()
 
     # things called by our Share instances
 
@@ -401,6 +551,14 @@ class DownloadNode:
         self._sharefinder.hungry()
 
     def fetch_failed(self, sf, f):
+        if self._readahead.get(sf.segnum) is sf:
+            # nobody is waiting for this one yet. If they ask for it later,
+            # they'll get a fresh attempt (and the error, if it recurs).
+            del self._readahead[sf.segnum]
+            log.msg(format="prefetch of segnum=%(segnum)d failed",
+                    segnum=sf.segnum, failure=f,
+                    level=log.NOISY, parent=self._lp, umid="v1x3dg")
+            return
         assert sf is self._active_segment
         self._active_segment = None
         # deliver error upwards
@@ -421,12 +579,22 @@ class DownloadNode:
             when = now()
             if isinstance(result, Failure):
                 # this catches failures in decode or ciphertext hash
+                self._readahead.pop(segnum, None)
                 for (d,c,seg_ev) in self._extract_requests(segnum):
                     seg_ev.error(when)
                     eventually(self._deliver, d, c, result)
             else:
                 (offset, segment, decodetime) = result
-                self._active_segment = None
+                if self._active_segment and self._active_segment.segnum == segnum:
+                    self._active_segment = None
+                elif self._readahead.pop(segnum, None):
+                    # a prefetch that nobody has asked for yet: keep it
+                    # until they do
+                    self._prefetched[segnum] = result
+                if self._segment_cache is not None:
+                    self._segment_cache.put_segment(
+                        self._cache_id, segnum,
+                        self.segment_size, segment)
                 for (d,c,seg_ev) in self._extract_requests(segnum):
                     # when we have two requests for the same segment, the
                     # second one will not be "activated" before the data is
@@ -483,7 +651,6 @@ class DownloadNode:
     def _check_ciphertext_hash(self, segment_and_decodetime, segnum):
         (segment, decodetime) = segment_and_decodetime
         start = now()
-        assert self._active_segment.segnum == segnum
         assert self.segment_size is not None
         offset = segnum * self.segment_size
 
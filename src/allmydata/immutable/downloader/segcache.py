@@ -0,0 +1,296 @@
+"""
+An optional on-disk cache of verified ciphertext segments.
+
+Media players and HTTP range requests tend to read the same parts of a file
+over and over. Each ``DownloadNode`` is short-lived, so without a cache every
+one of those reads locates shares and fetches and decodes blocks again. The
+cache remembers decoded ciphertext segments, keyed by (file id, segnum),
+so that a repeated read only has to decrypt.
+
+The file id is a hash of the whole verify cap (see ``file_id()``), not just
+the storage index. Anybody with the read key can upload a different file
+with the same storage index, but not one with the same UEB hash, so a
+segment of such a file is never served for the real one.
+
+Only segments that have been validated against the ciphertext hash tree are
+stored. The cache lives in the node's private directory and only holds
+ciphertext, so it is no more sensitive than the shares themselves. Each entry
+carries a checksum so that a damaged file is treated as a miss instead of
+being handed to the consumer.
+
+Layout: ``BASEDIR/<file id>/<segnum>``, each file holding a header
+(segment size of the file, checksum of the data) followed by the segment.
+The total size of the cache is bounded; the least recently used segments
+are evicted first.
+"""
+
+from __future__ import annotations
+
+import os
+import struct
+from collections import OrderedDict, Counter
+from typing import Optional, cast
+
+from twisted.internet.defer import Deferred
+from twisted.internet.interfaces import IReactorFromThreads
+from twisted.python.failure import Failure
+
+from allmydata import uri
+from allmydata.util import base32, fileutil, hashutil, log
+from allmydata.util.deferredutil import async_to_deferred
+from allmydata.util.iothreadpool import defer_to_io_thread
+
+# segment size of the file, crypttext_segment_hash of the data
+_HEADER = struct.Struct(">Q32s")
+
+
+def file_id(verifycap: uri.CHKFileVerifierURI) -> bytes:
+    """
+    Return the id under which the segments of the file with the given verify
+    cap are cached.
+    """
+    return hashutil.tagged_hash(b"allmydata_segment_cache_file_id_v1",
+                                verifycap.to_string())
+
+
+def _read_entry(path: str) -> Optional[bytes]:
+    """
+    Read and check one cache entry, marking it as recently used. Return
+    ``None`` if it is missing or damaged.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except EnvironmentError:
+        return None
+    if len(data) < _HEADER.size:
+        return None
+    (_, checksum) = _HEADER.unpack_from(data)
+    segment = data[_HEADER.size:]
+    if hashutil.crypttext_segment_hash(segment) != checksum:
+        return None
+    try:
+        # persist the LRU order across restarts
+        os.utime(path)
+    except EnvironmentError:
+        pass
+    return segment
+
+
+def _write_entry(dirname: str, path: str, segment_size: int, segment: bytes) -> None:
+    fileutil.make_dirs(dirname)
+    header = _HEADER.pack(segment_size, hashutil.crypttext_segment_hash(segment))
+    fileutil.write_atomically(path, header + segment)
+
+
+def _scan(basedir: str) -> tuple[dict[bytes, int], list[tuple[float, bytes, int, int]]]:
+    """
+    Find the entries already in the cache directory. Return the segment size
+    of each file with cached segments, and an (mtime, file id, segnum,
+    size) tuple for each entry.
+    """
+    fileutil.make_dirs(basedir)
+    segment_sizes = {}
+    found = []
+    for id_s in os.listdir(basedir):
+        dirname = os.path.join(basedir, id_s)
+        if not (os.path.isdir(dirname) and id_s.isascii() and
+                base32.could_be_base32_encoded(id_s.encode("ascii"))):
+            continue
+        file_id = base32.a2b(id_s.encode("ascii"))
+        for name in os.listdir(dirname):
+            path = os.path.join(dirname, name)
+            if not name.isdigit():
+                # left over from an interrupted write
+                fileutil.remove_if_possible(path)
+                continue
+            if file_id not in segment_sizes:
+                with open(path, "rb") as f:
+                    header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    fileutil.remove_if_possible(path)
+                    continue
+                (segment_size, _) = _HEADER.unpack(header)
+                segment_sizes[file_id] = segment_size
+            st = os.stat(path)
+            found.append((st.st_mtime, file_id, int(name), st.st_size))
+    return (segment_sizes, found)
+
+
+def _remove_entries(paths: list[str], dirnames: list[str]) -> None:
+    for path in paths:
+        fileutil.remove_if_possible(path)
+    for dirname in dirnames:
+        try:
+            os.rmdir(dirname)
+        except EnvironmentError:
+            # not empty: a new segment was written in the meantime
+            pass
+
+
+class SegmentCache:
+    """
+    I hold up to ``max_size`` bytes of ciphertext segments in ``basedir``.
+
+    My index lives in memory and is only used from the reactor thread; the
+    files themselves are read and written in the I/O thread pool. The
+    entries left by an earlier run are found in the I/O thread pool too, and
+    until they are, reads of them are misses.
+    """
+
+    def __init__(self, basedir: str, max_size: int):
+        self._basedir = basedir
+        self._max_size = max_size
+        # (file_id, segnum) -> size on disk, least recently used first
+        self._entries: OrderedDict[tuple[bytes, int], int] = OrderedDict()
+        self._total_size = 0
+        # file_id -> segment size, for every file with cached segments
+        self._segment_sizes: dict[bytes, int] = {}
+        self._segments_per_file: Counter[bytes] = Counter()
+        # keys currently being written
+        self._pending: set[tuple[bytes, int]] = set()
+        self._load()
+
+    def _dirname(self, file_id: bytes) -> str:
+        return os.path.join(self._basedir, str(base32.b2a(file_id), "ascii"))
+
+    def _path(self, file_id: bytes, segnum: int) -> str:
+        return os.path.join(self._dirname(file_id), str(segnum))
+
+    def _load(self) -> None:
+        from twisted.internet import reactor
+        d = Deferred.fromCoroutine(
+            defer_to_io_thread(cast(IReactorFromThreads, reactor), _scan,
+                               self._basedir)
+        )
+        d.addCallback(self._loaded)
+        d.addErrback(log.err, "error loading the segment cache",
+                     level=log.WEIRD, umid="Uq3Zmd")
+
+    def _loaded(self, result: tuple[dict[bytes, int],
+                                    list[tuple[float, bytes, int, int]]]) -> None:
+        (segment_sizes, found) = result
+        for (file_id, segment_size) in segment_sizes.items():
+            self._segment_sizes.setdefault(file_id, segment_size)
+        # Segments stored while we were scanning are more recently used than
+        # any we found, so the found ones go in front of them, newest first.
+        for (_, file_id, segnum, size) in sorted(found, reverse=True):
+            key = (file_id, segnum)
+            if key not in self._entries:
+                self._add(key, size)
+                self._entries.move_to_end(key, last=False)
+        self._evict()
+
+    def _add(self, key: tuple[bytes, int], size: int) -> None:
+        self._entries[key] = size
+        self._total_size += size
+        self._segments_per_file[key[0]] += 1
+
+    def _forget(self, key: tuple[bytes, int]) -> tuple[list[str], list[str]]:
+        """
+        Drop ``key`` from the index, returning the file and (possibly empty)
+        directory that should be removed from disk.
+        """
+        (file_id, segnum) = key
+        self._total_size -= self._entries.pop(key)
+        self._segments_per_file[file_id] -= 1
+        dirnames = []
+        if not self._segments_per_file[file_id]:
+            del self._segments_per_file[file_id]
+            del self._segment_sizes[file_id]
+            dirnames.append(self._dirname(file_id))
+        return ([self._path(file_id, segnum)], dirnames)
+
+    def _evict(self) -> None:
+        paths: list[str] = []
+        dirnames: list[str] = []
+        while self._total_size > self._max_size:
+            key = next(iter(self._entries))
+            (p, d) = self._forget(key)
+            paths.extend(p)
+            dirnames.extend(d)
+        if paths:
+            self._remove(paths, dirnames)
+
+    def _remove(self, paths: list[str], dirnames: list[str]) -> None:
+        from twisted.internet import reactor
+        d = Deferred.fromCoroutine(
+            defer_to_io_thread(cast(IReactorFromThreads, reactor),
+                               _remove_entries, paths, dirnames)
+        )
+        d.addErrback(log.err, "error removing segment cache entries",
+                     level=log.WEIRD, umid="ZlB2qQ")
+
+    def get_total_size(self) -> int:
+        """Return the number of bytes currently used on disk."""
+        return self._total_size
+
+    def get_segment_size(self, file_id: bytes) -> Optional[int]:
+        """
+        Return the segment size of the given file, if any of its segments are
+        cached, otherwise ``None``.
+        """
+        return self._segment_sizes.get(file_id)
+
+    def has_segment(self, file_id: bytes, segnum: int) -> bool:
+        return (file_id, segnum) in self._entries
+
+    def discard_segment(self, file_id: bytes, segnum: int) -> None:
+        """
+        Remove the given segment from the cache, if it is there.
+        """
+        key = (file_id, segnum)
+        if key in self._entries:
+            self._remove(*self._forget(key))
+
+    @async_to_deferred
+    async def get_segment(self, file_id: bytes, segnum: int) -> Optional[bytes]:
+        """
+        Return the cached ciphertext of the given segment, or ``None`` if it
+        is not cached (or could not be read back).
+        """
+        from twisted.internet import reactor
+        key = (file_id, segnum)
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        segment = await defer_to_io_thread(
+            cast(IReactorFromThreads, reactor), _read_entry,
+            self._path(file_id, segnum),
+        )
+        if segment is None and key in self._entries:
+            log.msg(format="segment cache entry %(id)s/%(segnum)d is damaged",
+                    id=base32.b2a(file_id), segnum=segnum,
+                    level=log.UNUSUAL, umid="p2Q3Vw")
+            self._remove(*self._forget(key))
+        return segment
+
+    @async_to_deferred
+    async def put_segment(self, file_id: bytes, segnum: int,
+                          segment_size: int, segment: bytes) -> None:
+        """
+        Store the ciphertext of a segment which has already been validated
+        against the file's ciphertext hash tree. Errors are logged, not
+        raised: the cache is only an optimization.
+        """
+        from twisted.internet import reactor
+        key = (file_id, segnum)
+        size = _HEADER.size + len(segment)
+        if key in self._entries or key in self._pending or size > self._max_size:
+            return
+        self._pending.add(key)
+        try:
+            await defer_to_io_thread(
+                cast(IReactorFromThreads, reactor), _write_entry,
+                self._dirname(file_id),
+                self._path(file_id, segnum), segment_size, segment,
+            )
+        except Exception:
+            log.err(Failure(), "error writing segment cache entry",
+                    level=log.WEIRD, umid="3mJq9A")
+            return
+        finally:
+            self._pending.discard(key)
+        self._segment_sizes[file_id] = segment_size
+        self._add(key, size)
+        self._evict()
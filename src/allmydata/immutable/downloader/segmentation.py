@@ -21,6 +21,11 @@ class Segmentation:
     (from my CiphertextDownloader) in order, and trim the segments down to
     match the offset+size span. I use the Producer/Consumer interface to only
     request one segment at a time.
+
+    While the consumer is busy with one segment, I ask my node to prefetch
+    the following ones (but nothing beyond the end of my span). The
+    read-ahead window starts at one segment and doubles with every segment
+    delivered in sequence, up to the node's readahead_max_bytes.
     """
     def __init__(self, node, offset, size, consumer, read_ev, logparent=None):
         self._node = node
@@ -36,6 +41,9 @@ class Segmentation:
         self._read_ev = read_ev
         self._start_pause = None
         self._lp = logparent
+        self._readahead_window = 0 # in segments
+        self._last_segnum = None
+        self._prefetching = set() # segnums we asked the node to prefetch
 
     def start(self):
         self._alive = True
@@ -124,6 +132,7 @@ class Segmentation:
 
         self._offset += len(desired_data)
         self._size -= len(desired_data)
+        self._read_ahead(wanted_segnum)
         self._consumer.write(desired_data)
         # the consumer might call our .pauseProducing() inside that write()
         # call, setting self._hungry=False
@@ -132,6 +141,31 @@ class Segmentation:
         # _read_ev.update with how much decrypt_time was consumed
         self._maybe_fetch_next()
 
+    def _read_ahead(self, segnum):
+        # segnum has just arrived: keep the next few coming
+        n = self._node
+        self._prefetching.discard(segnum)
+        if not self._size or n.segment_size is None:
+            return
+        max_window = n.readahead_max_bytes // n.segment_size
+        if self._last_segnum is not None and segnum == self._last_segnum + 1:
+            self._readahead_window = min(max(1, 2*self._readahead_window),
+                                         max_window)
+        else:
+            self._readahead_window = min(1, max_window)
+        self._last_segnum = segnum
+        last_wanted = (self._offset + self._size - 1) // n.segment_size
+        for s in range(segnum + 1,
+                       min(segnum + self._readahead_window, last_wanted) + 1):
+            if s not in self._prefetching:
+                self._prefetching.add(s)
+                n.prefetch(s, self._lp)
+
+    def _cancel_prefetches(self):
+        for segnum in self._prefetching:
+            self._node.cancel_prefetch(segnum)
+        self._prefetching.clear()
+
     def _retry_bad_segment(self, f):
         f.trap(WrongSegmentError, BadSegmentNumberError)
         # we guessed the segnum wrong: either one that doesn't overlap with
@@ -146,6 +180,7 @@ class Segmentation:
                 level=log.WEIRD, parent=self._lp, umid="EYlXBg")
         self._alive = False
         self._hungry = False
+        self._cancel_prefetches()
         self._deferred.errback(f)
 
     def stopProducing(self):
@@ -157,6 +192,7 @@ class Segmentation:
         if self._cancel_segment_request:
             self._cancel_segment_request.cancel()
             self._cancel_segment_request = None
+        self._cancel_prefetches()
         e = DownloadStopped("our Consumer called stopProducing()")
         self._deferred.errback(e)
 
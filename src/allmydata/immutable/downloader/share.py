@@ -7,6 +7,7 @@ import time
 now = time.time
 
 from twisted.python.failure import Failure
+from twisted.internet.defer import Deferred
 from foolscap.api import eventually
 from allmydata.util import base32, log, hashutil, mathutil
 from allmydata.util.spans import Spans, DataSpans
@@ -38,6 +39,13 @@ class Share:
     # this is a specific implementation of IShare for tahoe's native storage
     # servers. A different backend would use a different class.
 
+    # The most spans to ask for in one read vector:
+    MAX_READV_SPANS = 64
+    # The most bytes to ask for in one read vector. HTTP storage servers
+    # refuse larger ones (see MAX_IMMUTABLE_READ_VECTOR_SIZE in
+    # allmydata.storage.http_server):
+    MAX_READV_BYTES = 16 * 1024 * 1024
+
     def __init__(self, rref, server, verifycap, commonshare, node,
                  download_status, shnum, dyhb_rtt, logparent):
         self._rref = rref
@@ -87,9 +95,16 @@ class Share:
         # download can re-fetch it.
 
         self._requested_blocks = [] # (segnum, set(observer2..))
+        # segnum of the block whose hash is being computed, if any. The block
+        # has been removed from _received but not yet retired from
+        # _requested_blocks.
+        self._checking_block = None
         v = server.get_version()
         ver = v[b"http://allmydata.org/tahoe/protocols/storage/v1"]
         self._overrun_ok = ver[b"tolerates-immutable-read-overrun"]
+        # Some bucket readers (HTTP ones) can fetch several spans in one
+        # round trip.
+        self._readv_ok = getattr(rref, "supports_read_vectors", False)
         # If _overrun_ok and we guess the offsets correctly, we can get
         # everything in one RTT. If _overrun_ok and we guess wrong, we might
         # need two RTT (but we could get lucky and do it in one). If overrun
@@ -113,6 +128,11 @@ class Share:
         # state=CORRUPT so they'll find a different share.
         return self._alive
 
+    def is_checking_block(self):
+        # True if we have received a block and are checking its hash. We'll
+        # report COMPLETE or CORRUPT for it shortly.
+        return self._checking_block is not None
+
     def _guess_offsets(self, verifycap, guessed_segment_size):
         self.guessed_segment_size = guessed_segment_size
         size = verifycap.size
@@ -346,6 +366,9 @@ class Share:
                 return False
 
         # data blocks
+        if self._checking_block is not None:
+            # wait for the block we already have to be checked
+            return False
         return self._satisfy_data_block(segnum, observers)
 
     def _satisfy_offsets(self):
@@ -547,35 +570,67 @@ class Share:
                 share=repr(self), start=blockstart, length=blocklen,
                 level=log.NOISY, parent=self._lp, umid="uTDNZg")
         # this block is being retired, either as COMPLETE or CORRUPT, since
-        # no further data reads will help
+        # no further data reads will help. Large blocks are hashed in a
+        # thread, in which case this finishes on a later turn.
         assert self._requested_blocks[0][0] == segnum
-        try:
-            self._commonshare.check_block(segnum, block)
-            # hurrah, we have a valid block. Deliver it.
-            for o in observers:
-                # goes to SegmentFetcher._block_request_activity
-                o.notify(state=COMPLETE, block=block)
-            # now clear our received data, to dodge the #1170 spans.py
-            # complexity bug
-            self._received = DataSpans()
-        except (BadHashError, NotEnoughHashesError) as e:
+        d = Deferred.fromCoroutine(self._commonshare.check_block(segnum, block))
+        if d.called:
+            # small blocks are hashed right away
+            d.addBoth(self._block_checked, segnum, block, blockstart, blocklen)
+            d.addErrback(self._fail)
+            return True # got satisfaction
+        self._checking_block = segnum
+        d.addBoth(self._block_checked, segnum, block, blockstart, blocklen)
+        d.addErrback(self._fail)
+        d.addBoth(self._finish_checking_block)
+        return False
+
+    def _finish_checking_block(self, ignored):
+        # our observers hear about the block on a later turn. Stay busy until
+        # then, so SegmentFetcher doesn't see a share that is neither
+        # checking nor finished.
+        eventually(self._done_checking_block)
+
+    def _done_checking_block(self):
+        self._checking_block = None
+        self.schedule_loop()
+
+    def _block_checked(self, result, segnum, block, blockstart, blocklen):
+        if not self._alive:
+            return
+        if not (self._requested_blocks and
+                self._requested_blocks[0][0] == segnum):
+            # every request for this block was cancelled while we were
+            # checking it
+            return
+        (_, observers) = self._requested_blocks[0]
+        if isinstance(result, Failure):
+            # anything other than a hash failure kills the share, as it would
+            # in loop()
+            result.trap(BadHashError, NotEnoughHashesError)
             # rats, we have a corrupt block. Notify our clients that they
             # need to look elsewhere, and advise the server. Unlike
             # corruption in other parts of the share, this doesn't cause us
             # to abandon the whole share.
-            f = Failure(e)
             log.msg(format="hash failure in block %(segnum)d, from %(share)s",
-                    segnum=segnum, share=repr(self), failure=f,
+                    segnum=segnum, share=repr(self), failure=result,
                     level=log.WEIRD, parent=self._lp, umid="mZjkqA")
             for o in observers:
                 o.notify(state=CORRUPT)
-            self._signal_corruption(f, blockstart, blocklen)
+            self._signal_corruption(result, blockstart, blocklen)
             self.had_corruption = True
+        else:
+            # hurrah, we have a valid block. Deliver it.
+            for o in observers:
+                # goes to SegmentFetcher._block_request_activity
+                o.notify(state=COMPLETE, block=block)
+            # now clear our received data, to dodge the #1170 spans.py
+            # complexity bug
+            self._received = DataSpans()
         # in either case, we've retired this block
         self._requested_blocks.pop(0)
         # popping the request keeps us from turning around and wanting the
         # block again right away
-        return True # got satisfaction
 
     def _desire(self):
         segnum, observers = self._active_segnum_and_observers() # maybe None
@@ -619,7 +674,16 @@ class Share:
                 # what we guess the file contains, but _desire_block_hashes
                 # and _desire_data will tolerate that.
                 self._desire_block_hashes(desire, o, segnum)
-                self._desire_data(desire, o, r, segnum, segsize)
+                if segnum != self._checking_block:
+                    self._desire_data(desire, o, r, segnum, segsize)
+            # Blocks for the requests queued behind the active one (e.g.
+            # read-ahead) are fetched at the same time, so they're already
+            # here when we get to them. We merely want them: they must not
+            # cause this share to be abandoned.
+            ahead = (want_it, want_it, want_it)
+            for (segnum1, observers1) in self._requested_blocks[1:]:
+                self._desire_block_hashes(ahead, o, segnum1)
+                self._desire_data(ahead, o, r, segnum1, segsize)
 
         log.msg("end _desire: want_it=%s need_it=%s gotta=%s"
                 % (want_it.dump(), need_it.dump(), gotta_gotta_have_it.dump()),
@@ -739,6 +803,7 @@ class Share:
         # Reconsider the removal: maybe bring it back.
         ds = self._download_status
 
+        requests = []
         for (start, length) in ask:
             # TODO: quantize to reasonably-large blocks
             self._pending.add(start, length)
@@ -749,18 +814,82 @@ class Share:
                          level=log.NOISY, parent=self._lp, umid="sgVAyA")
             block_ev = ds.add_block_request(self._server, self._shnum,
                                             start, length, now())
-            d = self._send_request(start, length)
-            d.addCallback(self._got_data, start, length, block_ev, lp)
-            d.addErrback(self._got_error, start, length, block_ev, lp)
-            d.addCallback(self._trigger_loop)
-            d.addErrback(lambda f:
-                         log.err(format="unhandled error during send_request",
-                                 failure=f, parent=self._lp,
-                                 level=log.WEIRD, umid="qZu0wg"))
+            requests.append((start, length, block_ev, lp))
+
+        if self._readv_ok and len(requests) > 1:
+            # everything we want from this share, in as few round trips as
+            # the size limits on read vectors allow
+            for batch in self._readv_batches(requests):
+                if len(batch) == 1:
+                    self._send_single_request(*batch[0])
+                    continue
+                d = self._send_request_vector(
+                    [(start, length) for (start, length, _, _) in batch])
+                d.addCallbacks(self._got_data_vector, self._got_error_vector,
+                               callbackArgs=(batch,), errbackArgs=(batch,))
+                self._add_request_callbacks(d)
+            return
+
+        for request in requests:
+            self._send_single_request(*request)
+
+    def _readv_batches(self, requests):
+        """
+        Split ``requests`` into batches of at most MAX_READV_SPANS spans and
+        MAX_READV_BYTES bytes, except that a span bigger than that is a batch
+        of its own.
+        """
+        batches = []
+        batch = []
+        batch_size = 0
+        for request in requests:
+            length = request[1]
+            if batch and (len(batch) == self.MAX_READV_SPANS or
+                          batch_size + length > self.MAX_READV_BYTES):
+                batches.append(batch)
+                batch = []
+                batch_size = 0
+            batch.append(request)
+            batch_size += length
+        batches.append(batch)
+        return batches
+
+    def _send_single_request(self, start, length, block_ev, lp):
+        d = self._send_request(start, length)
+        d.addCallback(self._got_data, start, length, block_ev, lp)
+        d.addErrback(self._got_error, start, length, block_ev, lp)
+        self._add_request_callbacks(d)
+
+    def _add_request_callbacks(self, d):
+        d.addCallback(self._trigger_loop)
+        d.addErrback(lambda f:
+                     log.err(format="unhandled error during send_request",
+                             failure=f, parent=self._lp,
+                             level=log.WEIRD, umid="qZu0wg"))
 
     def _send_request(self, start, length):
         return self._rref.callRemote("read", start, length)
 
+    def _send_request_vector(self, readv):
+        return self._rref.callRemote("readv", readv)
+
+    def _got_data_vector(self, datav, requests):
+        for (data, (start, length, block_ev, lp)) in zip(datav, requests):
+            self._got_data(data, start, length, block_ev, lp)
+
+    def _got_error_vector(self, f, requests):
+        # the whole read vector failed: every span in it has, but the share
+        # has only failed once
+        for (start, length, block_ev, lp) in requests:
+            block_ev.error(now())
+        log.msg(format="error requesting %(spans)s"
+                " from %(server)s for si %(si)s",
+                spans=" ".join("%d+%d" % (start, length)
+                               for (start, length, _, _) in requests),
+                server=self._server.get_name(), si=self._si_prefix,
+                failure=f, parent=self._lp, level=log.UNUSUAL, umid="q3Rv2Q")
+        self._fail(f, log.UNUSUAL)
+
     def _got_data(self, data, start, length, block_ev, lp):
         block_ev.finished(len(data), now())
         if not self._alive:
@@ -900,9 +1029,9 @@ class CommonShare:
         # this may raise BadHashError or NotEnoughHashesError
         self._block_hash_tree.set_hashes(block_hashes)
 
-    def check_block(self, segnum, block):
+    async def check_block(self, segnum, block):
         assert self._block_hash_tree_is_authoritative
-        h = hashutil.block_hash(block)
+        [h] = await hashutil.block_hashes([block])
         # this may raise BadHashError or NotEnoughHashesError
         self._block_hash_tree.set_hashes(leaves={segnum: h})
 
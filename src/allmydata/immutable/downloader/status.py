@@ -20,6 +20,9 @@ class ReadEvent:
     def finished(self, finishtime):
         self._ev["finish_time"] = finishtime
         self._ds.update_last_timestamp(finishtime)
+        self._ds.add_timing("read", finishtime - self._ev["start_time"])
+        if self._ev["decrypt_time"]:
+            self._ds.add_timing("decrypt", self._ev["decrypt_time"])
 
 
 class SegmentEvent:
@@ -40,6 +43,8 @@ class SegmentEvent:
         self._ev["segment_start"] = start
         self._ev["segment_length"] = length
         self._ds.update_last_timestamp(when)
+        self._ds.add_timing("segment", when - self._ev["start_time"])
+        self._ds.add_timing("decode", decodetime)
 
     def error(self, when):
         self._ev["finish_time"] = when
@@ -63,6 +68,7 @@ class DYHBEvent:
         self._ev["success"] = True
         self._ev["response_shnums"] = shnums
         self._ds.update_last_timestamp(when)
+        self._ds.add_timing("dyhb", when - self._ev["start_time"])
 
 
 class BlockRequestEvent:
@@ -76,6 +82,7 @@ class BlockRequestEvent:
         self._ev["success"] = True
         self._ev["response_length"] = received
         self._ds.update_last_timestamp(when)
+        self._ds.add_timing("block_request", when - self._ev["start_time"])
 
     def error(self, when):
         self._ev["finish_time"] = when
@@ -149,6 +156,16 @@ class DownloadStatus:
 
         self.misc_events = []
 
+        # called with (phase, seconds) as each of the above finishes
+        self.timing_observer = None
+
+    def set_timing_observer(self, observer):
+        self.timing_observer = observer
+
+    def add_timing(self, phase, elapsed):
+        if self.timing_observer is not None:
+            self.timing_observer(phase, elapsed)
+
     def add_misc_event(self, what, start, finish=None):
         self.misc_events.append( {"what": what,
                                   "start_time": start,
@@ -5,6 +5,8 @@ Ported to Python 3.
 """
 
 import time
+from collections import deque
+from attrs import frozen
 from zope.interface import implementer
 from twisted.internet import defer
 from foolscap.api import fireEventually
@@ -13,6 +15,8 @@ from allmydata.storage.server import si_b2a
 from allmydata.hashtree import HashTree
 from allmydata.util import mathutil, hashutil, base32, log, happinessutil
 from allmydata.util.assertutil import _assert, precondition
+from allmydata.util.deferredutil import async_to_deferred
+from allmydata.util.cputhreadpool import defer_to_thread
 from allmydata.codec import CRSEncoder
 from allmydata.interfaces import IEncoder, IStorageBucketWriter, \
      IEncryptedUploadable, IUploadStatus, UploadUnhappinessError
@@ -42,9 +46,13 @@ log(number of segments)).
 Each segment (A,B,C) is read into memory, encrypted, and encoded into
 blocks. The 'share' (say, share #1) that makes it out to a host is a
 collection of these blocks (block A1, B1, C1), plus some hash-tree
-information necessary to validate the data upon retrieval. Only one segment
-is handled at a time: all blocks for segment A are delivered before any
-work is begun on segment B.
+information necessary to validate the data upon retrieval. Segments are
+pipelined: while the blocks for segment A are still being delivered, segment
+B can be read, encrypted and encoded (the CPU-heavy parts of which happen in
+a thread pool). How many segments may be in progress at once, and how many
+bytes of encoded blocks may be waiting to be delivered, is bounded by
+PipelineLimits. With a depth of 1, all blocks for segment A are delivered
+before any work is begun on segment B.
 
 As blocks are created, we retain the hash of each one. The list of block hashes
 for a single share (say, hash(A1), hash(B1), hash(C1)) is used to form the base
@@ -78,11 +86,38 @@ GiB=1024*MiB
 TiB=1024*GiB
 PiB=1024*TiB
 
+
+@frozen
+class PipelineLimits:
+    """
+    Bounds on how far the encoder may run ahead of the network.
+
+    :ivar depth: The maximum number of segments which may be encoded or
+        still waiting for their blocks to be delivered.  1 means each segment
+        is fully delivered before the next one is read.
+
+    :ivar max_bytes: The maximum number of bytes of encoded blocks which may
+        be waiting to be delivered.  A single segment is always allowed,
+        however large it is.
+    """
+    depth: int = 2
+    max_bytes: int = 32 * MiB
+
+    def __attrs_post_init__(self):
+        if self.depth < 1:
+            raise ValueError("pipeline depth must be at least 1")
+        if self.max_bytes < 0:
+            raise ValueError("pipeline max_bytes must not be negative")
+
+
 @implementer(IEncoder)
 class Encoder:
 
-    def __init__(self, log_parent=None, upload_status=None):
+    def __init__(self, log_parent=None, upload_status=None, pipeline=None):
         object.__init__(self)
+        if pipeline is None:
+            pipeline = PipelineLimits()
+        self._pipeline = pipeline
         self.uri_extension_data = {}
         self._codec = None
         self._status = None
@@ -237,20 +272,7 @@ class Encoder:
         d = fireEventually()
 
         d.addCallback(lambda res: self.start_all_shareholders())
-
-        for i in range(self.num_segments-1):
-            # note to self: this form doesn't work, because lambda only
-            # captures the slot, not the value
-            #d.addCallback(lambda res: self.do_segment(i))
-            # use this form instead:
-            d.addCallback(lambda res, i=i: self._encode_segment(i, is_tail=False))
-            d.addCallback(self._send_segment, i)
-            d.addCallback(self._turn_barrier)
-        last_segnum = self.num_segments - 1
-        d.addCallback(lambda res: self._encode_segment(last_segnum, is_tail=True))
-        d.addCallback(self._send_segment, last_segnum)
-        d.addCallback(self._turn_barrier)
-
+        d.addCallback(lambda res: self._encode_and_send_segments())
         d.addCallback(lambda res: self.finish_hashing())
 
         # These calls have to happen in order; layout.py now requires writes to
@@ -296,6 +318,53 @@ class Encoder:
 
         return fireEventually(res)
 
+    @async_to_deferred
+    async def _encode_and_send_segments(self):
+        """
+        Encode and send every segment, keeping up to ``self._pipeline`` worth
+        of segments in flight so encoding overlaps with the network.
+
+        Segments are still read, encoded and handed to the shareholders in
+        order, so the crypttext hashes, block hashes and the writes to each
+        bucket come out exactly as they would one-at-a-time.
+        """
+        # (Deferred for the delivery of a segment, bytes of blocks it holds)
+        in_flight = deque()
+        in_flight_bytes = 0
+        try:
+            for segnum in range(self.num_segments):
+                is_tail = (segnum == self.num_segments - 1)
+                codec = self._tail_codec if is_tail else self._codec
+                segment_bytes = codec.get_block_size() * self.num_shares
+                while in_flight and (
+                        len(in_flight) >= self._pipeline.depth or
+                        in_flight_bytes + segment_bytes > self._pipeline.max_bytes
+                ):
+                    (sent, nbytes) = in_flight.popleft()
+                    in_flight_bytes -= nbytes
+                    await sent
+                (shares, shareids) = await self._encode_segment(segnum, is_tail)
+                block_hashes = await hashutil.block_hashes(shares)
+                # _send_segment queues every block before returning, so the
+                # next segment's blocks always land after this one's.
+                in_flight.append((
+                    self._send_segment((shares, shareids), segnum, block_hashes),
+                    segment_bytes,
+                ))
+                in_flight_bytes += segment_bytes
+                await self._turn_barrier(None)
+            while in_flight:
+                (sent, _) = in_flight.popleft()
+                await sent
+        except BaseException:
+            # The upload is failing; don't leave errors from segments that
+            # are still being delivered unhandled.
+            for (sent, _) in in_flight:
+                sent.addErrback(
+                    lambda f: self.log("error from segment in flight",
+                                       failure=f, level=log.NOISY)
+                )
+            raise
 
     def start_all_shareholders(self):
         self.log("starting shareholders", level=log.NOISY)
@@ -410,23 +479,37 @@ class Encoder:
             precondition(len(data) <= read_size, len(data), read_size)
             if not allow_short:
                 precondition(len(data) == read_size, len(data), read_size)
-            crypttext_segment_hasher.update(data)
-            self._crypttext_hasher.update(data)
+            # Segments are gathered one at a time, so the hashers are never
+            # updated from two threads at once.
+            d2 = defer.Deferred.fromCoroutine(defer_to_thread(
+                self._hash_crypttext, crypttext_segment_hasher, data,
+            ))
+            d2.addCallback(lambda _: data)
+            return d2
+        d.addCallback(_got)
+        def _hashed(data):
             if allow_short and len(data) < read_size:
                 # padding
                 data += b"\x00" * (read_size - len(data))
             encrypted_pieces = [data[i:i+input_chunk_size]
                                 for i in range(0, len(data), input_chunk_size)]
             return encrypted_pieces
-        d.addCallback(_got)
+        d.addCallback(_hashed)
         return d
 
-    def _send_segment(self, shares_and_shareids, segnum):
+    def _hash_crypttext(self, crypttext_segment_hasher, data):
+        crypttext_segment_hasher.update(data)
+        self._crypttext_hasher.update(data)
+
+    def _send_segment(self, shares_and_shareids, segnum, block_hashes):
         # To generate the URI, we must generate the roothash, so we must
         # generate all shares, even if we aren't actually giving them to
         # anybody. This means that the set of shares we create will be equal
         # to or larger than the set of landlords. If we have any landlord who
         # *doesn't* have a share, that's an error.
+        #
+        # block_hashes[i] is the hash of shares[i], computed off the reactor
+        # thread by hashutil.block_hashes().
         (shares, shareids) = shares_and_shareids
         _assert(set(self.landlords.keys()).issubset(set(shareids)),
                 shareids=shareids, landlords=self.landlords)
@@ -442,7 +525,7 @@ class Encoder:
             d = self.send_block(shareid, segnum, block, lognum)
             dl.append(d)
 
-            block_hash = hashutil.block_hash(block)
+            block_hash = block_hashes[i]
             #from allmydata.util import base32
             #log.msg("creating block (shareid=%d, blocknum=%d) "
             #        "len=%d %r .. %r: %s" %
@@ -27,13 +27,17 @@ from allmydata.immutable.downloader.status import DownloadStatus
 
 class CiphertextFileNode:
     def __init__(self, verifycap, storage_broker, secret_holder,
-                 terminator, history):
+                 terminator, history, segment_cache=None,
+                 readahead_max_bytes=None, share_location_cache=None):
         assert isinstance(verifycap, uri.CHKFileVerifierURI)
         self._verifycap = verifycap
         self._storage_broker = storage_broker
         self._secret_holder = secret_holder
         self._terminator = terminator
         self._history = history
+        self._segment_cache = segment_cache
+        self._readahead_max_bytes = readahead_max_bytes
+        self._share_location_cache = share_location_cache
         self._download_status = None
         self._node = None # created lazily, on read()
 
@@ -48,7 +52,10 @@ class CiphertextFileNode:
             self._node = DownloadNode(self._verifycap, self._storage_broker,
                                       self._secret_holder,
                                       self._terminator,
-                                      self._history, self._download_status)
+                                      self._history, self._download_status,
+                                      self._segment_cache,
+                                      self._readahead_max_bytes,
+                                      self._share_location_cache)
 
     def read(self, consumer, offset=0, size=None):
         """I am the main entry point, from which FileNode.read() can get
@@ -236,11 +243,14 @@ class ImmutableFileNode:
 
     # I wrap a CiphertextFileNode with a decryption key
     def __init__(self, filecap, storage_broker, secret_holder, terminator,
-                 history):
+                 history, segment_cache=None, readahead_max_bytes=None,
+                 share_location_cache=None):
         assert isinstance(filecap, uri.CHKFileURI)
         verifycap = filecap.get_verify_cap()
         self._cnode = CiphertextFileNode(verifycap, storage_broker,
-                                         secret_holder, terminator, history)
+                                         secret_holder, terminator, history,
+                                         segment_cache, readahead_max_bytes,
+                                         share_location_cache)
         assert isinstance(filecap, uri.CHKFileURI)
         self.u = filecap
         self._readkey = filecap.key
@@ -25,6 +25,7 @@ from allmydata.util.deferredutil import (
     timeout_call,
     until,
 )
+from allmydata.util.cputhreadpool import defer_to_thread
 from allmydata import hashtree, uri
 from allmydata.storage.server import si_b2a
 from allmydata.immutable import encode
@@ -1091,13 +1092,23 @@ class EncryptAnUploadable:
         def _good(plaintext):
             # and encrypt it..
             # o/' over the fields we go, hashing all the way, sHA! sHA! sHA! o/'
-            ct = self._hash_and_encrypt_plaintext(plaintext, hash_only)
+            # This is CPU-bound, so it runs in a thread.  Reads are strictly
+            # sequential, so the hashers and the encryptor are never used by
+            # two threads at once.
+            return defer.Deferred.fromCoroutine(defer_to_thread(
+                self._hash_and_encrypt_plaintext, plaintext, hash_only,
+            ))
+        def _encrypted(ct):
+            if self._status:
+                progress = float(self._ciphertext_bytes_read) / self._file_size
+                self._status.set_progress(1, progress)
             # Intentionally tell the accumulator about the expected size, not
             # the actual size.  If we run out of data we still want remaining
             # to drop otherwise it will never reach 0 and the loop will never
             # end.
             ciphertext_accum.extend(size, ct)
         d.addCallback(_good)
+        d.addCallback(_encrypted)
         return d
 
     def _hash_and_encrypt_plaintext(self, data, hash_only):
@@ -1127,9 +1138,6 @@ class EncryptAnUploadable:
             del ciphertext
             del chunk
         self._ciphertext_bytes_read += bytes_processed
-        if self._status:
-            progress = float(self._ciphertext_bytes_read) / self._file_size
-            self._status.set_progress(1, progress)
         return cryptdata
 
 
@@ -1172,6 +1180,7 @@ class UploadStatus:
         self.results = None
         self.counter = next(self.statusid_counter)
         self.started = time.time()
+        self.timing_observer = None
 
     def get_started(self):
         return self.started
@@ -1207,13 +1216,25 @@ class UploadStatus:
         self.active = value
     def set_results(self, value):
         self.results = value
+        if self.timing_observer is not None:
+            for (phase, elapsed) in value.get_timings().items():
+                if isinstance(elapsed, (int, float)):
+                    self.timing_observer(phase, elapsed)
+    def set_timing_observer(self, observer):
+        """
+        Call ``observer(phase, seconds)`` with the time taken by each phase
+        of the upload, once it is done.
+        """
+        self.timing_observer = observer
 
 class CHKUploader:
 
-    def __init__(self, storage_broker, secret_holder, reactor=None):
+    def __init__(self, storage_broker, secret_holder, reactor=None,
+                 pipeline=None):
         # server_selector needs storage_broker and secret_holder
         self._storage_broker = storage_broker
         self._secret_holder = secret_holder
+        self._pipeline = pipeline
         self._log_number = self.log("CHKUploader starting", parent=None)
         self._encoder = None
         self._storage_index = None
@@ -1274,6 +1295,7 @@ class CHKUploader:
         self._encoder = encode.Encoder(
             self._log_number,
             self._upload_status,
+            pipeline=self._pipeline,
         )
         # this just returns itself
         yield self._encoder.set_encrypted_uploadable(eu)
@@ -1846,10 +1868,12 @@ class Uploader(service.MultiService, log.PrefixingLogMixin):
     name = "uploader"  # type: ignore[assignment]
     URI_LIT_SIZE_THRESHOLD = 55
 
-    def __init__(self, helper_furl=None, stats_provider=None, history=None):
+    def __init__(self, helper_furl=None, stats_provider=None, history=None,
+                 encoder_pipeline=None):
         self._helper_furl = helper_furl
         self.stats_provider = stats_provider
         self._history = history
+        self._encoder_pipeline = encoder_pipeline
         self._helper = None
         self._all_uploads = weakref.WeakKeyDictionary() # for debugging
         log.PrefixingLogMixin.__init__(self, facility="tahoe.immutable.upload")
@@ -1918,7 +1942,9 @@ class Uploader(service.MultiService, log.PrefixingLogMixin):
                 else:
                     storage_broker = self.parent.get_storage_broker()
                     secret_holder = self.parent._secret_holder
-                    uploader = CHKUploader(storage_broker, secret_holder, reactor=reactor)
+                    uploader = CHKUploader(storage_broker, secret_holder,
+                                           reactor=reactor,
+                                           pipeline=self._encoder_pipeline)
                     d2.addCallback(lambda x: uploader.start(eu))
 
                 self._all_uploads[uploader] = None
@@ -332,6 +332,21 @@ class IStorageServer(Interface):
         :see: ``RIStorageServer.add_lease``
         """
 
+    def add_leases(
+            leases,
+    ):
+        """
+        Add or renew a lease on each of several storage indexes.
+
+        :param leases: A list of ``(storage_index, renew_secret,
+            cancel_secret)`` tuples.
+
+        :return: A list with one ``Deferred`` for each lease, which fires as
+            the one returned by ``add_lease`` for that lease would.
+            Implementations may send the whole list to the server in fewer
+            messages than separate ``add_lease`` calls would need.
+        """
+
     def get_buckets(
             storage_index,
     ):
@@ -813,6 +828,15 @@ class IWriteable(Interface):
         # memory. For an SDMF file, any modification takes
         # O(node.get_size_of_best_version()).
 
+    def update_ranges(ranges):
+        """
+        I write several (offset, data) ranges to the file in a single
+        publish, as if update() had been called for each of them, except
+        that either all of them are applied or none are. The ranges must
+        be in ascending order of offset and must not overlap. For an MDMF
+        file, only the segments that the ranges touch are rewritten.
+        """
+
 
 class IMutableFileVersion(IReadable):
     """I provide access to a particular version of a mutable file. The
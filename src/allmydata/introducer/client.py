@@ -7,6 +7,7 @@ from six import ensure_text, ensure_str
 import time
 from zope.interface import implementer
 from twisted.application import service
+from twisted.internet.defer import Deferred, DeferredLock
 from foolscap.api import Referenceable
 from allmydata.interfaces import InsufficientVersionError
 from allmydata.introducer.interfaces import IIntroducerClient, \
@@ -14,6 +15,7 @@ from allmydata.introducer.interfaces import IIntroducerClient, \
 from allmydata.introducer.common import sign_to_foolscap, unsign_from_foolscap,\
      get_tubid_string_from_ann
 from allmydata.util import log, yamlutil, connection_status
+from allmydata.util.cputhreadpool import defer_to_thread
 from allmydata.util.rrefutil import add_version_to_remote_reference
 from allmydata.util.observer import (
     ObserverList,
@@ -26,12 +28,37 @@ class InvalidCacheError(Exception):
 
 V2 = b"http://allmydata.org/tahoe/protocols/introducer/v2"
 
+def _unsign_announcements(announcements):
+    """
+    Check the signatures on ``announcements``, a list of signed announcements
+    as sent by the introducer.
+
+    :return: a list with, for each announcement, its ``(ann, key_s)`` or
+        ``None`` if its signature is bad.
+    """
+    results = []
+    for ann_t in announcements:
+        try:
+            # this might raise UnknownKeyError or bad-sig error
+            results.append(unsign_from_foolscap(ann_t))
+        except BadSignature:
+            results.append(None)
+    return results
+
 @implementer(RIIntroducerSubscriberClient_v2, IIntroducerClient)  # type: ignore[misc]
 class IntroducerClient(service.Service, Referenceable):
 
+    # While running, wait this many seconds after an announcement changes
+    # before rewriting the cache file, so that the announcements which arrive
+    # together when a grid starts up are saved together.
+    CACHE_SAVE_DELAY = 1.0
+
     def __init__(self, tub, introducer_furl,
                  nickname, my_version, oldest_supported,
-                 sequencer, cache_filepath):
+                 sequencer, cache_filepath, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self._clock = clock
         self._tub = tub
         self.introducer_furl = introducer_furl
 
@@ -67,6 +94,9 @@ class IntroducerClient(service.Service, Referenceable):
         # from updates. It also provides memory for clients who subscribe
         # after startup.
         self._inbound_announcements = {}
+        # batches of announcements are checked and processed one at a time
+        self._inbound_lock = DeferredLock()
+        self._save_timer = None
 
         # hooks for unit tests
         self._debug_counts = {
@@ -96,6 +126,12 @@ class IntroducerClient(service.Service, Referenceable):
         d = self._tub.getReference(self.introducer_furl)
         d.addErrback(connect_failed)
 
+    def stopService(self):
+        if self._save_timer is not None:
+            self._save_timer.cancel()
+            self._save_announcements()
+        return service.Service.stopService(self)
+
     def _load_announcements(self):
         try:
             with self._cache_filepath.open() as f:
@@ -115,7 +151,22 @@ class IntroducerClient(service.Service, Referenceable):
             key_s = server_params['key_s'].encode("ascii")
             self._deliver_announcements(key_s, server_params['ann'])
 
+    def _schedule_save(self):
+        """
+        Save the announcements to the cache file soon, along with any other
+        changes made in the meantime.
+        """
+        if self._save_timer is not None:
+            return
+        if not self.running:
+            # stopService would not be there to save them
+            self._save_announcements()
+            return
+        self._save_timer = self._clock.callLater(self.CACHE_SAVE_DELAY,
+                                                 self._save_announcements)
+
     def _save_announcements(self):
+        self._save_timer = None
         announcements = []
         for value in self._inbound_announcements.values():
             ann, key_s, time_stamp = value
@@ -244,19 +295,30 @@ class IntroducerClient(service.Service, Referenceable):
         return self.got_announcements(announcements, lp)
 
     def got_announcements(self, announcements, lp=None):
+        """
+        Check the signatures on a batch of announcements in the CPU thread
+        pool, then process them. Batches are processed in the order they
+        arrived.
+
+        :return: a Deferred that fires once the batch has been processed.
+        """
         self._debug_counts["inbound_message"] += 1
-        for ann_t in announcements:
-            try:
-                # this might raise UnknownKeyError or bad-sig error
-                ann, key_s = unsign_from_foolscap(ann_t)
-                # key is "v0-base32abc123"
-                precondition(isinstance(key_s, bytes), key_s)
-            except BadSignature:
+        announcements = list(announcements)
+        return self._inbound_lock.run(
+            lambda: Deferred.fromCoroutine(
+                self._got_announcements(announcements, lp)))
+
+    async def _got_announcements(self, announcements, lp):
+        unsigned = await defer_to_thread(_unsign_announcements, announcements)
+        for (ann_t, result) in zip(announcements, unsigned):
+            if result is None:
                 self.log("bad signature on inbound announcement: %s" % (ann_t,),
                          parent=lp, level=log.WEIRD, umid="ZAU15Q")
                 # process other announcements that arrived with the bad one
                 continue
-
+            ann, key_s = result
+            # key is "v0-base32abc123"
+            precondition(isinstance(key_s, bytes), key_s)
             self._process_announcement(ann, key_s)
 
     def _process_announcement(self, ann, key_s):
@@ -326,7 +388,7 @@ class IntroducerClient(service.Service, Referenceable):
                      parent=lp2, level=log.NOISY)
 
         self._inbound_announcements[index] = (ann, key_s, time.time())
-        self._save_announcements()
+        self._schedule_save()
         # note: we never forget an index, but we might update its value
 
         self._deliver_announcements(key_s, ann)
@@ -156,8 +156,16 @@ class IntroducerService(service.MultiService, Referenceable):  # type: ignore[mi
                 b"application-version": allmydata.__full_version__.encode("utf-8"),
                 }
 
-    def __init__(self):
+    # While running, new announcements are held for this many seconds and
+    # then sent to each subscriber in one message, so that a grid starting
+    # up costs each subscriber a few messages rather than one per server.
+    ANNOUNCE_DELAY = 1.0
+
+    def __init__(self, clock=None):
         service.MultiService.__init__(self)
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self._clock = clock
         self.introducer_url = None
         # 'index' is (service_name, key_s, tubid), where key_s or tubid is
         # None
@@ -176,6 +184,18 @@ class IntroducerService(service.MultiService, Referenceable):  # type: ignore[mi
         # oldest-supported
         self._subscribers = dictutil.UnicodeKeyDict({})
 
+        # Announcements waiting to be sent to the subscribers: a dict mapping
+        # servicename to a dict mapping index to (ann_t, serial). Only the
+        # latest announcement for each index is kept. 'serial' comes from
+        # self._serial, which counts the announcements queued so far;
+        # self._subscribed_at maps (servicename, rref) to its value when that
+        # subscription was made, which delivered every announcement queued
+        # before then along with the rest of the table.
+        self._pending_announcements = {}
+        self._serial = 0
+        self._subscribed_at = {}
+        self._announce_timer = None
+
         self._debug_counts = {"inbound_message": 0,
                               "inbound_duplicate": 0,
                               "inbound_no_seqnum": 0,
@@ -190,6 +210,13 @@ class IntroducerService(service.MultiService, Referenceable):  # type: ignore[mi
         self._debug_outstanding -= 1
         return res
 
+    def stopService(self):
+        if self._announce_timer is not None:
+            self._announce_timer.cancel()
+            self._announce_timer = None
+            self._debug_outstanding -= 1
+        return service.MultiService.stopService(self)
+
     def log(self, *args, **kwargs):
         if "facility" not in kwargs:
             kwargs["facility"] = "tahoe.introducer.server"
@@ -284,16 +311,51 @@ class IntroducerService(service.MultiService, Referenceable):  # type: ignore[mi
         # actually we just want foolscap to give rref.is_connected(), since
         # this is only for the status display
 
-        for s in self._subscribers.get(service_name, []):
-            self._debug_counts["outbound_message"] += 1
-            self._debug_counts["outbound_announcements"] += 1
-            self._debug_outstanding += 1
-            d = s.callRemote("announce_v2", set([ann_t]))
-            d.addBoth(self._debug_retired)
-            d.addErrback(log.err,
-                         format="subscriber errored on announcement %(ann)s",
-                         ann=ann_t, facility="tahoe.introducer",
-                         level=log.UNUSUAL, umid="jfGMXQ")
+        if self._subscribers.get(service_name):
+            self._serial += 1
+            pending = self._pending_announcements.setdefault(service_name, {})
+            pending[index] = (ann_t, self._serial)
+            self._schedule_announce()
+
+    def _schedule_announce(self):
+        if self._announce_timer is not None:
+            return
+        if not self.running:
+            self._send_announcements()
+            return
+        # the queued announcements count as outstanding messages
+        self._debug_outstanding += 1
+        self._announce_timer = self._clock.callLater(self.ANNOUNCE_DELAY,
+                                                     self._announce_later)
+
+    def _announce_later(self):
+        self._announce_timer = None
+        self._debug_outstanding -= 1
+        self._send_announcements()
+
+    def _send_announcements(self):
+        """
+        Send the queued announcements, one message per subscriber.
+        """
+        (pending, self._pending_announcements) = (
+            self._pending_announcements, {})
+        for (service_name, queued) in pending.items():
+            for s in self._subscribers.get(service_name, []):
+                # leave out what they got when they subscribed
+                announcements = set(
+                    ann_t for (ann_t, serial) in queued.values()
+                    if serial > self._subscribed_at.get((service_name, s), 0))
+                if not announcements:
+                    continue
+                self._debug_counts["outbound_message"] += 1
+                self._debug_counts["outbound_announcements"] += len(announcements)
+                self._debug_outstanding += 1
+                d = s.callRemote("announce_v2", announcements)
+                d.addBoth(self._debug_retired)
+                d.addErrback(log.err,
+                             format="subscriber errored on announcements %(anns)s",
+                             anns=announcements, facility="tahoe.introducer",
+                             level=log.UNUSUAL, umid="jfGMXQ")
 
     def remote_subscribe_v2(self, subscriber, service_name, subscriber_info):
         self.log("introducer: subscription[%r] request at %r"
@@ -317,11 +379,13 @@ class IntroducerService(service.MultiService, Referenceable):  # type: ignore[mi
         assert subscriber_info
 
         subscribers[subscriber] = (subscriber_info, time.time())
+        self._subscribed_at[(service_name, subscriber)] = self._serial
         def _remove():
             self.log("introducer: unsubscribing[%s] %s" % (service_name,
                                                            subscriber),
                      umid="vYGcJg")
             subscribers.pop(subscriber, None)
+            self._subscribed_at.pop((service_name, subscriber), None)
         subscriber.notifyOnDisconnect(_remove)
 
         # Make sure types are correct:
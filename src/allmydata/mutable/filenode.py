@@ -19,7 +19,8 @@ from allmydata.uri import WriteableSSKFileURI, ReadonlySSKFileURI, \
                           WriteableMDMFFileURI, ReadonlyMDMFFileURI
 from allmydata.monitor import Monitor
 from allmydata.mutable.publish import Publish, MutableData,\
-                                      TransformingUploadable
+                                      TransformingUploadable, \
+                                      MultiRangeUploadable
 from allmydata.mutable.common import (
     MODE_READ,
     MODE_WRITE,
@@ -62,11 +63,16 @@ class BackoffAgent:
 class MutableFileNode:
 
     def __init__(self, storage_broker, secret_holder,
-                 default_encoding_parameters, history):
+                 default_encoding_parameters, history,
+                 share_size_hints=None, share_location_cache=None):
         self._storage_broker = storage_broker
         self._secret_holder = secret_holder
         self._default_encoding_parameters = default_encoding_parameters
         self._history = history
+        # a sizehints.ShareSizeHints shared with the other nodes, or None
+        self._share_size_hints = share_size_hints
+        # a share_locations.ShareLocationCache, or None
+        self._share_location_cache = share_location_cache
         self._pubkey = None # filled in upon first read
         self._privkey = None # filled in if we're mutable
         # we keep track of the last encoding parameters that we use. These
@@ -210,6 +216,10 @@ class MutableFileNode:
         return self._encprivkey
     def get_pubkey(self):
         return self._pubkey
+    def get_share_size_hints(self):
+        return self._share_size_hints
+    def get_share_location_cache(self):
+        return self._share_location_cache
 
     def get_required_shares(self):
         return self._required_shares
@@ -257,7 +267,9 @@ class MutableFileNode:
         if self.is_readonly():
             return self
         ro = MutableFileNode(self._storage_broker, self._secret_holder,
-                             self._default_encoding_parameters, self._history)
+                             self._default_encoding_parameters, self._history,
+                             self._share_size_hints,
+                             self._share_location_cache)
         ro.init_from_cap(self._uri.get_readonly())
         return ro
 
@@ -745,6 +757,15 @@ class MutableFileVersion:
         return self._version[0] # verinfo[0] == the sequence number
 
 
+    def get_root_hash(self):
+        """
+        Get the root of the share hash tree of the mutable version that I
+        represent. Together with the sequence number, this identifies the
+        version's contents.
+        """
+        return self._version[1] # verinfo[1] == the root hash
+
+
     # TODO: Terminology?
     def get_writekey(self):
         """
@@ -899,6 +920,19 @@ class MutableFileVersion:
                 old_uploadable = MutableData(old_contents)
                 new_contents = old_uploadable
             else:
+                offset = 0
+                # After an UncoordinatedWriteError, self._version may no
+                # longer be the newest version, and an in-place update would
+                # mix its hashes into the shares of another one.
+                if (first_time and
+                    self._version == self._servermap.best_recoverable_version()):
+                    offset = self._get_unchanged_prefix(old_contents,
+                                                        new_contents)
+                if offset:
+                    # Only rewrite the segments that changed.
+                    d2 = self._update(MutableData(new_contents[offset:]), offset)
+                    d2.addCallback(self._did_upload, len(new_contents))
+                    return d2
                 new_contents = MutableData(new_contents)
 
             return self._upload(new_contents)
@@ -906,6 +940,27 @@ class MutableFileVersion:
         return d
 
 
+    def _get_unchanged_prefix(self, old_contents, new_contents):
+        """
+        For an MDMF file, I return the length of the leading whole segments
+        which are the same in old_contents and new_contents, if an in-place
+        update from there on can produce new_contents. Otherwise I return 0,
+        and the new contents have to be published in full.
+        """
+        if self._version[2]: # version[2] == SDMF salt, which MDMF lacks
+            return 0
+        # An in-place update cannot shrink the file.
+        if len(new_contents) < len(old_contents):
+            return 0
+        segsize = self._version[3]
+        offset = 0
+        while (offset < len(old_contents) and
+               old_contents[offset:offset+segsize] ==
+               new_contents[offset:offset+segsize]):
+            offset += segsize
+        return min(offset, len(old_contents))
+
+
     def is_readonly(self):
         """
         I return True if this MutableFileVersion provides no write
@@ -1064,6 +1119,79 @@ class MutableFileVersion:
         return d
 
 
+    def update_ranges(self, ranges):
+        """
+        I write several ranges of data to this mutable file version in a
+        single publish, so that either all of them are applied or none
+        of them are. ranges is a list of (offset, data) pairs, in
+        ascending order of offset and not overlapping, where each data
+        is an IMutableUploadable. A range may start no later than the end
+        of the file or of the range before it, so the last range may
+        append to the file. I return a Deferred that fires when the
+        update has completed.
+
+        For an MDMF file, only the segments that the ranges touch are
+        re-encoded and uploaded, however far apart the ranges are.
+        """
+        return self._do_serialized(self._update_ranges, ranges)
+
+
+    def _update_ranges(self, ranges):
+        """
+        I am the serialized companion of update_ranges.
+        """
+        if self._version[2]: # version[2] == SDMF salt, which MDMF lacks
+            log.msg("doing re-encode instead of in-place update")
+            def m(old, servermap, first_time):
+                new = old
+                for (offset, data) in ranges:
+                    rest = offset + data.get_size()
+                    new = (new[:offset] +
+                           b"".join(data.read(data.get_size())) +
+                           new[rest:])
+                return new
+            return self._modify(m, None)
+
+        segment_size = self._version[3]
+        u = MultiRangeUploadable(ranges, segment_size, self.get_size())
+        segments = u.get_segments()
+        log.msg("updating segments %s in place" % (segments,))
+        # We only need the block hash trees from the servermap update; the
+        # old contents of the segments that are only partly written are
+        # read separately.
+        d = self._update_servermap(update_range=(segments[0], segments[0]))
+        d.addCallback(lambda ign: self._read_old_segments(u))
+        def _publish(ign):
+            (blockhashes, _, _) = self._get_update_data()
+            p = Publish(self._node, self._storage_broker, self._servermap)
+            return p.update(u, segments[0] * segment_size, blockhashes,
+                            self._version, segments)
+        d.addCallback(_publish)
+        return d
+
+
+    def _read_old_segments(self, uploadable):
+        """
+        I give uploadable the old contents of the segments that it only
+        partly replaces. I return a Deferred that fires when they have
+        all been read.
+        """
+        segment_size = self._version[3]
+        d = defer.succeed(None)
+        for segnum in uploadable.get_partial_segments():
+            start = segnum * segment_size
+            size = min(segment_size, self.get_size() - start)
+            def _read(ign, start=start, size=size):
+                r = Retrieve(self._node, self._storage_broker,
+                             self._servermap, self._version)
+                return r.download(consumer.MemoryConsumer(), start, size)
+            d.addCallback(_read)
+            d.addCallback(lambda mc, segnum=segnum:
+                          uploadable.set_old_segment(segnum,
+                                                     b"".join(mc.chunks)))
+        return d
+
+
     def _do_modify_update(self, data, offset):
         """
         I perform a file update by modifying the contents of the file
@@ -1131,6 +1259,20 @@ class MutableFileVersion:
         # segments. Does not download -- simply takes advantage of
         # existing infrastructure within the Retrieve class to avoid
         # duplicating code.
+        (blockhashes, start_segments, end_segments) = self._get_update_data()
+
+        d1 = r.decode(start_segments, self._start_segment)
+        d2 = r.decode(end_segments, self._end_segment)
+        d3 = defer.succeed(blockhashes)
+        return deferredutil.gatherResults([d1, d2, d3])
+
+
+    def _get_update_data(self):
+        """
+        I return the block hash trees and the start and end segments
+        that the servermap fetched for our version while doing its
+        update, as three dicts keyed by shnum.
+        """
         sm = self._servermap
         # XXX: If the methods in the servermap don't work as
         # abstractions, you should rewrite them instead of going around
@@ -1153,11 +1295,7 @@ class MutableFileVersion:
             blockhashes[shnum] = datum[0]
             start_segments[shnum] = datum[1] # (block,salt) bytestrings
             end_segments[shnum] = datum[2]
-
-        d1 = r.decode(start_segments, self._start_segment)
-        d2 = r.decode(end_segments, self._end_segment)
-        d3 = defer.succeed(blockhashes)
-        return deferredutil.gatherResults([d1, d2, d3])
+        return (blockhashes, start_segments, end_segments)
 
 
     def _build_uploadable_and_finish(self, segments_and_bht, data, offset):
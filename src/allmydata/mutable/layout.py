@@ -1766,6 +1766,14 @@ class MDMFSlotReadProxy:
             )
 
 
+    def has_whole_share(self):
+        """
+        I tell my caller whether I was given all of the share, so that I can
+        answer every request without asking the server.
+        """
+        return self._data_is_everything
+
+
     def is_sdmf(self):
         """I tell my caller whether or not my remote file is SDMF or MDMF
         """
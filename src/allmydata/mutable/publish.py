@@ -3,6 +3,7 @@ Ported to Python 3.
 """
 
 import os, time
+from collections import deque
 from io import BytesIO
 from itertools import count
 from zope.interface import implementer
@@ -36,6 +37,8 @@ from eliot import (
 
 KiB = 1024
 DEFAULT_MUTABLE_MAX_SEGMENT_SIZE = 128 * KiB
+# How many segments Publish may be encoding at once.
+DEFAULT_PUSH_PIPELINE_DEPTH = 4
 PUSHING_BLOCKS_STATE = 0
 PUSHING_EVERYTHING_ELSE_STATE = 1
 DONE_STATE = 2
@@ -59,11 +62,14 @@ class PublishStatus:
         self.progress = 0.0
         self.counter = next(self.statusid_counter)
         self.started = time.time()
+        self.timing_observer = None
 
     def add_per_server_time(self, server, elapsed):
         if server not in self.timings["send_per_server"]:
             self.timings["send_per_server"][server] = []
         self.timings["send_per_server"][server].append(elapsed)
+        if self.timing_observer is not None:
+            self.timing_observer("send", elapsed)
     def accumulate_encode_time(self, elapsed):
         self.timings["encode"] += elapsed
     def accumulate_encrypt_time(self, elapsed):
@@ -108,6 +114,17 @@ class PublishStatus:
         self.progress = value
     def set_active(self, value):
         self.active = value
+    def set_timing_observer(self, observer):
+        """
+        Call ``observer(phase, seconds)`` with the time taken by each write to
+        a server, and by each phase of the publish once it is done.
+        """
+        self.timing_observer = observer
+    def report_timings(self):
+        if self.timing_observer is not None:
+            for (phase, elapsed) in self.timings.items():
+                if isinstance(elapsed, (int, float)):
+                    self.timing_observer(phase, elapsed)
 
 class LoopLimitExceededError(Exception):
     pass
@@ -131,6 +148,7 @@ class Publish:
         self._running = True
         self._first_write_error = None
         self._last_failure = None
+        self._pipeline_depth = DEFAULT_PUSH_PIPELINE_DEPTH
 
         self._status = PublishStatus()
         self._status.set_storage_index(self._storage_index)
@@ -152,13 +170,18 @@ class Publish:
         return log.msg(*args, **kwargs)
 
 
-    def update(self, data, offset, blockhashes, version):
+    def update(self, data, offset, blockhashes, version, segments=None):
         """
         I replace the contents of this file with the contents of data,
         starting at offset. I return a Deferred that fires with None
         when the replacement has been completed, or with an error if
         something went wrong during the process.
 
+        If segments is given, it is an ascending list of the segments to
+        push, and data supplies the plaintext of exactly those segments,
+        one after another. This lets a single publish replace several
+        ranges of the file that are far apart.
+
         Note that this process will not upload new shares. If the file
         being updated is in need of repair, callers will have to repair
         it on their own.
@@ -229,7 +252,7 @@ class Publish:
         # This will set self.segment_size, self.num_segments, and
         # self.fec. TODO: Does it know how to do the offset? Probably
         # not. So do that part next.
-        self.setup_encoding_parameters(offset=offset)
+        self.setup_encoding_parameters(offset=offset, segments=segments)
 
         # if we experience any surprises (writes which were rejected because
         # our test vector did not match, or shares which we didn't expect to
@@ -548,7 +571,7 @@ class Publish:
         self._status.set_progress(1.0 * len(self.placed) / len(self.goal))
 
 
-    def setup_encoding_parameters(self, offset=0):
+    def setup_encoding_parameters(self, offset=0, segments=None):
         if self._version == MDMF_VERSION:
             segment_size = DEFAULT_MUTABLE_MAX_SEGMENT_SIZE # 128 KiB by default
         else:
@@ -626,6 +649,13 @@ class Publish:
             if end % segment_size == 0:
                 self.end_segment -= 1
 
+        if segments is None:
+            segments = range(self.starting_segment, self.end_segment + 1)
+        else:
+            self.starting_segment = self._current_segment = segments[0]
+            self.end_segment = segments[-1]
+        self._segments = list(segments)
+
         self.log("got start segment %d" % self.starting_segment)
         self.log("got end segment %d" % self.end_segment)
 
@@ -666,18 +696,49 @@ class Publish:
             self._state = PUSHING_EVERYTHING_ELSE_STATE
             return self._push()
 
-        d = self._encode_segment(segnum)
-        d.addCallback(self._push_segment, segnum)
-        def _increment_segnum(ign):
-            self._current_segment += 1
-        # XXX: I don't think we need to do addBoth here -- any errBacks
-        # should be handled within push_segment.
-        d.addCallback(_increment_segnum)
-        d.addCallback(self._turn_barrier)
+        d = self._push_segments(segnum)
         d.addCallback(self._push)
         d.addErrback(self._failure)
 
 
+    @async_to_deferred
+    async def _push_segments(self, segnum):
+        """
+        I encode and push the segments in self._segments from segnum
+        onwards, keeping up to self._pipeline_depth of them encoding at
+        once so that large MDMF files can use more than one CPU.
+
+        Segments are read from the uploadable and handed to the writers in
+        order. I stop early (leaving _push to call _failure) if we no longer
+        have enough writers to complete the publish.
+        """
+        # (segnum, Deferred firing with the encoded segment and its salt)
+        pending = deque()
+        todo = deque(s for s in self._segments if s >= segnum)
+        try:
+            while todo or pending:
+                while todo and len(pending) < self._pipeline_depth:
+                    # _encode_segment reads its data before it first waits,
+                    # so segments are read in order.
+                    segnum = todo.popleft()
+                    pending.append((segnum, self._encode_segment(segnum)))
+                (pushing, d) = pending.popleft()
+                encoded_and_salt = await d
+                await self._push_segment(encoded_and_salt, pushing)
+                self._current_segment = pushing + 1
+                if len(self.writers) < self.required_shares or self.surprised:
+                    return
+                await self._turn_barrier(None)
+        finally:
+            # If we stopped early, don't leave errors from segments that are
+            # still being encoded unhandled.
+            for (_, d) in pending:
+                d.addErrback(
+                    lambda f: self.log("error from segment being encoded",
+                                       failure=f, level=log.NOISY)
+                )
+
+
     def _turn_barrier(self, result):
         """
         I help the publish process avoid the recursion limit issues
@@ -766,15 +827,17 @@ class Publish:
         results, salt = encoded_and_salt
         shares, shareids = results
         self._status.set_status("Pushing segment")
+        if self._version == MDMF_VERSION:
+            hashed = [salt + sharedata for sharedata in shares]
+        else:
+            hashed = shares
+        block_hashes = await defer_to_thread(
+            lambda: [hashutil.block_hash(data) for data in hashed]
+        )
         for i in range(len(shares)):
             sharedata = shares[i]
             shareid = shareids[i]
-            if self._version == MDMF_VERSION:
-                hashed = salt + sharedata
-            else:
-                hashed = sharedata
-            block_hash = await defer_to_thread(hashutil.block_hash, hashed)
-            self.blockhashes[shareid][segnum] = block_hash
+            self.blockhashes[shareid][segnum] = block_hashes[i]
             # find the writer for this share
             writers = self.writers[shareid]
             for writer in writers:
@@ -1195,6 +1258,7 @@ class Publish:
 
         elapsed = now - self._started_pushing
         self._status.timings['push'] = elapsed
+        self._status.report_timings()
 
         self._status.set_active(False)
         self.log("Publish done, success")
@@ -1205,6 +1269,13 @@ class Publish:
         hints['segsize'] = self.segment_size
         hints['k'] = self.required_shares
         self._node.set_downloader_hints(hints)
+        location_cache = self._node.get_share_location_cache()
+        if location_cache is not None:
+            location_cache.record(
+                self._storage_index,
+                set(server.get_serverid() for (server, shnum) in self.placed),
+                self._new_seqnum,
+            )
         eventually(self.done_deferred.callback, None)
 
     def _failure(self, f=None):
@@ -1403,3 +1474,112 @@ class TransformingUploadable:
 
     def close(self):
         pass
+
+
+@implementer(IMutableUploadable)
+class MultiRangeUploadable:
+    """
+    I am an IMutableUploadable that replaces several ranges of an MDMF
+    file in one publish. I supply the plaintext of each segment that the
+    ranges touch, in order, taking it from the new data where a range
+    covers it and from the old contents of the segment everywhere else.
+    Segments that no range touches are not read or re-encoded at all.
+    """
+
+    def __init__(self, ranges, segment_size, file_size):
+        # ranges is a list of (offset, IMutableUploadable), in ascending
+        # order and not overlapping. file_size is the size of the version
+        # being updated.
+        self._ranges = []
+        end = 0
+        for (offset, data) in ranges:
+            assert IMutableUploadable.providedBy(data)
+            assert offset >= end, (offset, end)
+            # The gaps between ranges must come from the old contents.
+            assert offset <= max(file_size, end), (offset, file_size, end)
+            if data.get_size():
+                end = offset + data.get_size()
+                self._ranges.append((offset, end, data))
+        assert self._ranges
+        self._segment_size = segment_size
+        self._file_size = file_size
+        self._new_size = max(file_size, end)
+        self._end = end
+
+        segments = set()
+        for (offset, end, data) in self._ranges:
+            segments.update(range(offset // segment_size,
+                                  (end - 1) // segment_size + 1))
+        self._segments = sorted(segments)
+        # segnum -> old plaintext of that segment, for the segments that
+        # the ranges only partly cover.
+        self._old_segments = {}
+        self._next_segment = 0
+        self._buffer = b""
+
+    def get_segments(self):
+        """
+        I return the ascending list of the segments that I will supply.
+        """
+        return self._segments
+
+    def get_partial_segments(self):
+        """
+        I return the segments that the ranges only partly cover. The old
+        contents of each of these must be given to set_old_segment
+        before I am read.
+        """
+        partial = []
+        for segnum in self._segments:
+            start, end = self._segment_span(segnum)
+            covered = 0
+            for (offset, range_end, data) in self._ranges:
+                covered += max(0, min(end, range_end) - max(start, offset))
+            if covered < end - start:
+                partial.append(segnum)
+        return partial
+
+    def set_old_segment(self, segnum, data):
+        start, end = self._segment_span(segnum)
+        assert len(data) == min(end, self._file_size) - start, (segnum, len(data))
+        self._old_segments[segnum] = data
+
+    def _segment_span(self, segnum):
+        start = segnum * self._segment_size
+        return (start, min(start + self._segment_size, self._new_size))
+
+    def get_size(self):
+        return self._end
+
+    def read(self, length):
+        while len(self._buffer) < length and \
+              self._next_segment < len(self._segments):
+            self._buffer += self._read_segment(self._segments[self._next_segment])
+            self._next_segment += 1
+        data, self._buffer = self._buffer[:length], self._buffer[length:]
+        return data
+
+    def _read_segment(self, segnum):
+        start, end = self._segment_span(segnum)
+        old = self._old_segments.get(segnum, b"")
+        pieces = []
+        pos = start
+        for (offset, range_end, data) in self._ranges:
+            if range_end <= pos or offset >= end:
+                continue
+            if offset > pos:
+                pieces.append(old[pos - start:offset - start])
+                pos = offset
+            # Each range is read from front to back as the segments that
+            # it covers are read.
+            length = min(range_end, end) - pos
+            pieces.append(b"".join(data.read(length)))
+            pos += length
+        if pos < end:
+            pieces.append(old[pos - start:end - start])
+        segment = b"".join(pieces)
+        assert len(segment) == end - start, (segnum, len(segment))
+        return segment
+
+    def close(self):
+        pass
@@ -497,11 +497,16 @@ class Retrieve:
         elif len(self._active_readers) < self._required_shares:
             # need more shares
             more = self._required_shares - len(self._active_readers)
-            # We favor lower numbered shares, since FEC is faster with
-            # primary shares than with other shares, and lower-numbered
-            # shares are more likely to be primary than higher numbered
-            # shares.
-            new_shnums = sorted(unused_shnums)[:more]
+            # We favor shares that the servermap update already fetched in
+            # full, since they cost no round trip at all. After that we
+            # favor lower numbered shares, since FEC is faster with primary
+            # shares than with other shares, and lower-numbered shares are
+            # more likely to be primary than higher numbered shares.
+            new_shnums = sorted(
+                unused_shnums,
+                key=lambda shnum: (not self.readers[shnum].has_whole_share(),
+                                   shnum),
+            )[:more]
             if len(new_shnums) < more:
                 # We don't have enough readers to retrieve the file; fail.
                 self._raise_notenoughshareserror()
@@ -23,6 +23,7 @@ from allmydata.interfaces import IServermapUpdaterStatus
 from allmydata.mutable.common import MODE_CHECK, MODE_ANYTHING, MODE_WRITE, \
      MODE_READ, MODE_REPAIR, CorruptShareError, decrypt_privkey
 from allmydata.mutable.layout import SIGNED_PREFIX_LENGTH, MDMFSlotReadProxy
+from allmydata.mutable.sizehints import DEFAULT_READ_SIZE
 
 @implementer(IServermapUpdaterStatus)
 class UpdateStatus:
@@ -429,10 +430,18 @@ class ServermapUpdater:
         # At this point, we don't know which we are. Our filenode can
         # tell us, but it might be lying -- in some cases, we're
         # responsible for telling it which kind of file it is.
-        self._read_size = 4000
+        self._size_hints = filenode.get_share_size_hints()
+        self._location_cache = filenode.get_share_location_cache()
+        self._read_size = DEFAULT_READ_SIZE
         if mode == MODE_CHECK:
             # we use unpack_prefix_and_signature, so we need 1k
             self._read_size = 1000
+        elif mode in (MODE_READ, MODE_WRITE) and self._size_hints is not None:
+            # if we have seen this file before and its shares are small,
+            # read all of each share now, so Retrieve and Publish don't have
+            # to come back for the blocks, hashes and private key
+            self._read_size = self._size_hints.get_read_size(
+                self._storage_index, self._read_size)
         self._need_privkey = False
 
         if mode in (MODE_WRITE, MODE_REPAIR) and not self._node.get_privkey():
@@ -489,6 +498,14 @@ class ServermapUpdater:
         full_serverlist = list(sb.get_servers_for_psi(self._storage_index))
         self.full_serverlist = full_serverlist # for use later, immutable
         self.extra_servers = full_serverlist[:] # servers are removed as we use them
+        # where the shares were last seen, if we know
+        self._cached_locations = None
+        if self._location_cache is not None:
+            # ask those servers first
+            self._cached_locations = self._location_cache.get(
+                self._storage_index)
+            self.extra_servers = self._location_cache.order_servers(
+                self._storage_index, full_serverlist)
         self._good_servers = set() # servers who had some shares
         self._servers_with_shares = set() #servers that we know have shares now
         self._empty_servers = set() # servers who don't have any shares
@@ -518,14 +535,15 @@ class ServermapUpdater:
             # seen epsilon that don't have a share.
             # We don't query all of the servers because that could take a while.
             self.num_servers_to_query = N + self.EPSILON
+            if self._cached_locations is not None:
+                # start with the servers that the share location cache
+                # lists (they are at the front of extra_servers), and only
+                # look further if they don't have all the shares
+                self.num_servers_to_query = len(
+                    self._cached_locations.servers)
             initial_servers_to_query, must_query = self._build_initial_querylist()
             self.required_num_empty_servers = self.EPSILON
 
-            # TODO: arrange to read lots of data from k-ish servers, to avoid
-            # the extra round trip required to read large directories. This
-            # might also avoid the round trip required to read the encrypted
-            # private key.
-
         else: # MODE_READ, MODE_ANYTHING
             # 2*k servers is good enough.
             initial_servers_to_query, must_query = self._build_initial_querylist()
@@ -545,6 +563,13 @@ class ServermapUpdater:
         # I guess that self._must_query is a subset of
         # initial_servers_to_query?
         assert must_query.issubset(initial_servers_to_query)
+        if self._cached_locations is not None:
+            # Like the servers already in the servermap, the servers that
+            # the share location cache lists are expected to have shares, so
+            # wait for all of them before deciding what to do next.
+            self._must_query.update(
+                server for server in initial_servers_to_query
+                if server.get_serverid() in self._cached_locations.servers)
 
         self._send_initial_requests(initial_servers_to_query)
         self._status.timings["initial_queries"] = time.time() - self._started
@@ -1130,6 +1155,15 @@ class ServermapUpdater:
                          level=log.NOISY)
                 return self._send_more_queries(MAX_IN_FLIGHT)
 
+            if (self._cached_locations_are_current(recoverable_versions)
+                and not self._need_privkey):
+                # every share of the version we expected is where the share
+                # location cache said it would be, so there is no need to
+                # look for the boundary
+                self.log("found all shares at their cached locations: done",
+                         parent=lp)
+                return self._done()
+
             last_found = -1
             last_not_responded = -1
             num_not_responded = 0
@@ -1238,11 +1272,69 @@ class ServermapUpdater:
         self._status.set_active(False)
 
         self._servermap.set_last_update(self.mode, self._started)
+        if self._size_hints is not None:
+            self._record_share_size()
+        if self._location_cache is not None:
+            self._record_share_locations()
         # the servermap will not be touched after this
         self.log("servermap: %s" % self._servermap.summarize_versions())
 
         eventually(self._done_deferred.callback, self._servermap)
 
+    def _record_share_size(self):
+        """
+        Tell the share size hints how big the shares of the best version are,
+        so the next update of this file can read them whole.
+        """
+        verinfo = self._servermap.best_recoverable_version()
+        if verinfo is None:
+            return
+        offsets = dict(verinfo[-1])
+        self._size_hints.record(self._storage_index, offsets["EOF"])
+
+    def _cached_locations_are_current(self, recoverable_versions):
+        """
+        Return whether the share location cache was right about this file:
+        the newest version seen is the one it names, every server it lists
+        has answered with shares of that version, and all N shares of it
+        have been found.
+        """
+        locations = self._cached_locations
+        if locations is None or locations.seqnum is None:
+            return False
+        best = max(recoverable_versions)
+        if best[0] != locations.seqnum:
+            return False
+        for verinfo in self._servermap.make_versionmap():
+            if verinfo[0] >= best[0] and verinfo != best:
+                # a newer or competing version
+                return False
+        holders = set(server.get_serverid() for server
+                      in self._servermap.all_servers_for_version(best))
+        if not locations.servers <= holders:
+            return False
+        (found, k, N) = self._servermap.shares_available()[best]
+        return found == N
+
+    def _record_share_locations(self):
+        """
+        Tell the share location cache which servers hold shares of the best
+        version.
+        """
+        verinfo = self._servermap.best_recoverable_version()
+        if verinfo is None:
+            return
+        seqnum = verinfo[0]
+        holders = set(server.get_serverid() for server
+                      in self._servermap.all_servers_for_version(verinfo))
+        locations = self._cached_locations
+        if locations is not None and locations.seqnum == seqnum:
+            # we may not have asked all of the servers it listed
+            answered = set(server.get_serverid() for server
+                           in self._good_servers | self._empty_servers)
+            holders |= locations.servers - answered
+        self._location_cache.record(self._storage_index, holders, seqnum)
+
     def _fatal_error(self, f):
         self.log("fatal error", failure=f, level=log.WEIRD, umid="1cNvlw")
         self._done_deferred.errback(f)
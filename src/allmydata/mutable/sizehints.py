@@ -0,0 +1,69 @@
+"""
+Remember how big the shares of recently used mutable files are.
+
+A servermap update starts by reading a fixed-size prefix of each share. That
+is enough to find the version and check its signature, but ``Retrieve`` then
+has to go back to the servers for the blocks and hashes (and a write may have
+to go back for the encrypted private key). Most directories are small enough
+that the whole share could have come back with the first query. The
+``ServermapUpdater`` records the share size of each file it sees here, and
+the next update of the same file asks for the whole share. ``Retrieve``
+reuses the servermap's read proxies, so it can then decode the file without
+another round trip.
+
+This costs bandwidth: a MODE_READ update asks 2k servers, so up to twice as
+many share bytes are transferred as are needed. Shares bigger than
+``max_read_size`` are therefore read the usual way.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+
+# what the servermap updater reads when it knows nothing about the file
+DEFAULT_READ_SIZE = 4000
+
+MAX_READ_SIZE = 128 * 1024
+
+
+class ShareSizeHints:
+    """
+    I map the storage indexes of up to ``max_entries`` recently used mutable
+    files to the size of their shares. I am only used from the reactor
+    thread.
+    """
+
+    def __init__(self, max_entries: int = 10000,
+                 max_read_size: int = MAX_READ_SIZE):
+        self._max_entries = max_entries
+        self._max_read_size = max_read_size
+        # storage_index -> share size, least recently used first
+        self._sizes: OrderedDict[bytes, int] = OrderedDict()
+
+    def record(self, storage_index: bytes, share_size: int) -> None:
+        """
+        Remember that the shares of ``storage_index`` are ``share_size``
+        bytes long.
+        """
+        self._sizes[storage_index] = share_size
+        self._sizes.move_to_end(storage_index)
+        while len(self._sizes) > self._max_entries:
+            self._sizes.popitem(last=False)
+
+    def get_read_size(self, storage_index: bytes,
+                      default: int = DEFAULT_READ_SIZE) -> int:
+        """
+        Return how many bytes of each share of ``storage_index`` a servermap
+        update should ask for: enough for the whole share if it is known and
+        small enough, otherwise ``default``.
+        """
+        share_size = self._sizes.get(storage_index)
+        if share_size is None:
+            return default
+        self._sizes.move_to_end(storage_index)
+        if share_size >= self._max_read_size:
+            return default
+        # leave room for the file to have grown a little, and read more than
+        # the share so that a short answer shows we got all of it
+        read_size = share_size + max(1000, share_size // 8)
+        return max(default, min(read_size, self._max_read_size))
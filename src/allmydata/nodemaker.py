@@ -14,6 +14,7 @@ from allmydata.immutable.filenode import ImmutableFileNode, CiphertextFileNode
 from allmydata.immutable.upload import Data
 from allmydata.mutable.filenode import MutableFileNode
 from allmydata.mutable.publish import MutableData
+from allmydata.mutable.sizehints import ShareSizeHints
 from allmydata.dirnode import DirectoryNode, pack_children
 from allmydata.unknown import UnknownNode
 from allmydata.blacklist import ProhibitedNode
@@ -27,7 +28,9 @@ class NodeMaker:
     def __init__(self, storage_broker, secret_holder, history,
                  uploader, terminator,
                  default_encoding_parameters, mutable_file_default,
-                 key_generator, blacklist=None):
+                 key_generator, blacklist=None, segment_cache=None,
+                 readahead_max_bytes=None, directory_cache=None,
+                 share_location_cache=None):
         self.storage_broker = storage_broker
         self.secret_holder = secret_holder
         self.history = history
@@ -37,6 +40,11 @@ class NodeMaker:
         self.mutable_file_default = mutable_file_default
         self.key_generator = key_generator
         self.blacklist = blacklist
+        self.segment_cache = segment_cache
+        self.readahead_max_bytes = readahead_max_bytes
+        self.directory_cache = directory_cache
+        self.share_location_cache = share_location_cache
+        self.share_size_hints = ShareSizeHints()
 
         self._node_cache = weakref.WeakValueDictionary() # uri -> node
 
@@ -44,14 +52,19 @@ class NodeMaker:
         return LiteralFileNode(cap)
     def _create_immutable(self, cap):
         return ImmutableFileNode(cap, self.storage_broker, self.secret_holder,
-                                 self.terminator, self.history)
+                                 self.terminator, self.history,
+                                 self.segment_cache, self.readahead_max_bytes,
+                                 self.share_location_cache)
     def _create_immutable_verifier(self, cap):
         return CiphertextFileNode(cap, self.storage_broker, self.secret_holder,
-                                  self.terminator, self.history)
+                                  self.terminator, self.history,
+                                  self.segment_cache, self.readahead_max_bytes,
+                                  self.share_location_cache)
     def _create_mutable(self, cap):
         n = MutableFileNode(self.storage_broker, self.secret_holder,
                             self.default_encoding_parameters,
-                            self.history)
+                            self.history, self.share_size_hints,
+                            self.share_location_cache)
         return n.init_from_cap(cap)
     def _create_dirnode(self, filenode):
         return DirectoryNode(filenode, self, self.uploader)
@@ -126,7 +139,8 @@ class NodeMaker:
         if version is None:
             version = self.mutable_file_default
         n = MutableFileNode(self.storage_broker, self.secret_holder,
-                            self.default_encoding_parameters, self.history)
+                            self.default_encoding_parameters, self.history,
+                            self.share_size_hints, self.share_location_cache)
         if keypair is None:
             d = self.key_generator.generate()
         else:
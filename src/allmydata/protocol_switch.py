@@ -21,7 +21,6 @@ from typing import cast
 from twisted.internet.protocol import Protocol
 from twisted.internet.interfaces import IDelayedCall, IReactorFromThreads
 from twisted.internet.ssl import CertificateOptions
-from twisted.web.server import Site
 from twisted.protocols.tls import TLSMemoryBIOFactory
 from twisted.internet import reactor
 
@@ -94,7 +93,7 @@ class _FoolscapOrHttps(Protocol, metaclass=_PretendToBeNegotiation):
         cls.https_factory = TLSMemoryBIOFactory(
             certificate_options,
             False,
-            Site(http_storage_server.get_resource()),
+            http_storage_server.get_site(),
         )
 
         storage_nurls = set()
@@ -0,0 +1,240 @@
+"""
+An optional persistent cache of where the shares of recently used files are.
+
+Without it, every servermap update and every immutable download walks the
+servers in permuted order to rediscover where the shares live. On a large
+grid, or one where shares did not land on the first servers in that order,
+this costs many queries to servers that have nothing. With it, the servers
+that were last seen holding shares of a file are asked first. The permuted
+walk is still there behind them, so a stale entry only costs the queries to
+the servers that no longer have shares.
+
+For mutable files, each entry also records the sequence number of the
+version seen on those servers. A servermap update that finds that same
+version on every listed server, with all of its shares, can tell that the
+entry is current.
+
+The cache is a SQLite database in the node's private directory, mirrored in
+memory so that lookups never block. Changes are written in the I/O thread
+pool. Only the most recently used ``max_entries`` files are kept.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, cast
+
+from attrs import frozen
+
+from twisted.application import service
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.interfaces import IReactorFromThreads
+
+from allmydata.util import base32, dbutil, log
+from allmydata.util.iothreadpool import defer_to_io_thread
+
+SHARE_LOCATIONS_SCHEMA_V1 = """
+CREATE TABLE version
+(
+ version INTEGER  -- contains one row, set to 1
+);
+
+CREATE TABLE locations
+(
+ storage_index BLOB PRIMARY KEY,
+ seqnum INTEGER,          -- the version seen, NULL for immutable files
+ servers BLOB NOT NULL,   -- the server ids in base32, separated by newlines
+ last_used INTEGER NOT NULL
+);
+
+CREATE INDEX locations_by_last_used ON locations (last_used);
+"""
+
+
+@frozen
+class ShareLocations:
+    """
+    Where the shares of a file were last seen.
+
+    :ivar servers: The ids of the servers holding shares.
+    :ivar seqnum: For a mutable file, the sequence number of the version
+        those servers hold. ``None`` for an immutable file.
+    """
+
+    servers: frozenset[bytes]
+    seqnum: Optional[int] = None
+
+
+class ShareLocationCache(service.Service):
+    """
+    I remember where the shares of up to ``max_entries`` files are, in
+    ``dbfile``. I am only used from the reactor thread. When I am stopped as
+    a service, I close the database once the last changes are written.
+    """
+
+    def __init__(self, dbfile: str, max_entries: int):
+        (self._sqlite, self._db) = dbutil.get_db(
+            dbfile, create_version=(SHARE_LOCATIONS_SCHEMA_V1, 1),
+            dbname="share location cache", check_same_thread=False,
+        )
+        # The cache can always be rebuilt, so trade durability for speed.
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        # used by the I/O thread pool, one thread at a time
+        self._db_lock = threading.Lock()
+        self._max_entries = max_entries
+        # storage_index -> ShareLocations, least recently used first
+        self._entries: OrderedDict[bytes, ShareLocations] = OrderedDict()
+        # Rows are rewritten whenever they are used, least recently used
+        # first, so the rowid orders the ones used in the same second.
+        for (storage_index, seqnum, servers) in self._db.execute(
+            "SELECT storage_index, seqnum, servers FROM locations"
+            " ORDER BY last_used, rowid"
+        ).fetchall():
+            self._entries[storage_index] = ShareLocations(
+                frozenset(base32.a2b(s) for s in servers.split(b"\n")),
+                seqnum)
+        # changes not yet written, least recently used first: storage_index
+        # -> ShareLocations to (re)write, or None for an entry to delete
+        self._dirty: dict[bytes, Optional[ShareLocations]] = {}
+        self._flushing = False
+        # fired once a write in progress, and any started after it, finish
+        self._flush_waiters: list[Deferred[None]] = []
+        self._closed = False
+        self._evict()
+
+    def get(self, storage_index: bytes) -> Optional[ShareLocations]:
+        """
+        Return where the shares of ``storage_index`` were last seen, or
+        ``None`` if I don't know. This counts as a use of the entry; that is
+        written along with the next change, rather than on its own.
+        """
+        locations = self._entries.get(storage_index)
+        if locations is not None:
+            self._entries.move_to_end(storage_index)
+            self._mark_dirty(storage_index, locations)
+        return locations
+
+    def order_servers(self, storage_index: bytes, servers):
+        """
+        Return ``servers``, a sequence of ``IServer`` providers (for example
+        the permuted list for ``storage_index``), as a list with those last
+        seen holding shares of ``storage_index`` moved to the front. The
+        order is otherwise kept.
+        """
+        servers = list(servers)
+        locations = self._entries.get(storage_index)
+        if locations is None:
+            return servers
+        hinted = [s for s in servers if s.get_serverid() in locations.servers]
+        others = [s for s in servers
+                  if s.get_serverid() not in locations.servers]
+        return hinted + others
+
+    def record(self, storage_index: bytes, servers: Iterable[bytes],
+               seqnum: Optional[int] = None) -> None:
+        """
+        Remember that the servers with the ids in ``servers`` hold the shares
+        of ``storage_index`` (of version ``seqnum``, for a mutable file).
+        """
+        locations = ShareLocations(frozenset(servers), seqnum)
+        if not locations.servers:
+            self.forget(storage_index)
+            return
+        if self._entries.get(storage_index) == locations:
+            self._entries.move_to_end(storage_index)
+            self._mark_dirty(storage_index, locations)
+            return
+        self._entries[storage_index] = locations
+        self._entries.move_to_end(storage_index)
+        self._mark_dirty(storage_index, locations)
+        self._evict()
+        self._flush()
+
+    def forget(self, storage_index: bytes) -> None:
+        """
+        Forget where the shares of ``storage_index`` are.
+        """
+        if self._entries.pop(storage_index, None) is not None:
+            self._mark_dirty(storage_index, None)
+            self._flush()
+
+    def _mark_dirty(self, storage_index: bytes,
+                    locations: Optional[ShareLocations]) -> None:
+        # keep self._dirty in the order the entries were last used
+        self._dirty.pop(storage_index, None)
+        self._dirty[storage_index] = locations
+
+    def _evict(self) -> None:
+        while len(self._entries) > self._max_entries:
+            (storage_index, _) = self._entries.popitem(last=False)
+            self._mark_dirty(storage_index, None)
+
+    def _flush(self) -> None:
+        """
+        Write the changes made so far, unless a write is already in progress;
+        then they will be written once it finishes.
+        """
+        if self._flushing or not self._dirty:
+            return
+        from twisted.internet import reactor
+        self._flushing = True
+        (dirty, self._dirty) = (self._dirty, {})
+        d = Deferred.fromCoroutine(
+            defer_to_io_thread(cast(IReactorFromThreads, reactor), self._write,
+                               dirty, int(time.time()))
+        )
+        d.addErrback(log.err, "error writing the share location cache",
+                     level=log.WEIRD, umid="Q0r0bA")
+        def _written(_):
+            self._flushing = False
+            self._flush()
+            if not self._flushing:
+                (waiters, self._flush_waiters) = (self._flush_waiters, [])
+                for waiter in waiters:
+                    waiter.callback(None)
+        d.addCallback(_written)
+
+    def _write(self, dirty: dict[bytes, Optional[ShareLocations]],
+               now: int) -> None:
+        with self._db_lock:
+            if self._closed:
+                return
+            with self._db:
+                for (storage_index, locations) in dirty.items():
+                    if locations is None:
+                        self._db.execute(
+                            "DELETE FROM locations WHERE storage_index = ?",
+                            (storage_index,))
+                    else:
+                        self._db.execute(
+                            "INSERT OR REPLACE INTO locations"
+                            " (storage_index, seqnum, servers, last_used)"
+                            " VALUES (?,?,?,?)",
+                            (storage_index, locations.seqnum,
+                             b"\n".join(sorted(base32.b2a(s)
+                                               for s in locations.servers)),
+                             now))
+
+    def stopService(self) -> Deferred[None]:
+        service.Service.stopService(self)
+        if self._flushing:
+            d: Deferred[None] = Deferred()
+            self._flush_waiters.append(d)
+        else:
+            d = succeed(None)
+        d.addCallback(lambda _: self.close())
+        return d
+
+    def close(self) -> None:
+        """
+        Write any changes not yet written, and close the database.
+        """
+        (dirty, self._dirty) = (self._dirty, {})
+        self._write(dirty, int(time.time()))
+        with self._db_lock:
+            if not self._closed:
+                self._closed = True
+                self._db.close()
@@ -2,7 +2,9 @@
 Ported to Python 3.
 """
 
+from bisect import bisect_left
 from collections import deque
+import threading
 from time import process_time
 import time
 from typing import Deque, Tuple
@@ -14,6 +16,49 @@ from zope.interface import implementer
 from allmydata.util import log, dictutil
 from allmydata.interfaces import IStatsProducer
 
+# The upper bounds, in seconds, of the buckets of a LatencyHistogram: 1, 2.5
+# and 5 times each power of ten from 10us to 100s.
+LATENCY_BUCKETS = tuple(
+    float("%se%d" % (m, e)) for e in range(-5, 2) for m in ("1", "2.5", "5")
+) + (100.0,)
+
+
+class LatencyHistogram:
+    """
+    I count latencies in a fixed set of logarithmically-spaced buckets, so I
+    take the same memory however many samples I am given, and remember every
+    sample ever added (as opposed to only the most recent ones).
+
+    I am not thread-safe.
+    """
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        # counts[i] is the number of samples in (bounds[i-1], bounds[i]]; the
+        # last one counts the samples above every bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, latency: float) -> None:
+        self.counts[bisect_left(self.bounds, latency)] += 1
+        self.count += 1
+        self.sum += latency
+
+    def get_stats(self) -> dict:
+        """
+        Return a dict with ``count`` (the number of samples), ``sum`` (their
+        total) and ``buckets``: a list of ``(upper bound, number of samples
+        less than or equal to it)`` pairs, in increasing order.
+        """
+        buckets = []
+        cumulative = 0
+        for (bound, n) in zip(self.bounds, self.counts):
+            cumulative += n
+            buckets.append((bound, cumulative))
+        return {"buckets": buckets, "count": self.count, "sum": self.sum}
+
+
 @implementer(IStatsProducer)
 class CPUUsageMonitor(service.MultiService):
     HISTORY_LENGTH: int = 15
@@ -67,14 +112,30 @@ class StatsProvider(service.MultiService):
         self.node = node
 
         self.counters = dictutil.UnicodeKeyDict()
+        self.histograms = dictutil.UnicodeKeyDict()
+        # counters and histograms are also updated from other threads (for
+        # example, by the storage server's I/O thread pool)
+        self._lock = threading.Lock()
         self.stats_producers = []
         self.cpu_monitor = CPUUsageMonitor()
         self.cpu_monitor.setServiceParent(self)
         self.register_producer(self.cpu_monitor)
 
     def count(self, name, delta=1):
-        val = self.counters.setdefault(name, 0)
-        self.counters[name] = val + delta
+        with self._lock:
+            val = self.counters.setdefault(name, 0)
+            self.counters[name] = val + delta
+
+    def add_latency(self, name, latency):
+        """
+        Add ``latency`` (in seconds) to the histogram called ``name``. This
+        may be called from any thread.
+        """
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.add(latency)
 
     def register_producer(self, stats_producer):
         self.stats_producers.append(IStatsProducer(stats_producer))
@@ -83,6 +144,13 @@ class StatsProvider(service.MultiService):
         stats = {}
         for sp in self.stats_producers:
             stats.update(sp.get_stats())
-        ret = { 'counters': self.counters, 'stats': stats }
+        with self._lock:
+            counters = dictutil.UnicodeKeyDict(self.counters)
+            histograms = {
+                name: histogram.get_stats()
+                for (name, histogram) in self.histograms.items()
+            }
+        ret = { 'counters': counters, 'stats': stats,
+                'histograms': histograms }
         log.msg(format='get_stats() -> %(stats)s', stats=ret, level=log.NOISY)
         return ret
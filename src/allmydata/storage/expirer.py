@@ -9,11 +9,15 @@ from allmydata.storage.crawler import (
     _dump_json_to_file,
 )
 from allmydata.storage.shares import get_share_file
-from allmydata.storage.common import UnknownMutableContainerVersionError, \
+from allmydata.storage.common import si_a2b, UnknownMutableContainerVersionError, \
      UnknownImmutableContainerVersionError
 from twisted.python import log as twlog
 from twisted.python.filepath import FilePath
 
+# Leases are renewed for this long, which LeaseInfo also assumes to guess
+# when they were last renewed.
+LEASE_PERIOD = 31*24*60*60
+
 
 def _convert_pickle_state_to_json(state):
     """
@@ -99,6 +103,11 @@ class LeaseCheckingCrawler(ShareCrawler):
 
     All cycle-to-date values remain valid until the start of the next cycle.
 
+    If the server has a lease index (see lease_index.py), the first cycle
+    builds it, and later cycles get the leases of each bucket from it. Only
+    the buckets with a share that has an expired lease, or no lease left
+    that keeps it alive, are then read from disk.
+
     """
 
     slow_start = 360 # wait 6 minutes after startup
@@ -108,8 +117,13 @@ class LeaseCheckingCrawler(ShareCrawler):
                  expiration_enabled, mode,
                  override_lease_duration, # used if expiration_mode=="age"
                  cutoff_date, # used if expiration_mode=="cutoff-date"
-                 sharetypes):
+                 sharetypes,
+                 lease_index=None):
         self._history_serializer = _HistorySerializer(historyfile)
+        self._lease_index = lease_index
+        # What the lease index knows about the buckets of the prefix being
+        # processed, during a cycle that uses it:
+        self._indexed_buckets = None
         self.expiration_enabled = expiration_enabled
         self.mode = mode
         self.override_lease_duration = None
@@ -136,6 +150,8 @@ class LeaseCheckingCrawler(ShareCrawler):
         # the keys individually
         for k in so_far:
             self.state["cycle-to-date"].setdefault(k, so_far[k])
+        # whether the current cycle uses the lease index
+        self.state.setdefault("cycle-uses-lease-index", False)
 
     def create_empty_cycle_dict(self):
         recovered = self.create_empty_recovered_dict()
@@ -157,11 +173,46 @@ class LeaseCheckingCrawler(ShareCrawler):
 
     def started_cycle(self, cycle):
         self.state["cycle-to-date"] = self.create_empty_cycle_dict()
+        uses_index = False
+        if self._lease_index is not None:
+            uses_index = self._lease_index.is_complete()
+            if not uses_index:
+                # read every share file, and record their leases as we go
+                self._lease_index.rebuild_started(cycle)
+        self.state["cycle-uses-lease-index"] = uses_index
+
+    def process_prefixdir(self, cycle, prefix, prefixdir, buckets, start_slice):
+        if self._lease_index is not None:
+            self._lease_index.prune_prefix(
+                prefix,
+                {si_a2b(bucket.encode("ascii")) for bucket in buckets},
+            )
+            if self.state["cycle-uses-lease-index"]:
+                self._indexed_buckets = self._lease_index.get_prefix(prefix)
+        try:
+            ShareCrawler.process_prefixdir(self, cycle, prefix, prefixdir,
+                                           buckets, start_slice)
+        finally:
+            self._indexed_buckets = None
 
     def stat(self, fn):
         return os.stat(fn)
 
     def process_bucket(self, cycle, prefix, prefixdir, storage_index_b32):
+        storage_index = si_a2b(storage_index_b32.encode("ascii"))
+        if self._indexed_buckets is not None:
+            shares = self._indexed_buckets.get(storage_index)
+            if shares and not self._needs_visit(shares):
+                self.process_indexed_bucket(shares)
+                return
+        self.process_bucket_files(prefixdir, storage_index_b32)
+
+    def process_bucket_files(self, prefixdir, storage_index_b32):
+        """
+        Read the leases of every share in a bucket from disk, and remove
+        those that have expired (if so configured).
+        """
+        storage_index = si_a2b(storage_index_b32.encode("ascii"))
         bucketdir = os.path.join(prefixdir, storage_index_b32)
         s = self.stat(bucketdir)
         would_keep_shares = []
@@ -185,6 +236,13 @@ class LeaseCheckingCrawler(ShareCrawler):
                 wks = (1, 1, 1, "unknown")
             would_keep_shares.append(wks)
 
+        if any(not wks[2] for wks in would_keep_shares):
+            # we deleted some shares
+            self.server.bucket_changed(storage_index)
+        elif self._lease_index is not None:
+            # we may have removed leases, or be (re)building the index
+            self.server.index_leases(storage_index)
+
         sharetype = None
         if wks:
             # use the last share's sharetype as the buckettype
@@ -206,6 +264,65 @@ class LeaseCheckingCrawler(ShareCrawler):
         if sum([wks[2] for wks in would_keep_shares]) == 0:
             self.increment_bucketspace("actual", bucket_diskbytes, sharetype)
 
+    def _lease_expired(self, sharetype, expiration_time, now):
+        """
+        Return whether a lease with the given expiration time would be
+        expired, according to our configuration, like ``process_share``
+        decides it.
+        """
+        if sharetype not in self.sharetypes_to_expire:
+            return False
+        grant_renew_time = expiration_time - LEASE_PERIOD
+        if self.mode == "age":
+            age_limit = expiration_time
+            if self.override_lease_duration is not None:
+                age_limit = self.override_lease_duration
+            return now - grant_renew_time > age_limit
+        return grant_renew_time < self.cutoff_date
+
+    def _needs_visit(self, shares):
+        """
+        Return whether the bucket with the given ``IndexedShare`` values must
+        be read from disk: because a lease has expired and expiration is
+        enabled, or because a share would be (or would have been) deleted and
+        the space recovered must be measured.
+        """
+        now = time.time()
+        for share in shares.values():
+            expired = [
+                self._lease_expired(share.sharetype, expiration_time, now)
+                for expiration_time in share.expiration_times
+            ]
+            if all(expired):
+                return True
+            if self.expiration_enabled and any(expired):
+                return True
+            if not any(expiration_time > now
+                       for expiration_time in share.expiration_times):
+                return True
+        return False
+
+    def process_indexed_bucket(self, shares):
+        """
+        Account for a bucket from what the lease index knows about it. It
+        keeps all its shares, so it is only examined.
+        """
+        now = time.time()
+        so_far = self.state["cycle-to-date"]
+        sharetype = None
+        for share in shares.values():
+            sharetype = share.sharetype
+            for expiration_time in share.expiration_times:
+                age = now - (expiration_time - LEASE_PERIOD)
+                self.add_lease_age_to_histogram(age)
+            self.increment(so_far["leases-per-share-histogram"],
+                           str(len(share.expiration_times)), 1)
+            self.increment_share_space("examined", share.sharebytes,
+                                       share.diskbytes, sharetype)
+        rec = so_far["space-recovered"]
+        self.increment(rec, "examined-buckets", 1)
+        self.increment(rec, "examined-buckets-"+sharetype, 1)
+
     def process_share(self, sharefilename):
         # first, find out what kind of a share it is
         sf = get_share_file(sharefilename)
@@ -283,6 +400,9 @@ class LeaseCheckingCrawler(ShareCrawler):
             # the docs say that st_blocks is only on linux. I also see it on
             # MacOS. But it isn't available on windows.
             diskbytes = sharebytes
+        self.increment_share_space(a, sharebytes, diskbytes, sharetype)
+
+    def increment_share_space(self, a, sharebytes, diskbytes, sharetype):
         so_far_sr = self.state["cycle-to-date"]["space-recovered"]
         self.increment(so_far_sr, a+"-shares", 1)
         self.increment(so_far_sr, a+"-sharebytes", sharebytes)
@@ -324,6 +444,9 @@ class LeaseCheckingCrawler(ShareCrawler):
         return json_safe_lah
 
     def finished_cycle(self, cycle):
+        if self._lease_index is not None and not self.state["cycle-uses-lease-index"]:
+            self._lease_index.rebuild_finished(cycle)
+
         # add to our history state, prune old history
         h = {}
 
@@ -0,0 +1,185 @@
+"""
+A bounded cache of open, read-only file descriptors for share files.
+
+Serving a share used to open, seek, read and close its file for every chunk
+read (and for every ``get_buckets`` call, which parses the header). With this
+cache, reads of a recently used share are a single ``os.pread()`` on a
+descriptor that stays open, and the header is only parsed again if the file
+has changed.
+
+Reads happen in the I/O thread pool, so descriptors are shared between
+threads. ``os.pread()`` does not use the file position, so that is safe; a
+descriptor that is evicted or invalidated while a read is using it is only
+closed once that read is done.
+
+Each use of a cached descriptor costs one ``fstat()``, to notice files that
+have been deleted or replaced behind our back (which are then reopened).
+Whoever deletes a share file should still call ``invalidate()``, so that the
+descriptor is closed and the disk space freed right away.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+# The number of descriptors a storage server keeps open by default.
+DEFAULT_MAX_OPEN_FILES = 128
+
+
+def is_supported() -> bool:
+    """
+    Return whether this platform has what the cache needs (``os.pread`` is
+    not available on Windows).
+    """
+    return hasattr(os, "pread")
+
+
+class CachedFile:
+    """
+    An open read-only descriptor for a file.
+
+    :ivar stat: The result of ``os.fstat()``, as of the start of the current
+        ``OpenFileCache.open()`` block.
+
+    :ivar header: Whatever the user of the cache wants to remember about the
+        file's header, or ``None``. It is forgotten along with the descriptor;
+        check ``stat`` to see whether the file has changed since.
+    """
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.stat = os.fstat(fd)
+        self.header: Optional[Any] = None
+        # The number of ``OpenFileCache.open()`` blocks using this:
+        self._users = 0
+        self._discarded = False
+
+    def pread(self, length: int, offset: int) -> bytes:
+        """
+        Read up to ``length`` bytes at ``offset``.
+        """
+        return os.pread(self.fd, length, offset)
+
+
+class OpenFileCache:
+    """
+    I keep up to ``max_open`` files open for reading, closing the least
+    recently used one when another is needed. All methods may be called from
+    any thread.
+    """
+
+    def __init__(self, max_open: int = DEFAULT_MAX_OPEN_FILES):
+        self._max_open = max(1, max_open)
+        self._lock = threading.Lock()
+        # Map path to CachedFile, least recently used first:
+        self._files: OrderedDict[str, CachedFile] = OrderedDict()
+        # Bumped by every invalidation, so that a descriptor opened while
+        # one was going on is not added to the cache:
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    @contextmanager
+    def open(self, path: str) -> Iterator[CachedFile]:
+        """
+        Provide a ``CachedFile`` for ``path`` for the duration of the block.
+
+        :raise EnvironmentError: If the file cannot be opened.
+        """
+        with self._lock:
+            cached = self._files.get(path)
+            if cached is not None:
+                self._files.move_to_end(path)
+                cached._users += 1
+            generation = self._generation
+        if cached is not None:
+            cached.stat = os.fstat(cached.fd)
+            with self._lock:
+                if cached.stat.st_nlink == 0:
+                    # deleted or replaced: forget it and open the path again
+                    cached._users -= 1
+                    if self._files.get(path) is cached:
+                        del self._files[path]
+                    self._discard(cached)
+                    cached = None
+                else:
+                    self.hits += 1
+        if cached is None:
+            cached = self._open(path, generation)
+        try:
+            yield cached
+        finally:
+            with self._lock:
+                cached._users -= 1
+                self._close_if_unused(cached)
+
+    def _open(self, path: str, generation: int) -> CachedFile:
+        cached = CachedFile(os.open(path, os.O_RDONLY))
+        with self._lock:
+            self.misses += 1
+            existing = self._files.get(path)
+            if existing is not None:
+                # another thread opened it at the same time
+                os.close(cached.fd)
+                self._files.move_to_end(path)
+                existing._users += 1
+                return existing
+            cached._users += 1
+            if generation != self._generation:
+                # The file may have been deleted or replaced before we opened
+                # it; use the descriptor for this read only.
+                cached._discarded = True
+                return cached
+            self._files[path] = cached
+            while len(self._files) > self._max_open:
+                (_, evicted) = self._files.popitem(last=False)
+                self._discard(evicted)
+        return cached
+
+    def _discard(self, cached: CachedFile) -> None:
+        cached._discarded = True
+        self._close_if_unused(cached)
+
+    def _close_if_unused(self, cached: CachedFile) -> None:
+        if cached._discarded and cached._users == 0 and cached.fd >= 0:
+            os.close(cached.fd)
+            cached.fd = -1
+
+    def invalidate(self, path: str) -> None:
+        """
+        Forget ``path``, which has been (or is about to be) deleted or
+        replaced.
+        """
+        with self._lock:
+            self._generation += 1
+            cached = self._files.pop(path, None)
+            if cached is not None:
+                self._discard(cached)
+
+    def invalidate_directory(self, dirname: str) -> None:
+        """
+        Forget every file directly inside ``dirname``.
+        """
+        with self._lock:
+            self._generation += 1
+            for path in [p for p in self._files
+                         if os.path.dirname(p) == dirname]:
+                self._discard(self._files.pop(path))
+
+    def close(self) -> None:
+        """
+        Forget everything. Descriptors in use are closed once their users
+        are done.
+        """
+        with self._lock:
+            self._generation += 1
+            for cached in self._files.values():
+                self._discard(cached)
+            self._files.clear()
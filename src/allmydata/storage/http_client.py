@@ -14,6 +14,7 @@ from typing import (
     TypedDict,
     Set,
     Dict,
+    List,
     Callable,
     ClassVar,
 )
@@ -131,6 +132,22 @@ _SCHEMAS: Mapping[str, Schema] = {
     response = #6.258([0*256 uint])
     """
     ),
+    "list_shares_batch": Schema(
+        """
+        response = {0*1024 bstr => {0*256 share_number: uint}}
+        share_number = uint
+        """
+    ),
+    "add_or_renew_leases": Schema(
+        """
+        response = [0*1024 "ok" / "not-found" / "error"]
+        """
+    ),
+    "immutable_read_share_chunks": Schema(
+        """
+        response = [0*64 bstr]
+        """
+    ),
     "mutable_read_test_write": Schema(
         """
         response = {
@@ -657,6 +674,61 @@ class StorageClientGeneral:
         else:
             raise ClientException(response.code)
 
+    @async_to_deferred
+    async def add_or_renew_leases(
+        self, leases: list[tuple[bytes, bytes, bytes]]
+    ) -> list[str]:
+        """
+        Add or renew leases for up to 1024 storage indexes at once, given as
+        (storage_index, renew_secret, cancel_secret) tuples.
+
+        Return a list with the outcome for each lease, in the same order:
+        ``"ok"``, ``"not-found"`` if the server has no shares for that storage
+        index, or ``"error"``.
+
+        Servers that don't support this fail with a ``ClientException`` with
+        code 404.
+        """
+        with start_action(
+            action_type="allmydata:storage:http-client:add-or-renew-leases",
+            count=len(leases),
+        ):
+            return await self._add_or_renew_leases(leases)
+
+    async def _add_or_renew_leases(
+        self, leases: list[tuple[bytes, bytes, bytes]]
+    ) -> list[str]:
+        """Implementation of ``add_or_renew_leases()``."""
+        url = self._client.relative_url("/storage/v1/lease")
+        response = await self._client.request(
+            "POST",
+            url,
+            message_to_serialize={
+                "leases": [
+                    {
+                        "storage-index": storage_index,
+                        "renew-secret": renew_secret,
+                        "cancel-secret": cancel_secret,
+                    }
+                    for (storage_index, renew_secret, cancel_secret) in leases
+                ]
+            },
+        )
+        if response.code == http.OK:
+            results = cast(
+                List[str],
+                await self._client.decode_cbor(
+                    response, _SCHEMAS["add_or_renew_leases"]
+                ),
+            )
+            if len(results) != len(leases):
+                raise ClientException(
+                    response.code, "Wrong number of lease results"
+                )
+            return results
+        else:
+            raise ClientException(response.code)
+
 
 @define
 class UploadProgress:
@@ -998,6 +1070,69 @@ class StorageClientImmutables:
             ctx.add_success_fields(data_len=len(result))
             return result
 
+    @async_to_deferred
+    async def read_share_chunks(
+        self,
+        storage_index: bytes,
+        share_number: int,
+        readv: list[tuple[int, int]],
+    ) -> list[bytes]:
+        """
+        Download several chunks of a share in one request.  ``readv`` is a
+        list of up to 64 (offset, length) tuples; the result has the data for
+        each of them, truncated at the end of the share.
+
+        Servers that don't support this fail with a ``ClientException`` with
+        code 404, as they do for shares they don't have.
+        """
+        with start_action(
+            action_type="allmydata:storage:http-client:immutable:read-share-chunks",
+            storage_index=si_to_human_readable(storage_index),
+            share_number=share_number,
+            readv=readv,
+        ) as ctx:
+            result = await self._read_share_chunks(
+                storage_index, share_number, readv
+            )
+            ctx.add_success_fields(data_len=sum(len(data) for data in result))
+            return result
+
+    async def _read_share_chunks(
+        self,
+        storage_index: bytes,
+        share_number: int,
+        readv: list[tuple[int, int]],
+    ) -> list[bytes]:
+        """Implementation of ``read_share_chunks()``."""
+        url = self._client.relative_url(
+            "/storage/v1/immutable/{}/{}/readv".format(
+                _encode_si(storage_index), share_number
+            )
+        )
+        response = await self._client.request(
+            "POST",
+            url,
+            message_to_serialize={
+                "read-vector": [
+                    {"offset": offset, "size": length} for (offset, length) in readv
+                ]
+            },
+        )
+        if response.code == http.OK:
+            result = cast(
+                list[bytes],
+                await self._client.decode_cbor(
+                    response, _SCHEMAS["immutable_read_share_chunks"]
+                ),
+            )
+            if len(result) != len(readv) or any(
+                len(data) > length for (data, (_, length)) in zip(result, readv)
+            ):
+                raise ValueError("Server sent something other than we asked for")
+            return result
+        else:
+            raise ClientException(response.code)
+
     @async_to_deferred
     async def list_shares(self, storage_index: bytes) -> Set[int]:
         """
@@ -1028,6 +1163,44 @@ class StorageClientImmutables:
         else:
             raise ClientException(response.code)
 
+    @async_to_deferred
+    async def list_shares_batch(
+        self, storage_indexes: list[bytes]
+    ) -> dict[bytes, dict[int, int]]:
+        """
+        Return the shares for many storage indexes at once, as a dict mapping
+        each storage index to a dict mapping share number to share length.
+        Storage indexes the server has no shares for map to an empty dict.
+
+        Servers that don't support this fail with a ``ClientException`` with
+        code 404.
+        """
+        with start_action(
+            action_type="allmydata:storage:http-client:immutable:list-shares-batch",
+            count=len(storage_indexes),
+        ):
+            return await self._list_shares_batch(storage_indexes)
+
+    async def _list_shares_batch(
+        self, storage_indexes: list[bytes]
+    ) -> dict[bytes, dict[int, int]]:
+        """Implementation of ``list_shares_batch()``."""
+        url = self._client.relative_url("/storage/v1/immutable/shares")
+        response = await self._client.request(
+            "POST",
+            url,
+            message_to_serialize={"storage-indexes": storage_indexes},
+        )
+        if response.code == http.OK:
+            return cast(
+                Dict[bytes, Dict[int, int]],
+                await self._client.decode_cbor(
+                    response, _SCHEMAS["list_shares_batch"]
+                ),
+            )
+        else:
+            raise ClientException(response.code)
+
     @async_to_deferred
     async def advise_corrupt_share(
         self,
@@ -7,6 +7,7 @@ from __future__ import annotations
 from typing import (
     Any,
     Callable,
+    Coroutine,
     Union,
     cast,
     Optional,
@@ -16,9 +17,10 @@ from typing import (
     Dict,
 )
 from typing_extensions import ParamSpec, Concatenate
-from functools import wraps
+from functools import wraps, partial
 from base64 import b64decode
 import binascii
+import re
 from tempfile import TemporaryFile
 from os import SEEK_END, SEEK_SET
 import mmap
@@ -33,6 +35,7 @@ from twisted.internet.interfaces import (
     IListeningPort,
     IStreamServerEndpoint,
     IPullProducer,
+    IPushProducer,
     IProtocolFactory,
 )
 from twisted.internet.address import IPv4Address, IPv6Address
@@ -40,6 +43,7 @@ from twisted.internet.defer import Deferred
 from twisted.internet.ssl import CertificateOptions, Certificate, PrivateCertificate
 from twisted.internet.interfaces import IReactorFromThreads
 from twisted.web.server import Site, Request
+from twisted.web.http import HTTPChannel
 from twisted.web.iweb import IRequest
 from twisted.protocols.tls import TLSMemoryBIOFactory
 from twisted.python.filepath import FilePath
@@ -58,7 +62,7 @@ from cryptography.x509 import load_pem_x509_certificate
 
 
 from pycddl import Schema, ValidationError as CDDLValidationError
-from .server import StorageServer
+from .server import StorageServer, AsyncStorageServer
 from .http_common import (
     swissnum_auth_header,
     Secrets,
@@ -380,6 +384,31 @@ _SCHEMAS = {
     }
     """
     ),
+    "list_shares_batch": Schema(
+        """
+    request = {
+      storage-indexes: [1*1024 bstr .size 16]
+    }
+    """
+    ),
+    "add_or_renew_leases": Schema(
+        """
+    request = {
+      leases: [1*1024 {
+        storage-index: bstr .size 16
+        renew-secret: bstr .size 32
+        cancel-secret: bstr .size 32
+      }]
+    }
+    """
+    ),
+    "immutable_read_share_chunks": Schema(
+        """
+    request = {
+      read-vector: [1*64 {offset: uint, size: uint}]
+    }
+    """
+    ),
     "mutable_read_test_write": Schema(
         """
         request = {
@@ -399,7 +428,7 @@ _SCHEMAS = {
 
 
 # Callable that takes offset and length, returns the data at that range.
-ReadData = Callable[[int, int], bytes]
+ReadData = Callable[[int, int], Coroutine[Any, Any, bytes]]
 
 
 @implementer(IPullProducer)
@@ -414,6 +443,8 @@ class _ReadAllProducer:
     read_data: ReadData
     result: Deferred = Factory(Deferred)
     start: int = field(default=0)
+    # Is there a read in progress?
+    _reading: bool = field(default=False, init=False)
 
     @classmethod
     def produce_to(cls, request: Request, read_data: ReadData) -> Deferred[bytes]:
@@ -426,7 +457,16 @@ class _ReadAllProducer:
         return producer.result
 
     def resumeProducing(self) -> None:
-        data = self.read_data(self.start, 65536)
+        if self._reading:
+            return
+        self._reading = True
+        d: Deferred[bytes] = Deferred.fromCoroutine(
+            self.read_data(self.start, 65536)
+        )
+        d.addCallbacks(self._got_data, self._read_failed)
+
+    def _got_data(self, data: bytes) -> None:
+        self._reading = False
         if not data:
             self.request.unregisterProducer()
             d = self.result
@@ -436,6 +476,13 @@ class _ReadAllProducer:
         self.request.write(data)
         self.start += len(data)
 
+    def _read_failed(self, failure: Failure) -> None:
+        self._reading = False
+        self.request.unregisterProducer()
+        d = self.result
+        del self.result
+        d.errback(failure)
+
     def pauseProducing(self) -> None:
         pass
 
@@ -456,33 +503,42 @@ class _ReadRangeProducer:
     result: Optional[Deferred[bytes]]
     start: int
     remaining: int
+    # Is there a read in progress?
+    _reading: bool = field(default=False, init=False)
 
     def resumeProducing(self) -> None:
-        if self.result is None or self.request is None:
+        if self.result is None or self.request is None or self._reading:
             return
 
         to_read = min(self.remaining, 65536)
-        data = self.read_data(self.start, to_read)
+        self._reading = True
+        d: Deferred[bytes] = Deferred.fromCoroutine(
+            self.read_data(self.start, to_read)
+        )
+        d.addCallback(self._got_data, to_read)
+        d.addErrback(self._fail)
+
+    def _got_data(self, data: bytes, to_read: int) -> None:
+        self._reading = False
+        if self.result is None or self.request is None:
+            # We were stopped while reading.
+            return
         assert len(data) <= to_read
 
         if not data and self.remaining > 0:
-            d, self.result = self.result, None
-            d.errback(
+            self._fail(
                 ValueError(
                     f"Should be {self.remaining} bytes left, but we got an empty read"
                 )
             )
-            self.stopProducing()
             return
 
         if len(data) > self.remaining:
-            d, self.result = self.result, None
-            d.errback(
+            self._fail(
                 ValueError(
                     f"Should be {self.remaining} bytes left, but we got more than that ({len(data)})!"
                 )
             )
-            self.stopProducing()
             return
 
         self.start += len(data)
@@ -494,6 +550,14 @@ class _ReadRangeProducer:
         if self.remaining == 0:
             self.stopProducing()
 
+    def _fail(self, reason: Union[Failure, Exception]) -> None:
+        self._reading = False
+        if self.result is None:
+            return
+        d, self.result = self.result, None
+        d.errback(reason)
+        self.stopProducing()
+
     def pauseProducing(self) -> None:
         pass
 
@@ -507,9 +571,143 @@ class _ReadRangeProducer:
             d.callback(b"")
 
 
+# Immutable shares are read in chunks of this size, aligned to multiples of
+# it within the share:
+IMMUTABLE_READ_CHUNK_SIZE = 256 * 1024
+
+# The most data one immutable read vector may ask for:
+MAX_IMMUTABLE_READ_VECTOR_SIZE = 16 * 1024 * 1024
+
+
+@implementer(IPushProducer)
+@define
+class _StreamingReadProducer:
+    """
+    Producer that reads a range of data in large chunks and pushes them to a
+    request, reading the next chunk while the previous one is being sent.
+
+    At most one chunk is read ahead; if the transport asks us to pause, that
+    chunk is held until it asks us to resume.
+    """
+
+    request: Optional[Request]
+    read_data: ReadData
+    result: Optional[Deferred[bytes]]
+    start: int
+    remaining: int
+    chunk_size: int = IMMUTABLE_READ_CHUNK_SIZE
+    # Is there a read in progress?
+    _reading: bool = field(default=False, init=False)
+    _paused: bool = field(default=False, init=False)
+    # A chunk that was read while we were paused:
+    _pending: Optional[bytes] = field(default=None, init=False)
+
+    @classmethod
+    def produce_to(
+        cls, request: Request, read_data: ReadData, start: int, length: int
+    ) -> Deferred[bytes]:
+        """
+        Create, register and start the producer, returning ``Deferred`` that
+        should be returned from a HTTP server endpoint.
+        """
+        d: Deferred[bytes] = Deferred()
+        producer = cls(request, read_data, d, start, length)
+        request.registerProducer(producer, True)
+        if length == 0:
+            producer._finish()
+        else:
+            producer._read_next()
+        return d
+
+    def _read_next(self) -> None:
+        if (
+            self.result is None
+            or self._reading
+            or self._pending is not None
+            or self.remaining == 0
+        ):
+            return
+        # The first read stops at a chunk boundary, so that later ones are
+        # aligned.
+        to_read = min(
+            self.remaining, self.chunk_size - (self.start % self.chunk_size)
+        )
+        self._reading = True
+        d: Deferred[bytes] = Deferred.fromCoroutine(
+            self.read_data(self.start, to_read)
+        )
+        d.addCallback(self._got_data, to_read)
+        d.addErrback(self._fail)
+
+    def _got_data(self, data: bytes, to_read: int) -> None:
+        self._reading = False
+        if self.result is None:
+            # We were stopped while reading.
+            return
+        if len(data) != to_read:
+            self._fail(
+                ValueError(
+                    f"Should have read {to_read} bytes at {self.start}, but"
+                    f" got {len(data)}"
+                )
+            )
+            return
+        self.start += len(data)
+        self.remaining -= len(data)
+        if self._paused:
+            self._pending = data
+        else:
+            self._deliver(data)
+
+    def _deliver(self, data: bytes) -> None:
+        assert self.request is not None
+        self.request.write(data)
+        if self.remaining == 0:
+            self._finish()
+        else:
+            self._read_next()
+
+    def _finish(self) -> None:
+        if self.request is not None:
+            self.request.unregisterProducer()
+            self.request = None
+        if self.result is not None:
+            d, self.result = self.result, None
+            d.callback(b"")
+
+    def _fail(self, reason: Union[Failure, Exception]) -> None:
+        self._reading = False
+        if self.result is None:
+            return
+        d, self.result = self.result, None
+        self.stopProducing()
+        d.errback(reason)
+
+    def pauseProducing(self) -> None:
+        self._paused = True
+
+    def resumeProducing(self) -> None:
+        self._paused = False
+        if self._pending is not None and self.result is not None:
+            data, self._pending = self._pending, None
+            self._deliver(data)
+
+    def stopProducing(self) -> None:
+        self._pending = None
+        if self.request is not None:
+            self.request.unregisterProducer()
+            self.request = None
+        if self.result is not None:
+            d, self.result = self.result, None
+            d.callback(b"")
+
+
 def read_range(
-    request: Request, read_data: ReadData, share_length: int
-) -> Union[Deferred[bytes], bytes]:
+    request: Request,
+    read_data: ReadData,
+    share_length: int,
+    streaming: bool = False,
+) -> Deferred[bytes]:
     """
     Read an optional ``Range`` header, reads data appropriately via the given
     callable, writes the data to the request.
@@ -519,21 +717,27 @@ def read_range(
     Raises a ``_HTTPError(http.REQUESTED_RANGE_NOT_SATISFIABLE)`` if parsing is
     not possible or the header isn't set.
 
-    Takes a function that will do the actual reading given the start offset and
-    a length to read.
+    Takes an async function that will do the actual reading given the start
+    offset and a length to read.  If ``streaming`` is true, it must return
+    exactly as much data as was asked for, and it is called with large
+    aligned chunks, one ahead of what has been written so far.
 
     The resulting data is written to the request.
     """
 
-    def read_data_with_error_handling(offset: int, length: int) -> bytes:
+    async def read_data_with_error_handling(offset: int, length: int) -> bytes:
         try:
-            return read_data(offset, length)
+            return await read_data(offset, length)
         except _HTTPError as e:
             request.setResponseCode(e.code)
             # Empty read means we're done.
             return b""
 
     if request.getHeader("range") is None:
+        if streaming:
+            return _StreamingReadProducer.produce_to(
+                request, read_data, 0, share_length
+            )
         return _ReadAllProducer.produce_to(request, read_data_with_error_handling)
 
     range_header = parse_range_header(request.getHeader("range"))
@@ -566,6 +770,11 @@ def read_range(
         ContentRange("bytes", offset, end).to_header(),
     )
 
+    if streaming:
+        return _StreamingReadProducer.produce_to(
+            request, read_data, offset, end - offset
+        )
+
     d: Deferred[bytes] = Deferred()
     request.registerProducer(
         _ReadRangeProducer(
@@ -576,6 +785,193 @@ def read_range(
     return d
 
 
+# At most this much of the body of an immutable upload is held in memory
+# waiting to be written to disk; beyond that, reading from the connection is
+# paused:
+MAX_BUFFERED_UPLOAD_BYTES = 1024 * 1024
+
+_IMMUTABLE_UPLOAD_PATH = re.compile(
+    b"^/storage/v1/immutable/([" + rfc3548_alphabet + rb"]{26})/([0-9]+)(?:\?.*)?$"
+)
+
+
+@define
+class _StreamingUpload:
+    """
+    Stands in for ``request.content`` while the body of a write to an
+    in-progress immutable upload arrives, handing the data to the
+    ``BucketWriter`` as it comes in rather than after all of it has been
+    buffered.
+
+    At most ``max_buffered`` bytes are kept waiting to be written; past that,
+    ``transport`` is paused until the disk catches up.
+    """
+
+    async_storage_server: AsyncStorageServer
+    storage_index: bytes
+    bucket: BucketWriter
+    offset: int
+    # The number of bytes of the body not received yet:
+    remaining: int
+    transport: IPushProducer
+    max_buffered: int = MAX_BUFFERED_UPLOAD_BYTES
+
+    _pending: list[bytes] = Factory(list)
+    _received: int = 0
+    # Bytes received but not written yet:
+    _buffered: int = 0
+    _writing: bool = False
+    _paused: bool = False
+    _finished: bool = False
+    _error: Optional[Failure] = None
+    _waiting: list[Deferred[bool]] = Factory(list)
+
+    def write(self, data: bytes) -> None:
+        """
+        Receive a chunk of the body, from ``Request.handleContentChunk``.
+        """
+        self.remaining -= len(data)
+        self._received += len(data)
+        if self._error is not None:
+            # the upload has failed, just drain the body
+            return
+        self._pending.append(data)
+        self._buffered += len(data)
+        if self.remaining <= 0:
+            # That's all of it, so there's nothing left to hold back.
+            self._resume()
+        elif self._buffered >= self.max_buffered and not self._paused:
+            self._paused = True
+            self.transport.pauseProducing()
+        if not self._writing:
+            self._write_pending()
+
+    @async_to_deferred
+    async def _write_pending(self) -> None:
+        self._writing = True
+        try:
+            while self._pending and self._error is None:
+                data = b"".join(self._pending)
+                del self._pending[:]
+                try:
+                    finished = await self.async_storage_server.write_bucket(
+                        self.storage_index, self.bucket, self.offset, data
+                    )
+                except Exception:
+                    self._error = Failure()
+                    self._resume()
+                else:
+                    self._finished = self._finished or finished
+                self.offset += len(data)
+                self._buffered -= len(data)
+                if self._buffered <= self.max_buffered // 2:
+                    self._resume()
+        finally:
+            self._writing = False
+        self._maybe_done()
+
+    def _resume(self) -> None:
+        if self._paused:
+            self._paused = False
+            self.transport.resumeProducing()
+
+    def _maybe_done(self) -> None:
+        if self._writing:
+            return
+        if self._error is None and (self.remaining > 0 or self._pending):
+            return
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            if self._error is not None:
+                d.errback(self._error)
+            else:
+                d.callback(self._finished)
+
+    def when_done(self) -> Deferred[bool]:
+        """
+        Return a ``Deferred`` that fires once the whole body has been written,
+        with whether that completed the upload, or fails with the error from
+        writing it.
+        """
+        d: Deferred[bool] = Deferred()
+        self._waiting.append(d)
+        self._maybe_done()
+        return d
+
+    # ``Request`` also does these to its content:
+
+    def tell(self) -> int:
+        return self._received
+
+    def seek(self, offset: int, whence: int = SEEK_SET) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class _StorageRequest(Request):
+    """
+    A ``Request`` that streams the body of writes to in-progress immutable
+    uploads to disk as it arrives; ``twisted.web`` would otherwise buffer the
+    whole body, in memory or a temporary file, before the handler runs.
+    """
+
+    def __init__(self, http_server: HTTPServer, *args: Any, **kwargs: Any):
+        Request.__init__(self, *args, **kwargs)
+        self._http_server = http_server
+        self._request_line: Optional[tuple[bytes, bytes]] = None
+
+    def gotRequestLine(self, method: bytes, path: bytes) -> None:
+        """
+        Called by ``_StorageChannel`` with the method and path of this
+        request, before ``gotLength``; ``Request`` itself is only told them
+        once the whole body has arrived.
+        """
+        self._request_line = (method, path)
+
+    def gotLength(self, length: Optional[int]) -> None:
+        upload = None
+        if length and self._request_line is not None:
+            (method, path) = self._request_line
+            upload = self._http_server._start_streaming_upload(
+                self, method, path, length
+            )
+        if upload is None:
+            Request.gotLength(self, length)
+        else:
+            self.content = upload  # type: ignore[assignment]
+
+
+class _StorageChannel(HTTPChannel):
+    """
+    An ``HTTPChannel`` that tells each ``_StorageRequest`` its method and path
+    as soon as its headers have arrived, so that ``gotLength`` can decide
+    whether to stream the body.
+    """
+
+    _request_line: Optional[tuple[bytes, bytes]] = None
+
+    def lineReceived(self, line: bytes) -> None:
+        requests = len(self.requests)
+        HTTPChannel.lineReceived(self, line)
+        if len(self.requests) > requests:
+            # A new request was just started, so this was its request line:
+            parts = line.split()
+            if len(parts) == 3:
+                self._request_line = (parts[0], parts[1])
+            else:
+                self._request_line = None
+
+    def allHeadersReceived(self) -> None:
+        if self.requests and self._request_line is not None:
+            request = self.requests[-1]
+            if isinstance(request, _StorageRequest):
+                request.gotRequestLine(*self._request_line)
+        self._request_line = None
+        HTTPChannel.allHeadersReceived(self)
+
+
 def _add_error_handling(app: Klein) -> None:
     """Add exception handlers to a Klein app."""
 
@@ -657,6 +1053,8 @@ class HTTPServer(BaseApp):
     ):
         self._reactor = reactor
         self._storage_server = storage_server
+        # Disk I/O for serving requests runs in a thread pool via this:
+        self._async_storage_server = AsyncStorageServer(reactor, storage_server)
         self._swissnum = swissnum
         # Maps storage index to StorageIndexUploads:
         self._uploads = UploadsInProgress()
@@ -671,6 +1069,72 @@ class HTTPServer(BaseApp):
         """Return twisted.web ``Resource`` for this object."""
         return self._app.resource()
 
+    def get_site(self) -> Site:
+        """
+        Return a twisted.web ``Site`` serving this object, which streams the
+        bodies of immutable uploads to disk as they arrive.
+        """
+        site = Site(self.get_resource())
+        site.protocol = _StorageChannel  # type: ignore[method-assign]
+        site.requestFactory = partial(_StorageRequest, self)  # type: ignore[assignment]
+        return site
+
+    def _start_streaming_upload(
+        self, request: Request, method: bytes, path: bytes, length: int
+    ) -> Optional[_StreamingUpload]:
+        """
+        If ``request``, a ``method`` request for ``path`` whose headers have
+        arrived but whose body has not, is an authorized write of ``length``
+        bytes to an in-progress immutable upload, return a
+        ``_StreamingUpload`` to receive the body.
+
+        Otherwise return ``None``; the body is then buffered as usual, and
+        ``write_share_data`` (or whatever else the request is for) deals with
+        the request, including any errors in it.
+        """
+        if method != b"PATCH":
+            return None
+        match = _IMMUTABLE_UPLOAD_PATH.match(path)
+        if match is None:
+            return None
+        try:
+            storage_index = si_a2b(match.group(1))
+            share_number = int(match.group(2))
+            auth_header = request.requestHeaders.getRawHeaders(
+                "Authorization", [""]
+            )[0].encode("utf-8")
+            if not timing_safe_compare(
+                auth_header, swissnum_auth_header(self._swissnum)
+            ):
+                return None
+            secrets = _extract_secrets(
+                request.requestHeaders.getRawHeaders("X-Tahoe-Authorization", []),
+                {Secrets.UPLOAD},
+            )
+            content_range = parse_content_range_header(
+                request.getHeader("content-range")
+            )
+            if (
+                content_range is None
+                or content_range.units != "bytes"
+                or content_range.stop is None
+                or content_range.stop - (content_range.start or 0) != length
+            ):
+                return None
+            bucket = self._uploads.get_write_bucket(
+                storage_index, share_number, secrets[Secrets.UPLOAD]
+            )
+        except (ValueError, AssertionError, ClientSecretsException, _HTTPError):
+            return None
+        return _StreamingUpload(
+            self._async_storage_server,
+            storage_index,
+            bucket,
+            content_range.start or 0,
+            length,
+            cast(IPushProducer, request.channel.transport),
+        )
+
     def _send_encoded(self, request: Request, data: object) -> Deferred[bytes]:
         """
         Return encoded data suitable for writing as the HTTP body response, by
@@ -687,7 +1151,7 @@ class HTTPServer(BaseApp):
             f = TemporaryFile()
             cbor.dump(data, f)  # type: ignore
 
-            def read_data(offset: int, length: int) -> bytes:
+            async def read_data(offset: int, length: int) -> bytes:
                 f.seek(offset)
                 return f.read(length)
 
@@ -773,7 +1237,8 @@ class HTTPServer(BaseApp):
         "/storage/v1/immutable/<storage_index:storage_index>/<int(signed=False):share_number>/abort",
         methods=["PUT"],
     )
-    def abort_share_upload(
+    @async_to_deferred
+    async def abort_share_upload(
         self,
         request: Request,
         authorization: SecretsDict,
@@ -789,8 +1254,9 @@ class HTTPServer(BaseApp):
             if e.code == http.NOT_FOUND:
                 # It may be we've already uploaded this, in which case error
                 # should be method not allowed (405).
+                buckets = await self._async_storage_server.get_buckets(storage_index)
                 try:
-                    self._storage_server.get_buckets(storage_index)[share_number]
+                    buckets[share_number]
                 except KeyError:
                     pass
                 else:
@@ -810,7 +1276,8 @@ class HTTPServer(BaseApp):
         "/storage/v1/immutable/<storage_index:storage_index>/<int(signed=False):share_number>",
         methods=["PATCH"],
     )
-    def write_share_data(
+    @async_to_deferred
+    async def write_share_data(
         self,
         request: Request,
         authorization: SecretsDict,
@@ -834,11 +1301,22 @@ class HTTPServer(BaseApp):
         remaining = content_range.stop - offset
         finished = False
 
+        if isinstance(request.content, _StreamingUpload):
+            # The body has already been written as it arrived:
+            try:
+                finished = await request.content.when_done()
+            except ConflictingWriteError:
+                request.setResponseCode(http.CONFLICT)
+                return b""
+            remaining = 0
+
         while remaining > 0:
             data = request.content.read(min(remaining, 65536))
             assert data, "uploaded data length doesn't match range"
             try:
-                finished = bucket.write(offset, data)
+                finished = await self._async_storage_server.write_bucket(
+                    storage_index, bucket, offset, data
+                )
             except ConflictingWriteError:
                 request.setResponseCode(http.CONFLICT)
                 return b""
@@ -854,7 +1332,7 @@ class HTTPServer(BaseApp):
         required = []
         for start, end, _ in bucket.required_ranges().ranges():
             required.append({"begin": start, "end": end})
-        return self._send_encoded(request, {"required": required})
+        return await self._send_encoded(request, {"required": required})
 
     @_authorized_route(
         _app,
@@ -862,14 +1340,37 @@ class HTTPServer(BaseApp):
         "/storage/v1/immutable/<storage_index:storage_index>/shares",
         methods=["GET"],
     )
-    def list_shares(
+    @async_to_deferred
+    async def list_shares(
         self, request: Request, authorization: SecretsDict, storage_index: bytes
     ) -> KleinRenderable:
         """
         List shares for the given storage index.
         """
-        share_numbers = set(self._storage_server.get_buckets(storage_index).keys())
-        return self._send_encoded(request, share_numbers)
+        buckets = await self._async_storage_server.get_buckets(storage_index)
+        return await self._send_encoded(request, set(buckets.keys()))
+
+    @_authorized_route(
+        _app,
+        set(),
+        "/storage/v1/immutable/shares",
+        methods=["POST"],
+    )
+    @async_to_deferred
+    async def list_shares_batch(
+        self, request: Request, authorization: SecretsDict
+    ) -> KleinRenderable:
+        """
+        List shares, and their lengths, for many storage indexes at once.
+        """
+        # 1024 storage indexes of 16 bytes each, plus a little framing.
+        info = await read_encoded(
+            self._reactor, request, _SCHEMAS["list_shares_batch"], max_size=20000
+        )
+        lengths = await self._async_storage_server.get_immutable_share_lengths(
+            info["storage-indexes"]
+        )
+        return await self._send_encoded(request, lengths)
 
     @_authorized_route(
         _app,
@@ -877,7 +1378,8 @@ class HTTPServer(BaseApp):
         "/storage/v1/immutable/<storage_index:storage_index>/<int(signed=False):share_number>",
         methods=["GET"],
     )
-    def read_share_chunk(
+    @async_to_deferred
+    async def read_share_chunk(
         self,
         request: Request,
         authorization: SecretsDict,
@@ -886,13 +1388,48 @@ class HTTPServer(BaseApp):
     ) -> KleinRenderable:
         """Read a chunk for an already uploaded immutable."""
         request.setHeader("content-type", "application/octet-stream")
+        buckets = await self._async_storage_server.get_buckets(storage_index)
         try:
-            bucket = self._storage_server.get_buckets(storage_index)[share_number]
+            bucket = buckets[share_number]
         except KeyError:
             request.setResponseCode(http.NOT_FOUND)
             return b""
 
-        return read_range(request, bucket.read, bucket.get_length())
+        async def read_data(offset: int, length: int) -> bytes:
+            return await self._async_storage_server.read_bucket(bucket, offset, length)
+
+        return await read_range(
+            request, read_data, bucket.get_length(), streaming=True
+        )
+
+    @_authorized_route(
+        _app,
+        set(),
+        "/storage/v1/immutable/<storage_index:storage_index>/<int(signed=False):share_number>/readv",
+        methods=["POST"],
+    )
+    @async_to_deferred
+    async def read_share_chunks(
+        self,
+        request: Request,
+        authorization: SecretsDict,
+        storage_index: bytes,
+        share_number: int,
+    ) -> KleinRenderable:
+        """Read several chunks of an already uploaded immutable."""
+        info = await read_encoded(
+            self._reactor, request, _SCHEMAS["immutable_read_share_chunks"]
+        )
+        readv = [(r["offset"], r["size"]) for r in info["read-vector"]]
+        if sum(size for (_, size) in readv) > MAX_IMMUTABLE_READ_VECTOR_SIZE:
+            raise _HTTPError(http.REQUESTED_RANGE_NOT_SATISFIABLE)
+        buckets = await self._async_storage_server.get_buckets(storage_index)
+        try:
+            bucket = buckets[share_number]
+        except KeyError:
+            raise _HTTPError(http.NOT_FOUND)
+        datav = await self._async_storage_server.readv_bucket(bucket, readv)
+        return await self._send_encoded(request, datav)
 
     @_authorized_route(
         _app,
@@ -900,15 +1437,16 @@ class HTTPServer(BaseApp):
         "/storage/v1/lease/<storage_index:storage_index>",
         methods=["PUT"],
     )
-    def add_or_renew_lease(
+    @async_to_deferred
+    async def add_or_renew_lease(
         self, request: Request, authorization: SecretsDict, storage_index: bytes
     ) -> KleinRenderable:
         """Update the lease for an immutable or mutable share."""
-        if not list(self._storage_server.get_shares(storage_index)):
+        if not await self._async_storage_server.get_shares(storage_index):
             raise _HTTPError(http.NOT_FOUND)
 
         # Checking of the renewal secret is done by the backend.
-        self._storage_server.add_lease(
+        await self._async_storage_server.add_lease(
             storage_index,
             authorization[Secrets.LEASE_RENEW],
             authorization[Secrets.LEASE_CANCEL],
@@ -917,6 +1455,44 @@ class HTTPServer(BaseApp):
         request.setResponseCode(http.NO_CONTENT)
         return b""
 
+    @_authorized_route(
+        _app,
+        set(),
+        "/storage/v1/lease",
+        methods=["POST"],
+    )
+    @async_to_deferred
+    async def add_or_renew_leases(
+        self, request: Request, authorization: SecretsDict
+    ) -> KleinRenderable:
+        """
+        Update the leases for many storage indexes at once, reporting the
+        outcome for each one.
+        """
+        # 1024 leases of 80 bytes of secrets and storage index each, plus
+        # about 50 bytes of keys and framing.
+        info = await read_encoded(
+            self._reactor,
+            request,
+            _SCHEMAS["add_or_renew_leases"],
+            max_size=1024 * 130 + 100,
+        )
+        results = await self._async_storage_server.add_leases(
+            [
+                (lease["storage-index"], lease["renew-secret"], lease["cancel-secret"])
+                for lease in info["leases"]
+            ]
+        )
+        return await self._send_encoded(
+            request,
+            [
+                "ok" if result is True else
+                "not-found" if result is False else
+                "error"
+                for result in results
+            ],
+        )
+
     @_authorized_route(
         _app,
         set(),
@@ -932,9 +1508,8 @@ class HTTPServer(BaseApp):
         share_number: int,
     ) -> KleinRenderable:
         """Indicate that given share is corrupt, with a text reason."""
-        try:
-            bucket = self._storage_server.get_buckets(storage_index)[share_number]
-        except KeyError:
+        buckets = await self._async_storage_server.get_buckets(storage_index)
+        if share_number not in buckets:
             raise _HTTPError(http.NOT_FOUND)
 
         # The reason can be a string with explanation, so in theory it could be
@@ -945,7 +1520,9 @@ class HTTPServer(BaseApp):
             _SCHEMAS["advise_corrupt_share"],
             max_size=32768,
         )
-        bucket.advise_corrupt_share(info["reason"].encode("utf-8"))
+        await self._async_storage_server.advise_corrupt_share(
+            b"immutable", storage_index, share_number, info["reason"].encode("utf-8")
+        )
         return b""
 
     ##### Mutable APIs #####
@@ -973,7 +1550,7 @@ class HTTPServer(BaseApp):
             authorization[Secrets.LEASE_CANCEL],
         )
         try:
-            success, read_data = self._storage_server.slot_testv_and_readv_and_writev(
+            success, read_data = await self._async_storage_server.slot_testv_and_readv_and_writev(
                 storage_index,
                 secrets,
                 {
@@ -1001,7 +1578,8 @@ class HTTPServer(BaseApp):
         "/storage/v1/mutable/<storage_index:storage_index>/<int(signed=False):share_number>",
         methods=["GET"],
     )
-    def read_mutable_chunk(
+    @async_to_deferred
+    async def read_mutable_chunk(
         self,
         request: Request,
         authorization: SecretsDict,
@@ -1012,21 +1590,22 @@ class HTTPServer(BaseApp):
         request.setHeader("content-type", "application/octet-stream")
 
         try:
-            share_length = self._storage_server.get_mutable_share_length(
+            share_length = await self._async_storage_server.get_mutable_share_length(
                 storage_index, share_number
             )
         except KeyError:
             raise _HTTPError(http.NOT_FOUND)
 
-        def read_data(offset, length):
+        async def read_data(offset: int, length: int) -> bytes:
             try:
-                return self._storage_server.slot_readv(
+                datavs = await self._async_storage_server.slot_readv(
                     storage_index, [share_number], [(offset, length)]
-                )[share_number][0]
+                )
+                return datavs[share_number][0]
             except KeyError:
                 raise _HTTPError(http.NOT_FOUND)
 
-        return read_range(request, read_data, share_length)
+        return await read_range(request, read_data, share_length)
 
     @_authorized_route(
         _app,
@@ -1034,10 +1613,13 @@ class HTTPServer(BaseApp):
         "/storage/v1/mutable/<storage_index:storage_index>/shares",
         methods=["GET"],
     )
-    def enumerate_mutable_shares(self, request, authorization, storage_index):
+    @async_to_deferred
+    async def enumerate_mutable_shares(self, request, authorization, storage_index):
         """List mutable shares for a storage index."""
-        shares = self._storage_server.enumerate_mutable_shares(storage_index)
-        return self._send_encoded(request, shares)
+        shares = await self._async_storage_server.enumerate_mutable_shares(
+            storage_index
+        )
+        return await self._send_encoded(request, shares)
 
     @_authorized_route(
         _app,
@@ -1055,7 +1637,10 @@ class HTTPServer(BaseApp):
     ) -> KleinRenderable:
         """Indicate that given share is corrupt, with a text reason."""
         if share_number not in {
-            shnum for (shnum, _) in self._storage_server.get_shares(storage_index)
+            shnum
+            for (shnum, _) in await self._async_storage_server.get_shares(
+                storage_index
+            )
         }:
             raise _HTTPError(http.NOT_FOUND)
 
@@ -1064,7 +1649,7 @@ class HTTPServer(BaseApp):
         info = await read_encoded(
             self._reactor, request, _SCHEMAS["advise_corrupt_share"], max_size=32768
         )
-        self._storage_server.advise_corrupt_share(
+        await self._async_storage_server.advise_corrupt_share(
             b"mutable", storage_index, share_number, info["reason"].encode("utf-8")
         )
         return b""
@@ -1166,6 +1751,6 @@ def listen_tls(
             load_pem_x509_certificate(cert_path.getContent()),
         )
 
-    return endpoint.listen(Site(server.get_resource())).addCallback(
+    return endpoint.listen(server.get_site()).addCallback(
         lambda listening_port: (get_nurl(listening_port), listening_port)
     )
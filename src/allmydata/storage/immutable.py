@@ -140,6 +140,7 @@ class ShareFile:
             create=False,
             lease_count_format="L",
             schema=NEWEST_SCHEMA_VERSION,
+            fd_cache=None,
     ):
         """
         Initialize a ``ShareFile``.
@@ -161,6 +162,10 @@ class ShareFile:
             exercise values near the maximum encodeable value without having
             to create billions of leases.
 
+        :param Optional[OpenFileCache] fd_cache: If given, read the share
+            data (and the header) through this cache of open descriptors.
+            Only for shares which are not being written.
+
         :raise ValueError: If the encoding of ``lease_count_format`` is too
             large or if it is not a single format character.
         """
@@ -171,6 +176,7 @@ class ShareFile:
         self._lease_count_size = struct.calcsize(self._lease_count_format)
         self.home = filename
         self._max_size = max_size
+        self._fd_cache = fd_cache
         if create:
             # touch the file, so later callers will see that we're working on
             # it. Also construct the metadata.
@@ -181,6 +187,22 @@ class ShareFile:
                 f.write(self._schema.header(max_size))
             self._lease_offset = max_size + 0x0c
             self._num_leases = 0
+        elif fd_cache is not None:
+            with fd_cache.open(self.home) as cached:
+                filestamp = (cached.stat.st_size, cached.stat.st_mtime_ns)
+                if cached.header is None or cached.header[0] != filestamp:
+                    (version, unused, num_leases) = struct.unpack(
+                        ">LLL", cached.pread(0xc, 0))
+                    cached.header = (
+                        filestamp,
+                        version,
+                        cached.stat.st_size - (num_leases * self.LEASE_SIZE),
+                    )
+                (_, version, self._lease_offset) = cached.header
+            self._schema = schema_from_version(version)
+            if self._schema is None:
+                raise UnknownImmutableContainerVersionError(filename, version)
+            self._length = self._lease_offset - 0xc
         else:
             with open(self.home, 'rb') as f:
                 filesize = os.path.getsize(self.home)
@@ -201,6 +223,8 @@ class ShareFile:
         return self._length
 
     def unlink(self):
+        if self._fd_cache is not None:
+            self._fd_cache.invalidate(self.home)
         os.unlink(self.home)
 
     def read_share_data(self, offset, length):
@@ -211,6 +235,9 @@ class ShareFile:
         actuallength = max(0, min(length, self._lease_offset-seekpos))
         if actuallength == 0:
             return b""
+        if self._fd_cache is not None:
+            with self._fd_cache.open(self.home) as cached:
+                return cached.pread(actuallength, seekpos)
         with open(self.home, 'rb') as f:
             f.seek(seekpos)
             return f.read(actuallength)
@@ -388,10 +415,24 @@ class BucketWriter:
         """
         Write data at given offset, return whether the upload is complete.
         """
-        # Delay the timeout, since we received data; if we get an
-        # AlreadyCancelled error, that means there's a bug in the client and
-        # write() was called after close().
+        self.delay_timeout()
+        return self.write_data(offset, data)
+
+    def delay_timeout(self):  # type: () -> None
+        """
+        Push back the timeout, since we're receiving data.  Must be called
+        from the reactor thread.
+        """
+        # If we get an AlreadyCancelled error, that means there's a bug in the
+        # client and write() was called after close().
         self._timeout.reset(30 * 60)
+
+    def write_data(self, offset, data):  # type: (int, bytes) -> bool
+        """
+        Like ``write()``, but without delaying the timeout.  This doesn't
+        touch the reactor, so it can be run in a thread, although not
+        concurrently with other calls on the same ``BucketWriter``.
+        """
         start = self._clock.seconds()
         precondition(not self.closed)
         if self.throw_out_all_data:
@@ -523,9 +564,10 @@ class BucketReader:
     Manage the process for reading from a ``ShareFile``.
     """
 
-    def __init__(self, ss, sharefname, storage_index=None, shnum=None):
+    def __init__(self, ss, sharefname, storage_index=None, shnum=None,
+                 fd_cache=None):
         self.ss = ss
-        self._share_file = ShareFile(sharefname)
+        self._share_file = ShareFile(sharefname, fd_cache=fd_cache)
         self.storage_index = storage_index
         self.shnum = shnum
 
@@ -0,0 +1,230 @@
+"""
+An optional index of the leases on the shares held by a storage server.
+
+Without it, every cycle of the lease checker (see expirer.py) opens every
+share file to read its leases. With it, the lease checker gets the leases of
+each bucket from a SQLite database, and only opens the share files of
+buckets where there is something to do: a lease that has expired, or a share
+that would be deleted. The database also records the size of each share, for
+the lease checker's statistics.
+
+The storage server keeps the index up to date as shares are created and
+deleted and as leases are added or renewed. The lease checker builds it the
+first time, during a cycle that reads every share file the old way. Until
+that cycle has finished, the index is incomplete and the lease checker does
+not use it.
+"""
+
+from __future__ import annotations
+
+import threading
+
+from attrs import define
+
+from allmydata.storage.share_index import _prefix_bounds
+from allmydata.util import dbutil
+
+LEASE_INDEX_SCHEMA_V1 = """
+CREATE TABLE version
+(
+ version INTEGER  -- contains one row, set to 1
+);
+
+CREATE TABLE shares
+(
+ storage_index BLOB NOT NULL,
+ shnum INTEGER NOT NULL,
+ sharetype TEXT NOT NULL,     -- "immutable" or "mutable"
+ sharebytes INTEGER NOT NULL, -- the size of the share file
+ diskbytes INTEGER NOT NULL,  -- the disk space used by the share file
+ PRIMARY KEY (storage_index, shnum)
+);
+
+CREATE TABLE leases
+(
+ storage_index BLOB NOT NULL,
+ shnum INTEGER NOT NULL,
+ expiration_time INTEGER NOT NULL
+);
+
+CREATE INDEX leases_by_share ON leases (storage_index, shnum);
+
+CREATE TABLE rebuild
+(
+ cycle INTEGER,            -- the crawler cycle that is rebuilding the index
+ complete INTEGER NOT NULL
+);
+
+INSERT INTO rebuild (cycle, complete) VALUES (NULL, 0);
+"""
+
+
+@define
+class IndexedShare:
+    """
+    What the lease index knows about a share.
+
+    :ivar sharetype: "immutable" or "mutable".
+    :ivar sharebytes: The size of the share file.
+    :ivar diskbytes: The disk space used by the share file.
+    :ivar expiration_times: The expiration time of each lease on the share.
+    """
+
+    sharetype: str
+    sharebytes: int
+    diskbytes: int
+    expiration_times: list[int]
+
+
+class LeaseIndex:
+    """
+    I map the shares held for each storage index to their leases. Every
+    method may be called from any thread.
+    """
+
+    def __init__(self, dbfile: str):
+        (self._sqlite, self._db) = dbutil.get_db(
+            dbfile, create_version=(LEASE_INDEX_SCHEMA_V1, 1),
+            dbname="lease index", check_same_thread=False,
+        )
+        # The index can always be rebuilt, so trade durability for speed.
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._lock = threading.Lock()
+        (complete,) = self._db.execute(
+            "SELECT complete FROM rebuild").fetchone()
+        self._complete = bool(complete)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def is_complete(self) -> bool:
+        """
+        Return whether the index has been fully built, so that it can be used
+        instead of reading the share files.
+        """
+        return self._complete
+
+    def rebuild_started(self, cycle: int) -> None:
+        """
+        Lease checker cycle ``cycle``, which reads every share file, is
+        starting. If the index is incomplete and not already being rebuilt,
+        it will be complete once that cycle ends.
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE rebuild SET cycle = ? WHERE complete = 0"
+                " AND cycle IS NULL", (cycle,))
+
+    def rebuild_finished(self, cycle: int) -> None:
+        """
+        Lease checker cycle ``cycle`` has read every share file.
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE rebuild SET complete = 1 WHERE cycle = ?", (cycle,))
+            (complete,) = self._db.execute(
+                "SELECT complete FROM rebuild").fetchone()
+            self._complete = bool(complete)
+
+    def _set_share(self, storage_index: bytes, shnum: int,
+                   share: IndexedShare) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO shares"
+            " (storage_index, shnum, sharetype, sharebytes, diskbytes)"
+            " VALUES (?,?,?,?,?)",
+            (storage_index, shnum, share.sharetype, share.sharebytes,
+             share.diskbytes))
+        self._db.execute(
+            "DELETE FROM leases WHERE storage_index = ? AND shnum = ?",
+            (storage_index, shnum))
+        self._db.executemany(
+            "INSERT INTO leases (storage_index, shnum, expiration_time)"
+            " VALUES (?,?,?)",
+            [(storage_index, shnum, int(expiration_time))
+             for expiration_time in share.expiration_times])
+
+    def set_share(self, storage_index: bytes, shnum: int,
+                  share: IndexedShare) -> None:
+        """
+        Record a share and its leases, replacing what was recorded before.
+        """
+        with self._lock, self._db:
+            self._set_share(storage_index, shnum, share)
+
+    def remove_share(self, storage_index: bytes, shnum: int) -> None:
+        """
+        Record that a share no longer exists.
+        """
+        with self._lock, self._db:
+            for table in ("shares", "leases"):
+                self._db.execute(
+                    "DELETE FROM %s WHERE storage_index = ? AND shnum = ?"
+                    % (table,), (storage_index, shnum))
+
+    def set_bucket(self, storage_index: bytes,
+                   shares: dict[int, IndexedShare]) -> None:
+        """
+        Replace everything recorded about ``storage_index`` with ``shares``,
+        a dict mapping share numbers to ``IndexedShare``.
+        """
+        with self._lock, self._db:
+            for table in ("shares", "leases"):
+                self._db.execute(
+                    "DELETE FROM %s WHERE storage_index = ?" % (table,),
+                    (storage_index,))
+            for (shnum, share) in shares.items():
+                self._set_share(storage_index, shnum, share)
+
+    def _prefix_query(self, query: str, prefix: str) -> tuple[str, tuple]:
+        (lower, upper) = _prefix_bounds(prefix)
+        query += " WHERE storage_index >= ?"
+        args: tuple[bytes, ...] = (lower,)
+        if upper is not None:
+            query += " AND storage_index < ?"
+            args += (upper,)
+        return (query, args)
+
+    def get_prefix(self, prefix: str) -> dict[bytes, dict[int, IndexedShare]]:
+        """
+        Return what is recorded about every storage index whose base32 form
+        starts with ``prefix``: a dict mapping each of those storage indexes
+        to a dict like the one given to ``set_bucket``.
+        """
+        buckets: dict[bytes, dict[int, IndexedShare]] = {}
+        with self._lock:
+            for (storage_index, shnum, sharetype, sharebytes, diskbytes) in (
+                self._db.execute(*self._prefix_query(
+                    "SELECT storage_index, shnum, sharetype, sharebytes,"
+                    " diskbytes FROM shares", prefix)).fetchall()
+            ):
+                buckets.setdefault(storage_index, {})[shnum] = IndexedShare(
+                    sharetype, sharebytes, diskbytes, [])
+            for (storage_index, shnum, expiration_time) in (
+                self._db.execute(*self._prefix_query(
+                    "SELECT storage_index, shnum, expiration_time FROM leases",
+                    prefix)).fetchall()
+            ):
+                share = buckets.get(storage_index, {}).get(shnum)
+                if share is not None:
+                    share.expiration_times.append(expiration_time)
+        return buckets
+
+    def prune_prefix(self, prefix: str, storage_indexes: set[bytes]) -> None:
+        """
+        Forget every storage index whose base32 form starts with ``prefix``
+        except those in ``storage_indexes``, the buckets that exist on disk.
+        """
+        with self._lock, self._db:
+            stale = [
+                storage_index
+                for (storage_index,) in self._db.execute(*self._prefix_query(
+                    "SELECT DISTINCT storage_index FROM shares", prefix
+                )).fetchall()
+                if storage_index not in storage_indexes
+            ]
+            for table in ("shares", "leases"):
+                self._db.executemany(
+                    "DELETE FROM %s WHERE storage_index = ?" % (table,),
+                    [(storage_index,) for storage_index in stale])
@@ -3,21 +3,27 @@ Ported to Python 3.
 """
 from __future__ import annotations
 
-from typing import Iterable, Any
+from typing import Iterable, Any, Iterator, Union
 
-import os, re
+import os, re, struct, threading
+from collections import deque
+from contextlib import contextmanager
 
 from foolscap.api import Referenceable
 from foolscap.ipb import IRemoteReference
 from twisted.application import service
 from twisted.internet import reactor
+from twisted.internet.defer import DeferredLock, maybeDeferred
+from twisted.internet.interfaces import IReactorFromThreads
 
 from zope.interface import implementer
 from allmydata.interfaces import RIStorageServer, IStatsProducer
-from allmydata.util import fileutil, idlib, log, time_format
+from allmydata.util import dbutil, fileutil, idlib, log, time_format
+from allmydata.util.iothreadpool import defer_to_io_thread
 import allmydata # for __full_version__
 
-from allmydata.storage.common import si_b2a, si_a2b, storage_index_to_dir
+from allmydata.storage.common import si_b2a, si_a2b, storage_index_to_dir, \
+     UnknownContainerVersionError
 _pyflakes_hush = [si_b2a, si_a2b, storage_index_to_dir] # re-exported
 from allmydata.storage.lease import LeaseInfo
 from allmydata.storage.mutable import MutableShareFile, EmptyShare, \
@@ -29,6 +35,9 @@ from allmydata.storage.immutable import (
 )
 from allmydata.storage.crawler import BucketCountingCrawler
 from allmydata.storage.expirer import LeaseCheckingCrawler
+from allmydata.storage.share_index import ShareIndex, ShareIndexCrawler
+from allmydata.storage.lease_index import LeaseIndex, IndexedShare
+from allmydata.storage import fdcache
 
 # storage/
 # storage/shares/incoming
@@ -49,6 +58,36 @@ NUM_RE=re.compile("^[0-9]+$")
 DEFAULT_RENEWAL_TIME = 31 * 24 * 60 * 60
 
 
+class _StorageIndexLocks:
+    """
+    A lock per storage index, for operations that modify share files.
+
+    Share files may be touched from the reactor thread (Foolscap) and from
+    the I/O thread pool (HTTP) at the same time, so read-modify-write
+    operations like mutable test-and-set or lease updates need to exclude
+    each other.  Locks are discarded once nobody holds or waits on them.
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        # Map storage index to [lock, number of users]:
+        self._locks: dict[bytes, list] = {}
+
+    @contextmanager
+    def locked(self, storage_index: bytes) -> Iterator[None]:
+        with self._guard:
+            entry = self._locks.setdefault(storage_index, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[storage_index]
+
+
 @implementer(IStatsProducer)
 class StorageServer(service.MultiService):
     """
@@ -68,6 +107,9 @@ class StorageServer(service.MultiService):
                  expiration_override_lease_duration=None,
                  expiration_cutoff_date=None,
                  expiration_sharetypes=("mutable", "immutable"),
+                 share_index=False,
+                 lease_index=False,
+                 max_open_share_files=fdcache.DEFAULT_MAX_OPEN_FILES,
                  clock=reactor):
         service.MultiService.__init__(self)
         assert isinstance(nodeid, bytes)
@@ -97,17 +139,38 @@ class StorageServer(service.MultiService):
                 log.msg("warning: [storage]reserved_space= is set, but this platform does not support an API to get disk statistics (statvfs(2) or GetDiskFreeSpaceEx), so this reservation cannot be honored",
                         umin="0wZ27w", level=log.UNUSUAL)
 
-        self.latencies = {"allocate": [], # immutable
-                          "write": [],
-                          "close": [],
-                          "read": [],
-                          "get": [],
-                          "writev": [], # mutable
-                          "readv": [],
-                          "add-lease": [], # both
-                          "renew": [],
-                          "cancel": [],
-                          }
+        # The most recent latencies for each category, which get_latencies()
+        # summarizes. Every latency is also added to a histogram in the
+        # stats provider, if there is one.
+        self.latencies = {category: deque(maxlen=1000) for category in [
+            "allocate", "write", "close", "read", "get", # immutable
+            "writev", "readv", # mutable
+            "add-lease", "renew", "cancel", # both
+        ]}
+        # Counters and latencies are updated from the I/O thread pool too:
+        self._stats_lock = threading.Lock()
+        self._storage_index_locks = _StorageIndexLocks()
+        # Optional database of the shares we hold; see share_index.py
+        self._share_index = None
+        share_index_file = os.path.join(storedir, "share_index.sqlite")
+        if share_index:
+            self._share_index = ShareIndex(share_index_file)
+        else:
+            # Shares written while the index is disabled are missing from
+            # it, so an index left by an earlier run cannot be trusted.
+            dbutil.remove_db(share_index_file)
+        # Optional database of the leases on our shares; see lease_index.py
+        self._lease_index = None
+        lease_index_file = os.path.join(storedir, "lease_index.sqlite")
+        if lease_index:
+            self._lease_index = LeaseIndex(lease_index_file)
+        else:
+            # Likewise, leases added or renewed meanwhile would be missing.
+            dbutil.remove_db(lease_index_file)
+        # Open descriptors for reading immutable shares; see fdcache.py
+        self._fd_cache = None
+        if max_open_share_files and fdcache.is_supported():
+            self._fd_cache = fdcache.OpenFileCache(max_open_share_files)
         self.add_bucket_counter()
 
         statefile = os.path.join(self.storedir, "lease_checker.state")
@@ -117,7 +180,8 @@ class StorageServer(service.MultiService):
                                    expiration_enabled, expiration_mode,
                                    expiration_override_lease_duration,
                                    expiration_cutoff_date,
-                                   expiration_sharetypes)
+                                   expiration_sharetypes,
+                                   lease_index=self._lease_index)
         self.lease_checker.setServiceParent(self)
         self._clock = clock
 
@@ -131,7 +195,18 @@ class StorageServer(service.MultiService):
         # Cancel any in-progress uploads:
         for bw in list(self._bucket_writers.values()):
             bw.disconnected()
-        return service.MultiService.stopService(self)
+        if self._fd_cache is not None:
+            self._fd_cache.close()
+        d = maybeDeferred(service.MultiService.stopService, self)
+        def _close_indexes(result):
+            # after the crawlers, which use them, have stopped
+            if self._share_index is not None:
+                self._share_index.close()
+            if self._lease_index is not None:
+                self._lease_index.close()
+            return result
+        d.addBoth(_close_indexes)
+        return d
 
     def __repr__(self):
         return "<StorageServer %s>" % (idlib.shortnodeid_b2a(self.my_nodeid),)
@@ -139,22 +214,31 @@ class StorageServer(service.MultiService):
     def have_shares(self):
         # quick test to decide if we need to commit to an implicit
         # permutation-seed or if we should use a new one
+        if self._share_index is not None and self._share_index.is_complete():
+            return self._share_index.get_bucket_count() > 0
         return bool(set(os.listdir(self.sharedir)) - set(["incoming"]))
 
     def add_bucket_counter(self):
         statefile = os.path.join(self.storedir, "bucket_counter.state")
-        self.bucket_counter = BucketCountingCrawler(self, statefile)
+        if self._share_index is not None:
+            # this one also (re)builds the share index
+            self.bucket_counter = ShareIndexCrawler(self, statefile,
+                                                    self._share_index)
+        else:
+            self.bucket_counter = BucketCountingCrawler(self, statefile)
         self.bucket_counter.setServiceParent(self)
 
     def count(self, name, delta=1):
         if self.stats_provider:
-            self.stats_provider.count("storage_server." + name, delta)
+            with self._stats_lock:
+                self.stats_provider.count("storage_server." + name, delta)
 
     def add_latency(self, category, latency):
-        a = self.latencies[category]
-        a.append(latency)
-        if len(a) > 1000:
-            self.latencies[category] = a[-1000:]
+        with self._stats_lock:
+            self.latencies[category].append(latency)
+            if self.stats_provider:
+                self.stats_provider.add_latency(
+                    "storage_server." + category, latency)
 
     def get_latencies(self):
         """Return a dict, indexed by category, that contains a dict of
@@ -169,11 +253,15 @@ class StorageServer(service.MultiService):
         not be present in the return value. """
         # note that Amazon's Dynamo paper says they use 99.9% percentile.
         output = {}
-        for category in self.latencies:
-            if not self.latencies[category]:
+        with self._stats_lock:
+            latencies = {
+                category: list(samples)
+                for (category, samples) in self.latencies.items()
+            }
+        for category, samples in latencies.items():
+            if not samples:
                 continue
             stats = {}
-            samples = self.latencies[category][:]
             count = len(samples)
             stats["samplesize"] = count
             samples.sort()
@@ -234,8 +322,11 @@ class StorageServer(service.MultiService):
             writeable = False
 
         stats['storage_server.accepting_immutable_shares'] = int(writeable)
-        s = self.bucket_counter.get_state()
-        bucket_count = s.get("last-complete-bucket-count")
+        if self._share_index is not None and self._share_index.is_complete():
+            bucket_count = self._share_index.get_bucket_count()
+        else:
+            s = self.bucket_counter.get_state()
+            bucket_count = s.get("last-complete-bucket-count")
         if bucket_count:
             stats['storage_server.total_bucket_count'] = bucket_count
         return stats
@@ -326,7 +417,8 @@ class StorageServer(service.MultiService):
         for (shnum, fn) in self.get_shares(storage_index):
             alreadygot[shnum] = ShareFile(fn)
         if renew_leases:
-            self._add_or_renew_leases(alreadygot.values(), lease_info)
+            with self._storage_index_locks.locked(storage_index):
+                self._add_or_renew_leases(alreadygot.values(), lease_info)
 
         for shnum in sharenums:
             incominghome = os.path.join(self.incomingdir, si_dir, "%d" % shnum)
@@ -386,21 +478,63 @@ class StorageServer(service.MultiService):
         lease_info = LeaseInfo(owner_num,
                                renew_secret, cancel_secret,
                                new_expire_time, self.my_nodeid)
-        self._add_or_renew_leases(
-            self._iter_share_files(storage_index),
-            lease_info,
-        )
+        with self._storage_index_locks.locked(storage_index):
+            self._add_or_renew_leases(
+                self._iter_share_files(storage_index),
+                lease_info,
+            )
         self.add_latency("add-lease", self._clock.seconds() - start)
         return None
 
+    def add_leases(self, leases, owner_num=1):
+        """
+        Add or renew many leases at once, as if by calling ``add_lease`` for
+        each (storage_index, renew_secret, cancel_secret) tuple in ``leases``.
+
+        The storage indexes are visited in sorted order, so that shares in
+        the same prefix directory are written one after the other, and the
+        free space is only checked once for the whole batch.
+
+        :return: A list with one entry for each lease, in the same order:
+            ``True`` if it was put on the shares for its storage index,
+            ``False`` if there are no such shares, or the exception that
+            prevented it from being added.
+        """
+        start = self._clock.seconds()
+        self.count("add-lease", len(leases))
+        new_expire_time = self._clock.seconds() + DEFAULT_RENEWAL_TIME
+        available_space = self.get_available_space()
+        results = [False] * len(leases)
+        order = sorted(range(len(leases)), key=lambda i: leases[i][0])
+        for i in order:
+            (storage_index, renew_secret, cancel_secret) = leases[i]
+            lease_info = LeaseInfo(owner_num,
+                                   renew_secret, cancel_secret,
+                                   new_expire_time, self.my_nodeid)
+            try:
+                with self._storage_index_locks.locked(storage_index):
+                    for share in self._iter_share_files(storage_index):
+                        results[i] = True
+                        share.add_or_renew_lease(available_space, lease_info)
+                        self._index_share_leases(share)
+            except Exception as e:
+                log.msg(format="add_leases failed for %(si)s: %(e)r",
+                        si=si_b2a(storage_index), e=e,
+                        facility="tahoe.storage", level=log.UNUSUAL)
+                results[i] = e
+        self.add_latency("add-lease", self._clock.seconds() - start)
+        return results
+
     def renew_lease(self, storage_index, renew_secret):
         start = self._clock.seconds()
         self.count("renew")
         new_expire_time = self._clock.seconds() + DEFAULT_RENEWAL_TIME
         found_buckets = False
-        for sf in self._iter_share_files(storage_index):
-            found_buckets = True
-            sf.renew_lease(renew_secret, new_expire_time)
+        with self._storage_index_locks.locked(storage_index):
+            for sf in self._iter_share_files(storage_index):
+                found_buckets = True
+                sf.renew_lease(renew_secret, new_expire_time)
+                self._index_share_leases(sf)
         self.add_latency("renew", self._clock.seconds() - start)
         if not found_buckets:
             raise IndexError("no such lease to renew")
@@ -409,6 +543,23 @@ class StorageServer(service.MultiService):
         if self.stats_provider:
             self.stats_provider.count('storage_server.bytes_added', consumed_size)
         del self._bucket_writers[bw.incominghome]
+        if self._fd_cache is not None:
+            # in case an earlier share by this name was deleted behind our back
+            self._fd_cache.invalidate(bw.finalhome)
+        if consumed_size and (self._share_index is not None or
+                              self._lease_index is not None):
+            # the share is now in its final home (an aborted upload consumes
+            # nothing)
+            (bucketdir, shnum_s) = os.path.split(bw.finalhome)
+            storage_index = si_a2b(os.path.basename(bucketdir).encode("ascii"))
+            sharefile = ShareFile(bw.finalhome)
+            with self._storage_index_locks.locked(storage_index):
+                if self._share_index is not None:
+                    self._share_index.set_share(
+                        storage_index, int(shnum_s), "immutable",
+                        sharefile.get_length(),
+                    )
+                self._index_share_leases(sharefile)
         for handler in self._call_on_bucket_writer_close:
             handler(bw)
 
@@ -424,6 +575,29 @@ class StorageServer(service.MultiService):
         shares for this storage_index. In each tuple, 'shnum' will always be
         the integer form of the last component of 'pathname'.
         """
+        indexed = self._get_indexed_shares(storage_index)
+        if indexed is None:
+            return self._list_share_files(storage_index)
+        storagedir = os.path.join(self.sharedir, storage_index_to_dir(storage_index))
+        return iter([
+            (shnum, os.path.join(storagedir, "%d" % (shnum,)))
+            for shnum in indexed
+        ])
+
+    def _get_indexed_shares(self, storage_index):
+        """
+        Return what the share index knows about ``storage_index`` (see
+        ``ShareIndex.get_shares``), or None if there is no complete share
+        index to ask.
+        """
+        if self._share_index is None or not self._share_index.is_complete():
+            return None
+        return self._share_index.get_shares(storage_index)
+
+    def _list_share_files(self, storage_index) -> Iterator[tuple[int, str]]:
+        """
+        Like ``get_shares``, but always look at the bucket directory.
+        """
         storagedir = os.path.join(self.sharedir, storage_index_to_dir(storage_index))
         try:
             for f in os.listdir(storagedir):
@@ -434,6 +608,105 @@ class StorageServer(service.MultiService):
             # Commonly caused by there being no buckets at all.
             pass
 
+    def _describe_share(self, filename):
+        """
+        Return a (sharetype, size) tuple for a share file, as recorded in the
+        share index, or None if it is not a share file we understand.
+        """
+        try:
+            with open(filename, 'rb') as f:
+                header = f.read(32)
+            if MutableShareFile.is_valid_header(header):
+                return ("mutable", MutableShareFile(filename).get_length())
+            if ShareFile.is_valid_header(header):
+                return ("immutable", ShareFile(filename).get_length())
+        except (EnvironmentError, UnknownContainerVersionError):
+            pass
+        return None
+
+    def bucket_changed(self, storage_index):
+        """
+        The share files for ``storage_index`` may have been created, changed
+        or deleted by something other than my own methods (for example, the
+        lease expirer). Forget any open descriptors for them, and bring the
+        share index up to date with them.
+        """
+        if self._fd_cache is not None:
+            self._fd_cache.invalidate_directory(os.path.join(
+                self.sharedir, storage_index_to_dir(storage_index)))
+        if self._share_index is None and self._lease_index is None:
+            return
+        with self._storage_index_locks.locked(storage_index):
+            if self._share_index is not None:
+                shares = {}
+                for (shnum, filename) in self._list_share_files(storage_index):
+                    description = self._describe_share(filename)
+                    if description is not None:
+                        shares[shnum] = description
+                self._share_index.set_bucket(storage_index, shares)
+            self._index_bucket_leases(storage_index)
+
+    def index_leases(self, storage_index):
+        """
+        Bring the lease index up to date with the share files of
+        ``storage_index``, whose leases may have been changed by something
+        other than my own methods (for example, the lease expirer).
+        """
+        if self._lease_index is None:
+            return
+        with self._storage_index_locks.locked(storage_index):
+            self._index_bucket_leases(storage_index)
+
+    def _index_bucket_leases(self, storage_index):
+        if self._lease_index is None:
+            return
+        shares = {}
+        for (shnum, filename) in self._list_share_files(storage_index):
+            try:
+                with open(filename, 'rb') as f:
+                    header = f.read(32)
+                if MutableShareFile.is_valid_header(header):
+                    sf = MutableShareFile(filename, self)
+                elif ShareFile.is_valid_header(header):
+                    sf = ShareFile(filename)
+                else:
+                    continue # non-sharefile
+                shares[shnum] = self._describe_leases(sf)
+            except (EnvironmentError, UnknownContainerVersionError,
+                    struct.error):
+                # Leave the whole bucket out, so that the lease checker
+                # looks at it (and reports the broken share) every cycle.
+                shares = {}
+                break
+        self._lease_index.set_bucket(storage_index, shares)
+
+    def _describe_leases(self, share):
+        """
+        Return an ``IndexedShare`` describing a share file and its leases,
+        for the lease index.
+        """
+        s = os.stat(share.home)
+        try:
+            diskbytes = s.st_blocks * 512
+        except AttributeError:
+            diskbytes = s.st_size # no stat().st_blocks on windows
+        return IndexedShare(
+            share.sharetype, s.st_size, diskbytes,
+            [lease.get_expiration_time() for lease in share.get_leases()],
+        )
+
+    def _index_share_leases(self, share):
+        """
+        Record a share file and its leases in the lease index, if there is
+        one. The caller holds the lock for the share's storage index.
+        """
+        if self._lease_index is None:
+            return
+        (bucketdir, shnum_s) = os.path.split(share.home)
+        storage_index = si_a2b(os.path.basename(bucketdir).encode("ascii"))
+        self._lease_index.set_share(
+            storage_index, int(shnum_s), self._describe_leases(share))
+
     def get_buckets(self, storage_index):
         """
         Get ``BucketReaders`` for an immutable.
@@ -445,10 +718,36 @@ class StorageServer(service.MultiService):
         bucketreaders = {} # k: sharenum, v: BucketReader
         for shnum, filename in self.get_shares(storage_index):
             bucketreaders[shnum] = BucketReader(self, filename,
-                                                storage_index, shnum)
+                                                storage_index, shnum,
+                                                fd_cache=self._fd_cache)
         self.add_latency("get", self._clock.seconds() - start)
         return bucketreaders
 
+    def get_immutable_share_lengths(self, storage_indexes):
+        """
+        Return a dict mapping each of the given storage indexes to a dict
+        that maps the number of each immutable share held for it to the
+        length of that share's data. Storage indexes with no shares map to
+        an empty dict.
+        """
+        if self._share_index is not None and self._share_index.is_complete():
+            lengths = {}
+            for storage_index in storage_indexes:
+                indexed = self._share_index.get_shares(storage_index)
+                lengths[storage_index] = {
+                    shnum: size
+                    for (shnum, (sharetype, size)) in indexed.items()
+                    if sharetype == "immutable"
+                }
+            return lengths
+        return {
+            storage_index: {
+                shnum: bucket.get_length()
+                for (shnum, bucket) in self.get_buckets(storage_index).items()
+            }
+            for storage_index in storage_indexes
+        }
+
     def get_leases(self, storage_index):
         """Provide an iterator that yields all of the leases attached to this
         bucket. Each lease is returned as a LeaseInfo instance.
@@ -497,17 +796,14 @@ class StorageServer(service.MultiService):
             from integer share numbers to ``MutableShareFile`` instances.
         """
         shares = {}
-        if os.path.isdir(bucketdir):
-            # shares exist if there is a file for them
-            for sharenum_s in os.listdir(bucketdir):
-                try:
-                    sharenum = int(sharenum_s)
-                except ValueError:
-                    continue
-                filename = os.path.join(bucketdir, sharenum_s)
-                msf = MutableShareFile(filename, self)
-                msf.check_write_enabler(write_enabler, si_s)
-                shares[sharenum] = msf
+        # Shares exist if there is a file for them. This is where secrets are
+        # checked and shares are created, so look at the bucket directory
+        # rather than at the share index, which may not have caught up with
+        # it (say, after a crash).
+        for (sharenum, filename) in self._list_share_files(si_a2b(si_s)):
+            msf = MutableShareFile(filename, self)
+            msf.check_write_enabler(write_enabler, si_s)
+            shares[sharenum] = msf
         return shares
 
     def _evaluate_test_vectors(self, test_and_write_vectors, shares):
@@ -622,6 +918,7 @@ class StorageServer(service.MultiService):
         """
         for share in shares:
             share.add_or_renew_lease(self.get_available_space(), lease_info)
+            self._index_share_leases(share)
 
     def slot_testv_and_readv_and_writev(  # type: ignore # warner/foolscap#78
             self,
@@ -648,9 +945,37 @@ class StorageServer(service.MultiService):
         si_s = si_b2a(storage_index)
         log.msg("storage: slot_writev %r" % si_s)
         si_dir = storage_index_to_dir(storage_index)
-        (write_enabler, renew_secret, cancel_secret) = secrets
         bucketdir = os.path.join(self.sharedir, si_dir)
 
+        with self._storage_index_locks.locked(storage_index):
+            testv_is_good, read_data = self._test_read_and_write(
+                bucketdir,
+                si_s,
+                secrets,
+                test_and_write_vectors,
+                read_vector,
+                renew_leases,
+            )
+
+        # all done
+        self.add_latency("writev", self._clock.seconds() - start)
+        return (testv_is_good, read_data)
+
+    def _test_read_and_write(
+            self,
+            bucketdir,
+            si_s,
+            secrets,
+            test_and_write_vectors,
+            read_vector,
+            renew_leases,
+    ):
+        """
+        The body of ``slot_testv_and_readv_and_writev``, to be run with the
+        storage index lock held.
+        """
+        (write_enabler, renew_secret, cancel_secret) = secrets
+
         # If collection succeeds we know the write_enabler is good for all
         # existing shares.
         shares = self._collect_mutable_shares_for_storage_index(
@@ -682,10 +1007,24 @@ class StorageServer(service.MultiService):
             if renew_leases:
                 lease_info = self._make_lease_info(renew_secret, cancel_secret)
                 self._add_or_renew_leases(remaining_shares.values(), lease_info)
-
-        # all done
-        self.add_latency("writev", self._clock.seconds() - start)
-        return (testv_is_good, read_data)
+            if self._share_index is not None:
+                storage_index = si_a2b(si_s)
+                for sharenum in test_and_write_vectors:
+                    if sharenum in remaining_shares:
+                        self._share_index.set_share(
+                            storage_index, sharenum, "mutable",
+                            remaining_shares[sharenum].get_length(),
+                        )
+                    else:
+                        self._share_index.remove_share(storage_index, sharenum)
+            if self._lease_index is not None:
+                for sharenum in test_and_write_vectors:
+                    if sharenum not in remaining_shares:
+                        self._lease_index.remove_share(si_a2b(si_s), sharenum)
+                    elif not renew_leases:
+                        # otherwise it was indexed along with its new lease
+                        self._index_share_leases(remaining_shares[sharenum])
+        return testv_is_good, read_data
 
     def _allocate_slot_share(self, bucketdir, secrets, sharenum,
                              owner_num=0):
@@ -699,18 +1038,8 @@ class StorageServer(service.MultiService):
 
     def enumerate_mutable_shares(self, storage_index: bytes) -> set[int]:
         """Return all share numbers for the given mutable."""
-        si_dir = storage_index_to_dir(storage_index)
         # shares exist if there is a file for them
-        bucketdir = os.path.join(self.sharedir, si_dir)
-        if not os.path.isdir(bucketdir):
-            return set()
-        result = set()
-        for sharenum_s in os.listdir(bucketdir):
-            try:
-                result.add(int(sharenum_s))
-            except ValueError:
-                continue
-        return result
+        return {sharenum for (sharenum, _) in self.get_shares(storage_index)}
 
     def slot_readv(self, storage_index, shares, readv):
         start = self._clock.seconds()
@@ -718,22 +1047,13 @@ class StorageServer(service.MultiService):
         si_s = si_b2a(storage_index)
         lp = log.msg("storage: slot_readv %r %r" % (si_s, shares),
                      facility="tahoe.storage", level=log.OPERATIONAL)
-        si_dir = storage_index_to_dir(storage_index)
-        # shares exist if there is a file for them
-        bucketdir = os.path.join(self.sharedir, si_dir)
-        if not os.path.isdir(bucketdir):
-            self.add_latency("readv", self._clock.seconds() - start)
-            return {}
         datavs = {}
-        for sharenum_s in os.listdir(bucketdir):
-            try:
-                sharenum = int(sharenum_s)
-            except ValueError:
-                continue
-            if sharenum in shares or not shares:
-                filename = os.path.join(bucketdir, sharenum_s)
-                msf = MutableShareFile(filename, self)
-                datavs[sharenum] = msf.readv(readv)
+        with self._storage_index_locks.locked(storage_index):
+            # shares exist if there is a file for them
+            for (sharenum, filename) in self.get_shares(storage_index):
+                if sharenum in shares or not shares:
+                    msf = MutableShareFile(filename, self)
+                    datavs[sharenum] = msf.readv(readv)
         log.msg("returning shares %s" % (list(datavs.keys()),),
                 facility="tahoe.storage", level=log.NOISY, parent=lp)
         self.add_latency("readv", self._clock.seconds() - start)
@@ -811,6 +1131,153 @@ class StorageServer(service.MultiService):
         return MutableShareFile(path).get_length()
 
 
+class AsyncStorageServer:
+    """
+    Run ``StorageServer`` share file operations in the I/O thread pool, so
+    that slow disks don't block the reactor.
+
+    Operations that modify shares or leases of a storage index, and mutable
+    reads, are run one at a time per storage index in the order they were
+    requested.  Immutable reads are not ordered, since immutable share data
+    doesn't change once written.
+
+    Operations that need the reactor (like allocating ``BucketWriter``
+    instances, which schedule timeouts) should still be called directly on
+    the wrapped ``StorageServer``.
+    """
+
+    def __init__(self, reactor: IReactorFromThreads, storage_server: StorageServer):
+        self._reactor = reactor
+        self._server = storage_server
+        # Map storage index to DeferredLock, for ordered operations:
+        self._locks: dict[bytes, DeferredLock] = {}
+
+    async def _run(self, f, *args, **kwargs):
+        return await defer_to_io_thread(self._reactor, f, *args, **kwargs)
+
+    async def _run_ordered(self, storage_index: bytes, f, *args, **kwargs):
+        lock = self._locks.get(storage_index)
+        if lock is None:
+            lock = self._locks[storage_index] = DeferredLock()
+        await lock.acquire()
+        try:
+            return await self._run(f, *args, **kwargs)
+        finally:
+            lock.release()
+            if not lock.locked and not lock.waiting:
+                del self._locks[storage_index]
+
+    async def get_shares(self, storage_index: bytes) -> list[tuple[int, str]]:
+        """See ``StorageServer.get_shares``."""
+        return await self._run(
+            lambda: list(self._server.get_shares(storage_index))
+        )
+
+    async def get_buckets(self, storage_index: bytes) -> dict[int, BucketReader]:
+        """See ``StorageServer.get_buckets``."""
+        return await self._run(self._server.get_buckets, storage_index)
+
+    async def get_immutable_share_lengths(
+        self, storage_indexes: list[bytes]
+    ) -> dict[bytes, dict[int, int]]:
+        """See ``StorageServer.get_immutable_share_lengths``."""
+        return await self._run(
+            self._server.get_immutable_share_lengths, storage_indexes
+        )
+
+    async def read_bucket(self, bucket: BucketReader, offset: int, length: int) -> bytes:
+        """Read data from a ``BucketReader``."""
+        return await self._run(bucket.read, offset, length)
+
+    async def readv_bucket(
+        self, bucket: BucketReader, readv: list[tuple[int, int]]
+    ) -> list[bytes]:
+        """
+        Read each (offset, length) range in ``readv`` from a ``BucketReader``,
+        all in one trip to the I/O thread pool.
+        """
+        return await self._run(
+            lambda: [bucket.read(offset, length) for (offset, length) in readv]
+        )
+
+    async def write_bucket(
+        self, storage_index: bytes, bucket: BucketWriter, offset: int, data: bytes
+    ) -> bool:
+        """
+        Write data to a ``BucketWriter``, return whether the upload is
+        complete.
+        """
+        bucket.delay_timeout()
+        return await self._run_ordered(
+            storage_index, bucket.write_data, offset, data
+        )
+
+    async def add_lease(
+        self, storage_index: bytes, renew_secret: bytes, cancel_secret: bytes
+    ) -> None:
+        """See ``StorageServer.add_lease``."""
+        await self._run_ordered(
+            storage_index,
+            self._server.add_lease,
+            storage_index,
+            renew_secret,
+            cancel_secret,
+        )
+
+    async def add_leases(
+        self, leases: list[tuple[bytes, bytes, bytes]]
+    ) -> list[Union[bool, Exception]]:
+        """
+        See ``StorageServer.add_leases``. The whole batch is applied in one
+        trip to the I/O thread pool; ``StorageServer`` locks each storage
+        index while its leases are written.
+        """
+        return await self._run(self._server.add_leases, leases)
+
+    async def slot_readv(self, storage_index: bytes, shares, readv):
+        """See ``StorageServer.slot_readv``."""
+        return await self._run_ordered(
+            storage_index, self._server.slot_readv, storage_index, shares, readv
+        )
+
+    async def slot_testv_and_readv_and_writev(
+        self, storage_index: bytes, secrets, test_and_write_vectors, read_vector
+    ):
+        """See ``StorageServer.slot_testv_and_readv_and_writev``."""
+        return await self._run_ordered(
+            storage_index,
+            self._server.slot_testv_and_readv_and_writev,
+            storage_index,
+            secrets,
+            test_and_write_vectors,
+            read_vector,
+        )
+
+    async def enumerate_mutable_shares(self, storage_index: bytes) -> set[int]:
+        """See ``StorageServer.enumerate_mutable_shares``."""
+        return await self._run(self._server.enumerate_mutable_shares, storage_index)
+
+    async def get_mutable_share_length(
+        self, storage_index: bytes, share_number: int
+    ) -> int:
+        """See ``StorageServer.get_mutable_share_length``."""
+        return await self._run(
+            self._server.get_mutable_share_length, storage_index, share_number
+        )
+
+    async def advise_corrupt_share(
+        self, share_type: bytes, storage_index: bytes, shnum: int, reason: bytes
+    ) -> None:
+        """See ``StorageServer.advise_corrupt_share``."""
+        await self._run(
+            self._server.advise_corrupt_share,
+            share_type,
+            storage_index,
+            shnum,
+            reason,
+        )
+
+
 @implementer(RIStorageServer)
 class FoolscapStorageServer(Referenceable):  # type: ignore # warner/foolscap#78
     """
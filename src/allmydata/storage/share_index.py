@@ -0,0 +1,270 @@
+"""
+An optional index of the shares held by a storage server.
+
+Without it, every lookup lists the bucket directory of the storage index
+involved, and the bucket counter walks every prefix directory. With it,
+lookups are answered from a SQLite database that maps each storage index to
+its share numbers, the type of each share and the length of its data.
+
+The storage server keeps the index up to date as shares are created,
+written and deleted, and ``ShareIndexCrawler`` goes through every bucket on
+disk to (re)build it. Until one full crawl has finished since the database
+was created, the index is incomplete and the server does not use it.
+
+Shares are written to disk before the index is updated, and the database
+does not sync every change. So if the server stops without closing the
+index (a crash or a power failure), the index may be missing shares. In
+that case it is marked incomplete when the server starts again, and rebuilt
+by the next crawl.
+"""
+
+from __future__ import annotations
+
+import struct
+import threading
+
+from allmydata.storage.common import si_a2b
+from allmydata.storage.crawler import ShareCrawler, BucketCountingCrawler
+from allmydata.util import dbutil
+
+SHARE_INDEX_SCHEMA_V1 = """
+CREATE TABLE version
+(
+ version INTEGER  -- contains one row, set to 1
+);
+
+CREATE TABLE shares
+(
+ storage_index BLOB NOT NULL,
+ shnum INTEGER NOT NULL,
+ sharetype TEXT NOT NULL,  -- "immutable" or "mutable"
+ size INTEGER NOT NULL,    -- the length of the share data
+ PRIMARY KEY (storage_index, shnum)
+);
+
+CREATE TABLE rebuild
+(
+ cycle INTEGER,            -- the crawler cycle that is rebuilding the index
+ complete INTEGER NOT NULL,
+ in_use INTEGER NOT NULL   -- 1 from when a server opens the index until it
+                           -- closes it
+);
+
+INSERT INTO rebuild (cycle, complete, in_use) VALUES (NULL, 0, 0);
+"""
+
+
+def _prefix_bounds(prefix: str) -> tuple[bytes, bytes | None]:
+    """
+    Return the range of storage indexes (lower bound inclusive, upper bound
+    exclusive or None) whose base32 form starts with the two-character
+    ``prefix``, which stands for their first 10 bits.
+    """
+    first = si_a2b((prefix + "a" * 24).encode("ascii"))[:2]
+    (value,) = struct.unpack(">H", first)
+    value += 1 << (16 - 10)
+    if value >= 2**16:
+        return (first, None)
+    return (first, struct.pack(">H", value))
+
+
+class ShareIndex:
+    """
+    I map storage indexes to the shares held for them. Every method may be
+    called from any thread.
+    """
+
+    def __init__(self, dbfile: str):
+        (self._sqlite, self._db) = dbutil.get_db(
+            dbfile, create_version=(SHARE_INDEX_SCHEMA_V1, 1),
+            dbname="share index", check_same_thread=False,
+        )
+        # The index can always be rebuilt, so trade durability for speed.
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._lock = threading.Lock()
+        (self._bucket_count,) = self._db.execute(
+            "SELECT COUNT(DISTINCT storage_index) FROM shares").fetchone()
+        with self._db:
+            # Not closed by the last server to use it: start over.
+            self._db.execute(
+                "UPDATE rebuild SET cycle = NULL, complete = 0"
+                " WHERE in_use = 1")
+            self._db.execute("UPDATE rebuild SET in_use = 1")
+        # That must be on disk before any share the index might miss is.
+        self._db.execute("PRAGMA wal_checkpoint(FULL)")
+        (complete,) = self._db.execute(
+            "SELECT complete FROM rebuild").fetchone()
+        self._complete = bool(complete)
+
+    def close(self) -> None:
+        """
+        Record that the index is up to date with the shares on disk, and
+        close it.
+        """
+        with self._lock:
+            with self._db:
+                self._db.execute("UPDATE rebuild SET in_use = 0")
+            self._db.execute("PRAGMA wal_checkpoint(FULL)")
+            self._db.close()
+
+    def is_complete(self) -> bool:
+        """
+        Return whether the index has been fully built, so that it can be used
+        instead of looking at the share directories.
+        """
+        return self._complete
+
+    def rebuild_started(self, cycle: int) -> None:
+        """
+        Crawler cycle ``cycle`` is starting. If the index is incomplete and
+        not already being rebuilt, it will be complete once that cycle ends.
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE rebuild SET cycle = ? WHERE complete = 0"
+                " AND cycle IS NULL", (cycle,))
+
+    def rebuild_finished(self, cycle: int) -> None:
+        """
+        Crawler cycle ``cycle`` has visited every bucket.
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE rebuild SET complete = 1 WHERE cycle = ?", (cycle,))
+            (complete,) = self._db.execute(
+                "SELECT complete FROM rebuild").fetchone()
+            self._complete = bool(complete)
+
+    def get_shares(self, storage_index: bytes) -> dict[int, tuple[str, int]]:
+        """
+        Return a dict mapping the number of each share held for
+        ``storage_index`` to a (sharetype, size) tuple.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT shnum, sharetype, size FROM shares"
+                " WHERE storage_index = ? ORDER BY shnum",
+                (storage_index,)).fetchall()
+        return {shnum: (sharetype, size) for (shnum, sharetype, size) in rows}
+
+    def get_bucket_count(self) -> int:
+        """
+        Return the number of storage indexes with at least one share.
+        """
+        return self._bucket_count
+
+    def _has_bucket(self, storage_index: bytes) -> bool:
+        return self._db.execute(
+            "SELECT 1 FROM shares WHERE storage_index = ? LIMIT 1",
+            (storage_index,)).fetchone() is not None
+
+    def set_share(self, storage_index: bytes, shnum: int, sharetype: str,
+                  size: int) -> None:
+        """
+        Record that a share exists, or has changed size.
+        """
+        with self._lock, self._db:
+            if not self._has_bucket(storage_index):
+                self._bucket_count += 1
+            self._db.execute(
+                "INSERT OR REPLACE INTO shares"
+                " (storage_index, shnum, sharetype, size) VALUES (?,?,?,?)",
+                (storage_index, shnum, sharetype, size))
+
+    def remove_share(self, storage_index: bytes, shnum: int) -> None:
+        """
+        Record that a share no longer exists.
+        """
+        with self._lock, self._db:
+            if not self._has_bucket(storage_index):
+                return
+            self._db.execute(
+                "DELETE FROM shares WHERE storage_index = ? AND shnum = ?",
+                (storage_index, shnum))
+            if not self._has_bucket(storage_index):
+                self._bucket_count -= 1
+
+    def set_bucket(self, storage_index: bytes,
+                   shares: dict[int, tuple[str, int]]) -> None:
+        """
+        Replace everything recorded about ``storage_index`` with ``shares``,
+        a dict like the one returned by ``get_shares``.
+        """
+        with self._lock, self._db:
+            if self._has_bucket(storage_index):
+                self._bucket_count -= 1
+            self._db.execute("DELETE FROM shares WHERE storage_index = ?",
+                             (storage_index,))
+            self._db.executemany(
+                "INSERT INTO shares (storage_index, shnum, sharetype, size)"
+                " VALUES (?,?,?,?)",
+                [(storage_index, shnum, sharetype, size)
+                 for (shnum, (sharetype, size)) in shares.items()])
+            if shares:
+                self._bucket_count += 1
+
+    def prune_prefix(self, prefix: str, storage_indexes: set[bytes]) -> None:
+        """
+        Forget every storage index whose base32 form starts with ``prefix``
+        except those in ``storage_indexes``, the buckets that exist on disk.
+        """
+        (lower, upper) = _prefix_bounds(prefix)
+        query = "SELECT DISTINCT storage_index FROM shares WHERE storage_index >= ?"
+        args: tuple[bytes, ...] = (lower,)
+        if upper is not None:
+            query += " AND storage_index < ?"
+            args += (upper,)
+        with self._lock, self._db:
+            stale = [
+                storage_index
+                for (storage_index,) in self._db.execute(query, args).fetchall()
+                if storage_index not in storage_indexes
+            ]
+            self._db.executemany(
+                "DELETE FROM shares WHERE storage_index = ?",
+                [(storage_index,) for storage_index in stale])
+            self._bucket_count -= len(stale)
+
+
+class ShareIndexCrawler(BucketCountingCrawler):
+    """
+    I count buckets like a BucketCountingCrawler, and also bring the share
+    index up to date with every bucket I visit. The first cycle that starts
+    after the index is created completes it.
+    """
+
+    def __init__(self, server, statefile, share_index: ShareIndex,
+                 num_sample_prefixes=1):
+        self._share_index = share_index
+        BucketCountingCrawler.__init__(self, server, statefile,
+                                       num_sample_prefixes)
+
+    @property
+    def minimum_cycle_time(self):  # type: ignore[override]
+        # Once the index is complete the storage server keeps it up to date,
+        # so later cycles only repair drift (say, after a crash).
+        if self._share_index.is_complete():
+            return 24*60*60
+        return 60*60
+
+    def started_cycle(self, cycle):
+        self._share_index.rebuild_started(cycle)
+
+    def process_prefixdir(self, cycle, prefix, prefixdir, buckets, start_slice):
+        BucketCountingCrawler.process_prefixdir(self, cycle, prefix, prefixdir,
+                                                buckets, start_slice)
+        self._share_index.prune_prefix(
+            prefix,
+            {si_a2b(bucket.encode("ascii")) for bucket in buckets},
+        )
+        # visit each bucket, in time slices
+        ShareCrawler.process_prefixdir(self, cycle, prefix, prefixdir,
+                                       buckets, start_slice)
+
+    def process_bucket(self, cycle, prefix, prefixdir, storage_index_b32):
+        self.server.bucket_changed(si_a2b(storage_index_b32.encode("ascii")))
+
+    def finished_cycle(self, cycle):
+        BucketCountingCrawler.finished_cycle(self, cycle)
+        self._share_index.rebuild_finished(cycle)
@@ -1427,6 +1427,9 @@ class _StorageServer:
             cancel_secret,
         )
 
+    def add_leases(self, leases):
+        return [self.add_lease(*lease) for lease in leases]
+
     def get_buckets(
             self,
             storage_index,
@@ -1505,6 +1508,16 @@ class _FakeRemoteReference:
             raise RemoteException((e.code, e.message, e.body))
 
 
+@attr.s(hash=True)
+class _HTTPBucketReaderReference(_FakeRemoteReference):
+    """
+    A ``_FakeRemoteReference`` to an ``_HTTPBucketReader``.  Besides
+    ``callRemote("read", offset, length)``, this supports
+    ``callRemote("readv", [(offset, length), ...])``.
+    """
+    supports_read_vectors = True
+
+
 @attr.s
 class _HTTPBucketWriter:
     """
@@ -1550,16 +1563,71 @@ def _ignore_404(failure: Failure) -> Optional[Failure]:
 class _HTTPBucketReader:
     """
     Emulate a ``RIBucketReader``, but use HTTP protocol underneath.
+
+    Unlike a Foolscap bucket reader, this can also read several ranges at
+    once; see ``readv``.
     """
     client = attr.ib(type=StorageClientImmutables)
     storage_index = attr.ib(type=bytes)
     share_number = attr.ib(type=int)
+    # The _HTTPStorageServer we came from, which knows whether the server
+    # supports read vectors:
+    storage_server = attr.ib(default=None, eq=False)
+    # The length of the share, if the server told us when listing shares.
+    # Reads are clipped to it, and reads past it need no request at all.
+    share_length: Optional[int] = attr.ib(default=None, eq=False)
+
+    def _clip(self, offset: int, length: int) -> int:
+        """
+        Return how much of the range can be read from the share.
+        """
+        if self.share_length is None:
+            return length
+        return max(0, min(length, self.share_length - offset))
 
     def read(self, offset, length):
+        length = self._clip(offset, length)
+        if length == 0:
+            return defer.succeed(b"")
         return self.client.read_share_chunk(
             self.storage_index, self.share_number, offset, length
         )
 
+    @async_to_deferred
+    async def readv(self, readv: list[tuple[int, int]]) -> list[bytes]:
+        """
+        Read each (offset, length) range in ``readv``, in one request if the
+        server supports that.
+        """
+        clipped = [(offset, self._clip(offset, length))
+                   for (offset, length) in readv]
+        wanted = [(offset, length) for (offset, length) in clipped if length]
+        if len(wanted) < len(clipped):
+            data = iter(await self.readv(wanted) if wanted else [])
+            return [next(data) if length else b""
+                    for (offset, length) in clipped]
+        server = self.storage_server
+        if server is not None and server._read_vectors:
+            try:
+                return await self.client.read_share_chunks(
+                    self.storage_index, self.share_number, readv
+                )
+            except HTTPClientException as e:
+                if e.code != http.NOT_FOUND:
+                    raise
+                # Either an older server, or the share is gone. Reading the
+                # ranges one at a time tells us which.
+        try:
+            datav = await defer.gatherResults(
+                [self.read(offset, length) for (offset, length) in readv],
+                consumeErrors=True,
+            )
+        except defer.FirstError as e:
+            e.subFailure.raiseException()
+        if server is not None:
+            server._read_vectors = False
+        return datav
+
     def advise_corrupt_share(self, reason):
        return self.client.advise_corrupt_share(
            self.storage_index, self.share_number,
@@ -1576,6 +1644,27 @@ class _HTTPStorageServer:
     """
     _http_client = attr.ib(type=StorageClient)
 
+    # get_buckets() calls made in the same reactor turn are answered by a
+    # single batched request. These are the storage indexes (and their
+    # waiting Deferreds) for the next batch:
+    _pending_share_lookups: dict[
+        bytes, list[defer.Deferred[dict[int, Optional[int]]]]
+    ] = attr.ib(init=False, factory=dict)
+    # Set to False if the server turns out not to support batched lookups:
+    _batch_share_lookups = attr.ib(init=False, default=True)
+    # Set to False if the server turns out not to support reading several
+    # ranges of an immutable share in one request:
+    _read_vectors = attr.ib(init=False, default=True)
+    # add_lease() and add_leases() calls are sent in batches too: those
+    # made while a batch is being sent go into the next one. These are the
+    # leases (and their waiting Deferreds) for the next batch:
+    _pending_leases: list[
+        tuple[bytes, bytes, bytes, defer.Deferred[None]]
+    ] = attr.ib(init=False, factory=list)
+    _sending_leases = attr.ib(init=False, default=False)
+    # Set to False if the server turns out not to support batched leases:
+    _batch_leases = attr.ib(init=False, default=True)
+
     @staticmethod
     def from_http_client(http_client: StorageClient) -> _HTTPStorageServer:
         """
@@ -1621,18 +1710,156 @@ class _HTTPStorageServer:
             storage_index
     ):
         immutable_client = StorageClientImmutables(self._http_client)
-        share_numbers = yield immutable_client.list_shares(
-            storage_index
-        )
+        shares = yield self._list_shares(storage_index)
         defer.returnValue({
-            share_num: _FakeRemoteReference(_HTTPBucketReader(
-                immutable_client, storage_index, share_num
+            share_num: _HTTPBucketReaderReference(_HTTPBucketReader(
+                immutable_client, storage_index, share_num, self, length
             ))
-            for share_num in share_numbers
+            for (share_num, length) in shares.items()
         })
 
+    def _list_shares(
+        self, storage_index: bytes
+    ) -> defer.Deferred[dict[int, Optional[int]]]:
+        """
+        List the immutable shares for a storage index, batched together with
+        any other lookups made in the same reactor turn. The result maps each
+        share number to the share's length, or to ``None`` if the server did
+        not say.
+        """
+        if not self._batch_share_lookups:
+            return self._list_shares_unbatched(storage_index)
+        if not self._pending_share_lookups:
+            eventually(self._send_share_lookups)
+        d: defer.Deferred[dict[int, Optional[int]]] = defer.Deferred()
+        self._pending_share_lookups.setdefault(storage_index, []).append(d)
+        return d
+
+    def _list_shares_unbatched(
+        self, storage_index: bytes
+    ) -> defer.Deferred[dict[int, Optional[int]]]:
+        d = StorageClientImmutables(self._http_client).list_shares(
+            storage_index
+        )
+        d.addCallback(lambda share_numbers: dict.fromkeys(share_numbers))
+        return d
+
+    @async_to_deferred
+    async def _send_share_lookups(self) -> None:
+        pending = self._pending_share_lookups
+        self._pending_share_lookups = {}
+        immutable_client = StorageClientImmutables(self._http_client)
+        storage_indexes = list(pending)
+        results: dict[bytes, Union[dict[int, Optional[int]], Failure]] = {}
+        if len(storage_indexes) > 1:
+            for i in range(0, len(storage_indexes), 1024):
+                chunk = storage_indexes[i:i + 1024]
+                try:
+                    batch = await immutable_client.list_shares_batch(chunk)
+                except ClientException as e:
+                    if e.code == http.NOT_FOUND:
+                        # An older server: fall back to one request per
+                        # storage index, now and from now on.
+                        self._batch_share_lookups = False
+                        break
+                    f = Failure()
+                    results.update((storage_index, f) for storage_index in chunk)
+                except Exception:
+                    f = Failure()
+                    results.update((storage_index, f) for storage_index in chunk)
+                else:
+                    for storage_index, lengths in batch.items():
+                        results[storage_index] = dict(lengths)
+
+        def fire(result, waiters):
+            for d in waiters:
+                if isinstance(result, Failure):
+                    d.errback(result)
+                else:
+                    d.callback(result)
+
+        for storage_index in storage_indexes:
+            waiters = pending[storage_index]
+            if storage_index in results:
+                fire(results[storage_index], waiters)
+            else:
+                lookup = self._list_shares_unbatched(storage_index)
+                lookup.addBoth(fire, waiters)
+
+    def add_lease(
+        self,
+        storage_index,
+        renew_secret,
+        cancel_secret
+    ):
+        [d] = self.add_leases([(storage_index, renew_secret, cancel_secret)])
+        return d
+
+    def add_leases(
+        self,
+        leases: list[tuple[bytes, bytes, bytes]],
+    ) -> list[defer.Deferred[None]]:
+        if not self._batch_leases:
+            return [self._add_lease(*lease) for lease in leases]
+        ds: list[defer.Deferred[None]] = []
+        for (storage_index, renew_secret, cancel_secret) in leases:
+            d: defer.Deferred[None] = defer.Deferred()
+            self._pending_leases.append(
+                (storage_index, renew_secret, cancel_secret, d)
+            )
+            ds.append(d)
+        if ds and not self._sending_leases:
+            self._sending_leases = True
+            eventually(self._send_leases)
+        return ds
+
+    @async_to_deferred
+    async def _send_leases(self) -> None:
+        client = StorageClientGeneral(self._http_client)
+        try:
+            while self._pending_leases:
+                batch = self._pending_leases[:1024]
+                del self._pending_leases[:1024]
+                if not self._batch_leases:
+                    for (storage_index, renew_secret, cancel_secret, d) in batch:
+                        self._add_lease(
+                            storage_index, renew_secret, cancel_secret
+                        ).chainDeferred(d)
+                    continue
+                try:
+                    results = await client.add_or_renew_leases(
+                        [lease[:3] for lease in batch]
+                    )
+                except ClientException as e:
+                    if e.code == http.NOT_FOUND:
+                        # An older server: fall back to one request per
+                        # lease, now and from now on.
+                        self._batch_leases = False
+                        self._pending_leases[:0] = batch
+                        continue
+                    f = Failure()
+                    for lease in batch:
+                        lease[3].errback(f)
+                except Exception:
+                    f = Failure()
+                    for lease in batch:
+                        lease[3].errback(f)
+                else:
+                    for (lease, result) in zip(batch, results):
+                        if result == "error":
+                            lease[3].errback(ClientException(
+                                http.INTERNAL_SERVER_ERROR,
+                                "Adding the lease failed",
+                            ))
+                        else:
+                            # A storage index with no shares is silently
+                            # ignored, as is the case for the Foolscap client
+                            lease[3].callback(None)
+        finally:
+            self._sending_leases = False
+
     @async_to_deferred
-    async def add_lease(
+    async def _add_lease(
         self,
         storage_index,
         renew_secret,
@@ -839,6 +839,16 @@ class FakeMutableFileNode(object):  # type: ignore # incomplete implementation
             return new
         return self.modify(modifier)
 
+    def update_ranges(self, ranges):
+        assert not self.is_readonly()
+        def modifier(old, servermap, first_time):
+            new = old
+            for (offset, data) in ranges:
+                changed = new[:offset] + b"".join(data.read(data.get_size()))
+                new = changed + new[len(changed):]
+            return new
+        return self.modify(modifier)
+
 
     def read(self, consumer, offset=0, size=None):
         data = self._download_best_version()
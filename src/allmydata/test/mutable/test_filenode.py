@@ -8,6 +8,7 @@ from ..common import AsyncBrokenTestCase
 from testtools.matchers import (
     Equals,
     Contains,
+    GreaterThan,
     HasLength,
     Is,
     IsInstance,
@@ -385,6 +386,44 @@ class Filenode(AsyncBrokenTestCase, testutil.ShouldFailMixin):
         return d
 
 
+    async def _assert_one_round_trip(self, version):
+        """
+        Download a small file twice, each time through a new node. The first
+        download has to go back to the servers for more of the shares; the
+        second sends each server a single query.
+        """
+        contents = b"small directory" * 1000
+        node = await self.nodemaker.create_mutable_file(
+            MutableData(contents), version=version)
+        cap = node.get_uri()
+        del node
+        queries = []
+        for i in range(2):
+            for peer in self._peers:
+                peer.storage_server.queries = 0
+            node = self.nodemaker.create_from_cap(cap)
+            self.assertThat(await node.download_best_version(),
+                            Equals(contents))
+            queries.append(max(peer.storage_server.queries
+                               for peer in self._peers))
+        self.assertThat(queries[0], GreaterThan(1))
+        self.assertThat(queries[1], Equals(1))
+
+    async def test_small_sdmf_one_round_trip(self):
+        """
+        Once the size of its shares is known, a small SDMF file is downloaded
+        with a single query to each server.
+        """
+        await self._assert_one_round_trip(SDMF_VERSION)
+
+    async def test_small_mdmf_one_round_trip(self):
+        """
+        Once the size of its shares is known, a small MDMF file is downloaded
+        with a single query to each server.
+        """
+        await self._assert_one_round_trip(MDMF_VERSION)
+
+
     def test_mdmf_write_count(self):
         """
         Publishing an MDMF file causes exactly one write for each share that is to
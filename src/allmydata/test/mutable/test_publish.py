@@ -0,0 +1,89 @@
+"""
+Tests for pipelined segment pushing in ``allmydata.mutable.publish``.
+"""
+
+from ..common import AsyncTestCase
+from testtools.matchers import Equals, LessThan
+from allmydata.monitor import Monitor
+from allmydata.mutable.common import MODE_WRITE, NotEnoughServersError
+from allmydata.mutable.publish import Publish, MutableData
+from allmydata.mutable.servermap import ServerMap, ServermapUpdater
+from allmydata.util.deferredutil import async_to_deferred
+from .util import PublishMixin
+from .. import common_util as testutil
+
+
+class PipelinedPush(AsyncTestCase, testutil.ShouldFailMixin, PublishMixin):
+    def setUp(self):
+        super(PipelinedPush, self).setUp()
+        return self.publish_mdmf()
+
+    async def _make_publish(self, depth):
+        servermap = await ServermapUpdater(
+            self._fn, self._storage_broker, Monitor(), ServerMap(), MODE_WRITE
+        ).update()
+        p = Publish(self._fn, self._storage_broker, servermap)
+        p._pipeline_depth = depth
+        # Keep track of how many segments are being encoded at once.
+        p.encoding = 0
+        p.max_encoding = 0
+        p.encoded = []
+        encode_segment = p._encode_segment
+        async def _encode_segment(segnum):
+            p.encoding += 1
+            p.max_encoding = max(p.max_encoding, p.encoding)
+            try:
+                return await encode_segment(segnum)
+            finally:
+                p.encoding -= 1
+                p.encoded.append(segnum)
+        p._encode_segment = async_to_deferred(_encode_segment)
+        return p
+
+    @async_to_deferred
+    async def test_pipelined(self):
+        """
+        Several segments are encoded at once, up to the pipeline depth, and
+        the result downloads correctly.
+        """
+        new_contents = b"Some new MDMF contents" * 50000
+        p = await self._make_publish(3)
+        await p.publish(MutableData(new_contents))
+        self.assertThat(p.max_encoding, Equals(3))
+        self.assertThat(sorted(p.encoded), Equals(list(range(p.num_segments))))
+        data = await self._fn.download_best_version()
+        self.assertThat(data, Equals(new_contents))
+
+    @async_to_deferred
+    async def test_unpipelined(self):
+        """
+        With a depth of 1, segments are encoded one at a time.
+        """
+        new_contents = b"Other new MDMF contents" * 50000
+        p = await self._make_publish(1)
+        await p.publish(MutableData(new_contents))
+        self.assertThat(p.max_encoding, Equals(1))
+        data = await self._fn.download_best_version()
+        self.assertThat(data, Equals(new_contents))
+
+    @async_to_deferred
+    async def test_lost_writers(self):
+        """
+        If we drop below k writers while pushing segments, the publish fails
+        with NotEnoughServersError without encoding the rest of the file.
+        """
+        p = await self._make_publish(2)
+        push_segment = p._push_segment
+        def _push_segment(encoded_and_salt, segnum):
+            d = push_segment(encoded_and_salt, segnum)
+            if segnum == 1:
+                for shnum in list(p.writers)[p.required_shares - 1:]:
+                    del p.writers[shnum]
+            return d
+        p._push_segment = _push_segment
+        await self.shouldFail(
+            NotEnoughServersError, "test_lost_writers", None,
+            p.publish, MutableData(b"Doomed MDMF contents" * 50000),
+        )
+        self.assertThat(max(p.encoded), LessThan(4))
+        self.assertThat(p.num_segments, Equals(8))
@@ -2,15 +2,24 @@
 Ported to Python 3.
 """
 
-from ..common import AsyncTestCase
-from testtools.matchers import Equals, NotEquals, HasLength
+from ..common import AsyncTestCase, SyncTestCase
+from testtools.matchers import Equals, GreaterThan, NotEquals, HasLength
 from twisted.internet import defer
+from foolscap.api import flushEventualQueue
 from allmydata.monitor import Monitor
 from allmydata.mutable.common import \
      MODE_CHECK, MODE_ANYTHING, MODE_WRITE, MODE_READ
 from allmydata.mutable.publish import MutableData
 from allmydata.mutable.servermap import ServerMap, ServermapUpdater
-from .util import PublishMixin
+from allmydata.mutable.sizehints import ShareSizeHints
+from allmydata.share_locations import ShareLocationCache
+from allmydata.util.iothreadpool import disable_io_thread_pool_for_test
+from .util import (
+    FakeStorage,
+    PublishMixin,
+    make_nodemaker_with_peers,
+    make_peer,
+)
 
 class Servermap(AsyncTestCase, PublishMixin):
     def setUp(self):
@@ -79,6 +88,32 @@ class Servermap(AsyncTestCase, PublishMixin):
 
         return d
 
+    def test_share_size_hints(self):
+        """
+        A servermap update records the share size of the best version, and
+        the next update fetches whole shares.
+        """
+        hints = self._fn.get_share_size_hints()
+        storage_index = self._fn.get_storage_index()
+        d = self.make_servermap(MODE_READ)
+        def _check_first(sm):
+            self.assertTrue(all(not reader.has_whole_share()
+                                for reader in sm.proxies.values()))
+            eof = dict(sm.best_recoverable_version()[-1])["EOF"]
+            self.assertThat(eof, GreaterThan(4000))
+            self.assertThat(hints.get_read_size(storage_index),
+                            GreaterThan(eof))
+            return self.make_servermap(MODE_READ)
+        d.addCallback(_check_first)
+        def _check_second(sm):
+            self.assertThat(sm.proxies, HasLength(6))
+            self.assertTrue(all(reader.has_whole_share()
+                                for reader in sm.proxies.values()))
+        d.addCallback(_check_second)
+        # let the answers of the servers we stopped waiting for arrive
+        d.addCallback(flushEventualQueue)
+        return d
+
     def test_fetch_privkey(self):
         d = defer.succeed(None)
         # use the sibling filenode (which hasn't been used yet), and make
@@ -238,3 +273,127 @@ class Servermap(AsyncTestCase, PublishMixin):
         d.addCallback(lambda servermap:
             self.assertThat(servermap.recoverable_versions(), HasLength(1)))
         return d
+
+
+class ShareSizeHintsTests(SyncTestCase):
+    """
+    Tests for ``ShareSizeHints``.
+    """
+
+    def test_read_size(self):
+        """
+        Files that have not been seen, or whose shares are too big, are read
+        with the default read size. Other files are read whole, with room to
+        grow.
+        """
+        hints = ShareSizeHints(max_read_size=100000)
+        self.assertThat(hints.get_read_size(b"a" * 16), Equals(4000))
+        hints.record(b"a" * 16, 500)
+        self.assertThat(hints.get_read_size(b"a" * 16), Equals(4000))
+        self.assertThat(hints.get_read_size(b"a" * 16, 1000), Equals(1500))
+        hints.record(b"a" * 16, 40000)
+        self.assertThat(hints.get_read_size(b"a" * 16), Equals(45000))
+        hints.record(b"a" * 16, 99999)
+        self.assertThat(hints.get_read_size(b"a" * 16), Equals(100000))
+        hints.record(b"a" * 16, 100000)
+        self.assertThat(hints.get_read_size(b"a" * 16), Equals(4000))
+
+    def test_evict(self):
+        """
+        Only the most recently used files are remembered.
+        """
+        hints = ShareSizeHints(max_entries=2)
+        hints.record(b"a" * 16, 10000)
+        hints.record(b"b" * 16, 10000)
+        hints.get_read_size(b"a" * 16)
+        hints.record(b"c" * 16, 10000)
+        self.assertThat(hints.get_read_size(b"a" * 16), Equals(11250))
+        self.assertThat(hints.get_read_size(b"b" * 16), Equals(4000))
+        self.assertThat(hints.get_read_size(b"c" * 16), Equals(11250))
+
+
+class ShareLocationCacheTests(AsyncTestCase):
+    """
+    Tests for the use of a ``ShareLocationCache`` by ``ServermapUpdater``.
+    """
+
+    def setUp(self):
+        super(ShareLocationCacheTests, self).setUp()
+        disable_io_thread_pool_for_test(self)
+        self._storage = FakeStorage()
+        self._peers = [make_peer(self._storage, i) for i in range(30)]
+        self._nodemaker = make_nodemaker_with_peers(self._peers)
+        self._cache = ShareLocationCache(self.mktemp(), 100)
+        self.addCleanup(self._cache.close)
+        self._nodemaker.share_location_cache = self._cache
+
+    def _move_shares_to_the_end(self, storage_index):
+        """
+        Move the shares from the first servers in the permuted order to the
+        last ones, so that finding them the usual way takes many queries.
+        """
+        permuted = [server.get_serverid() for server in
+                    self._nodemaker.storage_broker.get_servers_for_psi(
+                        storage_index)]
+        holders = [peerid for peerid in permuted
+                   if self._storage._peers.get(peerid)]
+        new_holders = permuted[-len(holders):]
+        for (old, new) in zip(holders, new_holders):
+            self._storage._peers[new] = self._storage._peers.pop(old)
+        return set(new_holders)
+
+    def _count_queries(self):
+        queries = sum(peer.storage_server.queries for peer in self._peers)
+        for peer in self._peers:
+            peer.storage_server.queries = 0
+        return queries
+
+    @defer.inlineCallbacks
+    def test_write_update(self):
+        """
+        Publishing records where the shares went. A MODE_WRITE update asks the
+        servers the cache lists first, and stops once it has found every share
+        of the cached version there.
+        """
+        node = yield self._nodemaker.create_mutable_file(
+            MutableData(b"contents" * 100))
+        storage_index = node.get_storage_index()
+        self.assertThat(self._cache.get(storage_index).servers, HasLength(10))
+        self.assertThat(self._cache.get(storage_index).seqnum, Equals(1))
+
+        holders = self._move_shares_to_the_end(storage_index)
+        self._cache.forget(storage_index)
+        self._count_queries()
+        sm = yield node.get_servermap(MODE_WRITE)
+        cold_queries = self._count_queries()
+        self.assertThat(sm.recoverable_versions(), HasLength(1))
+        self.assertThat(self._cache.get(storage_index).servers,
+                        Equals(holders))
+        self.assertThat(self._cache.get(storage_index).seqnum, Equals(1))
+
+        sm = yield node.get_servermap(MODE_WRITE)
+        warm_queries = self._count_queries()
+        self.assertThat(sm.recoverable_versions(), HasLength(1))
+        self.assertThat(sm.shares_available()[sm.best_recoverable_version()],
+                        Equals((10, 3, 10)))
+        self.assertThat(cold_queries, GreaterThan(10))
+        self.assertThat(warm_queries, Equals(10))
+        yield flushEventualQueue()
+
+    @defer.inlineCallbacks
+    def test_stale_locations(self):
+        """
+        If the shares are no longer where the cache says, a MODE_WRITE update
+        looks for them the usual way and corrects the cache.
+        """
+        node = yield self._nodemaker.create_mutable_file(
+            MutableData(b"contents" * 100))
+        storage_index = node.get_storage_index()
+        holders = self._move_shares_to_the_end(storage_index)
+
+        sm = yield node.get_servermap(MODE_WRITE)
+        self.assertThat(sm.shares_available()[sm.best_recoverable_version()],
+                        Equals((10, 3, 10)))
+        self.assertThat(self._cache.get(storage_index).servers,
+                        Equals(holders))
+        yield flushEventualQueue()
@@ -11,8 +11,10 @@ from testtools.matchers import (
 )
 from twisted.internet import defer
 from allmydata.interfaces import MDMF_VERSION
-from allmydata.mutable.filenode import MutableFileNode
-from allmydata.mutable.publish import MutableData, DEFAULT_MUTABLE_MAX_SEGMENT_SIZE
+from allmydata.mutable.common import UncoordinatedWriteError
+from allmydata.mutable.filenode import MutableFileNode, MutableFileVersion
+from allmydata.mutable.publish import MutableData, DEFAULT_MUTABLE_MAX_SEGMENT_SIZE, \
+     Publish
 from ..no_network import GridTestMixin
 from .. import common_util as testutil
 
@@ -243,3 +245,147 @@ class Update(GridTestMixin, AsyncTestCase, testutil.ShouldFailMixin):
             return d
         d0.addCallback(_run)
         return d0
+
+    def _update_ranges(self, ranges):
+        """
+        Write ``ranges`` to the MDMF file with one update_ranges call,
+        recording the segments that were encoded.
+        """
+        encoded = []
+        original_encode = Publish._encode_segment
+        def _encode_segment(publish, segnum):
+            encoded.append(segnum)
+            return original_encode(publish, segnum)
+        d = self.do_upload_mdmf()
+        d.addCallback(lambda ign: self.patch(Publish, "_encode_segment",
+                                             _encode_segment))
+        d.addCallback(lambda ign: self.mdmf_node.get_best_mutable_version())
+        d.addCallback(lambda mv: mv.update_ranges(
+            [(offset, MutableData(data)) for (offset, data) in ranges]))
+        d.addCallback(lambda ign: self.mdmf_node.download_best_version())
+        d.addCallback(lambda results: (results, encoded))
+        return d
+
+    def test_update_ranges(self):
+        # Ranges at either end of the file are published together, without
+        # re-encoding the segments in between.
+        end = len(self.data) - 5
+        new_data = (self.data[:10] + b"first" + self.data[15:end] +
+                    b"last and appended")
+        d = self._update_ranges([(10, b"first"), (end, b"last and appended")])
+        def _check(results_and_encoded):
+            (results, encoded) = results_and_encoded
+            self.assertThat(results, Equals(new_data))
+            self.assertThat(encoded, Equals([0, 3]))
+        d.addCallback(_check)
+        return d
+
+    def test_update_ranges_same_segment(self):
+        # Several ranges can touch the same segment, and a range can cross a
+        # segment boundary.
+        new_data = bytearray(self.data)
+        new_data[SEGSIZE - 3:SEGSIZE + 3] = b"across"
+        new_data[SEGSIZE + 10:SEGSIZE + 11] = b"x"
+        new_data[SEGSIZE + 11:SEGSIZE + 12] = b"y"
+        d = self._update_ranges([(SEGSIZE - 3, b"across"),
+                                 (SEGSIZE + 10, b"x"),
+                                 (SEGSIZE + 11, b"y")])
+        def _check(results_and_encoded):
+            (results, encoded) = results_and_encoded
+            self.assertThat(results, Equals(bytes(new_data)))
+            self.assertThat(encoded, Equals([0, 1]))
+        d.addCallback(_check)
+        return d
+
+    def test_update_ranges_sdmf(self):
+        new_data = b"TEST" + self.small_data[4:] + b"appended"
+        d0 = self.do_upload_sdmf()
+        def _run(ign):
+            d = defer.succeed(None)
+            d.addCallback(lambda ign: self.sdmf_node.get_best_mutable_version())
+            d.addCallback(lambda mv: mv.update_ranges([
+                (0, MutableData(b"TEST")),
+                (len(self.small_data), MutableData(b"appended")),
+            ]))
+            d.addCallback(lambda ign: self.sdmf_node.download_best_version())
+            d.addCallback(lambda results:
+                          self.assertThat(results, Equals(new_data)))
+            return d
+        d0.addCallback(_run)
+        return d0
+
+    def _modify_mdmf(self, modifier, backoffer=None):
+        """
+        Apply ``modifier`` to the MDMF file, recording whether the whole file
+        had to be published again.
+        """
+        uploads = []
+        original_upload = MutableFileVersion._upload
+        def _upload(version, new_contents):
+            uploads.append(new_contents.get_size())
+            return original_upload(version, new_contents)
+        self.patch(MutableFileVersion, "_upload", _upload)
+        d = self.do_upload_mdmf()
+        d.addCallback(lambda ign: self.mdmf_node.modify(modifier, backoffer))
+        d.addCallback(lambda ign: self.mdmf_node.download_best_version())
+        d.addCallback(lambda results: (results, uploads))
+        return d
+
+    def test_modify_in_place(self):
+        # Modifying the tail of an MDMF file only rewrites the segments
+        # that changed, instead of publishing the whole file again.
+        new_data = self.data[:-100] + b"modified" * 100
+        d = self._modify_mdmf(lambda old, servermap, first_time: new_data)
+        def _check(results_and_uploads):
+            (results, uploads) = results_and_uploads
+            self.assertThat(results, Equals(new_data))
+            self.assertThat(uploads, Equals([]))
+        d.addCallback(_check)
+        return d
+
+    def test_modify_shrink(self):
+        # A modification that makes the file smaller is published in full.
+        new_data = self.data[:-100]
+        d = self._modify_mdmf(lambda old, servermap, first_time: new_data)
+        def _check(results_and_uploads):
+            (results, uploads) = results_and_uploads
+            self.assertThat(results, Equals(new_data))
+            self.assertThat(uploads, Equals([len(new_data)]))
+        d.addCallback(_check)
+        return d
+
+    def test_modify_first_segment(self):
+        # A modification of the first segment is published in full.
+        new_data = b"modified" + self.data[len(b"modified"):]
+        d = self._modify_mdmf(lambda old, servermap, first_time: new_data)
+        def _check(results_and_uploads):
+            (results, uploads) = results_and_uploads
+            self.assertThat(results, Equals(new_data))
+            self.assertThat(uploads, Equals([len(new_data)]))
+        d.addCallback(_check)
+        return d
+
+    def test_modify_retry(self):
+        # The retry after an UncoordinatedWriteError publishes the whole file
+        # rather than updating in place from a version that may no longer be
+        # current.
+        new_data = self.data[:-100] + b"modified" * 100
+        updates = []
+        original_update = MutableFileVersion._update
+        def _update(version, data, offset):
+            updates.append(offset)
+            if len(updates) == 1:
+                return defer.fail(UncoordinatedWriteError("simulated"))
+            return original_update(version, data, offset)
+        self.patch(MutableFileVersion, "_update", _update)
+        def _backoff(node, f):
+            return None
+        d = self._modify_mdmf(lambda old, servermap, first_time: new_data,
+                              _backoff)
+        def _check(results_and_uploads):
+            (results, uploads) = results_and_uploads
+            self.assertThat(results, Equals(new_data))
+            self.assertThat(len(updates), Equals(1))
+            self.assertThat(uploads, Equals([len(new_data)]))
+        d.addCallback(_check)
+        return d
@@ -46,6 +46,7 @@ from allmydata.util import fileutil, idlib, hashutil
 from allmydata.util.hashutil import permute_server_hash
 from allmydata.util.fileutil import abspath_expanduser_unicode
 from allmydata.interfaces import IStorageBroker, IServer
+from allmydata.stats import LatencyHistogram
 from allmydata.storage_client import (
     _StorageServer,
 )
@@ -296,12 +297,16 @@ class _NoNetworkClient(_Client):  # type: ignore  # tahoe-lafs/ticket/3573
 class SimpleStats:
     def __init__(self):
         self.counters = {}
+        self.histograms = {}
         self.stats_producers = []
 
     def count(self, name, delta=1):
         val = self.counters.setdefault(name, 0)
         self.counters[name] = val + delta
 
+    def add_latency(self, name, latency):
+        self.histograms.setdefault(name, LatencyHistogram()).add(latency)
+
     def register_producer(self, stats_producer):
         self.stats_producers.append(stats_producer)
 
@@ -309,7 +314,12 @@ class SimpleStats:
         stats = {}
         for sp in self.stats_producers:
             stats.update(sp.get_stats())
-        ret = { 'counters': self.counters, 'stats': stats }
+        histograms = {
+            name: histogram.get_stats()
+            for (name, histogram) in self.histograms.items()
+        }
+        ret = { 'counters': self.counters, 'stats': stats,
+                'histograms': histograms }
         return ret
 
 class NoNetworkGrid(service.MultiService):
@@ -29,6 +29,7 @@ from eliot.testing import (
 from twisted.trial import unittest
 from twisted.application import service
 from twisted.internet import defer
+from twisted.internet.task import Clock
 from twisted.python.filepath import (
     FilePath,
 )
@@ -56,6 +57,10 @@ from allmydata.nodemaker import (
 )
 from allmydata.node import OldConfigError, UnescapedHashError, create_node_dir
 from allmydata import client
+from allmydata.immutable.encode import PipelineLimits
+from allmydata.immutable.downloader.segcache import SegmentCache
+from allmydata.dirnode import DirectoryCache
+from allmydata.share_locations import ShareLocationCache
 from allmydata.storage_client import (
     StorageClientConfig,
     StorageFarmBroker,
@@ -396,6 +401,169 @@ class Basic(testutil.ReallyEqualMixin, unittest.TestCase):
         with self.assertRaises(ValueError):
             yield client.create_client(basedir)
 
+    @defer.inlineCallbacks
+    def test_upload_pipeline(self):
+        """
+        upload.pipeline_depth and upload.pipeline_max_bytes are propagated to
+        the uploader.
+        """
+        basedir = "client.Basic.test_upload_pipeline"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG +
+                       "upload.pipeline_depth = 4\n" +
+                       "upload.pipeline_max_bytes = 10MiB\n")
+        c = yield client.create_client(basedir)
+        self.assertEqual(
+            c.getServiceNamed("uploader")._encoder_pipeline,
+            PipelineLimits(depth=4, max_bytes=10*1024*1024),
+        )
+
+    @defer.inlineCallbacks
+    def test_upload_pipeline_bad(self):
+        """
+        upload.pipeline_max_bytes produces errors on non-numbers
+        """
+        basedir = "client.Basic.test_upload_pipeline_bad"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG +
+                       "upload.pipeline_max_bytes = bogus\n")
+        with self.assertRaises(ValueError):
+            yield client.create_client(basedir)
+
+    @defer.inlineCallbacks
+    def test_readahead(self):
+        """
+        download.readahead_max_bytes is propagated to the nodemaker.
+        """
+        basedir = "client.Basic.test_readahead"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), BASECONFIG)
+        c = yield client.create_client(basedir)
+        self.assertIs(c.nodemaker.readahead_max_bytes, None)
+
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG +
+                       "download.readahead_max_bytes = 4MiB\n")
+        c = yield client.create_client(basedir)
+        self.assertEqual(c.nodemaker.readahead_max_bytes, 4*1024*1024)
+
+    @defer.inlineCallbacks
+    def test_segment_cache(self):
+        """
+        download.segment_cache_size enables a segment cache in the private
+        directory; it is disabled by default.
+        """
+        basedir = "client.Basic.test_segment_cache"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), BASECONFIG)
+        c = yield client.create_client(basedir)
+        self.assertIs(c.nodemaker.segment_cache, None)
+
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG +
+                       "download.segment_cache_size = 10MB\n")
+        c = yield client.create_client(basedir)
+        self.assertIsInstance(c.nodemaker.segment_cache, SegmentCache)
+        self.assertTrue(
+            os.path.isdir(os.path.join(basedir, "private", "segment-cache")))
+
+    @defer.inlineCallbacks
+    def test_directory_cache(self):
+        """
+        The directory cache is enabled by default, and can be resized or
+        disabled with dirnode.cache_children.
+        """
+        basedir = "client.Basic.test_directory_cache"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), BASECONFIG)
+        c = yield client.create_client(basedir)
+        self.assertIsInstance(c.nodemaker.directory_cache, DirectoryCache)
+
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG +
+                       "dirnode.cache_children = 0\n")
+        c = yield client.create_client(basedir)
+        self.assertIs(c.nodemaker.directory_cache, None)
+
+    @defer.inlineCallbacks
+    def test_share_location_cache(self):
+        """
+        share_locations.max_entries enables a share location cache in the
+        private directory; it is disabled by default.
+        """
+        basedir = "client.Basic.test_share_location_cache"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), BASECONFIG)
+        c = yield client.create_client(basedir)
+        self.assertIs(c.nodemaker.share_location_cache, None)
+
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG +
+                       "share_locations.max_entries = 1000\n")
+        c = yield client.create_client(basedir)
+        cache = c.nodemaker.share_location_cache
+        self.addCleanup(cache.close)
+        self.assertIsInstance(cache, ShareLocationCache)
+        self.assertTrue(os.path.exists(
+            os.path.join(basedir, "private", "share-locations.sqlite")))
+
+        # stopping the client writes the cache and closes it
+        self.assertIs(cache.parent, c)
+        cache.record(b"a" * 16, [b"server1"])
+        yield cache.stopService()
+        self.assertTrue(cache._closed)
+        reloaded = ShareLocationCache(
+            os.path.join(basedir, "private", "share-locations.sqlite"), 1000)
+        self.addCleanup(reloaded.close)
+        self.assertEqual(reloaded.get(b"a" * 16).servers, {b"server1"})
+
+    @defer.inlineCallbacks
+    def test_keypair_pool(self):
+        """
+        keypair_pool.size enables a pool of pre-generated keypairs, which
+        the nodemaker draws from and which reports stats.
+        """
+        basedir = "client.Basic.test_keypair_pool"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), BASECONFIG)
+        c = yield client.create_client(basedir)
+        self.assertIsInstance(c.nodemaker.key_generator, client.KeyGenerator)
+
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG +
+                       "keypair_pool.size = 4\n"
+                       "keypair_pool.refill_concurrency = 2\n")
+        c = yield client.create_client(basedir)
+        pool = c.nodemaker.key_generator
+        self.assertIsInstance(pool, client.KeyPool)
+        self.failUnlessReallyEqual(pool._low_water, 2)
+        self.failUnlessReallyEqual(pool._concurrency, 2)
+        self.failUnlessReallyEqual(
+            c.stats_provider.get_stats()["stats"]["keypair_pool.available"],
+            0)
+
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG +
+                       "keypair_pool.size = 4\n"
+                       "keypair_pool.low_water = 5\n")
+        with self.assertRaises(ValueError):
+            yield client.create_client(basedir)
+
+    @defer.inlineCallbacks
+    def test_segment_cache_bad(self):
+        """
+        download.segment_cache_size produces errors on non-numbers
+        """
+        basedir = "client.Basic.test_segment_cache_bad"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG +
+                       "download.segment_cache_size = bogus\n")
+        with self.assertRaises(ValueError):
+            yield client.create_client(basedir)
+
     @defer.inlineCallbacks
     def test_web_apiauthtoken(self):
         """
@@ -984,6 +1152,91 @@ class Run(unittest.TestCase, testutil.StallMixin):
         c2.setServiceParent(self.sparent)
         yield c2.disownServiceParent()
 
+class FakeKeyGenerator:
+    """
+    Produce numbered keypairs, each one when its Deferred is fired.
+    """
+    def __init__(self):
+        self.pending = []
+        self.count = 0
+
+    def generate(self):
+        d = defer.Deferred()
+        self.pending.append(d)
+        return d
+
+    def finish(self):
+        for d in self.pending[:]:
+            self.pending.remove(d)
+            self.count += 1
+            d.callback(("public%d" % (self.count,), "private%d" % (self.count,)))
+
+
+class KeyPoolTests(testutil.ReallyEqualMixin, unittest.TestCase):
+    """
+    Tests for ``KeyPool``.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.generator = FakeKeyGenerator()
+        self.pool = client.KeyPool(self.generator, 4, 2, concurrency=2,
+                                   clock=self.clock)
+        self.pool.startService()
+        self.addCleanup(self.pool.stopService)
+
+    def _fill(self):
+        self.clock.advance(client.KeyPool.IDLE_DELAY)
+        while self.generator.pending:
+            self.generator.finish()
+
+    def test_fill(self):
+        """
+        The pool fills up once idle, with a bounded number of keypairs being
+        generated at once, and hands them out without generating more.
+        """
+        self.failUnlessReallyEqual(self.generator.pending, [])
+        self.clock.advance(client.KeyPool.IDLE_DELAY)
+        self.failUnlessReallyEqual(len(self.generator.pending), 2)
+        self._fill()
+        self.failUnlessReallyEqual(self.generator.count, 4)
+        results = []
+        self.pool.generate().addCallback(results.append)
+        self.failUnlessReallyEqual(results, [("public1", "private1")])
+        self.failUnlessReallyEqual(self.generator.pending, [])
+        stats = self.pool.get_stats()
+        self.failUnlessReallyEqual(stats["keypair_pool.available"], 3)
+        self.failUnlessReallyEqual(stats["keypair_pool.hits"], 1)
+
+    def test_low_water(self):
+        """
+        Refilling starts once fewer than low_water keypairs are left, after
+        the pool has not been used for a while, and continues until it is
+        full.
+        """
+        self._fill()
+        self.pool.generate()
+        self.pool.generate()
+        self.clock.advance(client.KeyPool.IDLE_DELAY)
+        self.failUnlessReallyEqual(self.generator.pending, [])
+        self.pool.generate()
+        self.clock.advance(client.KeyPool.IDLE_DELAY / 2)
+        self.pool.generate()
+        self.clock.advance(client.KeyPool.IDLE_DELAY / 2)
+        self.failUnlessReallyEqual(self.generator.pending, [])
+        self._fill()
+        self.failUnlessReallyEqual(self.pool.get_stats()["keypair_pool.available"], 4)
+
+    def test_empty(self):
+        """
+        An empty pool generates keypairs on demand.
+        """
+        results = []
+        self.pool.generate().addCallback(results.append)
+        self.generator.finish()
+        self.failUnlessReallyEqual(results, [("public1", "private1")])
+        self.failUnlessReallyEqual(self.pool.get_stats()["keypair_pool.misses"], 1)
+
+
 class NodeMakerTests(testutil.ReallyEqualMixin, AsyncBrokenTestCase):
 
     def _make_node_maker(self, mode, writecap, deep_immutable):
@@ -20,6 +20,8 @@ from allmydata.interfaces import ICheckResults, ICheckAndRepairResults, \
      IDeepCheckResults, IDeepCheckAndRepairResults
 from allmydata.monitor import Monitor, OperationCancelledError
 from allmydata.uri import LiteralFileURI
+from allmydata.storage.shares import get_share_file
+from allmydata.storage_client import _StorageServer
 
 from allmydata.test.common import ErrorMixin, _corrupt_mutable_share_data, \
      ShouldFailMixin
@@ -1217,3 +1219,51 @@ class Large(DeepCheckBase, unittest.TestCase):
         d.addCallback(_check)
 
         return d
+
+
+class DeepAddLease(DeepCheckBase, unittest.TestCase):
+    @inlineCallbacks
+    def test_batches(self):
+        """
+        A deep-check with ``add_lease=True`` sends each server one batch
+        with a lease for every file and directory that it holds shares
+        of, rather than one ``add_lease`` message per node.
+        """
+        self.basedir = "deepcheck/DeepAddLease/batches"
+        self.set_up_grid(num_clients=2)
+        COUNT = 30
+        c0 = self.g.clients[0]
+        root = yield c0.create_dirnode()
+        subdir = yield root.create_subdirectory(u"subdir")
+        for i in range(COUNT):
+            data = b"%03d large enough for CHK" % i * 10
+            yield subdir.add_file(u"%03d" % i, upload.Data(data, b""))
+        mutable = yield c0.create_mutable_file(MutableData(b"mutable"))
+        yield root.set_node(u"mutable", mutable)
+
+        batches = []
+        def _add_leases(storage_server, leases):
+            batches.append(len(leases))
+            return original_add_leases(storage_server, leases)
+        original_add_leases = _StorageServer.add_leases
+        self.patch(_StorageServer, "add_leases", _add_leases)
+        # Foolscap has no batched message, so add_leases() sends each lease
+        # with add_lease(). Nothing else should.
+        singles = []
+        def _add_lease(storage_server, *args):
+            singles.append(args)
+            return original_add_lease(storage_server, *args)
+        original_add_lease = _StorageServer.add_lease
+        self.patch(_StorageServer, "add_lease", _add_lease)
+
+        # A second client has different lease secrets, so it adds a new
+        # lease to every share.
+        c1 = self.g.clients[1]
+        root1 = c1.create_node_from_uri(root.get_uri())
+        yield root1.start_deep_check(add_lease=True).when_done()
+
+        nodes = COUNT + 3 # root, subdir, the files, mutable
+        self.assertEqual(batches, [nodes] * len(self.g.servers_by_number))
+        self.assertEqual(len(singles), sum(batches))
+        for (shnum, serverid, fn) in self.find_uri_shares(mutable.get_uri()):
+            self.assertEqual(len(list(get_share_file(fn).get_leases())), 2)
@@ -9,8 +9,10 @@ from zope.interface import implementer
 from twisted.trial import unittest
 from twisted.internet import defer
 from twisted.internet.interfaces import IConsumer
+from twisted.internet.task import Clock
+from foolscap.api import fireEventually
 from twisted.python.filepath import FilePath
-from allmydata import uri, dirnode
+from allmydata import uri, dirnode, deep_traverse
 from allmydata.client import _Client
 from allmydata.crypto.rsa import create_signing_keypair
 from allmydata.immutable import upload
@@ -25,9 +27,10 @@ from allmydata.mutable.common import (
     UncoordinatedWriteError,
     derive_mutable_keys,
 )
-from allmydata.util import hashutil, base32
+from allmydata.util import hashutil, base32, fileutil
+from allmydata.util.iothreadpool import disable_io_thread_pool_for_test
 from allmydata.util.netstring import split_netstring
-from allmydata.monitor import Monitor
+from allmydata.monitor import Monitor, OperationCancelledError
 from allmydata.test.common import make_chk_file_uri, make_mutable_file_uri, \
      ErrorMixin
 from allmydata.test.mutable.util import (
@@ -1866,6 +1869,469 @@ class DeepStats(testutil.ReallyEqualMixin, unittest.TestCase):
                                      (3162277660169, 10000000000000, 1),
                                      ])
 
+class PausingManifestWalker(dirnode.ManifestWalker):
+    """
+    A walker whose add_node() only completes when the test says so.
+    """
+    def __init__(self, origin):
+        dirnode.ManifestWalker.__init__(self, origin)
+        self.pending = []
+        self.max_pending = 0
+
+    def add_node(self, node, path):
+        dirnode.ManifestWalker.add_node(self, node, path)
+        d = defer.Deferred()
+        self.pending.append(d)
+        self.max_pending = max(self.max_pending, len(self.pending))
+        return d
+
+    @defer.inlineCallbacks
+    def run(self):
+        """
+        Complete add_node() calls, oldest first, until the traversal is done.
+        """
+        while not self.monitor.is_finished():
+            while self.pending:
+                self.pending.pop(0).callback(None)
+            yield fireEventually()
+
+
+class DeepTraverse(GridTestMixin, testutil.ReallyEqualMixin, unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def _create_tree(self):
+        """
+        Create a tree of 15 directories and 30 LIT files, with one directory
+        linked twice, returning the root and the set of expected paths.
+        """
+        c = self.g.clients[0]
+        root = yield c.create_dirnode()
+        expected = {()}
+        for i in range(3):
+            name = u"dir%d" % (i,)
+            parent = yield root.create_subdirectory(name)
+            expected.add((name,))
+            for j in range(4):
+                subname = u"sub%d" % (j,)
+                subdir = yield parent.create_subdirectory(subname)
+                expected.add((name, subname))
+                for k in range(2 + j % 2):
+                    litcap = uri.LiteralFileURI(b"data%d" % (k,)).to_string()
+                    filename = u"file%d" % (k,)
+                    yield subdir.set_uri(filename, litcap, litcap)
+                    expected.add((name, subname, filename))
+        # a second link to dir0 is not followed
+        yield root.set_node(u"alias", parent)
+        defer.returnValue((root, expected))
+
+    @defer.inlineCallbacks
+    def test_concurrency(self):
+        """
+        Up to ``concurrency`` walker operations are in flight at once, and
+        every node is visited exactly once.
+        """
+        self.basedir = "dirnode/DeepTraverse/test_concurrency"
+        self.set_up_grid(oneshare=True)
+        (root, expected) = yield self._create_tree()
+        walker = PausingManifestWalker(root)
+        monitor = root.deep_traverse(walker, concurrency=4)
+        yield walker.run()
+        result = yield monitor.when_done()
+        self.failUnlessReallyEqual(walker.max_pending, 4)
+        paths = [path for (path, cap) in result["manifest"]]
+        self.failUnlessReallyEqual(len(paths), len(expected))
+        self.failUnlessReallyEqual(set(paths), expected)
+        self.failUnlessReallyEqual(result["stats"]["count-directories"], 16)
+
+    @defer.inlineCallbacks
+    def test_spill(self):
+        """
+        Spilling the frontier to disk does not change which nodes are
+        visited, or in which order.
+        """
+        self.basedir = "dirnode/DeepTraverse/test_spill"
+        self.set_up_grid(oneshare=True)
+        (root, expected) = yield self._create_tree()
+        in_memory = yield root.deep_traverse(
+            dirnode.ManifestWalker(root), concurrency=1,
+        ).when_done()
+        spilled = yield root.deep_traverse(
+            dirnode.ManifestWalker(root), concurrency=1, max_in_memory=2,
+        ).when_done()
+        self.failUnlessReallyEqual(
+            set(path for (path, cap) in in_memory["manifest"]), expected)
+        self.failUnlessReallyEqual(spilled["manifest"], in_memory["manifest"])
+
+    @defer.inlineCallbacks
+    def test_spill_encrypted(self):
+        """
+        The caps in the spilled frontier are encrypted on disk.
+        """
+        self.basedir = "dirnode/DeepTraverse/test_spill_encrypted"
+        self.set_up_grid(oneshare=True)
+        (root, expected) = yield self._create_tree()
+        # so the spill file is still there when the traversal is done
+        disable_io_thread_pool_for_test(self)
+        ondisk = []
+        EncryptedTemporaryFile = fileutil.EncryptedTemporaryFile
+        class RecordingFile(EncryptedTemporaryFile):
+            def close(self):
+                self.file.seek(0)
+                ondisk.append(self.file.read())
+                EncryptedTemporaryFile.close(self)
+        self.patch(fileutil, "EncryptedTemporaryFile", RecordingFile)
+        yield root.deep_traverse(
+            dirnode.ManifestWalker(root), concurrency=1, max_in_memory=2,
+        ).when_done()
+        self.failUnlessReallyEqual(len(ondisk), 1)
+        self.failUnless(ondisk[0])
+        self.failIfIn(b"URI:", ondisk[0])
+
+    @defer.inlineCallbacks
+    def test_spill_in_io_thread(self):
+        """
+        The spilled frontier is written and read back in the I/O thread pool,
+        and a failure to read it back fails the traversal.
+        """
+        self.basedir = "dirnode/DeepTraverse/test_spill_in_io_thread"
+        self.set_up_grid(oneshare=True)
+        (root, expected) = yield self._create_tree()
+        calls = []
+        real_defer_to_io_thread = deep_traverse.defer_to_io_thread
+        async def defer_to_io_thread(reactor, f, *args):
+            calls.append(f.__name__)
+            if f.__name__ == "_read" and calls.count("_read") == 2:
+                raise IOError("disk failed")
+            return await real_defer_to_io_thread(reactor, f, *args)
+        self.patch(deep_traverse, "defer_to_io_thread", defer_to_io_thread)
+        yield self.assertFailure(root.deep_traverse(
+            dirnode.ManifestWalker(root), concurrency=1, max_in_memory=2,
+        ).when_done(), IOError)
+        self.failUnlessIn("_write", calls)
+
+    @defer.inlineCallbacks
+    def test_cancel(self):
+        """
+        Cancelling the monitor stops the traversal once the operations in
+        flight have finished.
+        """
+        self.basedir = "dirnode/DeepTraverse/test_cancel"
+        self.set_up_grid(oneshare=True)
+        (root, expected) = yield self._create_tree()
+        walker = PausingManifestWalker(root)
+        monitor = root.deep_traverse(walker, concurrency=2)
+        # let the root be listed, then cancel while its children are busy
+        walker.pending.pop(0).callback(None)
+        while not walker.pending:
+            yield fireEventually()
+        monitor.cancel()
+        yield walker.run()
+        yield self.assertFailure(monitor.when_done(), OperationCancelledError)
+        self.failUnless(len(walker.manifest) < len(expected))
+
+
+class DirectoryCacheTests(testutil.ReallyEqualMixin, unittest.TestCase):
+    """
+    Tests for ``DirectoryCache``.
+    """
+    def _children(self, *names):
+        return dirnode.LazyChildren(
+            lambda name, entry: (name, {"tahoe": {"linkcrtime": 1}}),
+            {name: name.encode("ascii") for name in names},
+        )
+
+    def test_version(self):
+        """
+        Children are only returned for the version they were stored with,
+        and as a copy that the caller may modify.
+        """
+        cache = dirnode.DirectoryCache(10, clock=Clock())
+        cache.put(b"si", True, (1, b"root"), self._children(u"a", u"b"))
+        self.assertIs(cache.get(b"si", True, (2, b"root")), None)
+        self.assertIs(cache.get(b"si", False, (1, b"root")), None)
+        children = cache.get(b"si", True, (1, b"root"))
+        self.failUnlessReallyEqual(sorted(children), [u"a", u"b"])
+        self.failUnlessReallyEqual(children.get_aux(u"a"), b"a")
+        children[u"a"][1]["tahoe"]["linkcrtime"] = 2
+        del children[u"b"]
+        again = cache.get(b"si", True, (1, b"root"))
+        self.failUnlessReallyEqual(sorted(again), [u"a", u"b"])
+        self.failUnlessReallyEqual(again[u"a"][1]["tahoe"]["linkcrtime"], 1)
+
+    def test_eviction(self):
+        """
+        The least recently used directories are dropped once the cache holds
+        too many children.
+        """
+        cache = dirnode.DirectoryCache(7, clock=Clock())
+        cache.put(b"si1", True, None, self._children(u"a", u"b"))
+        cache.put(b"si2", True, None, self._children(u"a", u"b"))
+        cache.get(b"si1", True, None)
+        cache.put(b"si3", True, None, self._children(u"a"))
+        self.assertIsNot(cache.get(b"si1", True, None), None)
+        self.assertIs(cache.get(b"si2", True, None), None)
+        self.assertIsNot(cache.get(b"si3", True, None), None)
+        # too big to be cached at all
+        cache.put(b"si4", True, None, self._children(*u"abcdefg"))
+        self.assertIs(cache.get(b"si4", True, None), None)
+
+    def test_readonly_ttl(self):
+        """
+        Read-only directories can be used without a version check until
+        ``readonly_ttl`` seconds after they were last validated.
+        """
+        clock = Clock()
+        cache = dirnode.DirectoryCache(10, readonly_ttl=5, clock=clock)
+        cache.put(b"si", False, (1, b"root"), self._children(u"a"))
+        cache.put(b"si", True, (1, b"root"), self._children(u"a"))
+        clock.advance(4)
+        self.assertIsNot(cache.get_recent(b"si"), None)
+        clock.advance(1)
+        self.assertIs(cache.get_recent(b"si"), None)
+        # a successful version check makes it fresh again
+        cache.get(b"si", False, (1, b"root"))
+        self.assertIsNot(cache.get_recent(b"si"), None)
+        cache.invalidate(b"si")
+        self.assertIs(cache.get_recent(b"si"), None)
+        self.assertIs(cache.get(b"si", True, (1, b"root")), None)
+
+    def test_readonly_ttl_disabled(self):
+        """
+        Without a ``readonly_ttl`` every read is checked.
+        """
+        cache = dirnode.DirectoryCache(10, clock=Clock())
+        cache.put(b"si", False, (1, b"root"), self._children(u"a"))
+        self.assertIs(cache.get_recent(b"si"), None)
+
+
+class CachedDirnode(GridTestMixin, testutil.ReallyEqualMixin, unittest.TestCase):
+    """
+    Tests for reading directories through the directory cache.
+    """
+
+    @defer.inlineCallbacks
+    def test_reuse(self):
+        """
+        Reading an unchanged directory again returns the same child nodes.
+        """
+        self.basedir = "dirnode/CachedDirnode/test_reuse"
+        self.set_up_grid(oneshare=True)
+        c = self.g.clients[0]
+        self.assertIsNot(c.nodemaker.directory_cache, None)
+        n = yield c.create_dirnode()
+        yield n.create_subdirectory(u"sub")
+        first = yield n.list()
+        second = yield n.list()
+        self.assertIs(first[u"sub"][0], second[u"sub"][0])
+        self.assertIsNot(first, second)
+
+    @defer.inlineCallbacks
+    def test_changed_elsewhere(self):
+        """
+        Changes made through another client are seen by the next read.
+        """
+        self.basedir = "dirnode/CachedDirnode/test_changed_elsewhere"
+        self.set_up_grid(num_clients=2, oneshare=True)
+        c0 = self.g.clients[0]
+        c1 = self.g.clients[1]
+        n0 = yield c0.create_dirnode()
+        yield n0.list()
+        n1 = c1.create_node_from_uri(n0.get_uri())
+        yield n1.create_subdirectory(u"sub")
+        children = yield n0.list()
+        self.failUnlessReallyEqual(list(children), [u"sub"])
+        self.failUnless(n0.get_size() > 0)
+
+
+class IncrementalModify(GridTestMixin, testutil.ReallyEqualMixin, unittest.TestCase):
+    """
+    Modifying a directory only decodes and re-packs the children involved.
+    """
+
+    @defer.inlineCallbacks
+    def _create(self):
+        self.set_up_grid(oneshare=True)
+        c = self.g.clients[0]
+        kids = {}
+        for i in range(10):
+            litcap = uri.LiteralFileURI(b"data%d" % (i,)).to_string()
+            kids[u"file%d" % (i,)] = (c.create_node_from_uri(litcap), {})
+        n = yield c.create_dirnode(kids)
+        old_contents = yield n._node.download_best_version()
+        unpacked = []
+        original_unpack_entry = n._unpack_entry
+        def _unpack_entry(name, entry):
+            unpacked.append(name)
+            return original_unpack_entry(name, entry)
+        n._unpack_entry = _unpack_entry
+        defer.returnValue((n, old_contents, unpacked))
+
+    @defer.inlineCallbacks
+    def _check_unchanged(self, n, old_contents, names):
+        new_contents = yield n._node.download_best_version()
+        old_entries = n._index_contents(old_contents)
+        new_entries = n._index_contents(new_contents)
+        for name in names:
+            self.failUnlessReallyEqual(new_entries[name], old_entries[name])
+
+    @defer.inlineCallbacks
+    def test_add(self):
+        self.basedir = "dirnode/IncrementalModify/test_add"
+        (n, old_contents, unpacked) = yield self._create()
+        litcap = uri.LiteralFileURI(b"new").to_string()
+        yield n.set_uri(u"new", litcap, litcap)
+        self.failUnlessReallyEqual(unpacked, [])
+        yield self._check_unchanged(n, old_contents,
+                                    [u"file%d" % (i,) for i in range(10)])
+        children = yield n.list()
+        self.failUnlessReallyEqual(len(children), 11)
+
+    @defer.inlineCallbacks
+    def test_replace(self):
+        self.basedir = "dirnode/IncrementalModify/test_replace"
+        (n, old_contents, unpacked) = yield self._create()
+        litcap = uri.LiteralFileURI(b"new").to_string()
+        yield n.set_uri(u"file3", litcap, litcap)
+        self.failUnlessReallyEqual(unpacked, [u"file3"])
+        yield self._check_unchanged(n, old_contents,
+                                    [u"file%d" % (i,) for i in range(10) if i != 3])
+        child = yield n.get(u"file3")
+        self.failUnlessReallyEqual(child.get_uri(), litcap)
+
+    @defer.inlineCallbacks
+    def test_delete_and_set_metadata(self):
+        self.basedir = "dirnode/IncrementalModify/test_delete_and_set_metadata"
+        (n, old_contents, unpacked) = yield self._create()
+        yield n.delete(u"file1")
+        yield n.set_metadata_for(u"file2", {"key": "value"})
+        self.failUnlessReallyEqual(unpacked, [u"file1", u"file2"])
+        yield self._check_unchanged(n, old_contents,
+                                    [u"file%d" % (i,) for i in range(3, 10)])
+        children = yield n.list()
+        self.failIf(u"file1" in children)
+        self.failUnlessReallyEqual(children[u"file2"][1]["key"], "value")
+
+
+class LazyChildrenTests(testutil.ReallyEqualMixin, unittest.TestCase):
+    """
+    Tests for ``LazyChildren``.
+    """
+    def setUp(self):
+        self.decoded = []
+        entries = {name: name.encode("ascii") for name in u"abcd"}
+        self.children = dirnode.LazyChildren(self._unpack_entry, entries)
+
+    def _unpack_entry(self, name, entry):
+        self.decoded.append(name)
+        if name == u"c":
+            # unusable
+            return None
+        return (name, {"entry": entry})
+
+    def test_lookup(self):
+        """
+        Looking up a child only decodes that child, once.
+        """
+        self.failUnlessReallyEqual(self.children[u"b"], (u"b", {"entry": b"b"}))
+        self.failUnless(u"b" in self.children)
+        self.failIf(u"e" in self.children)
+        self.assertRaises(KeyError, lambda: self.children[u"e"])
+        self.failUnlessReallyEqual(self.decoded, [u"b"])
+
+    def test_unusable(self):
+        """
+        Unusable entries are left out.
+        """
+        self.failIf(u"c" in self.children)
+        self.assertRaises(KeyError, lambda: self.children[u"c"])
+        self.failUnlessReallyEqual(list(self.children), [u"a", u"b", u"d"])
+        self.failUnlessReallyEqual(len(self.children), 3)
+        self.failUnlessReallyEqual(self.children.count_entries(), 4)
+
+    def test_modify(self):
+        """
+        Changed children lose their packed entry, unchanged ones keep it.
+        """
+        self.children[u"a"] = (u"new", {})
+        del self.children[u"b"]
+        self.children[u"e"] = (u"e", {})
+        self.failUnlessReallyEqual(self.children.get_aux(u"a"), None)
+        self.failUnlessReallyEqual(self.children.get_aux(u"d"), b"d")
+        self.failUnlessReallyEqual(sorted(self.children), [u"a", u"d", u"e"])
+        self.failUnlessReallyEqual(self.children[u"a"], (u"new", {}))
+        self.failIf(u"a" in self.decoded)
+
+    def test_stream_items(self):
+        """
+        ``stream_items`` produces the same children as ``items`` without
+        keeping them, and decoding is shared between copies.
+        """
+        copied = self.children.copy()
+        streamed = list(self.children.stream_items())
+        self.failUnlessReallyEqual(self.decoded, [u"a", u"b", u"c", u"d"])
+        list(self.children.stream_items())
+        self.failUnlessReallyEqual(len(self.decoded), 8)
+        self.failUnlessReallyEqual(sorted(copied.items()), streamed)
+        self.failUnlessReallyEqual(len(self.decoded), 12)
+        list(self.children.items())
+        list(self.children.stream_items())
+        self.failUnlessReallyEqual(len(self.decoded), 12)
+        copied[u"a"][1]["entry"] = b"changed"
+        self.failUnlessReallyEqual(self.children[u"a"][1]["entry"], b"a")
+
+    def test_get(self):
+        """
+        Getting a child of a real directory only decodes that child.
+        """
+        nm = NodeMaker(None, None, None, None, None, {"k": 3, "n": 10}, None,
+                       None)
+        n = nm.create_from_cap(b"URI:DIR2-LIT:")
+        kids = {}
+        for i in range(5):
+            litcap = uri.LiteralFileURI(b"data%d" % (i,)).to_string()
+            kids[u"file%d" % (i,)] = (nm.create_from_cap(litcap), {})
+        children = n._unpack_contents(dirnode.pack_children(kids, None))
+        unpacked = []
+        original_unpack_entry = n._unpack_entry
+        def _unpack_entry(name, entry):
+            unpacked.append(name)
+            return original_unpack_entry(name, entry)
+        children._unpack_entry = _unpack_entry
+        (child, metadata) = children[u"file3"]
+        self.failUnlessReallyEqual(
+            child.get_uri(), uri.LiteralFileURI(b"data3").to_string())
+        self.failUnlessReallyEqual(unpacked, [u"file3"])
+
+
+    def test_pack(self):
+        """
+        Packing copies the unmodified children of a real directory through
+        without decoding them.
+        """
+        nm = NodeMaker(None, None, None, None, None, {"k": 3, "n": 10}, None,
+                       None)
+        kids = {}
+        for i in range(5):
+            litcap = uri.LiteralFileURI(b"data%d" % (i,)).to_string()
+            kids[u"file%d" % (i,)] = (nm.create_from_cap(litcap), {})
+        n = nm.create_from_cap(b"URI:DIR2-LIT:")
+        children = n._unpack_contents(dirnode.pack_children(kids, None))
+        unpacked = []
+        original_unpack_entry = n._unpack_entry
+        def _unpack_entry(name, entry):
+            unpacked.append(name)
+            return original_unpack_entry(name, entry)
+        children._unpack_entry = _unpack_entry
+        litcap = uri.LiteralFileURI(b"new").to_string()
+        kids[u"file2"] = children[u"file2"] = (nm.create_from_cap(litcap), {})
+        del kids[u"file4"]
+        del children[u"file4"]
+        self.failUnlessReallyEqual(
+            dirnode._pack_normalized_children(children, None),
+            dirnode.pack_children(kids, None))
+        self.failUnlessReallyEqual(unpacked, [u"file4"])
+
+
 class UCWEingMutableFileNode(MutableFileNode):
     please_ucwe_after_next_upload = False
 
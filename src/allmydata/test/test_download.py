@@ -11,6 +11,7 @@ from typing import Any
 import os
 from twisted.trial import unittest
 from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
 from allmydata import uri
 from allmydata.storage.server import storage_index_to_dir
 from allmydata.util import base32, fileutil, spans, log, hashutil
@@ -24,6 +25,12 @@ from allmydata.immutable.downloader.common import BadSegmentNumberError, \
      BadCiphertextHashError, COMPLETE, OVERDUE, DEAD
 from allmydata.immutable.downloader.status import DownloadStatus
 from allmydata.immutable.downloader.fetcher import SegmentFetcher
+from allmydata.immutable.downloader.share import Share
+from allmydata.immutable.downloader import segcache
+from allmydata.immutable.downloader import share as share_module
+from allmydata.immutable.downloader.segcache import SegmentCache
+from allmydata.share_locations import ShareLocationCache
+from allmydata.util.iothreadpool import disable_io_thread_pool_for_test
 from allmydata.codec import CRSDecoder
 from foolscap.eventual import eventually, fireEventually, flushEventualQueue
 
@@ -1199,6 +1206,398 @@ class Corruption(_Base, unittest.TestCase):
             return b"".join([before_corruption, corrupt_byte, after_corruption])
         self.corrupt_all_shares(imm_uri, _corruptor)
 
+    def _upload_large_blocks(self):
+        # big enough that blocks are hashed in a thread, see
+        # hashutil.BLOCK_HASHES_INLINE_LIMIT
+        self.basedir = self.mktemp()
+        self.set_up_grid()
+        self.c0 = self.g.clients[0]
+        self.large = b"".join(b"%d\n" % i for i in range(40000))
+        assert len(self.large) // 3 > hashutil.BLOCK_HASHES_INLINE_LIMIT
+        d = self.c0.upload(upload.Data(self.large, None))
+        d.addCallback(lambda ur: ur.get_uri())
+        return d
+
+    def _corrupt_block0(self, s, debug=False):
+        which = 48 # first byte of block0
+        return s[:which] + bchr(ord(s[which:which+1])^0x01) + s[which+1:]
+
+    def test_large_blocks_some_corrupt(self):
+        """
+        Corrupt blocks are rejected even when they are hashed in a thread, and
+        the download uses other shares instead.
+        """
+        d = self._upload_large_blocks()
+        def _uploaded(imm_uri):
+            self.corrupt_shares_numbered(imm_uri, range(7), self._corrupt_block0)
+            return download_to_data(self.c0.create_node_from_uri(imm_uri))
+        d.addCallback(_uploaded)
+        d.addCallback(lambda data: self.assertEqual(data, self.large))
+        return d
+
+    def test_large_blocks_all_corrupt(self):
+        """
+        If every share's block is corrupt the download fails with
+        ``NoSharesError``, even when the blocks are hashed in a thread.
+        """
+        d = self._upload_large_blocks()
+        def _uploaded(imm_uri):
+            self.corrupt_all_shares(imm_uri, self._corrupt_block0)
+            n = self.c0.create_node_from_uri(imm_uri)
+            return self.shouldFail(NoSharesError, "all corrupt",
+                                   "Last failure: None",
+                                   download_to_data, n)
+        d.addCallback(_uploaded)
+        return d
+
+
+class SegmentCacheTests(_Base, unittest.TestCase):
+    def setUp(self):
+        # cache entries are read and written synchronously
+        disable_io_thread_pool_for_test(self)
+        return _Base.setUp(self)
+
+    def _set_up(self, max_size=100000):
+        self.basedir = self.mktemp()
+        self.set_up_grid()
+        self.c0 = self.g.clients[0]
+        self.cache_dir = os.path.join(self.basedir, "segment-cache")
+        self.cache = SegmentCache(self.cache_dir, max_size)
+        self.c0.nodemaker.segment_cache = self.cache
+
+    def _fresh_node(self, imm_uri):
+        # bypass the NodeMaker's node cache, so nothing is remembered from
+        # an earlier download
+        return self.c0.nodemaker._create_immutable(uri.from_string(imm_uri))
+
+    @defer.inlineCallbacks
+    def _upload(self):
+        u = upload.Data(plaintext, None)
+        u.max_segment_size = 70 # 5 segs
+        ur = yield self.c0.upload(u)
+        self.imm_uri = ur.get_uri()
+        self.si = uri.from_string(self.imm_uri).get_storage_index()
+        self.verifycap = uri.from_string(self.imm_uri).get_verify_cap()
+        self.cache_id = segcache.file_id(self.verifycap)
+
+    @defer.inlineCallbacks
+    def test_hit_skips_servers(self):
+        """
+        Once a file has been downloaded, it can be read again from the cache
+        even if every share is gone.
+        """
+        self._set_up()
+        yield self._upload()
+        data = yield download_to_data(self._fresh_node(self.imm_uri))
+        self.assertEqual(data, plaintext)
+        self.assertEqual(self.cache.get_segment_size(self.cache_id), 72)
+        for segnum in range(5):
+            self.assertTrue(self.cache.has_segment(self.cache_id, segnum))
+
+        for (i, ss, ssdir) in self.iterate_servers():
+            self.delete_all_shares(ssdir)
+        data = yield download_to_data(self._fresh_node(self.imm_uri))
+        self.assertEqual(data, plaintext)
+
+        # a range which doesn't start at the first segment
+        c = MemoryConsumer()
+        yield self._fresh_node(self.imm_uri).read(c, 100, 150)
+        self.assertEqual(b"".join(c.chunks), plaintext[100:250])
+
+    @defer.inlineCallbacks
+    def test_damaged_entry(self):
+        """
+        A damaged cache entry is discarded and the segment is fetched from
+        the storage servers again.
+        """
+        self._set_up()
+        yield self._upload()
+        yield download_to_data(self._fresh_node(self.imm_uri))
+        path = os.path.join(self.cache_dir, str(base32.b2a(self.cache_id), "ascii"), "2")
+        with open(path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"!")
+        data = yield download_to_data(self._fresh_node(self.imm_uri))
+        self.assertEqual(data, plaintext)
+        # and the fresh copy replaced it
+        self.assertTrue(self.cache.has_segment(self.cache_id, 2))
+        segment = yield self.cache.get_segment(self.cache_id, 2)
+        self.assertEqual(len(segment), 72)
+
+    @defer.inlineCallbacks
+    def test_other_file_same_storage_index(self):
+        """
+        Segments cached for another file with the same storage index (but a
+        different UEB) are not used.
+        """
+        self._set_up()
+        yield self._upload()
+        v = self.verifycap
+        other = uri.CHKFileVerifierURI(v.storage_index, b"\x00" * 32,
+                                       v.needed_shares, v.total_shares,
+                                       v.size)
+        for segnum in range(5):
+            yield self.cache.put_segment(segcache.file_id(other), segnum, 72,
+                                         b"!" * 72)
+        data = yield download_to_data(self._fresh_node(self.imm_uri))
+        self.assertEqual(data, plaintext)
+
+    @defer.inlineCallbacks
+    def test_wrong_size_entry(self):
+        """
+        A cached segment whose length does not fit the file is discarded and
+        fetched from the storage servers again.
+        """
+        self._set_up()
+        yield self._upload()
+        yield download_to_data(self._fresh_node(self.imm_uri))
+        self.cache.discard_segment(self.cache_id, 2)
+        yield self.cache.put_segment(self.cache_id, 2, 72, b"!" * 10)
+        data = yield download_to_data(self._fresh_node(self.imm_uri))
+        self.assertEqual(data, plaintext)
+        segment = yield self.cache.get_segment(self.cache_id, 2)
+        self.assertEqual(len(segment), 72)
+
+    @defer.inlineCallbacks
+    def test_eviction(self):
+        """
+        When the cache is full the least recently used segments are evicted,
+        and the index survives being reloaded from disk.
+        """
+        self._set_up(max_size=2 * (40 + 72))
+        self.si = b"\x01" * 16
+        for segnum in range(2):
+            yield self.cache.put_segment(self.si, segnum, 72, b"%d" % segnum * 72)
+        # segment 0 is now the most recently used
+        segment = yield self.cache.get_segment(self.si, 0)
+        self.assertEqual(segment, b"0" * 72)
+        yield self.cache.put_segment(self.si, 2, 72, b"2" * 72)
+        self.assertEqual(
+            [self.cache.has_segment(self.si, segnum) for segnum in range(3)],
+            [True, False, True],
+        )
+        self.assertEqual(self.cache.get_total_size(), 2 * (40 + 72))
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.cache_dir,
+                                           str(base32.b2a(self.si), "ascii")))),
+            ["0", "2"],
+        )
+
+        reloaded = SegmentCache(self.cache_dir, 40 + 72)
+        self.assertEqual(reloaded.get_total_size(), 40 + 72)
+        self.assertEqual(reloaded.get_segment_size(self.si), 72)
+
+        # segments which could never fit are not stored
+        yield reloaded.put_segment(self.si, 3, 72, b"3" * 100)
+        self.assertFalse(reloaded.has_segment(self.si, 3))
+
+    @defer.inlineCallbacks
+    def test_load_in_io_thread(self):
+        """
+        The entries left by an earlier run are found in the I/O thread pool,
+        not while the cache is being created.
+        """
+        self._set_up()
+        self.si = b"\x01" * 16
+        yield self.cache.put_segment(self.si, 0, 72, b"0" * 72)
+
+        io_thread = defer.Deferred()
+        async def defer_to_io_thread(reactor, f, *args):
+            await io_thread
+            return f(*args)
+        self.patch(segcache, "defer_to_io_thread", defer_to_io_thread)
+        reloaded = SegmentCache(self.cache_dir, 100000)
+        self.assertFalse(reloaded.has_segment(self.si, 0))
+        io_thread.callback(None)
+        self.assertTrue(reloaded.has_segment(self.si, 0))
+        self.assertEqual(reloaded.get_total_size(), 40 + 72)
+
+
+class ShareLocationCacheTests(_Base, unittest.TestCase):
+    def setUp(self):
+        # cache changes are written synchronously
+        disable_io_thread_pool_for_test(self)
+        return _Base.setUp(self)
+
+    def _fresh_node(self, imm_uri):
+        return self.c0.nodemaker._create_immutable(uri.from_string(imm_uri))
+
+    def _move_shares_to_the_end(self, imm_uri):
+        """
+        Move every share of ``imm_uri`` to a server near the end of the
+        permuted list, and return the ids of the servers now holding them.
+        """
+        si = uri.from_string(imm_uri).get_storage_index()
+        servers = dict((ss.my_nodeid, ss) for (_, ss, _)
+                       in self.iterate_servers())
+        permuted = [s.get_serverid() for s
+                    in self.c0.storage_broker.get_servers_for_psi(si)]
+        new_holders = set()
+        for (shnum, serverid, sharefile) in self.find_uri_shares(imm_uri):
+            target = permuted.pop()
+            sharedir = os.path.join(servers[target].sharedir,
+                                    storage_index_to_dir(si))
+            fileutil.make_dirs(sharedir)
+            os.rename(sharefile, os.path.join(sharedir, str(shnum)))
+            new_holders.add(target)
+        return new_holders
+
+    @defer.inlineCallbacks
+    def test_ask_cached_servers_first(self):
+        """
+        A download asks the servers where shares were found last time before
+        the others, and the cache follows shares that have moved.
+        """
+        self.basedir = self.mktemp()
+        self.set_up_grid(num_servers=30)
+        self.c0 = self.g.clients[0]
+        cache = ShareLocationCache(
+            os.path.join(self.basedir, "share-locations.sqlite"), 100)
+        self.c0.nodemaker.share_location_cache = cache
+        ur = yield self.c0.upload(upload.Data(plaintext, None))
+        imm_uri = ur.get_uri()
+        si = uri.from_string(imm_uri).get_storage_index()
+        holders = self._move_shares_to_the_end(imm_uri)
+
+        def asked(node):
+            return [r["server"].get_serverid() for r
+                    in node._cnode._download_status.dyhb_requests]
+
+        node = self._fresh_node(imm_uri)
+        data = yield download_to_data(node)
+        self.assertEqual(data, plaintext)
+        self.assertTrue(cache.get(si).servers <= holders)
+        asked_before = asked(node)
+
+        # the next download only asks servers that have shares
+        node = self._fresh_node(imm_uri)
+        data = yield download_to_data(node)
+        self.assertEqual(data, plaintext)
+        self.assertTrue(set(asked(node)) <= cache.get(si).servers)
+        self.assertLess(len(asked(node)), len(asked_before))
+
+        # and the cache survives a restart
+        cache.close()
+        reloaded = ShareLocationCache(
+            os.path.join(self.basedir, "share-locations.sqlite"), 100)
+        self.assertEqual(reloaded.get(si), cache.get(si))
+        reloaded.close()
+
+    def test_evict(self):
+        """
+        Only the most recently recorded entries are kept, on disk too.
+        """
+        dbfile = os.path.join(self.mktemp() + ".sqlite")
+        cache = ShareLocationCache(dbfile, 2)
+        cache.record(b"a" * 16, [b"server1"])
+        # server ids are binary, and may contain newlines
+        cache.record(b"b" * 16, [b"server1", b"server\n2"], 4)
+        cache.record(b"c" * 16, [b"server3"])
+        cache.forget(b"c" * 16)
+        cache.close()
+        reloaded = ShareLocationCache(dbfile, 1)
+        self.assertIsNone(reloaded.get(b"a" * 16))
+        self.assertEqual(reloaded.get(b"b" * 16).servers,
+                         {b"server1", b"server\n2"})
+        self.assertEqual(reloaded.get(b"b" * 16).seqnum, 4)
+        self.assertIsNone(reloaded.get(b"c" * 16))
+        reloaded.close()
+
+    def test_evict_least_recently_used(self):
+        """
+        Looking an entry up keeps it, rather than the ones recorded after it,
+        on disk too.
+        """
+        dbfile = os.path.join(self.mktemp() + ".sqlite")
+        cache = ShareLocationCache(dbfile, 2)
+        cache.record(b"a" * 16, [b"server1"])
+        cache.record(b"b" * 16, [b"server2"])
+        cache.get(b"a" * 16)
+        cache.record(b"c" * 16, [b"server3"])
+        self.assertIsNotNone(cache.get(b"a" * 16))
+        self.assertIsNone(cache.get(b"b" * 16))
+        cache.get(b"c" * 16)
+        cache.get(b"a" * 16)
+        cache.close()
+        reloaded = ShareLocationCache(dbfile, 1)
+        self.assertEqual(reloaded.get(b"a" * 16).servers, {b"server1"})
+        self.assertIsNone(reloaded.get(b"c" * 16))
+        reloaded.close()
+
+
+class ReadAheadTests(_Base, unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def _upload(self, readahead_max_bytes):
+        self.basedir = self.mktemp()
+        self.set_up_grid()
+        self.c0 = self.g.clients[0]
+        self.c0.nodemaker.readahead_max_bytes = readahead_max_bytes
+        u = upload.Data(plaintext, None)
+        u.max_segment_size = 70 # 5 segs of 72 bytes
+        ur = yield self.c0.upload(u)
+        n = self.c0.nodemaker._create_immutable(uri.from_string(ur.get_uri()))
+        n._cnode._maybe_create_download_node()
+        self.node = n._cnode._node
+        self.prefetched = []
+        self.max_in_flight = 0
+        original_prefetch = self.node.prefetch
+        def prefetch(segnum, logparent=None):
+            self.prefetched.append(segnum)
+            original_prefetch(segnum, logparent)
+            self.max_in_flight = max(self.max_in_flight,
+                                     len(self.node._readahead))
+        self.node.prefetch = prefetch
+        return n
+
+    @defer.inlineCallbacks
+    def test_window_grows(self):
+        """
+        A sequential read prefetches segments ahead of the consumer, with a
+        window that doubles up to readahead_max_bytes, and never past the
+        end of the read.
+        """
+        n = yield self._upload(readahead_max_bytes=3*72)
+        data = yield download_to_data(n)
+        self.assertEqual(data, plaintext)
+        # window of 1 after segment 0, 2 after segment 1, then capped at 3
+        self.assertEqual(self.prefetched, [1, 2, 3, 4])
+        # several segments were on their way at the same time
+        self.assertGreater(self.max_in_flight, 1)
+        yield flushEventualQueue()
+        self.assertEqual((self.node._readahead, self.node._prefetched), ({}, {}))
+
+        self.prefetched = []
+        c = MemoryConsumer()
+        yield n.read(c, 80, 100) # segments 1 and 2
+        self.assertEqual(b"".join(c.chunks), plaintext[80:180])
+        self.assertEqual(self.prefetched, [2])
+
+    @defer.inlineCallbacks
+    def test_disabled(self):
+        """
+        With readahead_max_bytes smaller than a segment, nothing is fetched
+        ahead.
+        """
+        n = yield self._upload(readahead_max_bytes=0)
+        data = yield download_to_data(n)
+        self.assertEqual(data, plaintext)
+        self.assertEqual(self.prefetched, [])
+
+    @defer.inlineCallbacks
+    def test_stop(self):
+        """
+        Prefetches are cancelled when the consumer stops the download.
+        """
+        n = yield self._upload(readahead_max_bytes=4*72)
+        yield self.shouldFail(DownloadStopped, "test_stop",
+                              "our Consumer called stopProducing()",
+                              n.read, StoppingConsumer())
+        self.assertEqual(self.prefetched, [1])
+        yield flushEventualQueue()
+        self.assertEqual((self.node._readahead, self.node._prefetched), ({}, {}))
+
+
 class DownloadV2(_Base, unittest.TestCase):
     # tests which exercise v2-share code. They first upload a file with
     # FORCE_V2 set.
@@ -1356,6 +1755,9 @@ class MyShare:
     def __repr__(self):
         return "sh%d-on-%s" % (self._shnum, str(self._server.get_name(), "ascii"))
 
+    def is_checking_block(self):
+        return False
+
 class MySegmentFetcher(SegmentFetcher):
     def __init__(self, *args, **kwargs):
         SegmentFetcher.__init__(self, *args, **kwargs)
@@ -1704,3 +2106,54 @@ class Selection(unittest.TestCase):
                                                       2: "block-2"}) )
         d.addCallback(_check4)
         return d
+
+
+class ReadVectorBatches(unittest.TestCase):
+    def _batch_lengths(self, lengths):
+        share = Share.__new__(Share)
+        requests = [(i * 1000, length, None, None)
+                    for (i, length) in enumerate(lengths)]
+        return [[length for (_, length, _, _) in batch]
+                for batch in share._readv_batches(requests)]
+
+    def test_span_limit(self):
+        self.patch(Share, "MAX_READV_SPANS", 2)
+        self.failUnlessEqual(self._batch_lengths([1, 2, 3, 4, 5]),
+                             [[1, 2], [3, 4], [5]])
+
+    def test_size_limit(self):
+        """
+        A read vector never asks for more than MAX_READV_BYTES, which HTTP
+        storage servers would refuse, unless it is a single span.
+        """
+        self.patch(Share, "MAX_READV_BYTES", 100)
+        self.failUnlessEqual(self._batch_lengths([40, 60, 40, 200, 10, 10]),
+                             [[40, 60], [40], [200], [10, 10]])
+
+    def test_error_vector(self):
+        """
+        When a read vector fails, every span in it is marked as failed, and
+        the failure is logged, with all of the spans, and handled once.
+        """
+        class BlockEvent(object):
+            errors = 0
+            def error(self, when):
+                self.errors += 1
+        share = Share.__new__(Share)
+        share._server = make_servers([b"peer-A"])[b"peer-A"]
+        share._si_prefix = "si"
+        share._lp = None
+        failures = []
+        self.patch(share, "_fail", lambda f, level: failures.append(f))
+        logged = []
+        self.patch(share_module.log, "msg",
+                   lambda *args, **kwargs: logged.append(kwargs))
+        events = [BlockEvent() for i in range(3)]
+        requests = [(i * 1000, 100, events[i], None) for i in range(3)]
+        f = Failure(ValueError("readv failed"))
+        share._got_error_vector(f, requests)
+        self.failUnlessEqual([ev.errors for ev in events], [1, 1, 1])
+        self.failUnlessEqual(failures, [f])
+        self.failUnlessEqual(len(logged), 1)
+        self.failUnlessEqual(logged[0]["spans"], "0+100 1000+100 2000+100")
+        self.assertIs(logged[0]["failure"], f)
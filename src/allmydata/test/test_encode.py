@@ -4,7 +4,7 @@ Ported to Python 3.
 
 from zope.interface import implementer
 from twisted.trial import unittest
-from twisted.internet import defer
+from twisted.internet import defer, reactor, task
 from twisted.python.failure import Failure
 from foolscap.api import fireEventually
 from allmydata import uri
@@ -354,6 +354,146 @@ class Encode(unittest.TestCase):
         return self.do_encode(25, 101, 100, 5, 15, 8)
 
 
+class HeldBucketProxy(FakeBucketReaderWriterProxy):
+    """
+    A bucket writer whose ``put_block`` calls don't complete until the test
+    releases them.
+    """
+    def __init__(self, started, held):
+        FakeBucketReaderWriterProxy.__init__(self)
+        self._started = started
+        self._held = held
+
+    def put_block(self, segmentnum, data):
+        self._started.add(segmentnum)
+        d = defer.Deferred()
+        self._held.append(d)
+        d.addCallback(lambda _: FakeBucketReaderWriterProxy.put_block(
+            self, segmentnum, data))
+        return d
+
+
+class EncodePipeline(unittest.TestCase):
+    """
+    Tests for how far ``Encoder`` runs ahead of delivering blocks.
+    """
+    def setUp(self):
+        self.started = set()
+        self.held = []
+
+    def start_upload(self, pipeline, datalen=101):
+        """
+        Start encoding ``datalen`` bytes in 25 byte segments to 100 shares,
+        whose blocks aren't delivered until ``release()`` is called.
+        """
+        e = encode.Encoder(pipeline=pipeline)
+        u = upload.Data(make_data(datalen), convergence=b"some convergence string")
+        u.set_default_encoding_parameters({'max_segment_size': 25,
+                                           'k': 25, 'happy': 75, 'n': 100})
+        eu = upload.EncryptAnUploadable(u)
+        d = e.set_encrypted_uploadable(eu)
+
+        self.shareholders = []
+        def _ready(res):
+            shareholders = {}
+            servermap = {}
+            for shnum in range(100):
+                peer = HeldBucketProxy(self.started, self.held)
+                shareholders[shnum] = peer
+                servermap.setdefault(shnum, set()).add(peer.get_peerid())
+                self.shareholders.append(peer)
+            e.set_shareholders(shareholders, servermap)
+            return e.start()
+        d.addCallback(_ready)
+        return d
+
+    async def settle(self, expected_segments):
+        """
+        Wait until blocks for ``expected_segments`` segments have been handed
+        to the shareholders, then give the encoder a while longer to (wrongly)
+        start on more.
+        """
+        for _ in range(500):
+            if len(self.started) >= expected_segments:
+                break
+            await task.deferLater(reactor, 0.01, lambda: None)
+        await task.deferLater(reactor, 0.1, lambda: None)
+
+    def release(self):
+        held, self.held[:] = self.held[:], []
+        for d in held:
+            d.callback(None)
+
+    async def release_all(self, upload):
+        """
+        Keep delivering blocks until ``upload`` has a result.
+        """
+        done = []
+        def _done(res):
+            done.append(True)
+            return res
+        upload.addBoth(_done)
+        while not done:
+            self.release()
+            await task.deferLater(reactor, 0.01, lambda: None)
+
+    @defer.inlineCallbacks
+    def check_in_flight(self, pipeline, expected):
+        """
+        While no blocks are delivered, blocks for exactly ``expected``
+        segments are handed to the shareholders; once they are delivered the
+        upload completes.
+        """
+        d = self.start_upload(pipeline)
+        yield defer.Deferred.fromCoroutine(self.settle(expected))
+        self.assertEqual(self.started, set(range(expected)))
+        yield defer.Deferred.fromCoroutine(self.release_all(d))
+        verifycap = yield d
+        self.assertEqual(len(verifycap.uri_extension_hash), 32)
+        for peer in self.shareholders:
+            self.assertTrue(peer.closed)
+            self.assertEqual(sorted(peer.blocks), [0, 1, 2, 3, 4])
+
+    def test_depth_one(self):
+        """
+        With a depth of 1, a segment isn't encoded until the previous one has
+        been delivered.
+        """
+        return self.check_in_flight(encode.PipelineLimits(depth=1), 1)
+
+    def test_depth(self):
+        """
+        The number of segments in flight is limited by the pipeline depth.
+        """
+        return self.check_in_flight(encode.PipelineLimits(depth=3), 3)
+
+    def test_max_bytes(self):
+        """
+        The number of segments in flight is limited by the total size of
+        their blocks.  Each segment here is 100 one-byte blocks.
+        """
+        return self.check_in_flight(
+            encode.PipelineLimits(depth=5, max_bytes=250), 2,
+        )
+
+    def test_max_bytes_smaller_than_segment(self):
+        """
+        A single segment is always allowed in flight, no matter how small
+        ``max_bytes`` is.
+        """
+        return self.check_in_flight(
+            encode.PipelineLimits(depth=5, max_bytes=0), 1,
+        )
+
+    def test_invalid(self):
+        """
+        ``PipelineLimits`` rejects a depth below one and a negative byte
+        limit.
+        """
+        self.assertRaises(ValueError, encode.PipelineLimits, depth=0)
+        self.assertRaises(ValueError, encode.PipelineLimits, max_bytes=-1)
+
+
 class Roundtrip(GridTestMixin, unittest.TestCase):
 
     # a series of 3*3 tests to check out edge conditions. One axis is how the
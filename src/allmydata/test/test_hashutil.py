@@ -5,6 +5,7 @@ Ported to Python 3.
 """
 
 from twisted.trial import unittest
+from twisted.internet.defer import Deferred
 
 from allmydata.util import hashutil, base32
 
@@ -36,6 +37,17 @@ class HashUtilTests(unittest.TestCase):
         self.failUnlessEqual(len(h2), 16)
         self.failUnlessEqual(h1, h2)
 
+    def test_block_hashes(self):
+        """
+        ``block_hashes`` computes ``block_hash`` of each block, in order.
+        """
+        blocks = [b"a" * 100, b"", b"b" * 100000]
+        d = Deferred.fromCoroutine(hashutil.block_hashes(iter(blocks)))
+        d.addCallback(
+            self.assertEqual, [hashutil.block_hash(b) for b in blocks],
+        )
+        return d
+
     def test_well_known_tagged_hash(self):
         self.assertEqual(
             b"yra322btzoqjp4ts2jon5dztgnilcdg6jgztgk7joi6qpjkitg2q",
@@ -19,6 +19,7 @@ from testtools.matchers import (
 )
 
 from twisted.internet import defer, address
+from twisted.internet.task import Clock
 from twisted.python import log
 from twisted.python.filepath import FilePath
 from twisted.web.template import flattenString
@@ -46,6 +47,7 @@ from allmydata.client import (
     create_introducer_clients,
 )
 from allmydata.util import pollmixin, idlib, fileutil, yamlutil
+from allmydata.util.cputhreadpool import disable_thread_pool_for_test
 from allmydata.util.iputil import (
     listenOnUnused,
 )
@@ -193,6 +195,7 @@ def make_ann_t(ic, furl, privkey, seqnum):
 
 class Client(AsyncTestCase):
     def test_duplicate_receive_v2(self):
+        disable_thread_pool_for_test(self)
         ic1 = IntroducerClient(None,
                                "introducer.furl", u"my_nickname",
                                "ver23", "oldest_version", fakeseq,
@@ -759,6 +762,96 @@ class ClientInfo(AsyncTestCase):
         self.failUnlessEqual(s0.version, "my_version")
 
 
+class RecordingRemoteReference(FakeRemoteReference):
+    """
+    A subscriber which remembers the announcements sent to it.
+    """
+    def __init__(self):
+        self.messages = []
+
+    def callRemote(self, methname, announcements):
+        assert methname == "announce_v2"
+        self.messages.append(announcements)
+        return defer.succeed(None)
+
+
+class Batching(AsyncTestCase):
+    """
+    Tests for how ``IntroducerService`` sends announcements to subscribers.
+    """
+
+    def setUp(self):
+        super(Batching, self).setUp()
+        self.clock = Clock()
+        self.introducer = IntroducerService(clock=self.clock)
+        self.introducer.startService()
+        self.addCleanup(self.introducer.stopService)
+        self.ic = IntroducerClient(None, "introducer.furl", u"my_nickname",
+                                   "my_version", "oldest_version", fakeseq,
+                                   FilePath(self.mktemp()))
+        self.private_key, _ = ed25519.create_signing_keypair()
+
+    def subscribe(self):
+        subscriber = RecordingRemoteReference()
+        self.introducer.remote_subscribe_v2(subscriber, "storage",
+                                            self.ic._my_subscriber_info)
+        return subscriber
+
+    def make_ann_t(self, n, seqnum=1, private_key=None):
+        furl = "pb://%s@127.0.0.1:%d/swissnum" % (
+            "onug64tu" * 4, 1000 + n)
+        if private_key is None:
+            private_key, _ = ed25519.create_signing_keypair()
+        return make_ann_t(self.ic, furl, private_key, seqnum)
+
+    def test_batch(self):
+        """
+        Announcements published close together are sent to each subscriber
+        in one message, after ``ANNOUNCE_DELAY``.
+        """
+        subscriber = self.subscribe()
+        anns = [self.make_ann_t(n) for n in range(5)]
+        for ann_t in anns:
+            self.introducer.remote_publish_v2(ann_t, None)
+        self.assertEqual(subscriber.messages, [])
+        self.clock.advance(IntroducerService.ANNOUNCE_DELAY)
+        self.assertEqual(subscriber.messages, [set(anns)])
+        self.assertEqual(self.introducer._debug_counts["outbound_message"], 1)
+
+    def test_latest_only(self):
+        """
+        If a server publishes twice within ``ANNOUNCE_DELAY``, only the later
+        announcement is sent.
+        """
+        subscriber = self.subscribe()
+        private_key, _ = ed25519.create_signing_keypair()
+        ann_t1 = self.make_ann_t(0, 1, private_key)
+        ann_t2 = self.make_ann_t(0, 2, private_key)
+        self.introducer.remote_publish_v2(ann_t1, None)
+        self.introducer.remote_publish_v2(ann_t2, None)
+        self.clock.advance(IntroducerService.ANNOUNCE_DELAY)
+        self.assertEqual(subscriber.messages, [{ann_t2}])
+
+    def test_subscribe_while_pending(self):
+        """
+        A subscriber which subscribes while announcements are waiting to be
+        sent gets them with the rest of the table, and does not get them
+        again.
+        """
+        old = self.subscribe()
+        ann_t1 = self.make_ann_t(1)
+        self.introducer.remote_publish_v2(ann_t1, None)
+        new = self.subscribe()
+        self.assertEqual(new.messages, [{ann_t1}])
+        ann_t2 = self.make_ann_t(2)
+        self.introducer.remote_publish_v2(ann_t2, None)
+        self.clock.advance(IntroducerService.ANNOUNCE_DELAY)
+        self.assertEqual(old.messages, [{ann_t1, ann_t2}])
+        self.assertEqual(new.messages, [{ann_t1}, {ann_t2}])
+        self.assertEqual(
+            self.introducer._debug_counts["outbound_announcements"], 4)
+
+
 class Announcements(AsyncTestCase):
     def test_client_v2_signed(self):
         introducer = IntroducerService()
@@ -817,7 +910,7 @@ class Announcements(AsyncTestCase):
         furl1 = "pb://onug64tu@127.0.0.1:123/short" # base32("short")
         ann_t = make_ann_t(ic, furl1, private_key, 1)
 
-        ic.got_announcements([ann_t])
+        yield ic.got_announcements([ann_t])
         yield flushEventualQueue()
 
         # check the cache for the announcement
@@ -832,7 +925,7 @@ class Announcements(AsyncTestCase):
         # cached entry, not duplicate it
         furl2 = furl1 + "er"
         ann_t2 = make_ann_t(ic, furl2, private_key, 2)
-        ic.got_announcements([ann_t2])
+        yield ic.got_announcements([ann_t2])
         yield flushEventualQueue()
         announcements = self._load_cache(cache_filepath)
         self.failUnlessEqual(len(announcements), 1)
@@ -847,7 +940,7 @@ class Announcements(AsyncTestCase):
         public_key_str2 = remove_prefix(ed25519.string_from_verifying_key(public_key2), b"pub-")
         furl3 = "pb://onug64tu@127.0.0.1:456/short"
         ann_t3 = make_ann_t(ic, furl3, private_key2, 1)
-        ic.got_announcements([ann_t3])
+        yield ic.got_announcements([ann_t3])
         yield flushEventualQueue()
 
         announcements = self._load_cache(cache_filepath)
@@ -882,6 +975,36 @@ class Announcements(AsyncTestCase):
         self.assertEqual(c2.storage_broker.get_all_serverids(),
                          frozenset([public_key_str, public_key_str2]))
 
+    def test_client_cache_debounced(self):
+        """
+        While the introducer client is running, the cache file is written
+        ``CACHE_SAVE_DELAY`` seconds after the first change, with every change
+        made by then, and when the client stops.
+        """
+        disable_thread_pool_for_test(self)
+        clock = Clock()
+        cache_filepath = FilePath(self.mktemp())
+        ic = IntroducerClient(Tub(), "pb://%s@127.0.0.1:1/intro" % ("a" * 32,),
+                              u"my_nickname", "my_version", "oldest_version",
+                              fakeseq, cache_filepath, clock=clock)
+        ic.subscribe_to("storage", lambda key_s, ann: None)
+        ic.startService()
+
+        furl = "pb://onug64tu@127.0.0.1:%d/short"
+        for n in range(3):
+            private_key, _ = ed25519.create_signing_keypair()
+            ic.got_announcements([make_ann_t(ic, furl % (n,), private_key, 1)])
+        self.assertFalse(cache_filepath.exists())
+        clock.advance(IntroducerClient.CACHE_SAVE_DELAY)
+        self.assertEqual(len(self._load_cache(cache_filepath)), 3)
+
+        private_key, _ = ed25519.create_signing_keypair()
+        ic.got_announcements([make_ann_t(ic, furl % (3,), private_key, 1)])
+        self.assertEqual(len(self._load_cache(cache_filepath)), 3)
+        ic.stopService()
+        self.assertEqual(len(self._load_cache(cache_filepath)), 4)
+        self.assertEqual(clock.getDelayedCalls(), [])
+
 class ClientSeqnums(AsyncBrokenTestCase):
 
     @defer.inlineCallbacks
@@ -1031,6 +1154,7 @@ class Signatures(SyncTestCase):
         """
         An incorrectly signed announcement is not delivered to subscribers.
         """
+        disable_thread_pool_for_test(self)
         private_key, public_key = ed25519.create_signing_keypair()
         public_key_str = ed25519.string_from_verifying_key(public_key)
 
@@ -13,8 +13,9 @@ from __future__ import annotations
 from random import Random
 from unittest import SkipTest
 
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import inlineCallbacks, returnValue, gatherResults, fail
 from twisted.internet.task import Clock
+from twisted.web import http
 from foolscap.api import Referenceable, RemoteException
 
 # A better name for this would be IStorageClient...
@@ -23,6 +24,7 @@ from allmydata.interfaces import IStorageServer
 from .common_system import SystemTestMixin
 from .common import AsyncTestCase
 from allmydata.storage.server import StorageServer  # not a IStorageServer!!
+from allmydata.storage.http_client import ClientException, StorageClientGeneral
 
 
 # Use random generator with known seed, so results are reproducible if tests
@@ -355,6 +357,35 @@ class IStorageServerImmutableAPIsTestsMixin:
         buckets = yield self.storage_client.get_buckets(storage_index)
         self.assertEqual(set(buckets.keys()), {1})
 
+    @inlineCallbacks
+    def test_get_buckets_concurrently(self):
+        """
+        Concurrent ``IStorageServer.get_buckets()`` calls for different
+        storage indexes each get the shares of their own storage index.
+        """
+        storage_indexes = [new_storage_index() for _ in range(3)]
+        for (i, storage_index) in enumerate(storage_indexes[:2]):
+            (_, allocated) = yield self.storage_client.allocate_buckets(
+                storage_index,
+                renew_secret=new_secret(),
+                cancel_secret=new_secret(),
+                sharenums={i, i + 2},
+                allocated_size=10,
+                canary=Referenceable(),
+            )
+            for bucket in allocated.values():
+                yield bucket.callRemote("write", 0, b"1" * 10)
+                yield bucket.callRemote("close")
+
+        results = yield gatherResults([
+            self.storage_client.get_buckets(storage_index)
+            for storage_index in storage_indexes
+        ])
+        self.assertEqual(
+            [set(buckets.keys()) for buckets in results],
+            [{0, 2}, {1, 3}, set()],
+        )
+
     @inlineCallbacks
     def test_read_bucket_at_offset(self):
         """
@@ -514,6 +545,61 @@ class IStorageServerImmutableAPIsTestsMixin:
         self.assertEqual(lease1.get_expiration_time(), initial_expiration_time)
         self.assertEqual(lease2.get_expiration_time() - initial_expiration_time, 167)
 
+    @inlineCallbacks
+    def test_add_lease_concurrently(self):
+        """
+        Concurrent ``IStorageServer.add_lease()`` calls for different storage
+        indexes each renew or add the lease on their own storage index, and
+        ones for storage indexes without shares do nothing.
+        """
+        (si1, renew1, cancel1) = yield self.create_share()
+        (si2, _, _) = yield self.create_share()
+        [lease] = self.server.get_leases(si1)
+        initial_expiration_time = lease.get_expiration_time()
+
+        # Time passes:
+        self.fake_sleep(123)
+
+        unknown_storage_index = new_storage_index()
+        yield gatherResults([
+            self.storage_client.add_lease(si1, renew1, cancel1),
+            self.storage_client.add_lease(si2, new_secret(), new_secret()),
+            self.storage_client.add_lease(
+                unknown_storage_index, new_secret(), new_secret()
+            ),
+        ])
+        [lease] = self.server.get_leases(si1)
+        self.assertEqual(lease.get_expiration_time() - initial_expiration_time, 123)
+        self.assertEqual(len(list(self.server.get_leases(si2))), 2)
+        self.assertEqual(list(self.server.get_leases(unknown_storage_index)), [])
+
+    @inlineCallbacks
+    def test_add_leases(self):
+        """
+        ``IStorageServer.add_leases()`` returns a ``Deferred`` for each lease,
+        and adds or renews each one as ``add_lease()`` would.
+        """
+        (si1, renew1, cancel1) = yield self.create_share()
+        (si2, _, _) = yield self.create_share()
+        [lease] = self.server.get_leases(si1)
+        initial_expiration_time = lease.get_expiration_time()
+
+        # Time passes:
+        self.fake_sleep(45)
+
+        unknown_storage_index = new_storage_index()
+        ds = self.storage_client.add_leases([
+            (si1, renew1, cancel1),
+            (si2, new_secret(), new_secret()),
+            (unknown_storage_index, new_secret(), new_secret()),
+        ])
+        self.assertEqual(len(ds), 3)
+        yield gatherResults(ds)
+        [lease] = self.server.get_leases(si1)
+        self.assertEqual(lease.get_expiration_time() - initial_expiration_time, 45)
+        self.assertEqual(len(list(self.server.get_leases(si2))), 2)
+        self.assertEqual(list(self.server.get_leases(unknown_storage_index)), [])
+
 
 class IStorageServerMutableAPIsTestsMixin:
     """
@@ -1142,6 +1228,86 @@ class HTTPImmutableAPIsTests(
 
     FORCE_FOOLSCAP_FOR_STORAGE = False
 
+    @inlineCallbacks
+    def create_bucket(self, data):
+        """
+        Upload ``data`` as share 0 of a new storage index, returning its
+        read bucket.
+        """
+        storage_index = new_storage_index()
+        (_, allocated) = yield self.storage_client.allocate_buckets(
+            storage_index,
+            renew_secret=new_secret(),
+            cancel_secret=new_secret(),
+            sharenums={0},
+            allocated_size=len(data),
+            canary=Referenceable(),
+        )
+        yield allocated[0].callRemote("write", 0, data)
+        yield allocated[0].callRemote("close")
+        buckets = yield self.storage_client.get_buckets(storage_index)
+        returnValue(buckets[0])
+
+    @inlineCallbacks
+    def test_read_bucket_vector(self):
+        """
+        HTTP read buckets can read several ranges at once, with reads past the
+        end resulting in short or empty bytes.
+        """
+        data = _randbytes(1000)
+        bucket = yield self.create_bucket(data)
+        self.assertTrue(bucket.supports_read_vectors)
+        readv = [(0, 10), (500, 100), (990, 100), (2000, 10)]
+        datav = yield bucket.callRemote("readv", readv)
+        self.assertEqual(
+            datav, [data[start : start + length] for (start, length) in readv]
+        )
+
+    @inlineCallbacks
+    def test_read_bucket_vector_fallback(self):
+        """
+        If the server doesn't support read vectors, the ranges are read one
+        at a time, and read vectors aren't tried again.
+        """
+        data = _randbytes(100)
+        bucket = yield self.create_bucket(data)
+        attempts = []
+
+        class OldClient:
+            def __init__(self, client):
+                self._client = client
+
+            def __getattr__(self, name):
+                return getattr(self._client, name)
+
+            def read_share_chunks(self, *args):
+                attempts.append(args)
+                return fail(ClientException(http.NOT_FOUND))
+
+        bucket.local_object.client = OldClient(bucket.local_object.client)
+        for _ in range(2):
+            datav = yield bucket.callRemote("readv", [(0, 10), (50, 10)])
+            self.assertEqual(datav, [data[0:10], data[50:60]])
+        self.assertEqual(len(attempts), 1)
+
+    @inlineCallbacks
+    def test_add_leases_one_request(self):
+        """
+        The leases given to one ``add_leases()`` call are sent in requests of
+        up to 1024 leases.
+        """
+        (si, renew, cancel) = yield self.create_share()
+        requests = []
+        original = StorageClientGeneral.add_or_renew_leases
+        def add_or_renew_leases(client, leases):
+            requests.append(len(leases))
+            return original(client, leases)
+        self.patch(StorageClientGeneral, "add_or_renew_leases", add_or_renew_leases)
+        yield gatherResults(self.storage_client.add_leases(
+            [(si, renew, cancel)] * 1500
+        ))
+        self.assertEqual(requests, [1024, 1500 - 1024])
+
 
 class FoolscapMutableAPIsTests(
     _SharedMixin, IStorageServerMutableAPIsTestsMixin, AsyncTestCase
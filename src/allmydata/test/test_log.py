@@ -6,6 +6,7 @@ Ported to Python 3.
 
 from twisted.trial import unittest
 from twisted.python.failure import Failure
+from twisted.internet.threads import deferToThread
 
 from foolscap.logging import log
 
@@ -37,6 +38,25 @@ class Log(unittest.TestCase):
         result = self.flushLoggedErrors(SampleError)
         self.assertEqual(len(result), 1)
 
+    def test_msg_from_thread(self):
+        """
+        ``log.msg()`` called from a non-reactor thread returns a message id
+        immediately and delivers the message from the reactor thread.
+        """
+        d = deferToThread(
+            tahoe_log.msg, "from a thread", facility="fac", parent=None,
+        )
+
+        def got_msgid(msgid):
+            self.assertEqual(len(self.messages), 1)
+            (message, facility, parent, args, kwargs) = self.messages[0]
+            self.assertEqual(message, "from a thread")
+            self.assertEqual(facility, "fac")
+            self.assertEqual(kwargs["num"], msgid)
+            self.assertIn("time", kwargs)
+        d.addCallback(got_msgid)
+        return d
+
     def test_default_facility(self):
         """
         If facility is passed to PrefixingLogMixin.__init__, it is used as
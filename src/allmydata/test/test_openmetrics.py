@@ -22,6 +22,7 @@ from testtools.matchers import (
 )
 from testtools.content import text_content
 
+from allmydata.stats import LatencyHistogram
 from allmydata.web.status import Statistics
 from allmydata.test.common import SyncTestCase
 
@@ -128,6 +129,22 @@ class FakeStatsProvider:
         return stats
 
 
+class FakeHistogramStatsProvider:
+    """
+    A stats provider with a latency histogram.
+    """
+
+    def get_stats(self):
+        histogram = LatencyHistogram(bounds=(0.001, 0.01))
+        for latency in [0.0005, 0.002, 0.003, 0.5]:
+            histogram.add(latency)
+        return {
+            "stats": {"storage_server.total_bucket_count": 393},
+            "counters": {"storage_server.read": 170},
+            "histograms": {"storage_server.add-lease": histogram.get_stats()},
+        }
+
+
 class HackItResource(Resource, object):
     """
     A bridge between ``RequestTraversalAgent`` and ``MultiFormatResource``
@@ -158,6 +175,48 @@ class OpenMetrics(SyncTestCase):
         d = rta.request(b"GET", b"http://localhost/?t=openmetrics")
         self.assertThat(d, succeeded(matches_stats(self)))
 
+    def test_histograms(self):
+        """
+        Latency histograms are rendered as OpenMetrics histograms.
+        """
+        root = HackItResource()
+        root.putChild(b"", Statistics(FakeHistogramStatsProvider()))
+        rta = RequestTraversalAgent(root)
+        d = rta.request(b"GET", b"http://localhost/?t=openmetrics")
+        d.addCallback(readBodyText)
+        d.addCallback(
+            lambda body: {
+                family.name: family
+                for family in parser.text_string_to_metric_families(body)
+            }
+        )
+        name = "tahoe_latency_storage_server_add_lease_seconds"
+        self.assertThat(
+            d,
+            succeeded(
+                AfterPreprocessing(
+                    lambda families: families[name],
+                    MatchesStructure(
+                        type=Equals("histogram"),
+                        unit=Equals("seconds"),
+                        samples=AfterPreprocessing(
+                            lambda samples: [
+                                (s.name, s.labels.get("le"), s.value)
+                                for s in samples
+                            ],
+                            Equals([
+                                (name + "_bucket", "0.001", 1),
+                                (name + "_bucket", "0.01", 3),
+                                (name + "_bucket", "+Inf", 4),
+                                (name + "_count", None, 4),
+                                (name + "_sum", None, 0.5055),
+                            ]),
+                        ),
+                    ),
+                ),
+            ),
+        )
+
 
 def matches_stats(testcase):
     """
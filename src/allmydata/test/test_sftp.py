@@ -2,7 +2,7 @@
 Ported to Python 3.
 """
 
-import re, struct, traceback, time, calendar
+import re, struct, traceback, time, calendar, tempfile
 from stat import S_IFREG, S_IFDIR
 
 from twisted.trial import unittest
@@ -21,8 +21,10 @@ except ImportError as e:
 else:
     conch_unavailable_reason = None  # type: ignore
 
-from allmydata.interfaces import IDirectoryNode, ExistingChildError, NoSuchChildError
+from allmydata.interfaces import IDirectoryNode, ExistingChildError, NoSuchChildError, \
+     MDMF_VERSION
 from allmydata.mutable.common import NotWriteableError
+from allmydata.mutable.filenode import MutableFileNode, MutableFileVersion
 
 from allmydata.util.consumer import download_to_data
 from allmydata.immutable import upload
@@ -561,6 +563,145 @@ class Handler(GridTestMixin, ShouldFailMixin, ReallyEqualMixin, unittest.TestCas
         d.addCallback(lambda ign: self.failUnlessEqual(self.handler._heisenfiles, {}))
         return d
 
+    @defer.inlineCallbacks
+    def test_openFile_read_ranges(self):
+        """
+        Large immutable and MDMF files opened read-only are read in blocks, as
+        the read requests need them, instead of being downloaded whole.
+        """
+        yield self._set_up("openFile_read_ranges")
+        block_size = sftpd.READ_BLOCK_SIZE
+        contents = bytes(range(256)) * (3 * block_size // 256) + b"tail"
+        yield self.root.add_file(u"large", upload.Data(contents, None))
+        mdmf = yield self.client.create_mutable_file(publish.MutableData(contents),
+                                                     version=MDMF_VERSION)
+        yield self.root.set_node(u"mdmf", mdmf)
+
+        for name in (b"large", b"mdmf"):
+            rf = yield self.handler.openFile(name, sftp.FXF_READ, {})
+            self.assertIsInstance(rf, sftpd.RangeReadOnlySFTPFile)
+
+            # seeking to the end only downloads the last block
+            data = yield rf.readChunk(len(contents) - 2, 100)
+            self.failUnlessReallyEqual(data, b"il")
+            self.failUnlessReallyEqual(list(rf._blocks), [3])
+
+            # a read that spans two blocks
+            data = yield rf.readChunk(block_size - 10, 20)
+            self.failUnlessReallyEqual(data, contents[block_size - 10:block_size + 10])
+            self.failUnlessReallyEqual(sorted(rf._blocks), [0, 1, 3])
+
+            data = yield rf.readChunk(5, 0)
+            self.failUnlessReallyEqual(data, b"")
+            yield self.shouldFailWithSFTPError(sftp.FX_EOF, "readChunk starting at EOF",
+                                               rf.readChunk, len(contents), 1)
+
+            attrs = yield rf.getAttrs()
+            self.failUnlessReallyEqual(attrs['size'], len(contents))
+            yield self.shouldFailWithSFTPError(sftp.FX_PERMISSION_DENIED, "writeChunk on read-only handle denied",
+                                               rf.writeChunk, 0, b"a")
+            yield rf.close()
+            yield self.shouldFailWithSFTPError(sftp.FX_BAD_MESSAGE, "readChunk on closed file",
+                                               rf.readChunk, 0, 1)
+
+        self.failUnlessEqual(sftpd.all_heisenfiles, {})
+        self.failUnlessEqual(self.handler._heisenfiles, {})
+
+    @defer.inlineCallbacks
+    def test_openFile_write_mdmf(self):
+        """
+        Writes to an existing MDMF file are published as one in-place update
+        that re-encodes only the segments that were written, unless the file
+        is made shorter.
+        """
+        yield self._set_up("openFile_write_mdmf")
+        block_size = sftpd.READ_BLOCK_SIZE
+        contents = bytes(range(256)) * (4 * block_size // 256) + b"tail"
+        mdmf = yield self.client.create_mutable_file(publish.MutableData(contents),
+                                                     version=MDMF_VERSION)
+        yield self.root.set_node(u"mdmf", mdmf)
+
+        updates = []
+        original_update_ranges = MutableFileVersion.update_ranges
+        def _update_ranges(version, ranges):
+            updates.append([(offset, data.get_size()) for (offset, data) in ranges])
+            return original_update_ranges(version, ranges)
+        self.patch(MutableFileVersion, "update_ranges", _update_ranges)
+        encoded = []
+        original_encode = publish.Publish._encode_segment
+        def _encode_segment(p, segnum):
+            encoded.append(segnum)
+            return original_encode(p, segnum)
+        self.patch(publish.Publish, "_encode_segment", _encode_segment)
+        overwrites = []
+        original_overwrite = MutableFileNode.overwrite
+        def _overwrite(node, data):
+            overwrites.append(data.get_size())
+            return original_overwrite(node, data)
+        self.patch(MutableFileNode, "overwrite", _overwrite)
+
+        wf = yield self.handler.openFile(b"mdmf", sftp.FXF_READ | sftp.FXF_WRITE, {})
+        yield wf.writeChunk(10, b"0123456789")
+        yield wf.writeChunk(3 * block_size + 1, b"abc")
+        # writing past the end-of-file fills the gap with zeroes
+        yield wf.writeChunk(len(contents) + 2, b"xyz")
+        expected = (contents[:10] + b"0123456789" + contents[20:3 * block_size + 1] +
+                    b"abc" + contents[3 * block_size + 4:] + b"\x00\x00xyz")
+
+        data = yield wf.readChunk(5, 20)
+        self.failUnlessReallyEqual(data, expected[5:25])
+        data = yield wf.readChunk(len(contents) - 4, 100)
+        self.failUnlessReallyEqual(data, expected[-9:])
+        attrs = yield wf.getAttrs()
+        self.failUnlessReallyEqual(attrs['size'], len(expected))
+        self.assertIsInstance(wf.consumer, sftpd.MutableUpdateFile)
+        yield wf.close()
+
+        self.failUnlessReallyEqual(updates, [[(10, 10), (3 * block_size + 1, 3),
+                                              (len(contents), 5)]])
+        # the segments in between are neither read nor re-encoded
+        self.failUnlessReallyEqual(block_size, publish.DEFAULT_MUTABLE_MAX_SEGMENT_SIZE)
+        self.failUnlessReallyEqual(encoded, [0, 3, 4])
+        self.failUnlessReallyEqual(overwrites, [])
+        node = yield self.root.get(u"mdmf")
+        data = yield node.download_best_version()
+        self.failUnlessReallyEqual(data, expected)
+
+        # truncating the file needs the whole file to be published
+        del updates[:]
+        wf = yield self.handler.openFile(b"mdmf", sftp.FXF_WRITE, {})
+        yield wf.setAttrs({'size': 100})
+        yield wf.writeChunk(50, b"hi")
+        yield wf.close()
+
+        self.failUnlessReallyEqual(updates, [])
+        self.failUnlessReallyEqual(overwrites, [100])
+        node = yield self.root.get(u"mdmf")
+        data = yield node.download_best_version()
+        self.failUnlessReallyEqual(data, expected[:50] + b"hi" + expected[52:100])
+
+        self.failUnlessEqual(sftpd.all_heisenfiles, {})
+        self.failUnlessEqual(self.handler._heisenfiles, {})
+
+    def test_MutableUpdateFile_read_error(self):
+        # a failure to download part of the file is reported as itself, not
+        # wrapped in a FirstError
+        class FakeVersion(object):
+            def get_size(self):
+                return 10
+
+        def _download_to_data(version, offset, size):
+            return defer.fail(ZeroDivisionError("download failed"))
+        self.patch(sftpd, "download_to_data", _download_to_data)
+
+        f = sftpd.MutableUpdateFile(FakeVersion(), tempfile.TemporaryFile)
+        self.addCleanup(f.close)
+        f.overwrite(0, b"abc")
+        d = f.read(0, 10)
+        d = self.assertFailure(d, ZeroDivisionError)
+        d.addCallback(lambda e: self.failUnlessReallyEqual(str(e), "download failed"))
+        return d
+
     def test_openFile_write(self):
         d = self._set_up("openFile_write")
         d.addCallback(lambda ign: self._set_up_tree())
@@ -2,9 +2,15 @@
 Ported to Python 3.
 """
 
+import threading
+
 from twisted.trial import unittest
 from twisted.application import service
-from allmydata.stats import CPUUsageMonitor
+from allmydata.history import History
+from allmydata.mutable.publish import PublishStatus
+from allmydata.stats import (
+    CPUUsageMonitor, LatencyHistogram, LATENCY_BUCKETS, StatsProvider,
+)
 from allmydata.util import pollmixin
 import allmydata.test.common_util as testutil
 
@@ -40,3 +46,63 @@ class CPUUsage(unittest.TestCase, pollmixin.PollMixin, testutil.StallMixin):
         d.addCallback(_check)
         return d
 
+
+
+class Histograms(unittest.TestCase):
+    def test_buckets(self):
+        h = LatencyHistogram(bounds=(0.1, 1.0, 10.0))
+        for latency in [0.05, 0.1, 0.5, 2.0, 3.0, 20.0]:
+            h.add(latency)
+        s = h.get_stats()
+        self.assertEqual(s["buckets"], [(0.1, 2), (1.0, 3), (10.0, 5)])
+        self.assertEqual(s["count"], 6)
+        self.assertAlmostEqual(s["sum"], 25.65)
+        self.assertEqual(len(h.counts), 4)
+
+    def test_default_buckets(self):
+        self.assertEqual(list(LATENCY_BUCKETS), sorted(LATENCY_BUCKETS))
+        self.assertEqual(LATENCY_BUCKETS[0], 0.00001)
+        self.assertEqual(LATENCY_BUCKETS[-1], 100.0)
+
+    def test_provider(self):
+        provider = StatsProvider(None)
+        provider.add_latency("storage_server.read", 0.002)
+        provider.add_latency("storage_server.read", 0.003)
+        histograms = provider.get_stats()["histograms"]
+        self.assertEqual(list(histograms), ["storage_server.read"])
+        self.assertEqual(histograms["storage_server.read"]["count"], 2)
+        self.assertEqual(dict(histograms["storage_server.read"]["buckets"])[0.0025], 1)
+
+    def test_provider_threads(self):
+        """
+        Latencies added from another thread wait while the histograms are in
+        use.
+        """
+        provider = StatsProvider(None)
+        with provider._lock:
+            t = threading.Thread(target=provider.add_latency,
+                                 args=("storage_server.read", 0.002))
+            t.start()
+            t.join(0.1)
+            self.assertTrue(t.is_alive())
+            self.assertEqual(provider.histograms, {})
+        t.join()
+        histograms = provider.get_stats()["histograms"]
+        self.assertEqual(histograms["storage_server.read"]["count"], 1)
+
+    def test_history(self):
+        """
+        ``History`` feeds the timings of the operations it is told about into
+        the stats provider's histograms.
+        """
+        provider = StatsProvider(None)
+        history = History(provider)
+        status = PublishStatus()
+        history.notify_publish(status, 1000)
+        status.add_per_server_time(object(), 0.5)
+        status.timings["total"] = 2.0
+        status.report_timings()
+        histograms = provider.get_stats()["histograms"]
+        self.assertEqual(histograms["mutable.publish.send"]["count"], 1)
+        self.assertEqual(histograms["mutable.publish.total"]["sum"], 2.0)
+        self.assertNotIn("mutable.publish.send_per_server", histograms)
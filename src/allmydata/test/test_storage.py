@@ -28,6 +28,13 @@ from testtools.matchers import (
     Contains,
     HasLength,
     IsInstance,
+    Is,
+    AfterPreprocessing,
+)
+from testtools.twistedsupport import (
+    succeeded,
+    failed,
+    has_no_result,
 )
 
 from twisted.trial import unittest
@@ -40,8 +47,10 @@ from hypothesis import given, strategies, example
 import itertools
 from allmydata import interfaces
 from allmydata.util import fileutil, hashutil, base32
+from allmydata.stats import StatsProvider
 from allmydata.storage.server import (
     StorageServer, DEFAULT_RENEWAL_TIME, FoolscapStorageServer,
+    AsyncStorageServer,
 )
 from allmydata.storage.shares import get_share_file
 from allmydata.storage.mutable import MutableShareFile
@@ -59,6 +68,7 @@ from allmydata.storage.common import storage_index_to_dir, \
      UnknownMutableContainerVersionError, UnknownImmutableContainerVersionError, \
      si_b2a, si_a2b
 from allmydata.storage.lease import LeaseInfo
+from allmydata.storage.fdcache import OpenFileCache, is_supported
 from allmydata.immutable.layout import WriteBucketProxy, WriteBucketProxy_v2, \
      ReadBucketProxy, _WriteBuffer
 from allmydata.mutable.layout import MDMFSlotWriteProxy, MDMFSlotReadProxy, \
@@ -82,6 +92,7 @@ from .common import (
     FakeDisk,
     SyncTestCase,
     AsyncTestCase,
+    skipIf,
 )
 
 from .common_util import FakeCanary
@@ -134,6 +145,8 @@ class UtilTests(SyncTestCase):
 class FakeStatsProvider:
     def count(self, name, delta=1):
         pass
+    def add_latency(self, name, latency):
+        pass
     def register_producer(self, producer):
         pass
 
@@ -1146,6 +1159,34 @@ class Server(AsyncTestCase):
         [lease] = ss.get_leases(b"si0")
         self.assertThat(lease.get_expiration_time(), Equals(123 + 123456 + DEFAULT_RENEWAL_TIME))
 
+    def test_add_leases(self):
+        """
+        ``StorageServer.add_leases`` renews or adds each lease like
+        ``add_lease``, and reports for each one whether there were any shares
+        to put it on.
+        """
+        clock = Clock()
+        clock.advance(123)
+        ss = self.create("test_add_leases", clock=clock)
+        renewal_secret, cancel_secret = self.create_bucket_5_shares(ss, b"si1")
+        self.create_bucket_5_shares(ss, b"si0")
+
+        # Time passes:
+        clock.advance(1000)
+
+        new_secret = b"\x05" * 32
+        results = ss.add_leases([
+            (b"si1", renewal_secret, cancel_secret),
+            (b"si9", new_secret, new_secret),
+            (b"si0", new_secret, new_secret),
+        ])
+        self.assertThat(results, Equals([True, False, True]))
+        [lease] = ss.get_leases(b"si1")
+        self.assertThat(lease.get_expiration_time(), Equals(123 + 1000 + DEFAULT_RENEWAL_TIME))
+        [_, lease] = ss.get_leases(b"si0")
+        self.assertThat(lease.get_expiration_time(), Equals(123 + 1000 + DEFAULT_RENEWAL_TIME))
+        self.assertThat(list(ss.get_leases(b"si9")), Equals([]))
+
     def test_have_shares(self):
         """By default the StorageServer has no shares."""
         workdir = self.workdir("test_have_shares")
@@ -3412,6 +3453,488 @@ class Stats(SyncTestCase):
         self.assertTrue(output["get"]["99_0_percentile"] is None, output)
         self.assertTrue(output["get"]["99_9_percentile"] is None, output)
 
+    def test_latency_histograms(self):
+        """
+        Every latency is also added to a histogram in the stats provider,
+        which keeps counting after the most recent samples have been
+        forgotten.
+        """
+        workdir = self.workdir("test_latency_histograms")
+        stats_provider = StatsProvider(None)
+        ss = StorageServer(workdir, b"\x00" * 20, stats_provider=stats_provider)
+        ss.setServiceParent(self.sparent)
+        for i in range(2000):
+            ss.add_latency("add-lease", 0.001)
+        ss.add_latency("readv", 0.5)
+
+        self.assertThat(ss.latencies["add-lease"], HasLength(1000))
+        histograms = stats_provider.get_stats()["histograms"]
+        self.assertThat(
+            sorted(histograms),
+            Equals(["storage_server.add-lease", "storage_server.readv"]),
+        )
+        self.assertThat(histograms["storage_server.add-lease"]["count"],
+                        Equals(2000))
+        self.assertThat(histograms["storage_server.readv"]["sum"], Equals(0.5))
+
+class ShareIndexTests(SyncTestCase):
+    """
+    Tests for a ``StorageServer`` with a share index.
+    """
+
+    def setUp(self):
+        super(ShareIndexTests, self).setUp()
+        self.sparent = LoggingServiceParent()
+        self.addCleanup(self.sparent.stopService)
+
+    def workdir(self, name):
+        return os.path.join("storage", "ShareIndexTests", name)
+
+    def create(self, name, share_index=True):
+        ss = StorageServer(self.workdir(name), b"\x00" * 20,
+                           share_index=share_index, clock=Clock())
+        ss.setServiceParent(self.sparent)
+        return ss
+
+    def crawl(self, ss):
+        """
+        Run one full cycle of the share index crawler.
+        """
+        crawler = ss.bucket_counter
+        crawler.cpu_slice = 500
+        crawler.start_current_prefix(time.time())
+
+    def upload(self, ss, storage_index, sharenums, data):
+        secret = hashutil.tagged_hash(b"secret", storage_index)
+        _, writers = ss.allocate_buckets(storage_index, secret, secret,
+                                         sharenums, len(data))
+        for writer in writers.values():
+            writer.write(0, data)
+            writer.close()
+
+    def writev(self, ss, storage_index, tw_vectors):
+        secrets = (hashutil.tagged_hash(b"we", storage_index),
+                   hashutil.tagged_hash(b"renew", storage_index),
+                   hashutil.tagged_hash(b"cancel", storage_index))
+        (ok, _) = ss.slot_testv_and_readv_and_writev(
+            storage_index, secrets, tw_vectors, [])
+        self.assertTrue(ok)
+
+    def test_incomplete(self):
+        """
+        Until a crawler cycle has finished, the index is not used, but it is
+        kept up to date anyway.
+        """
+        ss = self.create("test_incomplete")
+        index = ss._share_index
+        self.upload(ss, b"si1" * 5 + b"x", [0, 3], b"immutable data")
+        self.assertFalse(index.is_complete())
+        self.assertThat(dict(ss.get_shares(b"si1" * 5 + b"x")),
+                        HasLength(2))
+        self.assertThat(index.get_shares(b"si1" * 5 + b"x"),
+                        Equals({0: ("immutable", 14), 3: ("immutable", 14)}))
+        self.crawl(ss)
+        self.assertTrue(index.is_complete())
+
+    def test_rebuild(self):
+        """
+        The crawler indexes shares that were there before the index was
+        enabled, and forgets ones that are gone.
+        """
+        ss = self.create("test_rebuild", share_index=False)
+        self.upload(ss, b"a" * 16, [1], b"some data")
+        self.writev(ss, b"b" * 16, {2: ([], [(0, b"mutable data")], None)})
+        ss.disownServiceParent()
+        ss = self.create("test_rebuild")
+        index = ss._share_index
+        index.set_share(b"c" * 16, 0, "immutable", 10)
+        self.crawl(ss)
+        self.assertThat(index.get_shares(b"a" * 16),
+                        Equals({1: ("immutable", 9)}))
+        self.assertThat(index.get_shares(b"b" * 16),
+                        Equals({2: ("mutable", 12)}))
+        self.assertThat(index.get_shares(b"c" * 16), Equals({}))
+        self.assertThat(index.get_bucket_count(), Equals(2))
+        self.assertThat(
+            ss.get_stats()["storage_server.total_bucket_count"], Equals(2))
+        self.assertTrue(ss.have_shares())
+
+    def test_updates(self):
+        """
+        Once complete, the index answers share lookups, and is kept up to
+        date as shares are created, written and deleted.
+        """
+        ss = self.create("test_updates")
+        self.crawl(ss)
+        self.assertFalse(ss.have_shares())
+        self.upload(ss, b"i" * 16, [0, 1], b"immutable")
+        self.writev(ss, b"m" * 16, {0: ([], [(0, b"mutable")], None),
+                                    5: ([], [(0, b"mutable")], None)})
+        self.assertThat(
+            ss.get_immutable_share_lengths([b"i" * 16, b"m" * 16, b"x" * 16]),
+            Equals({b"i" * 16: {0: 9, 1: 9}, b"m" * 16: {}, b"x" * 16: {}}))
+        self.assertThat(ss.enumerate_mutable_shares(b"m" * 16),
+                        Equals({0, 5}))
+        self.assertThat(sorted(ss.get_buckets(b"i" * 16)), Equals([0, 1]))
+
+        self.writev(ss, b"m" * 16, {0: ([], [(0, b"a longer mutable")], None),
+                                    5: ([], [], 0)})
+        self.assertThat(ss._share_index.get_shares(b"m" * 16),
+                        Equals({0: ("mutable", 16)}))
+        self.assertThat(ss.slot_readv(b"m" * 16, [], [(0, 8)]),
+                        Equals({0: [b"a longer"]}))
+
+        # something else deletes a share
+        os.unlink(dict(ss._list_share_files(b"i" * 16))[1])
+        ss.bucket_changed(b"i" * 16)
+        self.assertThat(sorted(ss.get_buckets(b"i" * 16)), Equals([0]))
+        self.assertThat(ss._share_index.get_bucket_count(), Equals(2))
+
+
+    def test_disabled(self):
+        """
+        An index left by a run with the index disabled is rebuilt before it
+        is used again.
+        """
+        ss = self.create("test_disabled")
+        self.crawl(ss)
+        self.assertTrue(ss._share_index.is_complete())
+        ss.disownServiceParent()
+        ss = self.create("test_disabled", share_index=False)
+        self.writev(ss, b"m" * 16, {0: ([], [(0, b"mutable")], None)})
+        ss.disownServiceParent()
+        ss = self.create("test_disabled")
+        self.assertFalse(ss._share_index.is_complete())
+        self.assertThat(ss.enumerate_mutable_shares(b"m" * 16), Equals({0}))
+        self.writev(ss, b"m" * 16, {0: ([], [(0, b"changed")], None)})
+        self.assertThat(ss.slot_readv(b"m" * 16, [], [(0, 7)]),
+                        Equals({0: [b"changed"]}))
+
+    def test_restart(self):
+        """
+        An index closed by a clean shutdown is still complete when the
+        server starts again.
+        """
+        ss = self.create("test_restart")
+        self.crawl(ss)
+        ss.stopService()
+        ss.disownServiceParent()
+        ss = self.create("test_restart")
+        self.assertTrue(ss._share_index.is_complete())
+
+    def test_unclean_shutdown(self):
+        """
+        An index that was not closed (because the server crashed, say) may
+        be missing shares, so it is rebuilt before it is used again.
+        """
+        ss = self.create("test_unclean_shutdown")
+        self.crawl(ss)
+        self.upload(ss, b"i" * 16, [0], b"immutable data")
+        # the share reached the disk, but not the index
+        ss._share_index.remove_share(b"i" * 16, 0)
+        self.patch(ss._share_index, "close", lambda: None)
+        ss.disownServiceParent()
+        ss = self.create("test_unclean_shutdown")
+        self.assertFalse(ss._share_index.is_complete())
+        self.assertThat(sorted(ss.get_buckets(b"i" * 16)), Equals([0]))
+        self.crawl(ss)
+        self.assertTrue(ss._share_index.is_complete())
+        self.assertThat(sorted(ss.get_buckets(b"i" * 16)), Equals([0]))
+
+    def test_writev_unindexed(self):
+        """
+        Mutable writes look at the bucket directory, so they check the write
+        enabler of shares that the index is missing.
+        """
+        ss = self.create("test_writev_unindexed")
+        self.crawl(ss)
+        self.writev(ss, b"m" * 16, {0: ([], [(0, b"mutable")], None)})
+        ss._share_index.remove_share(b"m" * 16, 0)
+        secrets = (b"\x01" * 32,
+                   hashutil.tagged_hash(b"renew", b"m" * 16),
+                   hashutil.tagged_hash(b"cancel", b"m" * 16))
+        self.assertRaises(BadWriteEnablerError,
+                          ss.slot_testv_and_readv_and_writev,
+                          b"m" * 16, secrets,
+                          {0: ([], [(0, b"stolen")], None)}, [])
+        self.writev(ss, b"m" * 16, {0: ([], [(0, b"changed")], None)})
+        self.assertThat(list(ss._list_share_files(b"m" * 16)), HasLength(1))
+
+
+class LeaseIndexTests(SyncTestCase):
+    """
+    Tests for a ``StorageServer`` with a lease index, and for the lease
+    checker that uses it.
+    """
+
+    def setUp(self):
+        super(LeaseIndexTests, self).setUp()
+        self.sparent = LoggingServiceParent()
+        self.addCleanup(self.sparent.stopService)
+        # The lease checker looks at the real time.
+        self.clock = Clock()
+        self.clock.advance(time.time())
+
+    def workdir(self, name):
+        return os.path.join("storage", "LeaseIndexTests", name)
+
+    def create(self, name, lease_index=True, **kwargs):
+        ss = StorageServer(self.workdir(name), b"\x00" * 20,
+                           lease_index=lease_index, clock=self.clock,
+                           **kwargs)
+        ss.setServiceParent(self.sparent)
+        # count the buckets the lease checker reads from disk
+        lc = ss.lease_checker
+        lc.buckets_read = 0
+        process_bucket_files = lc.process_bucket_files
+        def count_bucket_files(*args):
+            lc.buckets_read += 1
+            return process_bucket_files(*args)
+        lc.process_bucket_files = count_bucket_files
+        return ss
+
+    def crawl(self, ss):
+        """
+        Run one full cycle of the lease checker.
+        """
+        lc = ss.lease_checker
+        lc.cpu_slice = 500
+        lc.buckets_read = 0
+        lc.start_current_prefix(time.time())
+
+    def upload(self, ss, storage_index, sharenums, data):
+        secret = hashutil.tagged_hash(b"secret", storage_index)
+        _, writers = ss.allocate_buckets(storage_index, secret, secret,
+                                         sharenums, len(data))
+        for writer in writers.values():
+            writer.write(0, data)
+            writer.close()
+        return secret
+
+    def writev(self, ss, storage_index, tw_vectors):
+        secrets = (hashutil.tagged_hash(b"we", storage_index),
+                   hashutil.tagged_hash(b"renew", storage_index),
+                   hashutil.tagged_hash(b"cancel", storage_index))
+        (ok, _) = ss.slot_testv_and_readv_and_writev(
+            storage_index, secrets, tw_vectors, [])
+        self.assertTrue(ok)
+
+    def indexed(self, ss, storage_index):
+        """
+        Return what the lease index knows about the shares of
+        ``storage_index``, as a dict mapping share numbers to (sharetype,
+        sharebytes, sorted expiration times).
+        """
+        prefix = si_b2a(storage_index)[:2].decode("ascii")
+        shares = ss._lease_index.get_prefix(prefix).get(storage_index, {})
+        return {
+            shnum: (share.sharetype, share.sharebytes,
+                    sorted(share.expiration_times))
+            for (shnum, share) in shares.items()
+        }
+
+    def test_updates(self):
+        """
+        The index is kept up to date as shares are created, written and
+        deleted, and as leases are added and renewed.
+        """
+        ss = self.create("test_updates")
+        now = int(self.clock.seconds())
+        secret = self.upload(ss, b"i" * 16, [0, 1], b"immutable")
+        size = os.stat(dict(ss._list_share_files(b"i" * 16))[0]).st_size
+        expected = ("immutable", size, [now + DEFAULT_RENEWAL_TIME])
+        self.assertThat(self.indexed(ss, b"i" * 16),
+                        Equals({0: expected, 1: expected}))
+
+        self.clock.advance(100)
+        ss.add_lease(b"i" * 16, secret, secret)
+        ss.add_leases([(b"i" * 16, b"\x01" * 32, b"\x01" * 32)])
+        # the first renews the lease, the second adds one
+        expected = ("immutable", size + 72,
+                    [now + 100 + DEFAULT_RENEWAL_TIME] * 2)
+        self.assertThat(self.indexed(ss, b"i" * 16),
+                        Equals({0: expected, 1: expected}))
+
+        self.writev(ss, b"m" * 16, {0: ([], [(0, b"mutable")], None),
+                                    5: ([], [(0, b"mutable")], None)})
+        self.assertThat(sorted(self.indexed(ss, b"m" * 16)), Equals([0, 5]))
+        self.writev(ss, b"m" * 16, {5: ([], [], 0)})
+        [(sharetype, _, expiration_times)] = self.indexed(
+            ss, b"m" * 16).values()
+        self.assertThat(sharetype, Equals("mutable"))
+        self.assertThat(expiration_times,
+                        Equals([now + 100 + DEFAULT_RENEWAL_TIME]))
+
+        # something else deletes a share
+        os.unlink(dict(ss._list_share_files(b"i" * 16))[1])
+        ss.bucket_changed(b"i" * 16)
+        self.assertThat(sorted(self.indexed(ss, b"i" * 16)), Equals([0]))
+
+    def test_disabled(self):
+        """
+        An index left by a run with the index disabled is rebuilt before it
+        is used again.
+        """
+        ss = self.create("test_disabled")
+        secret = self.upload(ss, b"i" * 16, [0], b"immutable")
+        self.crawl(ss)
+        self.assertTrue(ss._lease_index.is_complete())
+        ss.disownServiceParent()
+        ss = self.create("test_disabled", lease_index=False)
+        self.clock.advance(100)
+        ss.add_lease(b"i" * 16, secret, secret)
+        ss.disownServiceParent()
+        ss = self.create("test_disabled")
+        self.assertFalse(ss._lease_index.is_complete())
+        self.crawl(ss)
+        self.assertThat(ss.lease_checker.buckets_read, Equals(1))
+        [(_, _, expiration_times)] = self.indexed(ss, b"i" * 16).values()
+        self.assertThat(
+            expiration_times,
+            Equals([int(self.clock.seconds()) + DEFAULT_RENEWAL_TIME]))
+
+    def test_indexed_cycle(self):
+        """
+        The first lease checker cycle reads every bucket and builds the
+        index. Later cycles only read the buckets that need it, and produce
+        the same statistics.
+        """
+        ss = self.create("test_indexed_cycle")
+        lc = ss.lease_checker
+        for i in range(5):
+            self.upload(ss, bytes([i]) * 16, [0, 1], b"immutable data")
+        self.writev(ss, b"m" * 16, {0: ([], [(0, b"mutable")], None)})
+        # added before the index, so only the first cycle finds it
+        ss._lease_index.set_bucket(b"m" * 16, {})
+
+        self.crawl(ss)
+        self.assertThat(lc.buckets_read, Equals(6))
+        self.assertTrue(ss._lease_index.is_complete())
+        self.assertThat(self.indexed(ss, b"m" * 16), HasLength(1))
+
+        self.crawl(ss)
+        self.assertThat(lc.buckets_read, Equals(0))
+        history = lc.get_state()["history"]
+        for key in ("leases-per-share-histogram", "lease-age-histogram",
+                    "space-recovered"):
+            self.assertThat(history["1"][key], Equals(history["0"][key]))
+        self.assertThat(history["1"]["space-recovered"]["examined-shares"],
+                        Equals(11))
+
+    def test_expire(self):
+        """
+        A cycle that uses the index reads the buckets with expired leases
+        from disk, removes those leases, and updates the index.
+        """
+        ss = self.create("test_expire", expiration_enabled=True,
+                         expiration_mode="age",
+                         expiration_override_lease_duration=2000)
+        lc = ss.lease_checker
+        self.upload(ss, b"a" * 16, [0], b"immutable data")
+        secret = self.upload(ss, b"b" * 16, [0], b"immutable data")
+        ss.add_lease(b"b" * 16, b"\x01" * 32, b"\x01" * 32)
+        self.crawl(ss)
+        self.assertThat(lc.buckets_read, Equals(2))
+
+        # backdate the first lease on each bucket
+        now = time.time()
+        for (storage_index, renew_secret) in [
+            (b"a" * 16, hashutil.tagged_hash(b"secret", b"a" * 16)),
+            (b"b" * 16, secret),
+        ]:
+            for sf in ss._iter_share_files(storage_index):
+                sf.renew_lease(renew_secret, now - 1000, allow_backdate=True)
+            ss.index_leases(storage_index)
+
+        self.crawl(ss)
+        self.assertThat(lc.buckets_read, Equals(2))
+        self.assertThat(list(ss._list_share_files(b"a" * 16)), Equals([]))
+        self.assertThat(self.indexed(ss, b"a" * 16), Equals({}))
+        [(_, _, expiration_times)] = self.indexed(ss, b"b" * 16).values()
+        self.assertThat(expiration_times, HasLength(1))
+        rec = lc.get_state()["history"]["1"]["space-recovered"]
+        self.assertThat(rec["actual-shares"], Equals(1))
+        self.assertThat(rec["examined-shares"], Equals(2))
+
+        # only the empty directory of the first bucket is left to list
+        self.crawl(ss)
+        self.assertThat(lc.buckets_read, Equals(1))
+        self.assertThat(lc.get_state()["history"]["2"]["space-recovered"]
+                        ["actual-shares"], Equals(0))
+
+
+class AsyncStorageServerTests(SyncTestCase):
+    """Tests for ``allmydata.storage.server.AsyncStorageServer``."""
+
+    def setUp(self):
+        super(AsyncStorageServerTests, self).setUp()
+        self.sparent = LoggingServiceParent()
+        self.addCleanup(self.sparent.stopService)
+        ss = StorageServer(self.mktemp(), b"\x00" * 20)
+        ss.setServiceParent(self.sparent)
+        self.server = AsyncStorageServer(Clock(), ss)
+
+        # Instead of running functions in a thread, record them and let the
+        # test decide when they finish:
+        self.running = []
+
+        async def run(f, *args, **kwargs):
+            d = defer.Deferred()
+            self.running.append((d, args))
+            return await d
+
+        self.server._run = run
+
+    def add_lease(self, storage_index):
+        return defer.Deferred.fromCoroutine(
+            self.server.add_lease(storage_index, b"r" * 32, b"c" * 32)
+        )
+
+    def test_ordered_per_storage_index(self):
+        """
+        Ordered operations on the same storage index run one at a time, in
+        the order they were started; those on different storage indexes run
+        concurrently.
+        """
+        first = self.add_lease(b"a" * 16)
+        second = self.add_lease(b"a" * 16)
+        other = self.add_lease(b"b" * 16)
+        self.assertThat(
+            [args[0] for (_, args) in self.running],
+            Equals([b"a" * 16, b"b" * 16]),
+        )
+
+        self.running[0][0].callback(None)
+        self.assertThat(first, succeeded(Equals(None)))
+        self.assertThat(second, has_no_result())
+        self.assertThat(self.running, HasLength(3))
+        self.assertThat(self.running[2][1][0], Equals(b"a" * 16))
+
+        self.running[1][0].callback(None)
+        self.running[2][0].callback(None)
+        self.assertThat(second, succeeded(Equals(None)))
+        self.assertThat(other, succeeded(Equals(None)))
+
+        # Nothing is left holding locks:
+        self.assertThat(self.server._locks, Equals({}))
+
+    def test_failure_releases_lock(self):
+        """
+        If an ordered operation fails, the next one for the same storage
+        index still runs.
+        """
+        first = self.add_lease(b"a" * 16)
+        second = self.add_lease(b"a" * 16)
+        self.running[0][0].errback(ZeroDivisionError())
+        self.assertThat(
+            first,
+            failed(AfterPreprocessing(lambda f: f.type, Is(ZeroDivisionError))),
+        )
+        self.running[1][0].callback(None)
+        self.assertThat(second, succeeded(Equals(None)))
+        self.assertThat(self.server._locks, Equals({}))
+
+
 immutable_schemas = strategies.sampled_from(list(ALL_IMMUTABLE_SCHEMAS))
 
 class ShareFileTests(SyncTestCase):
@@ -3551,6 +4074,136 @@ class ShareFileTests(SyncTestCase):
         (loaded_lease,) = sf.get_leases()
         self.assertTrue(loaded_lease.is_cancel_secret(cancel_secret))
 
+
+@skipIf(not is_supported(), "os.pread() is not available")
+class OpenFileCacheTests(SyncTestCase):
+    """
+    Tests for ``allmydata.storage.fdcache.OpenFileCache`` and its use by
+    ``ShareFile`` and ``StorageServer``.
+    """
+
+    def make_file(self, data):
+        path = self.mktemp()
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_reuse(self):
+        """
+        A file is opened once, and read from the same descriptor until it is
+        invalidated.
+        """
+        cache = OpenFileCache(4)
+        path = self.make_file(b"0123456789")
+        with cache.open(path) as cached:
+            self.assertThat(cached.pread(4, 3), Equals(b"3456"))
+            fd = cached.fd
+        with cache.open(path) as cached:
+            self.assertThat(cached.fd, Equals(fd))
+        self.assertThat((cache.hits, cache.misses), Equals((1, 1)))
+
+        cache.invalidate(path)
+        self.assertThat(cache, HasLength(0))
+        self.assertRaises(OSError, os.fstat, fd)
+
+    def test_replaced(self):
+        """
+        A file that is replaced without invalidating the cache is reopened.
+        """
+        cache = OpenFileCache(4)
+        path = self.make_file(b"old")
+        with cache.open(path) as cached:
+            self.assertThat(cached.pread(3, 0), Equals(b"old"))
+        os.unlink(path)
+        os.rename(self.make_file(b"new"), path)
+        with cache.open(path) as cached:
+            self.assertThat(cached.pread(3, 0), Equals(b"new"))
+        self.assertThat((cache.hits, cache.misses), Equals((0, 2)))
+
+    def test_eviction(self):
+        """
+        Once more than ``max_open`` files have been opened, the least recently
+        used one is closed.
+        """
+        cache = OpenFileCache(2)
+        paths = [self.make_file(b"%d" % (i,)) for i in range(3)]
+        fds = []
+        for path in paths[:2]:
+            with cache.open(path) as cached:
+                fds.append(cached.fd)
+        with cache.open(paths[0]):
+            pass
+        with cache.open(paths[2]) as cached:
+            self.assertThat(cached.pread(1, 0), Equals(b"2"))
+        self.assertThat(cache, HasLength(2))
+        # paths[1] was the least recently used
+        os.fstat(fds[0])
+        self.assertRaises(OSError, os.fstat, fds[1])
+
+    def test_invalidate_in_use(self):
+        """
+        A descriptor that is invalidated while it is being used stays open
+        until the user is done with it.
+        """
+        cache = OpenFileCache(2)
+        path = self.make_file(b"data")
+        with cache.open(path) as cached:
+            cache.invalidate_directory(os.path.dirname(path))
+            self.assertThat(cache, HasLength(0))
+            self.assertThat(cached.pread(4, 0), Equals(b"data"))
+        self.assertThat(cached.fd, Equals(-1))
+
+    def test_sharefile(self):
+        """
+        ``ShareFile`` reads through the cache, is not confused by leases added
+        after its header was cached, and invalidates the cache when it deletes
+        its file.
+        """
+        path = self.mktemp()
+        sf = ShareFile(path, max_size=5, create=True)
+        sf.write_share_data(0, b"abcde")
+        cache = OpenFileCache(2)
+
+        sf = ShareFile(path, fd_cache=cache)
+        self.assertThat(sf.read_share_data(1, 10), Equals(b"bcde"))
+        lease = LeaseInfo(
+            owner_num=0,
+            renew_secret=b"r" * 32,
+            cancel_secret=b"c" * 32,
+            expiration_time=2 ** 31,
+        )
+        sf.add_lease(lease)
+        sf = ShareFile(path, fd_cache=cache)
+        self.assertThat(sf.get_length(), Equals(5))
+        self.assertThat(sf.read_share_data(0, 100), Equals(b"abcde"))
+        self.assertThat((cache.hits, cache.misses), Equals((3, 1)))
+
+        sf.cancel_lease(b"c" * 32)
+        self.assertFalse(os.path.exists(path))
+        self.assertThat(cache, HasLength(0))
+
+    def test_server_bucket_changed(self):
+        """
+        When shares are deleted behind the storage server's back, telling it
+        about that makes it stop serving them from open descriptors.
+        """
+        ss = StorageServer(self.mktemp(), b"\x00" * 20, clock=Clock())
+        storage_index = b"s" * 16
+        secret = b"x" * 32
+        _, writers = ss.allocate_buckets(storage_index, secret, secret,
+                                         {0}, 4)
+        writers[0].write(0, b"data")
+        writers[0].close()
+        self.assertThat(ss.get_buckets(storage_index)[0].read(0, 4),
+                        Equals(b"data"))
+        self.assertThat(ss._fd_cache, HasLength(1))
+
+        os.unlink(dict(ss.get_shares(storage_index))[0])
+        ss.bucket_changed(storage_index)
+        self.assertThat(ss._fd_cache, HasLength(0))
+        self.assertThat(ss.get_buckets(storage_index), Equals({}))
+
+
 mutable_schemas = strategies.sampled_from(list(ALL_MUTABLE_SCHEMAS))
 
 class MutableShareFileTests(SyncTestCase):
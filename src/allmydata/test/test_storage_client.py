@@ -51,6 +51,7 @@ from twisted.trial import unittest
 from twisted.internet.defer import (
     Deferred,
     inlineCallbacks,
+    succeed,
 )
 from twisted.python.filepath import (
     FilePath,
@@ -59,6 +60,7 @@ from twisted.internet.task import Clock
 
 from foolscap.api import (
     Tub,
+    flushEventualQueue,
 )
 from foolscap.ipb import (
     IConnectionHintHandler,
@@ -96,8 +98,13 @@ from allmydata.storage_client import (
     _FoolscapStorage,
     _NullStorage,
     _pick_a_http_server,
+    _HTTPStorageServer,
     ANONYMOUS_STORAGE_NURLS,
 )
+from ..storage.http_client import (
+    ClientException,
+    StorageClientImmutables,
+)
 from ..storage.server import (
     StorageServer,
 )
@@ -897,3 +904,74 @@ class PickHTTPServerTests(unittest.SynchronousTestCase):
         exc = self.failureResultOf(result).value
         self.assertIsInstance(exc, MultiFailure)
         self.assertEqual({f.value for f in exc.failures}, {exception2, exception1})
+
+
+class HTTPShareLookupTests(unittest.TestCase):
+    """
+    Tests for the batched share lookups of ``_HTTPStorageServer``.
+    """
+
+    def setUp(self):
+        self.batches: list[list[bytes]] = []
+        self.reads: list[tuple[int, int]] = []
+        self.patch(
+            StorageClientImmutables, "list_shares_batch", self.list_shares_batch
+        )
+        self.patch(
+            StorageClientImmutables, "read_share_chunk", self.read_share_chunk
+        )
+        self.server = _HTTPStorageServer(http_client=None)
+
+    async def list_shares_batch(self, storage_indexes):
+        self.batches.append(storage_indexes)
+        if len(self.batches) == 2:
+            raise ClientException(500)
+        return {si: {0: 10, 3: 20} for si in storage_indexes}
+
+    def read_share_chunk(self, storage_index, share_number, offset, length):
+        self.reads.append((offset, length))
+        return succeed(b"x" * length)
+
+    @inlineCallbacks
+    def test_failed_chunk(self):
+        """
+        If one chunk of a batched lookup fails, only the lookups of that
+        chunk fail; the others get the shares their chunk found.
+        """
+        storage_indexes = [b"%016d" % i for i in range(1500)]
+        results = [
+            self.server.get_buckets(storage_index).addErrback(
+                lambda f: f.trap(ClientException)
+            )
+            for storage_index in storage_indexes
+        ]
+        yield flushEventualQueue()
+        self.assertEqual(
+            [len(batch) for batch in self.batches], [1024, 1500 - 1024]
+        )
+        results = [self.successResultOf(d) for d in results]
+        self.assertEqual(
+            [set(buckets) for buckets in results[:1024]], [{0, 3}] * 1024
+        )
+        self.assertEqual(results[1024:], [ClientException] * (1500 - 1024))
+
+    @inlineCallbacks
+    def test_share_lengths(self):
+        """
+        The bucket readers know the share lengths the batched lookup
+        returned, and don't ask the server for data past them.
+        """
+        d = self.server.get_buckets(b"a" * 16)
+        self.server.get_buckets(b"b" * 16)
+        yield flushEventualQueue()
+        buckets = self.successResultOf(d)
+        self.assertEqual(
+            {shnum: bucket.local_object.share_length
+             for (shnum, bucket) in buckets.items()},
+            {0: 10, 3: 20},
+        )
+        data = yield buckets[0].callRemote("read", 5, 100)
+        self.assertEqual(data, b"x" * 5)
+        data = yield buckets[0].callRemote("read", 10, 100)
+        self.assertEqual(data, b"")
+        self.assertEqual(self.reads, [(5, 5)])
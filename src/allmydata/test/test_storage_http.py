@@ -35,23 +35,34 @@ from collections_extended import RangeMap
 from twisted.internet.task import Clock, Cooperator
 from twisted.internet.interfaces import IReactorTime, IReactorFromThreads
 from twisted.internet.defer import CancelledError, Deferred, ensureDeferred
+from twisted.internet.testing import StringTransport
 from twisted.web import http
 from twisted.web.http_headers import Headers
 from werkzeug import routing
 from werkzeug.exceptions import NotFound as WNotFound
-from testtools.matchers import Equals
+from testtools.matchers import (
+    Equals,
+    AfterPreprocessing,
+    HasLength,
+    StartsWith,
+    IsInstance,
+)
+from testtools.twistedsupport import succeeded, failed
 from zope.interface import implementer
 
 from ..util.cbor import dumps
 from ..util.deferredutil import async_to_deferred
 from ..util.cputhreadpool import disable_thread_pool_for_test
+from ..util.iothreadpool import disable_io_thread_pool_for_test
 from .common import SyncTestCase
 from ..storage.http_common import (
     get_content_type,
     CBOR_MIME_TYPE,
     response_is_not_html,
+    swissnum_auth_header,
 )
 from ..storage.common import si_b2a
+from ..storage.immutable import ConflictingWriteError
 from ..storage.lease import LeaseInfo
 from ..storage.server import StorageServer
 from ..storage.http_server import (
@@ -65,6 +76,8 @@ from ..storage.http_server import (
     read_encoded,
     _SCHEMAS as SERVER_SCHEMAS,
     BaseApp,
+    _StreamingReadProducer,
+    _StreamingUpload,
 )
 from ..storage.http_client import (
     StorageClient,
@@ -104,6 +117,217 @@ class HTTPUtilities(SyncTestCase):
         assert_header_values_result(["text/html;encoding=utf-8"], "text/html")
 
 
+class FakeStreamingRequest:
+    """
+    Just enough of a ``Request`` for ``_StreamingReadProducer``.
+    """
+
+    def __init__(self):
+        self.producer = None
+        self.written = []
+
+    def registerProducer(self, producer, streaming):
+        assert streaming
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def write(self, data):
+        self.written.append(data)
+
+
+class StreamingReadProducerTests(SyncTestCase):
+    """Tests for ``_StreamingReadProducer``."""
+
+    def setUp(self):
+        super().setUp()
+        self.data = urandom(1000)
+        self.reads = []
+        self.request = FakeStreamingRequest()
+
+    async def read_data(self, offset, length):
+        self.reads.append((offset, length))
+        return self.data[offset : offset + length]
+
+    def produce(self, start, length):
+        return _StreamingReadProducer.produce_to(
+            self.request, self.read_data, start, length
+        )
+
+    def test_aligned_chunks(self):
+        """
+        After the first chunk, reads start at multiples of the chunk size.
+        """
+        d = Deferred()
+        producer = _StreamingReadProducer(self.request, self.read_data, d, 50, 800, 300)
+        self.request.registerProducer(producer, True)
+        producer._read_next()
+        self.assertThat(d, succeeded(Equals(b"")))
+        self.assertEqual(self.reads, [(50, 250), (300, 300), (600, 250)])
+        self.assertEqual(b"".join(self.request.written), self.data[50:850])
+        self.assertEqual(self.request.producer, None)
+
+    def test_paused(self):
+        """
+        While paused, one chunk is read ahead and held until resumed.
+        """
+        producer = _StreamingReadProducer(
+            self.request, self.read_data, Deferred(), 0, 1000, 100
+        )
+        self.request.registerProducer(producer, True)
+        producer.pauseProducing()
+        producer._read_next()
+        self.assertEqual(self.reads, [(0, 100)])
+        self.assertEqual(self.request.written, [])
+        producer.resumeProducing()
+        self.assertEqual(b"".join(self.request.written), self.data)
+
+    def test_empty(self):
+        """
+        Producing an empty range finishes right away without reading.
+        """
+        d = self.produce(10, 0)
+        self.assertThat(d, succeeded(Equals(b"")))
+        self.assertEqual((self.reads, self.request.written), ([], []))
+
+    def test_short_read(self):
+        """
+        A read that returns less data than asked for fails the response.
+        """
+        d = self.produce(900, 200)
+        self.assertThat(
+            d,
+            failed(AfterPreprocessing(lambda f: f.type, Equals(ValueError))),
+        )
+        self.assertEqual(self.request.producer, None)
+
+
+    def test_disconnect(self):
+        """
+        If the client goes away in the middle of the response, the response
+        finishes and nothing more is read or written.
+        """
+        producer = _StreamingReadProducer(
+            self.request, self.read_data, Deferred(), 0, 1000, 100
+        )
+        d = producer.result
+        self.request.registerProducer(producer, True)
+        producer.pauseProducing()
+        producer._read_next()
+        producer.stopProducing()
+        self.assertThat(d, succeeded(Equals(b"")))
+        self.assertEqual(self.request.producer, None)
+        producer.resumeProducing()
+        producer._read_next()
+        self.assertEqual((self.reads, self.request.written), ([(0, 100)], []))
+
+
+class FakeTransport:
+    """
+    Records whether it has been paused.
+    """
+
+    paused = False
+
+    def pauseProducing(self):
+        assert not self.paused
+        self.paused = True
+
+    def resumeProducing(self):
+        assert self.paused
+        self.paused = False
+
+
+class FakeAsyncStorageServer:
+    """
+    Just enough of an ``AsyncStorageServer`` for ``_StreamingUpload``; each
+    write waits until the test fires it.
+    """
+
+    def __init__(self):
+        self.writes = []
+
+    def write_bucket(self, storage_index, bucket, offset, data):
+        d = Deferred()
+        self.writes.append((offset, data, d))
+        return d
+
+
+class StreamingUploadTests(SyncTestCase):
+    """Tests for ``_StreamingUpload``."""
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeAsyncStorageServer()
+        self.transport = FakeTransport()
+        self.upload = _StreamingUpload(
+            self.server, b"si", None, 100, 50, self.transport, max_buffered=20
+        )
+
+    def test_write_as_received(self):
+        """
+        Data is written as it arrives, coalescing whatever arrived during the
+        previous write, and ``when_done()`` fires once all of it is written.
+        """
+        done = self.upload.when_done()
+        self.upload.write(b"a" * 10)
+        self.upload.write(b"b" * 5)
+        self.upload.write(b"c" * 5)
+        self.assertThat(
+            [(offset, data) for (offset, data, _) in self.server.writes],
+            Equals([(100, b"a" * 10)]),
+        )
+        self.server.writes[0][2].callback(False)
+        self.assertThat(
+            [(offset, data) for (offset, data, _) in self.server.writes[1:]],
+            Equals([(110, b"b" * 5 + b"c" * 5)]),
+        )
+        self.upload.write(b"d" * 30)
+        self.server.writes[1][2].callback(False)
+        self.assertFalse(done.called)
+        self.server.writes[2][2].callback(True)
+        self.assertThat(self.server.writes[2][:2], Equals((120, b"d" * 30)))
+        self.assertThat(done, succeeded(Equals(True)))
+
+    def test_backpressure(self):
+        """
+        Once ``max_buffered`` bytes are waiting to be written, the transport is
+        paused until at most half of that is left.
+        """
+        self.upload.write(b"a" * 10)
+        self.upload.write(b"b" * 10)
+        self.assertTrue(self.transport.paused)
+        self.server.writes[0][2].callback(False)
+        # 10 bytes are still being written
+        self.assertFalse(self.transport.paused)
+        self.upload.write(b"c" * 15)
+        self.assertTrue(self.transport.paused)
+        # The rest of the body doesn't need holding back:
+        self.upload.write(b"d" * 15)
+        self.assertFalse(self.transport.paused)
+
+    def test_error(self):
+        """
+        If a write fails, the rest of the body is discarded, and
+        ``when_done()`` fails with the error.
+        """
+        self.upload.write(b"a" * 25)
+        self.assertTrue(self.transport.paused)
+        self.server.writes[0][2].errback(ConflictingWriteError())
+        self.assertFalse(self.transport.paused)
+        self.upload.write(b"b" * 25)
+        self.assertThat(self.server.writes, HasLength(1))
+        self.assertThat(
+            self.upload.when_done(),
+            failed(
+                AfterPreprocessing(
+                    lambda f: f.type, Equals(ConflictingWriteError)
+                )
+            ),
+        )
+
+
 def _post_process(params):
     secret_types, secrets = params
     secrets = {t: s for (t, s) in zip(secret_types, secrets)}
@@ -708,6 +932,7 @@ class GenericHTTPAPITests(SyncTestCase):
     def setUp(self):
         super(GenericHTTPAPITests, self).setUp()
         disable_thread_pool_for_test(self)
+        disable_io_thread_pool_for_test(self)
         self.http = self.useFixture(HttpTestFixture())
 
     def test_missing_authentication(self) -> None:
@@ -818,6 +1043,7 @@ class ImmutableHTTPAPITests(SyncTestCase):
     def setUp(self):
         super(ImmutableHTTPAPITests, self).setUp()
         disable_thread_pool_for_test(self)
+        disable_io_thread_pool_for_test(self)
         self.http = self.useFixture(HttpTestFixture())
         self.imm_client = StorageClientImmutables(self.http.client)
         self.general_client = StorageClientGeneral(self.http.client)
@@ -1075,6 +1301,67 @@ class ImmutableHTTPAPITests(SyncTestCase):
             set(),
         )
 
+    def test_list_shares_batch(self):
+        """
+        The shares of several storage indexes can be listed with a single
+        request, along with their lengths; unknown storage indexes have no
+        shares.
+        """
+        (upload_secret, _, storage_index, _) = self.create_upload({1, 3}, 10)
+        for share_number in [1, 3]:
+            self.http.result_of_with_flush(
+                self.imm_client.write_share_chunk(
+                    storage_index,
+                    share_number,
+                    upload_secret,
+                    0,
+                    b"0123456789",
+                )
+            )
+        unknown_storage_index = bytes(range(16))
+
+        self.assertEqual(
+            self.http.result_of_with_flush(
+                self.imm_client.list_shares_batch(
+                    [storage_index, unknown_storage_index]
+                )
+            ),
+            {storage_index: {1: 10, 3: 10}, unknown_storage_index: {}},
+        )
+
+    def test_read_share_chunks(self):
+        """
+        Several ranges of a share can be read with a single request; ranges
+        past the end of the share are truncated.  Unknown shares result in a
+        404, and asking for too much data in a 416.
+        """
+        (upload_secret, _, storage_index, _) = self.create_upload({1}, 26)
+        data = b"abcdefghijklmnopqrstuvwxyz"
+        self.http.result_of_with_flush(
+            self.imm_client.write_share_chunk(
+                storage_index, 1, upload_secret, 0, data
+            )
+        )
+
+        self.assertEqual(
+            self.http.result_of_with_flush(
+                self.imm_client.read_share_chunks(
+                    storage_index, 1, [(0, 3), (10, 2), (24, 10), (30, 5)]
+                )
+            ),
+            [b"abc", b"kl", b"yz", b""],
+        )
+        with assert_fails_with_http_code(self, http.NOT_FOUND):
+            self.http.result_of_with_flush(
+                self.imm_client.read_share_chunks(storage_index, 2, [(0, 3)])
+            )
+        with assert_fails_with_http_code(self, http.REQUESTED_RANGE_NOT_SATISFIABLE):
+            self.http.result_of_with_flush(
+                self.imm_client.read_share_chunks(
+                    storage_index, 1, [(0, 10 * 1024 * 1024)] * 2
+                )
+            )
+
     def test_upload_non_existent_storage_index(self):
         """
         Uploading to a non-existent storage index or share number results in
@@ -1136,6 +1423,160 @@ class ImmutableHTTPAPITests(SyncTestCase):
             b"2" * 10,
         )
 
+    def patch_over_site(self, storage_index, share_number, upload_secret,
+                        offset, data, chunk_size):
+        """
+        Write ``data`` to an upload with a PATCH sent to the ``Site`` from
+        ``HTTPServer.get_site()`` over a fake connection, ``chunk_size`` bytes
+        at a time.
+
+        :return: (response bytes, list of the ranges still needed after each
+            chunk)
+        """
+        site = self.http.http_server.get_site()
+        site.timeOut = None
+        channel = site.buildProtocol(None)
+        transport = StringTransport()
+        channel.makeConnection(transport)
+        bucket = self.http.http_server._uploads.get_write_bucket(
+            storage_index, share_number, upload_secret
+        )
+        channel.dataReceived(
+            b"PATCH /storage/v1/immutable/%s/%d HTTP/1.1\r\n"
+            b"Host: 127.0.0.1\r\n"
+            b"Authorization: %s\r\n"
+            b"X-Tahoe-Authorization: upload-secret %s\r\n"
+            b"Content-Range: bytes %d-%d/*\r\n"
+            b"Content-Length: %d\r\n"
+            b"\r\n" % (
+                _encode_si(storage_index).encode("ascii"),
+                share_number,
+                swissnum_auth_header(SWISSNUM_FOR_TEST),
+                b64encode(upload_secret),
+                offset,
+                offset + len(data) - 1,
+                len(data),
+            )
+        )
+        required = []
+        for i in range(0, len(data), chunk_size):
+            channel.dataReceived(data[i:i + chunk_size])
+            required.append(
+                [(start, end) for (start, end, _) in
+                 bucket.required_ranges().ranges()]
+            )
+        for i in range(10):
+            self.http.clock.advance(0.001)
+        channel.connectionLost(None)
+        return (transport.value(), required)
+
+    def test_streaming_upload(self):
+        """
+        With the ``Site`` from ``HTTPServer.get_site()``, the body of a write
+        to an upload is written as it arrives.
+        """
+        (upload_secret, _, storage_index, _) = self.create_upload({1}, 100)
+        data = urandom(100)
+        (response, required) = self.patch_over_site(
+            storage_index, 1, upload_secret, 0, data[:60], 20
+        )
+        self.assertThat(response, StartsWith(b"HTTP/1.1 200 "))
+        self.assertThat(
+            required, Equals([[(20, 100)], [(40, 100)], [(60, 100)]])
+        )
+        (response, required) = self.patch_over_site(
+            storage_index, 1, upload_secret, 60, data[60:], 40
+        )
+        self.assertThat(response, StartsWith(b"HTTP/1.1 201 "))
+        self.assertThat(
+            self.http.result_of_with_flush(
+                self.imm_client.read_share_chunk(storage_index, 1, 0, 100)
+            ),
+            Equals(data),
+        )
+
+    def test_streaming_upload_is_used(self):
+        """
+        The ``Site`` from ``HTTPServer.get_site()`` tells
+        ``_start_streaming_upload`` the method and path of a write to an
+        upload, and the body is received by the ``_StreamingUpload`` it
+        returns.
+        """
+        (upload_secret, _, storage_index, _) = self.create_upload({1}, 100)
+        http_server = self.http.http_server
+        original = http_server._start_streaming_upload
+        calls = []
+
+        def start_streaming_upload(request, method, path, length):
+            upload = original(request, method, path, length)
+            calls.append((method, path, length, upload))
+            return upload
+
+        http_server._start_streaming_upload = start_streaming_upload
+        (response, _) = self.patch_over_site(
+            storage_index, 1, upload_secret, 0, b"0" * 100, 50
+        )
+        self.assertThat(response, StartsWith(b"HTTP/1.1 201 "))
+        [(method, path, length, upload)] = calls
+        self.assertThat(
+            (method, path, length),
+            Equals((
+                b"PATCH",
+                b"/storage/v1/immutable/%s/1"
+                % (_encode_si(storage_index).encode("ascii"),),
+                100,
+            )),
+        )
+        self.assertThat(upload, IsInstance(_StreamingUpload))
+
+    def test_streaming_upload_conflict(self):
+        """
+        A write streamed to an upload that conflicts with data already
+        uploaded gets a CONFLICT response.
+        """
+        (upload_secret, _, storage_index, _) = self.create_upload({1}, 100)
+        self.patch_over_site(storage_index, 1, upload_secret, 0, b"0" * 10, 10)
+        (response, _) = self.patch_over_site(
+            storage_index, 1, upload_secret, 0, b"0123456789", 5
+        )
+        self.assertThat(response, StartsWith(b"HTTP/1.1 409 "))
+
+    def test_streaming_upload_wrong_secret(self):
+        """
+        A write with the wrong upload secret isn't streamed, and is rejected
+        as usual.
+        """
+        (upload_secret, _, storage_index, _) = self.create_upload({1}, 100)
+        site = self.http.http_server.get_site()
+        site.timeOut = None
+        channel = site.buildProtocol(None)
+        transport = StringTransport()
+        channel.makeConnection(transport)
+        channel.dataReceived(
+            b"PATCH /storage/v1/immutable/%s/1 HTTP/1.1\r\n"
+            b"Host: 127.0.0.1\r\n"
+            b"Authorization: %s\r\n"
+            b"X-Tahoe-Authorization: upload-secret %s\r\n"
+            b"Content-Range: bytes 0-9/*\r\n"
+            b"Content-Length: 10\r\n"
+            b"\r\n" % (
+                _encode_si(storage_index).encode("ascii"),
+                swissnum_auth_header(SWISSNUM_FOR_TEST),
+                b64encode(urandom(32)),
+            )
+        )
+        channel.dataReceived(b"0" * 10)
+        self.http.clock.advance(0.001)
+        channel.connectionLost(None)
+        self.assertThat(transport.value(), StartsWith(b"HTTP/1.1 401 "))
+        bucket = self.http.http_server._uploads.get_write_bucket(
+            storage_index, 1, upload_secret
+        )
+        self.assertThat(
+            [(start, end) for (start, end, _) in bucket.required_ranges().ranges()],
+            Equals([(0, 100)]),
+        )
+
     def test_mismatching_upload_fails(self):
         """
         If an uploaded chunk conflicts with an already uploaded chunk, a
@@ -1321,6 +1762,82 @@ class ImmutableHTTPAPITests(SyncTestCase):
                 self.general_client.add_or_renew_lease(storage_index, secret, secret)
             )
 
+    def test_add_or_renew_leases(self):
+        """
+        Leases for several storage indexes can be added or renewed with a
+        single request, which reports the outcome for each one.
+        """
+        (upload_secret, lease_secret, storage_index, _) = self.create_upload(
+            {0}, 10
+        )
+        self.http.result_of_with_flush(
+            self.imm_client.write_share_chunk(
+                storage_index, 0, upload_secret, 0, b"0123456789"
+            )
+        )
+        [lease] = self.http.storage_server.get_leases(storage_index)
+        initial_expiration_time = lease.get_expiration_time()
+        self.http.clock.advance(167)
+
+        unknown_storage_index = urandom(16)
+        new_secret = b"B" * 32
+        self.assertEqual(
+            self.http.result_of_with_flush(
+                self.general_client.add_or_renew_leases(
+                    [
+                        (storage_index, lease_secret, lease_secret),
+                        (unknown_storage_index, new_secret, new_secret),
+                        (storage_index, new_secret, new_secret),
+                    ]
+                )
+            ),
+            ["ok", "not-found", "ok"],
+        )
+        [lease1, lease2] = self.http.storage_server.get_leases(storage_index)
+        self.assertEqual(
+            lease1.get_expiration_time() - initial_expiration_time, 167
+        )
+        self.assertTrue(lease2.is_renew_secret(new_secret))
+
+    def test_add_or_renew_leases_error(self):
+        """
+        A lease that can't be added is reported as an error, without
+        affecting the others in the same request.
+        """
+        (upload_secret, lease_secret, storage_index, _) = self.create_upload(
+            {0}, 10
+        )
+        self.http.result_of_with_flush(
+            self.imm_client.write_share_chunk(
+                storage_index, 0, upload_secret, 0, b"0123456789"
+            )
+        )
+        (upload_secret, _, full_storage_index, _) = self.create_upload({0}, 10)
+        self.http.result_of_with_flush(
+            self.imm_client.write_share_chunk(
+                full_storage_index, 0, upload_secret, 0, b"0123456789"
+            )
+        )
+        # Adding a new lease needs more space than there is:
+        self.http.storage_server.get_available_space = lambda: 0
+
+        new_secret = b"B" * 32
+        self.assertEqual(
+            self.http.result_of_with_flush(
+                self.general_client.add_or_renew_leases(
+                    [
+                        (full_storage_index, new_secret, new_secret),
+                        (storage_index, lease_secret, lease_secret),
+                    ]
+                )
+            ),
+            ["error", "ok"],
+        )
+        self.assertEqual(
+            len(list(self.http.storage_server.get_leases(full_storage_index))),
+            1,
+        )
+
 
 class MutableHTTPAPIsTests(SyncTestCase):
     """Tests for mutable APIs."""
@@ -1328,6 +1845,7 @@ class MutableHTTPAPIsTests(SyncTestCase):
     def setUp(self):
         super(MutableHTTPAPIsTests, self).setUp()
         disable_thread_pool_for_test(self)
+        disable_io_thread_pool_for_test(self)
         self.http = self.useFixture(HttpTestFixture())
         self.mut_client = StorageClientMutables(self.http.client)
 
@@ -1746,6 +2264,7 @@ class ImmutableSharedTests(SharedImmutableMutableTestsMixin, SyncTestCase):
     def setUp(self):
         super(ImmutableSharedTests, self).setUp()
         disable_thread_pool_for_test(self)
+        disable_io_thread_pool_for_test(self)
         self.http = self.useFixture(HttpTestFixture())
         self.client = self.clientFactory(self.http.client)
         self.general_client = StorageClientGeneral(self.http.client)
@@ -1801,6 +2320,7 @@ class MutableSharedTests(SharedImmutableMutableTestsMixin, SyncTestCase):
     def setUp(self):
         super(MutableSharedTests, self).setUp()
         disable_thread_pool_for_test(self)
+        disable_io_thread_pool_for_test(self)
         self.http = self.useFixture(HttpTestFixture())
         self.client = self.clientFactory(self.http.client)
         self.general_client = StorageClientGeneral(self.http.client)
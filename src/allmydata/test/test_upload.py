@@ -30,6 +30,7 @@ from allmydata.interfaces import FileTooLargeError, UploadUnhappinessError
 from allmydata.util import log, base32
 from allmydata.util.assertutil import precondition
 from allmydata.util.deferredutil import DeferredListShouldSucceed
+from allmydata.util.cputhreadpool import disable_thread_pool_for_test
 from allmydata.test.no_network import GridTestMixin
 from allmydata.storage_client import StorageFarmBroker
 from allmydata.storage.server import storage_index_to_dir
@@ -2073,6 +2074,9 @@ class EncryptAnUploadableTests(unittest.TestCase):
     """
     Tests for ``EncryptAnUploadable``.
     """
+    def setUp(self):
+        disable_thread_pool_for_test(self)
+
     def test_same_length(self):
         """
         ``EncryptAnUploadable.read_encrypted`` returns ciphertext of the same
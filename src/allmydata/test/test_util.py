@@ -8,6 +8,7 @@ import json
 from threading import current_thread
 
 from twisted.trial import unittest
+from twisted.internet import reactor
 from foolscap.api import Violation, RemoteException
 
 from allmydata.util import idlib, mathutil
@@ -18,6 +19,9 @@ from allmydata.util import yamlutil
 from allmydata.util import rrefutil
 from allmydata.util.fileutil import EncryptedTemporaryFile
 from allmydata.util.cputhreadpool import defer_to_thread, disable_thread_pool_for_test
+from allmydata.util.iothreadpool import (
+    defer_to_io_thread, disable_io_thread_pool_for_test,
+)
 from allmydata.test.common_util import ReallyEqualMixin
 from .no_network import fireNow, LocalWrapper
 
@@ -621,3 +625,40 @@ class CPUThreadPool(unittest.TestCase):
         self.assertEqual(thread, this_thread)
         self.assertEqual(args, (1, 3))
         self.assertEqual(kwargs, {"key": 4, "value": 5})
+
+
+class IOThreadPool(unittest.TestCase):
+    """Tests for iothreadpool."""
+
+    async def test_runs_in_thread(self):
+        """The given function runs in a thread."""
+        def f(*args, **kwargs):
+            return current_thread(), args, kwargs
+
+        this_thread = current_thread().ident
+        thread, args, kwargs = await defer_to_io_thread(
+            reactor, f, 1, 3, key=4, value=5
+        )
+
+        # The task ran in a different thread:
+        self.assertNotEqual(thread.ident, this_thread)
+        self.assertEqual(args, (1, 3))
+        self.assertEqual(kwargs, {"key": 4, "value": 5})
+
+    async def test_when_disabled_runs_in_same_thread(self):
+        """
+        If the I/O thread pool is disabled, the given function runs in the
+        current thread.
+        """
+        disable_io_thread_pool_for_test(self)
+        def f(*args, **kwargs):
+            return current_thread().ident, args, kwargs
+
+        this_thread = current_thread().ident
+        thread, args, kwargs = await defer_to_io_thread(
+            reactor, f, 1, 3, key=4, value=5
+        )
+
+        self.assertEqual(thread, this_thread)
+        self.assertEqual(args, (1, 3))
+        self.assertEqual(kwargs, {"key": 4, "value": 5})
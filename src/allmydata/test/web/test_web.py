@@ -20,6 +20,7 @@ from twisted.internet import defer
 from twisted.internet.defer import inlineCallbacks, returnValue
 from twisted.internet.task import Clock
 from twisted.web import client, error, http
+from twisted.web.test.requesthelper import DummyRequest
 from twisted.python import failure, log
 
 from allmydata import interfaces, uri, webish
@@ -29,6 +30,7 @@ from allmydata.immutable.downloader.status import DownloadStatus
 from allmydata.dirnode import DirectoryNode
 from allmydata.nodemaker import NodeMaker
 from allmydata.web.common import MultiFormatResource
+from allmydata.web.directory import _directory_json_metadata
 from allmydata.util import fileutil, base32, hashutil, jsonbytes as json
 from allmydata.util.consumer import download_to_data
 from allmydata.util.encodingutil import to_bytes
@@ -2145,6 +2147,20 @@ class Web(WebMixin, WebErrorMixin, testutil.StallMixin, testutil.ReallyEqualMixi
         d.addCallback(self.failUnlessIsFooJSON)
         return d
 
+    def test_directory_json_metadata(self):
+        # The whole listing is rendered before the response starts, so it
+        # has a content-length.
+        req = DummyRequest(b"")
+        d = defer.maybeDeferred(_directory_json_metadata, req, self._foo_node)
+        def _got(res):
+            self.failUnlessReallyEqual(req.written, [])
+            self.failUnlessReallyEqual(
+                req.responseHeaders.getRawHeaders("content-length"),
+                ["%d" % len(res)])
+            self.failUnlessIsFooJSON(res)
+        d.addCallback(_got)
+        return d
+
     def test_GET_DIRURL_json_format(self):
         d = self.PUT(self.public_url + \
                      "/foo/sdmf.txt?format=sdmf",
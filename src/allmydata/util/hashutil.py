@@ -116,6 +116,30 @@ def block_hasher():
     return tagged_hasher(BLOCK_TAG)
 
 
+# Batches smaller than this are hashed in the calling thread: handing them to
+# a thread pool would cost more than hashing them.
+BLOCK_HASHES_INLINE_LIMIT = 16 * 1024
+
+
+async def block_hashes(blocks):
+    """
+    Compute ``block_hash()`` of each of ``blocks`` (typically all the blocks
+    of one segment), in order.
+
+    The hashing is done in a single call into the CPU thread pool, so it
+    doesn't block the reactor and the thread hand-off cost is paid once per
+    batch rather than once per block.  Batches smaller than
+    ``BLOCK_HASHES_INLINE_LIMIT`` bytes are hashed immediately instead.
+    """
+    # Imported here so that importing hashutil doesn't install the reactor.
+    from allmydata.util.cputhreadpool import defer_to_thread
+    blocks = list(blocks)
+    hash_all = lambda: [block_hash(b) for b in blocks]
+    if sum(len(b) for b in blocks) < BLOCK_HASHES_INLINE_LIMIT:
+        return hash_all()
+    return await defer_to_thread(hash_all)
+
+
 def uri_extension_hash(data):
     return tagged_hash(UEB_TAG, data)
 
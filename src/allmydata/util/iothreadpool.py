@@ -0,0 +1,88 @@
+"""
+A global thread pool for blocking disk I/O.
+
+Motivation:
+
+* Storage servers do a lot of blocking ``open()``/``listdir()``/``read()``/
+  ``write()`` calls.  On slow disks a single call can take long enough that
+  running it in the reactor thread stalls every other client.
+* CPU-bound work has its own pool (``allmydata.util.cputhreadpool``), sized to
+  the number of CPUs.  Disk I/O mostly waits rather than computes, so it gets
+  a separate pool and doesn't compete with hashing and erasure coding for
+  threads.
+* The number of threads is bounded, so a flood of requests turns into a queue
+  rather than thousands of threads all seeking on the same disk.
+"""
+
+from typing import TypeVar, Callable
+from functools import partial
+import threading
+from typing_extensions import ParamSpec
+from unittest import TestCase
+
+from twisted.python.threadpool import ThreadPool
+from twisted.internet.threads import deferToThreadPool
+from twisted.internet.interfaces import IReactorFromThreads
+
+# Spinning disks don't benefit from very deep queues, while SSDs and network
+# filesystems are happy with more outstanding requests; this is a compromise.
+IO_THREADS = 16
+
+_IO_THREAD_POOL = ThreadPool(minthreads=0, maxthreads=IO_THREADS, name="TahoeIO")
+if hasattr(threading, "_register_atexit"):
+    # See allmydata.util.cputhreadpool for why this private API is used.
+    threading._register_atexit(_IO_THREAD_POOL.stop)  # type: ignore
+else:
+    _IO_THREAD_POOL.threadFactory = partial(  # type: ignore
+        _IO_THREAD_POOL.threadFactory, daemon=True
+    )
+_IO_THREAD_POOL.start()
+
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+# Is running in a thread pool disabled? Should only be true in synchronous unit
+# tests.
+_DISABLED = False
+
+
+async def defer_to_io_thread(
+    reactor: IReactorFromThreads,
+    f: Callable[P, R],
+    *args: P.args,
+    **kwargs: P.kwargs,
+) -> R:
+    """
+    Run the function in the I/O thread pool, return the result.
+
+    The result is delivered via the given reactor's ``callFromThread``, which
+    lets tests use a fake reactor.
+
+    However, if ``disable_io_thread_pool_for_test()`` was called the function
+    will be called synchronously inside the current thread.
+    """
+    if _DISABLED:
+        return f(*args, **kwargs)
+
+    result = await deferToThreadPool(reactor, _IO_THREAD_POOL, f, *args, **kwargs)
+    return result
+
+
+def disable_io_thread_pool_for_test(test: TestCase) -> None:
+    """
+    For the duration of the test, calls to ``defer_to_io_thread()`` will
+    actually run synchronously, which is useful for synchronous unit tests.
+    """
+    global _DISABLED
+
+    def restore():
+        global _DISABLED
+        _DISABLED = False
+
+    test.addCleanup(restore)
+
+    _DISABLED = True
+
+
+__all__ = ["defer_to_io_thread", "disable_io_thread_pool_for_test"]
@@ -4,12 +4,15 @@ Logging utilities.
 Ported to Python 3.
 """
 
+import time
+
 from six import ensure_str
 
 from pyutil import nummedobj
 
 from foolscap.logging import log
 from twisted.python import log as tw_log
+from twisted.python import threadable
 
 # We want to convert bytes keys to Unicode, otherwise JSON serialization
 # inside foolscap will fail (for details see
@@ -28,7 +31,19 @@ BAD = log.BAD # 40
 
 
 def msg(*args, **kwargs):
-    return log.msg(*args, **bytes_to_unicode(True, kwargs))
+    kwargs = bytes_to_unicode(True, kwargs)
+    if threadable.ioThread is not None and not threadable.isInIOThread():
+        # Foolscap's logger isn't thread-safe: it notifies observers with
+        # eventual-sends, which must happen in the reactor thread.  Code
+        # running in a thread pool (e.g. storage server disk I/O) gets its
+        # message id and timestamp now, and the message is delivered from the
+        # reactor thread shortly after.
+        from twisted.internet import reactor
+        kwargs.setdefault("num", log.theLogger.seqnum.next())
+        kwargs.setdefault("time", time.time())
+        reactor.callFromThread(log.msg, *args, **kwargs)
+        return kwargs["num"]
+    return log.msg(*args, **kwargs)
 
 # If log.err() happens during a unit test, the unit test should fail. We
 # accomplish this by sending it to twisted.log too. When a WEIRD/SCARY/BAD
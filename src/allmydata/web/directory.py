@@ -1009,31 +1009,38 @@ class DirectoryAsHTML(Element):
     def results(self, req, tag):
         return get_arg(req, "results", "")
 
+def _child_json(childnode, metadata):
+    assert IFilesystemNode.providedBy(childnode), childnode
+    rw_uri = childnode.get_write_uri()
+    ro_uri = childnode.get_readonly_uri()
+    if IFileNode.providedBy(childnode):
+        kiddata = ("filenode", get_filenode_metadata(childnode))
+    elif IDirectoryNode.providedBy(childnode):
+        kiddata = ("dirnode", {'mutable': childnode.is_mutable()})
+    else:
+        kiddata = ("unknown", {})
+
+    kiddata[1]["metadata"] = metadata
+    if rw_uri:
+        kiddata[1]["rw_uri"] = rw_uri
+    if ro_uri:
+        kiddata[1]["ro_uri"] = ro_uri
+    verifycap = childnode.get_verify_cap()
+    if verifycap:
+        kiddata[1]['verify_uri'] = verifycap.to_string()
+    return kiddata
+
 def _directory_json_metadata(req, dirnode):
+    """
+    Render a directory as JSON. Each child node is only decoded to build its
+    entry, and is not kept, so listing a huge directory does not need memory
+    for all of its child nodes at once.
+    """
     d = dirnode.list()
     def _got(children):
         kids = {}
-        for name, (childnode, metadata) in list(children.items()):
-            assert IFilesystemNode.providedBy(childnode), childnode
-            rw_uri = childnode.get_write_uri()
-            ro_uri = childnode.get_readonly_uri()
-            if IFileNode.providedBy(childnode):
-                kiddata = ("filenode", get_filenode_metadata(childnode))
-            elif IDirectoryNode.providedBy(childnode):
-                kiddata = ("dirnode", {'mutable': childnode.is_mutable()})
-            else:
-                kiddata = ("unknown", {})
-
-            kiddata[1]["metadata"] = metadata
-            if rw_uri:
-                kiddata[1]["rw_uri"] = rw_uri
-            if ro_uri:
-                kiddata[1]["ro_uri"] = ro_uri
-            verifycap = childnode.get_verify_cap()
-            if verifycap:
-                kiddata[1]['verify_uri'] = verifycap.to_string()
-
-            kids[name] = kiddata
+        for name, (childnode, metadata) in children.stream_items():
+            kids[name] = _child_json(childnode, metadata)
 
         drw_uri = dirnode.get_write_uri()
         dro_uri = dirnode.get_readonly_uri()
@@ -1391,7 +1398,7 @@ class DeepCheckStreamer(dirnode.DeepStats):
         self.req = req
         self.verify = verify
         self.repair = repair
-        self.add_lease = add_lease
+        self.leases = dirnode.DeepLeaseAdder(origin) if add_lease else None
 
     def setMonitor(self, monitor):
         self.monitor = monitor
@@ -1430,10 +1437,14 @@ class DeepCheckStreamer(dirnode.DeepStats):
         data["storage-index"] = si or ""
 
         if self.repair:
-            d = node.check_and_repair(self.monitor, self.verify, self.add_lease)
+            d = node.check_and_repair(self.monitor, self.verify, False)
+            if self.leases:
+                d.addCallback(self.leases.add_results, node)
             d.addCallback(self.add_check_and_repair, data)
         else:
-            d = node.check(self.monitor, self.verify, self.add_lease)
+            d = node.check(self.monitor, self.verify, False)
+            if self.leases:
+                d.addCallback(self.leases.add_results, node)
             d.addCallback(self.add_check, data)
         d.addCallback(self.write_line)
         return d
@@ -1452,6 +1463,11 @@ class DeepCheckStreamer(dirnode.DeepStats):
         self.req.write(j.encode("utf-8")+b"\n")
 
     def finish(self):
+        d = self.leases.flush() if self.leases else defer.succeed(None)
+        d.addCallback(lambda ignored: self._write_stats())
+        return d
+
+    def _write_stats(self):
         stats = dirnode.DeepStats.get_results(self)
         d = {"type": "stats",
              "stats": stats,
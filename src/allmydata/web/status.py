@@ -1549,6 +1549,9 @@ class Statistics(MultiFormatResource):
         For example Prometheus and Victoriametrics can parse this.
         Point the scraper to ``/statistics?t=openmetrics`` (instead of the
         default ``/metrics``).
+
+        Counters and stats are flat metrics; the latency histograms kept by
+        the stats provider become ``tahoe_latency_*_seconds`` histograms.
         """
         req.setHeader("content-type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
         stats = self._provider.get_stats()
@@ -1568,6 +1571,15 @@ class Statistics(MultiFormatResource):
             ret.append(u"tahoe_counters_%s %s" % (mangle_name(k), mangle_value(v)))
         for (k, v) in sorted(stats['stats'].items()):
             ret.append(u"tahoe_stats_%s %s" % (mangle_name(k), mangle_value(v)))
+        for (k, h) in sorted(stats.get('histograms', {}).items()):
+            name = u"tahoe_latency_%s_seconds" % (re.sub(r"[^A-Za-z0-9_]", u"_", k),)
+            ret.append(u"# TYPE %s histogram" % (name,))
+            ret.append(u"# UNIT %s seconds" % (name,))
+            for (bound, count) in h["buckets"]:
+                ret.append(u'%s_bucket{le="%r"} %d' % (name, bound, count))
+            ret.append(u'%s_bucket{le="+Inf"} %d' % (name, h["count"]))
+            ret.append(u"%s_count %d" % (name, h["count"]))
+            ret.append(u"%s_sum %r" % (name, h["sum"]))
 
         ret.append(u"# EOF\n")
 